@@ -17,104 +17,125 @@
 #    under the License.
 
 import time
-import json
-import logging
-import traceback
 from collections import OrderedDict
 
-class HallBuffer():
-    """
+# entry format: [data, size, expire_time, uuid, time_from, time_to]
+DATA, SIZE, EXPIRE, UUID, TIME_FROM, TIME_TO = range(6)
+
+
+class ResultCache():
+    """LRU + TTL cache of query results.
+    The size of the cache is the sum of the sizes given to put() (e.g. the
+    number of points of a report), so it is bounded by memory rather than
+    by entry count. get() and put() are O(1); entries are also indexed by
+    vm so invalidate() only looks at the entries of one vm.
     example:
-        k = hit_test([p1, p2]):
-        if k not None:
-            bufdata = getbuf(k)
-            return bufdata
-        # // not hit, do your work,
-        # such as select * from data and save into data;
-        # ... 
-        cleanup() # optional
-        save(k, data)
+        data = cache.get(key)
+        if data is None:
+            # not hit, do your work
+            data = ...
+            cache.put(key, data, size=len(data), uuid=uuid,
+                      time_from=time_from, time_to=time_to)
+        # new samples of uuid at time t were written:
+        cache.invalidate(uuid, t, t)
     """
-    def __init__(self):
-        # buf format: key:[bufdata, hit_times, last_hit_Time, create_time]
-        self.buf = dict()
+    def __init__(self, max_size=100000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        # least recently used first
+        self.entries = OrderedDict()
+        # uuid --> set of keys
+        self.by_uuid = dict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[EXPIRE] < time.time():
+            self.forget(key, entry)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        # move to the most recently used end
+        self.entries[key] = entry
+        self.hits += 1
+        return entry[DATA]
 
-    def save(self, key, data):
-        if isinstance(key, list):
-            key = str(key)
-        now = time.time()
-        self.buf[key] = [data, 0, now, now]
+    def put(self, key, data, size=1, uuid=None, time_from=0, time_to=0,
+            ttl=None):
+        if self.entries.has_key(key):
+            self.forget(key, self.entries.pop(key))
+        if size > self.max_size:
+            return data
+        while self.size + size > self.max_size:
+            old_key, old_entry = self.entries.popitem(last=False)
+            self.forget(old_key, old_entry)
+            self.evictions += 1
+        if ttl is None:
+            ttl = self.ttl
+        self.entries[key] = [data, size, time.time() + ttl,
+                             uuid, time_from, time_to]
+        self.size += size
+        if not uuid is None:
+            self.by_uuid.setdefault(uuid, set()).add(key)
         return data
-        
-    def cleanup(self, time_out = 300, max_count = 999):
-        count = 0
-        new = dict()
-        for key, i in self.buf.iteritems():
-            count += 1
-            print i
-            if count > max_count:
-                break;
-            if (time.time() - i[3] < time_out):
-                print "\t", time.time(),"-", i[3],"<",time_out
-                new[key] = i
-        self.buf = new
-        
-    def hit_test(self, key):
-        if isinstance(key, list):
-            key = str(key)    
-        if self.buf.has_key(key):
-            self.buf[key][1] += 1
-            self.buf[key][2] = time.time()
-            return True
-        else:
-            return False
 
-    def get_buf(self, key):
-        if isinstance(key, list):
-            key = str(key)
-        if self.buf.has_key(key):
-            return self.buf[key][0];
-        else:
-            return None
-            
-    def get_hit_rate(self, key):
-        if isinstance(key, list):
-            key = str(key)
-        if self.buf.has_key(key):
-            return self.buf[key][1]
-        else:
+    def invalidate(self, uuid, time_from, time_to):
+        """drop the entries of ${uuid} whose range meets [from, to]"""
+        keys = self.by_uuid.get(uuid)
+        if not keys:
             return 0
-        
-if __name__ == '__main__':
-    params = ["iPhone", 2012]
-    data = "detail of 2012 iPhone 4S"
-    params2 = ["iPad", 2013]
-    data2 = "detail of 2012 iPad"
-    
-    b = HallBuffer()
-    key = str(params)
-    print "Hit rate=", b.get_hit_rate(key), "of", len(b.buf)
-    
-    if b.hit_test(key):
-        print b.get_buf(key)
-        assert False
-    else:
-        b.save(key, data)
-        time.sleep(3)
-        b.save(str(params2), data2)
-        print "not hit."
-    print "Hit rate=", b.get_hit_rate(key), "of", len(b.buf)
-        
-    if b.hit_test(key):
-        print "hit!"
-        print "\t", b.get_buf(key)
-    else:
-        b.save(key, data)
-        assert False
-    print "Hit rate=", b.get_hit_rate(key), "of", len(b.buf)
-    
-    assert len(b.buf) == 2
-    
-    b.cleanup(time_out = 1)
-    print "after cleanup, Hit rate=", b.get_hit_rate(key), "of", len(b.buf)
-    assert len(b.buf) == 1
+        count = 0
+        for key in list(keys):
+            entry = self.entries[key]
+            if entry[TIME_FROM] <= time_to and time_from <= entry[TIME_TO]:
+                del self.entries[key]
+                self.forget(key, entry)
+                count += 1
+        self.invalidations += count
+        return count
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.by_uuid = dict()
+        self.size = 0
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self.entries),
+                'size': self.size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations}
+
+    ####### private ########
+    def forget(self, key, entry):
+        """[private]account for an entry already removed from entries"""
+        self.size -= entry[SIZE]
+        uuid = entry[UUID]
+        if not uuid is None:
+            keys = self.by_uuid.get(uuid)
+            keys.discard(key)
+            if not keys:
+                del self.by_uuid[uuid]
+
+
+def bucket_range(time_from, time_to, period):
+    """widen [time_from, time_to) to whole ${period} buckets, so nearby
+    queries share one cache key(and one result)"""
+    time_from = time_from - time_from % period
+    if time_to % period:
+        time_to = time_to - time_to % period + period
+    return time_from, time_to
+
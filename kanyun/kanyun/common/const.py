@@ -24,6 +24,9 @@ class MSG_TYPE:
     LOCAL_INFO = '1'
     TRAFFIC_ACCOUNTING = '2'
     AGENT = '3'
+    SAMPLES_WRITTEN = '4' # data-server --> api-server, cache invalidation
+    AGENT_DICT = '5'      # devices of a packed worker, see kanyun.common.wire
+    AGENT_PACKED = '6'
     
 class STATISTIC:
     SUM = 'sum'
@@ -31,6 +34,34 @@ class STATISTIC:
     MINIMUM = 'min'
     AVERAGE = 'avg'
     SAMPLES = 'sam'
+    LAST = 'last'
+    RATE = 'rate'
+
+class METRIC:
+    """metric id of the vm_metric table"""
+    CPU = 1
+    MEM_FREE = 2
+    MEM_MAX = 3
+    NIC_IN = 4
+    NIC_OUT = 5
+    BLK_READ = 6
+    BLK_WRITE = 7
+
+metric_str = dict()
+metric_str[METRIC.CPU] = "cpu_usage"
+metric_str[METRIC.MEM_FREE] = "mem_free"
+metric_str[METRIC.MEM_MAX] = "mem_max"
+metric_str[METRIC.NIC_IN] = "nic_in"
+metric_str[METRIC.NIC_OUT] = "nic_out"
+metric_str[METRIC.BLK_READ] = "disk_read"
+metric_str[METRIC.BLK_WRITE] = "disk_write"
+metric_id = dict([(v, k) for k, v in metric_str.items()])
+# column family names used by the api protocol(see plugin_agent_srv.cf_dict)
+metric_id['cpu'] = METRIC.CPU
+metric_id['nic_incoming'] = METRIC.NIC_IN
+metric_id['nic_outgoing'] = METRIC.NIC_OUT
+metric_id['blk_read'] = METRIC.BLK_READ
+metric_id['blk_write'] = METRIC.BLK_WRITE
 
 #statistic_str = dict()
 #statistic_str[STATISTIC.SUM] = "SUM"
@@ -28,13 +28,50 @@ from sqlalchemy.orm import sessionmaker
 from kanyun.common.app import *
 
 class NovaTools():
+    """instance metadata of nova, served from memory.
+    The first lookup loads every live instance; after that only the rows
+    created, updated or deleted since the newest timestamp seen are read,
+    at most every refresh_interval seconds, or at most every
+    miss_interval seconds when an unknown instance is looked up.
+    Every full_refresh_interval seconds all the live instances are loaded
+    again, so the rows stamped by a host with a late clock(older than the
+    newest timestamp seen) and the rows purged from nova are not kept
+    wrong forever.
+    Only the columns below are selected, by name. The changes are read by
+    one range per timestamp column(a UNION, not an OR), so each one can
+    use an index; nova does not create them, add them to read less than
+    the whole table:
+        CREATE INDEX instances_created_at_idx ON instances (created_at);
+        CREATE INDEX instances_updated_at_idx ON instances (updated_at);
+        CREATE INDEX instances_deleted_at_idx ON instances (deleted_at);
+    """
+    refresh_interval = 60
+    miss_interval = 5
+    full_refresh_interval = 3600
+
     def __init__(self, app):
         self.app = app
         self.cfg = self.app.get_cfg("DEFAULT")
         self.db = create_engine(self.cfg["sql_connection"])
         self.db.echo = False
         metadata = MetaData(self.db)
-        self.instances = Table('instances', metadata, autoload=True)
+        self.instances = Table('instances', metadata,
+                               Column('id', Integer, primary_key=True),
+                               Column('uuid', String(36)),
+                               Column('display_name', String(255)),
+                               Column('project_id', String(255)),
+                               Column('created_at', DateTime),
+                               Column('updated_at', DateTime),
+                               Column('deleted_at', DateTime),
+                               Column('deleted', Boolean))
+        # (id, uuid, display_name, project_id) by id and by uuid
+        self.by_id = dict()
+        self.by_uuid = dict()
+        # newest created_at/updated_at/deleted_at seen, None until the
+        # first instance is loaded
+        self.last_change = None
+        self.previous_refresh = 0
+        self.previous_full_refresh = 0
         
     def get_uuid_by_novaid(self, instance):
         ret = self.get_id(instance)
@@ -60,19 +97,75 @@ class NovaTools():
         
     def get_instances(self, uuid=None, id=None):
         "return format: (id, uuid, display_name) or None"
-        if not uuid is None:
-            stmt = self.instances.select(self.instances.c.uuid == uuid)
-        elif not id is None:
-            stmt = self.instances.select(self.instances.c.id == id)
-        else:
+        ret = self.get_instance(uuid=uuid, id=id)
+        if ret is None:
             return None
-        rs = stmt.execute()
-        if not rs is None:
-            row = rs.first()
-            if row is None:
-                return None
-            return (row[4], row[34], row[26])
-        return None
+        return ret[:3]
+
+    def get_instance(self, uuid=None, id=None):
+        "return format: (id, uuid, display_name, project_id) or None"
+        if uuid is None and id is None:
+            return None
+        self.refresh()
+        ret = self.lookup(uuid, id)
+        if ret is None and self.refresh(self.miss_interval):
+            ret = self.lookup(uuid, id)
+        return ret
+
+    def get_project(self, uuid):
+        ret = self.get_instance(uuid=uuid)
+        if ret is None:
+            return None
+        return ret[3]
+
+    def refresh(self, interval=None):
+        """read the changes since the last refresh if ${interval}(default
+        refresh_interval) seconds passed, return True if it did"""
+        if interval is None:
+            interval = self.refresh_interval
+        now = time.time()
+        if now - self.previous_refresh < interval:
+            return False
+        self.previous_refresh = now
+
+        c = self.instances.c
+        stmt = select([c.id, c.uuid, c.display_name, c.project_id,
+                       c.created_at, c.updated_at, c.deleted_at, c.deleted])
+        full = self.last_change is None or \
+            now - self.previous_full_refresh >= self.full_refresh_interval
+        if full:
+            self.previous_full_refresh = now
+            stmt = stmt.where(c.deleted == False)
+            by_id = dict()
+            by_uuid = dict()
+        else:
+            # >=: rows committed later with the same timestamp are not lost
+            stmt = union(*[stmt.where(t >= self.last_change)
+                           for t in (c.created_at, c.updated_at,
+                                     c.deleted_at)])
+            by_id = self.by_id
+            by_uuid = self.by_uuid
+        for row in self.db.execute(stmt):
+            for t in (row.created_at, row.updated_at, row.deleted_at):
+                if not t is None and (self.last_change is None
+                                      or t > self.last_change):
+                    self.last_change = t
+            if row.deleted:
+                by_id.pop(row.id, None)
+                by_uuid.pop(row.uuid, None)
+                continue
+            info = (row.id, row.uuid, row.display_name, row.project_id)
+            by_id[row.id] = info
+            by_uuid[row.uuid] = info
+        self.by_id = by_id
+        self.by_uuid = by_uuid
+        return True
+
+    ####### private ########
+    def lookup(self, uuid, id):
+        if not uuid is None:
+            return self.by_uuid.get(uuid)
+        return self.by_id.get(id)
         
 if __name__ == '__main__':
     app = App(conf="/etc/nova/nova.conf", log='/tmp/kanyun.log')
@@ -0,0 +1,124 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2012 Sina Corporation
+# All Rights Reserved.
+# Author: YuWei Peng <pengyuwei@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from kanyun.common.const import *
+
+
+class Statistics():
+    """running min/max/sum/count/last of one series.
+    update() takes raw samples, merge() takes already aggregated buckets
+    (rollup rows), so a coarse bucket can be built from finer ones.
+    """
+
+    def __init__(self):
+        self.clean()
+
+    def clean(self):
+        self.first = True
+        self.count = 0
+        self.sum = 0.0
+        self.min = 0.0
+        self.max = 0.0
+        self.previous = 0.0
+        self.diff = 0.0
+        self.last = 0.0
+        self.last_time = 0
+
+    def update(self, value, timestamp=None):
+        self.count += 1
+        self.sum += value
+        if self.first:
+            self.first = False
+            self.previous = value
+            self.max = value
+            self.min = value
+            self.set_last(value, timestamp)
+            return
+
+        if value > self.max:
+            self.max = value
+        if value < self.min:
+            self.min = value
+        self.diff = value - self.previous
+        self.previous = value
+        self.set_last(value, timestamp)
+
+    def merge(self, min, max, sum, count, last, last_time=None):
+        """fold an aggregated bucket into this one"""
+        if count <= 0:
+            return
+        if self.first:
+            self.first = False
+            self.min = min
+            self.max = max
+        else:
+            if max > self.max:
+                self.max = max
+            if min < self.min:
+                self.min = min
+        self.count += count
+        self.sum += sum
+        self.diff = last - self.previous
+        self.previous = last
+        self.set_last(last, last_time)
+
+    def set_last(self, value, timestamp):
+        if timestamp is None or timestamp >= self.last_time:
+            self.last = value
+            if not timestamp is None:
+                self.last_time = timestamp
+
+    def get_value(self, w):
+        if w == 'avg' or w == STATISTIC.AVERAGE:
+            return self.get_agerage()
+        elif w == 'min' or w == STATISTIC.MINIMUM:
+            return self.get_min()
+        elif w == 'max' or w == STATISTIC.MAXIMUM:
+            return self.get_max()
+        elif w == 'sum' or w == STATISTIC.SUM:
+            return self.get_sum()
+        elif w == 'sam' or w == STATISTIC.SAMPLES:
+            return self.get_samples()
+        elif w == 'last' or w == STATISTIC.LAST:
+            return self.get_last()
+        else:
+            print 'error:', w
+            return 0
+
+    def get_diff(self):
+        return self.diff
+
+    def get_agerage(self):
+        if self.count == 0:
+            return 0
+        else:
+            return self.sum / self.count
+    def get_sum(self):
+        return self.sum
+
+    def get_max(self):
+        return self.max
+
+    def get_min(self):
+        return self.min
+
+    def get_last(self):
+        return self.last
+
+    def get_samples(self):
+        return self.count
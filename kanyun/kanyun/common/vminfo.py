@@ -0,0 +1,144 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2012 Sina Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from kanyun.common.const import *
+
+"""
+Decoded vm samples.
+
+agent data example(one report of a worker):
+    {"instance-00000001":
+        [
+            ["cpu", "total", [1332465360.033008, 12.5]],
+            ["mem", "total", [1332465360.033008, 131072, 65536]],
+            ["nic", "vnet0", [1332465360.038922, 3860180, 1025563]],
+            ["blk", "vda", [1332465360.044262, 474624, 4741120]],
+            "76d6f296-68b8-4a21-9a20-9f46ff48d6ef"
+        ]
+    }
+sample(one vm):
+    {'instance_id': 'instance-00000001',
+     'uuid': '76d6f296-68b8-4a21-9a20-9f46ff48d6ef',
+     'time': 1332465360,
+     'cpu': 12.5,
+     'mem_free': 65536,
+     'mem_max': 131072,
+     'nic': [('vnet0', 3860180, 1025563)],
+     'blk': [('vda', 474624, 4741120)]}
+"""
+
+
+def new_sample(instance_id, uuid):
+    return {'instance_id': instance_id,
+            'uuid': uuid,
+            'time': 0,
+            'cpu': 0.0,
+            'mem_free': 0,
+            'mem_max': 0,
+            'nic': list(),
+            'blk': list()}
+
+
+def decode_agent_data(data):
+    """agent data --> list of samples"""
+    samples = list()
+    for instance_id, items in data.iteritems():
+        uuid = ''
+        if len(items) > 0 and isinstance(items[-1], basestring):
+            uuid = str(items[-1])
+            items = items[:-1]
+        # else an old worker, the data-server looks the uuid up in nova
+        sample = new_sample(str(instance_id), uuid)
+        for item in items:
+            kind, dev, value = item
+            if kind == 'cpu':
+                sample['time'] = int(value[0])
+                sample['cpu'] = float(value[1])
+            elif kind == 'mem':
+                sample['mem_max'] = int(value[1])
+                sample['mem_free'] = int(value[2])
+            elif kind == 'nic':
+                sample['nic'].append((str(dev), int(value[1]), int(value[2])))
+            elif kind == 'blk':
+                sample['blk'].append((str(dev), int(value[1]), int(value[2])))
+        samples.append(sample)
+    return samples
+
+
+def sample_to_metrics(sample):
+    """sample --> [(metric, device, value), ...]"""
+    ret = [(METRIC.CPU, '', sample['cpu']),
+           (METRIC.MEM_FREE, '', sample['mem_free']),
+           (METRIC.MEM_MAX, '', sample['mem_max'])]
+    for dev, rx, tx in sample['nic']:
+        ret.append((METRIC.NIC_IN, dev, rx))
+        ret.append((METRIC.NIC_OUT, dev, tx))
+    for dev, rd, wr in sample['blk']:
+        ret.append((METRIC.BLK_READ, dev, rd))
+        ret.append((METRIC.BLK_WRITE, dev, wr))
+    return ret
+
+
+def formate_vm_info(sample):
+    """sample --> the string-packed row of the legacy vm_monitor table:
+    [instance_id, cpu_usage, mem_free, mem_max, nic_in, nic_out,
+     disk_read, disk_write, monitor_time, uuid]
+    """
+    return [sample['instance_id'],
+            str(sample['cpu'])[0:5],
+            str(sample['mem_free']),
+            str(sample['mem_max']),
+            '#'.join(['%s:%s' % (dev, rx) for dev, rx, _ in sample['nic']]),
+            '#'.join(['%s:%s' % (dev, tx) for dev, _, tx in sample['nic']]),
+            '#'.join(['%s:%s' % (dev, rd) for dev, rd, _ in sample['blk']]),
+            '#'.join(['%s:%s' % (dev, wr) for dev, _, wr in sample['blk']]),
+            str(sample['time']),
+            sample['uuid']]
+
+
+def parse_vm_info(row):
+    """the legacy vm_monitor row --> sample, only used by the migration.
+    row: (instance_id, cpu_usage, mem_free, mem_max, nic_in, nic_out,
+          disk_read, disk_write, unix monitor_time, uuid)
+    """
+    def split_devs(packed_a, packed_b):
+        ret = list()
+        if not packed_a:
+            return ret
+        values_b = dict()
+        for item in (packed_b or '').split('#'):
+            if ':' in item:
+                dev, value = item.rsplit(':', 1)
+                values_b[dev] = int(value)
+        for item in packed_a.split('#'):
+            if not ':' in item:
+                continue
+            dev, value = item.rsplit(':', 1)
+            ret.append((dev, int(value), values_b.get(dev, 0)))
+        return ret
+
+    sample = new_sample(str(row[0]), str(row[9]))
+    try:
+        sample['cpu'] = float(row[1])
+    except ValueError:
+        sample['cpu'] = 0.0
+    sample['mem_free'] = int(row[2])
+    sample['mem_max'] = int(row[3])
+    sample['nic'] = split_devs(row[4], row[5])
+    sample['blk'] = split_devs(row[6], row[7])
+    sample['time'] = int(row[8])
+    return sample
@@ -0,0 +1,222 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2012 Sina Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import time
+import struct
+import operator
+from kanyun.common.const import *
+from kanyun.common.vminfo import new_sample, decode_agent_data
+
+"""
+Packed encoding of the agent data(worker --> data-server).
+
+The json agent data repeats every instance id, uuid and device name each
+cycle and its counters are absolute. A packed worker sends instead:
+    [MSG_TYPE.AGENT_DICT, json dictionary]
+        when its vms or devices change, and before every keyframe
+    [MSG_TYPE.AGENT_PACKED, worker_id, frame]
+        every cycle
+dictionary:
+    {"worker_id": "worker_1", "dict_id": 3,
+     "vms": [[instance_id, uuid, [nic, ...], [blk, ...]], ...]}
+frame:
+    header '!BBIId': version, flags, dict_id, seq, time
+    then the cpu of every vm('f'), then the counters of every vm in
+    dictionary order: mem_max, mem_free, rx and tx of each nic, read and
+    write of each blk. The counters are absolute in a keyframe(FLAG_KEY)
+    and deltas against the previous frame otherwise, 32 bits when they all
+    fit, 64 bits(FLAG_WIDE) when not.
+All the vms of a frame share its time, they are collected in one pass.
+A data-server which missed a frame(restart, gap in seq, unknown dict_id)
+drops the deltas of that worker until its next keyframe, which comes every
+keyframe_interval frames.
+
+The json agent data is still accepted, so workers can be switched one by
+one(wire_format in the [worker] section of kanyun.conf).
+"""
+
+VERSION = 1
+FLAG_KEY = 0x01
+FLAG_WIDE = 0x02
+HEADER = struct.Struct('!BBIId')
+UINT32_MASK = 0xffffffff
+INT32_MIN = -(1 << 31)
+INT32_MAX = (1 << 31) - 1
+
+
+def get_counters(sample):
+    ret = [sample['mem_max'], sample['mem_free']]
+    for _, rx, tx in sample['nic']:
+        ret.append(rx)
+        ret.append(tx)
+    for _, rd, wr in sample['blk']:
+        ret.append(rd)
+        ret.append(wr)
+    return ret
+
+
+def get_format(vms, counters, wide):
+    return struct.Struct('!%df%d%s' % (vms, counters, 'q' if wide else 'i'))
+
+
+class PackedEncoder():
+    """worker side, one per worker process"""
+
+    def __init__(self, worker_id, keyframe_interval=5):
+        self.worker_id = worker_id
+        self.keyframe_interval = max(1, int(keyframe_interval))
+        self.dict_id = 0
+        self.vms = None
+        self.seq = 0
+        self.previous = None
+        self.since_key = 0
+
+    def get_dictionary(self):
+        return {'worker_id': self.worker_id,
+                'dict_id': self.dict_id,
+                'vms': self.vms}
+
+    def encode(self, data):
+        """agent data(see kanyun.common.vminfo) --> list of messages"""
+        samples = decode_agent_data(data)
+        samples.sort(key=lambda s: s['instance_id'])
+        vms = [[s['instance_id'], s['uuid'],
+                [dev for dev, _, _ in s['nic']],
+                [dev for dev, _, _ in s['blk']]] for s in samples]
+        ret = list()
+        key = self.since_key >= self.keyframe_interval - 1
+        if vms != self.vms:
+            self.vms = vms
+            self.dict_id = (self.dict_id + 1) & UINT32_MASK
+            key = True
+        if key:
+            ret.append([MSG_TYPE.AGENT_DICT, json.dumps(self.get_dictionary())])
+
+        counters = list()
+        for s in samples:
+            counters.extend(get_counters(s))
+        if key:
+            values = counters
+            flags = FLAG_KEY
+            self.since_key = 0
+        else:
+            values = map(operator.sub, counters, self.previous)
+            flags = 0
+            self.since_key += 1
+        if values and (min(values) < INT32_MIN or max(values) > INT32_MAX):
+            flags |= FLAG_WIDE
+        self.previous = counters
+        self.seq = (self.seq + 1) & UINT32_MASK
+
+        t = min([s['time'] for s in samples]) if samples else time.time()
+        frame = HEADER.pack(VERSION, flags, self.dict_id, self.seq, t) + \
+            get_format(len(samples), len(counters), flags & FLAG_WIDE).pack(
+                *([s['cpu'] for s in samples] + values))
+        ret.append([MSG_TYPE.AGENT_PACKED, str(self.worker_id), frame])
+        return ret
+
+
+class WorkerState():
+    """what the data-server knows about one packed worker"""
+
+    def __init__(self, dictionary):
+        self.dict_id = dictionary['dict_id']
+        self.vms = [(str(instance_id), str(uuid),
+                     [str(dev) for dev in nics], [str(dev) for dev in blks])
+                    for instance_id, uuid, nics, blks in dictionary['vms']]
+        self.counter_count = sum([2 + 2 * len(nics) + 2 * len(blks)
+                                  for _, _, nics, blks in self.vms])
+        self.formats = [get_format(len(self.vms), self.counter_count, False),
+                        get_format(len(self.vms), self.counter_count, True)]
+        # counters of the last frame, None until a keyframe
+        self.counters = None
+        self.seq = 0
+
+
+class PackedDecoder():
+    """data-server side, keeps the dictionary and the last counters of
+    every packed worker"""
+
+    def __init__(self):
+        # worker_id --> WorkerState
+        self.workers = dict()
+        self.frames = 0
+        self.dropped = 0
+
+    def set_dictionary(self, dictionary):
+        worker_id = str(dictionary['worker_id'])
+        self.workers[worker_id] = WorkerState(dictionary)
+
+    def decode(self, worker_id, frame):
+        """return the list of samples(see kanyun.common.vminfo), empty when
+        the frame can not be decoded yet"""
+        self.frames += 1
+        state = self.workers.get(worker_id)
+        try:
+            version, flags, dict_id, seq, t = HEADER.unpack_from(frame)
+            if version != VERSION or state is None \
+                    or state.dict_id != dict_id:
+                return self.drop(worker_id, 'unknown dictionary')
+            fmt = state.formats[1 if flags & FLAG_WIDE else 0]
+            values = fmt.unpack(frame[HEADER.size:])
+        except struct.error:
+            return self.drop(worker_id, 'bad frame')
+
+        cpus = values[:len(state.vms)]
+        values = values[len(state.vms):]
+        if flags & FLAG_KEY:
+            counters = values
+        elif state.counters is None \
+                or seq != (state.seq + 1) & UINT32_MASK:
+            state.counters = None
+            return self.drop(worker_id, 'missing frame')
+        else:
+            counters = map(operator.add, state.counters, values)
+        state.counters = counters
+        state.seq = seq
+
+        samples = list()
+        i = 0
+        t = int(t)
+        for (instance_id, uuid, nics, blks), cpu in zip(state.vms, cpus):
+            sample = new_sample(instance_id, uuid)
+            sample['time'] = t
+            sample['cpu'] = cpu
+            sample['mem_max'] = counters[i]
+            sample['mem_free'] = counters[i + 1]
+            i += 2
+            for dev in nics:
+                sample['nic'].append((dev, counters[i], counters[i + 1]))
+                i += 2
+            for dev in blks:
+                sample['blk'].append((dev, counters[i], counters[i + 1]))
+                i += 2
+            samples.append(sample)
+        return samples
+
+    def get_stats(self):
+        return {'workers': len(self.workers),
+                'frames': self.frames,
+                'dropped': self.dropped}
+
+    ####### private ########
+    def drop(self, worker_id, reason):
+        self.dropped += 1
+        print 'packed frame of %s dropped: %s' % (worker_id, reason)
+        return list()
+
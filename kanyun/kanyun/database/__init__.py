@@ -0,0 +1,23 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+try:
+    from MySQLdb import Error as DbError
+except ImportError:
+    class DbError(StandardError):
+        """MySQLdb is not installed, nothing raises it"""
+
+
+def get_db(cfg):
+    """open the storage selected by 'storage' in the [mysql_db] section:
+        metric: numeric time-series tables(vm_metric.sql), the default
+        legacy: the string-packed vm_monitor table(vm_monitor.sql)
+    """
+    storage = cfg.get('storage', 'metric')
+    if storage == 'legacy':
+        from kanyun.database.mysqldb import MysqlDb
+        return MysqlDb(cfg)
+    elif storage == 'metric':
+        from kanyun.database.metricdb import MetricDb
+        return MetricDb(cfg)
+    else:
+        raise ValueError('unknown storage: %s' % storage)
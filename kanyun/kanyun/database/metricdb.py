@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+#coding=utf-8
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import calendar
+from kanyun.common.const import *
+from kanyun.common.vminfo import sample_to_metrics
+from kanyun.database import DbError
+from kanyun.database.mysqldb import MysqlDb
+
+"""
+Numeric time-series storage, schema in vm_metric.sql.
+
+Every metric of every device is a (uuid, metric, monitor_time, device, value)
+row, so range queries are scans of the (uuid, metric, monitor_time) primary
+key prefix and nothing has to be parsed on the way out.
+"""
+
+
+def to_unix_time(t):
+    """unix time or '%Y-%m-%d %H:%M:%S'(UTC) --> int unix time"""
+    if t is None:
+        return 0
+    if isinstance(t, (int, long, float)):
+        return int(t)
+    return calendar.timegm(time.strptime(str(t), "%Y-%m-%d %H:%M:%S"))
+
+
+class MetricDb(MysqlDb):
+    PARTITION_SPAN = 24 * 60 * 60   # one chunk per day
+    PARTITIONS_AHEAD = 2            # days created before samples arrive
+    INSERT_CHUNK = 5000             # rows per insert statement
+    ROLLUP_INSERT = 'insert into vm_rollup(period,uuid,metric,bucket_time,' \
+                    'device,min_value,max_value,sum_value,count,last_value,' \
+                    'last_time)values%s on duplicate key update ' \
+                    'min_value=least(min_value,values(min_value)),' \
+                    'max_value=greatest(max_value,values(max_value)),' \
+                    'sum_value=sum_value+values(sum_value),' \
+                    'count=count+values(count),' \
+                    'last_value=if(values(last_time)>=last_time,' \
+                    'values(last_value),last_value),' \
+                    'last_time=greatest(last_time,values(last_time))'
+
+    def __init__(self, conn_dict):
+        MysqlDb.__init__(self, conn_dict)
+        # samples before this time have a partition, 0 = unknown
+        self.partition_end = 0
+
+    def insert_vm_samples(self, samples):
+        """ insert decoded samples(see kanyun.common.vminfo)"""
+        if not samples:
+            return True
+        rows = list()
+        instances = dict()
+        newest = 0
+        for s in samples:
+            for metric, device, value in sample_to_metrics(s):
+                rows.append((s['uuid'], metric, s['time'], device, value))
+            instances[s['uuid']] = (s['uuid'], s['instance_id'], s['time'])
+            newest = max(newest, s['time'])
+        self.ensure_partitions(newest)
+        self.__reconnect_db__()
+        for i in range(0, len(rows), self.INSERT_CHUNK):
+            self.insert_rows(rows[i:i + self.INSERT_CHUNK])
+        self.touch_instances(instances.values())
+        self.conn.commit()
+        return True
+
+    def get_all_instances(self, start_time):
+        """ list all instances seen from time ${start_time} to now"""
+        self.__reconnect_db__()
+        self.cursor.execute('select instance_id from vm_instance '
+                            'where last_seen>=%s', (to_unix_time(start_time),))
+        return self.cursor.fetchall()
+
+    def get_uuid(self, instance_id):
+        self.__reconnect_db__()
+        self.cursor.execute('select uuid from vm_instance '
+                            'where instance_id=%s', (instance_id,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def get_instance_info(self, instance_id, start_time, end_time=None):
+        """ get vm info by instance_id from time $(start_time) to now
+        return: ((metric_name, device, monitor_time, value), ...)"""
+        uuid = self.get_uuid(instance_id)
+        if uuid is None:
+            return tuple()
+        ret = list()
+        for metric in sorted(metric_str.keys()):
+            for t, device, value in self.get_metric_range(uuid, metric,
+                                                start_time, end_time):
+                ret.append((metric_str[metric], device, t, value))
+        return tuple(ret)
+
+    def get_metric_range(self, uuid, metric, time_from, time_to=None,
+                         device=None):
+        """ index scan of one metric of one vm
+        return: ((monitor_time, device, value), ...) ordered by time"""
+        self.__reconnect_db__()
+        sql_cmd = 'select monitor_time,device,value from vm_metric ' \
+                  'where uuid=%s and metric=%s and monitor_time>=%s'
+        params = [uuid, metric, to_unix_time(time_from)]
+        if not time_to is None:
+            sql_cmd += ' and monitor_time<%s'
+            params.append(to_unix_time(time_to))
+        if not device is None:
+            sql_cmd += ' and device=%s'
+            params.append(device)
+        sql_cmd += ' order by monitor_time'
+        self.cursor.execute(sql_cmd, params)
+        return self.cursor.fetchall()
+
+    def get_metric_all(self, metric, time_from, time_to=None, device=None):
+        """ one metric of every vm, the time partitions prune the scan
+        return: ((uuid, monitor_time, device, value), ...)"""
+        self.__reconnect_db__()
+        sql_cmd = 'select uuid,monitor_time,device,value from vm_metric ' \
+                  'where metric=%s and monitor_time>=%s'
+        params = [metric, to_unix_time(time_from)]
+        if not time_to is None:
+            sql_cmd += ' and monitor_time<%s'
+            params.append(to_unix_time(time_to))
+        if not device is None:
+            sql_cmd += ' and device=%s'
+            params.append(device)
+        self.cursor.execute(sql_cmd, params)
+        return self.cursor.fetchall()
+
+    ####### rollup tiers ########
+    def insert_rollups(self, rows):
+        """ merge aggregated buckets into vm_rollup
+        rows: [(period, uuid, metric, bucket_time, device,
+                min, max, sum, count, last, last_time), ...]"""
+        if not rows:
+            return True
+        self.__reconnect_db__()
+        # the merge adds to sum and count: the chunks are committed
+        # together or not at all, so a retried flush counts them once
+        try:
+            for i in range(0, len(rows), self.INSERT_CHUNK):
+                chunk = rows[i:i + self.INSERT_CHUNK]
+                params = list()
+                for row in chunk:
+                    params.extend(row)
+                self.cursor.execute(self.ROLLUP_INSERT % ','.join(
+                    ['(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)'] * len(chunk)),
+                    params)
+            self.conn.commit()
+        except DbError:
+            self.conn.rollback()
+            raise
+        return True
+
+    def get_rollup_range(self, period, uuid, metric, time_from, time_to=None,
+                         device=None):
+        """ index scan of one metric of one vm in one tier
+        return: ((bucket_time, device, min, max, sum, count, last,
+                  last_time), ...) ordered by time"""
+        self.__reconnect_db__()
+        sql_cmd = 'select bucket_time,device,min_value,max_value,sum_value,' \
+                  'count,last_value,last_time from vm_rollup where period=%s ' \
+                  'and uuid=%s and metric=%s and bucket_time>=%s'
+        params = [period, uuid, metric, to_unix_time(time_from)]
+        if not time_to is None:
+            sql_cmd += ' and bucket_time<%s'
+            params.append(to_unix_time(time_to))
+        if not device is None:
+            sql_cmd += ' and device=%s'
+            params.append(device)
+        sql_cmd += ' order by bucket_time'
+        self.cursor.execute(sql_cmd, params)
+        return self.cursor.fetchall()
+
+    def get_rollup_all(self, period, metric, time_from, time_to=None,
+                       device=None):
+        """ one metric of every vm in one tier, scan of the period_time index
+        return: ((uuid, bucket_time, device, min, max, sum, count, last,
+                  last_time), ...)"""
+        self.__reconnect_db__()
+        sql_cmd = 'select uuid,bucket_time,device,min_value,max_value,' \
+                  'sum_value,count,last_value,last_time from vm_rollup ' \
+                  'where period=%s and bucket_time>=%s'
+        params = [period, to_unix_time(time_from)]
+        if not time_to is None:
+            sql_cmd += ' and bucket_time<%s'
+            params.append(to_unix_time(time_to))
+        sql_cmd += ' and metric=%s'
+        params.append(metric)
+        if not device is None:
+            sql_cmd += ' and device=%s'
+            params.append(device)
+        self.cursor.execute(sql_cmd, params)
+        return self.cursor.fetchall()
+
+    def delete_rollups_before(self, period, t, limit=10000):
+        """ delete the buckets of one tier older than ${t}, ${limit} rows
+        per transaction so the table is never locked for long"""
+        total = 0
+        while True:
+            self.__reconnect_db__()
+            self.cursor.execute('delete from vm_rollup where period=%s and '
+                                'bucket_time<%s limit %s',
+                                (period, to_unix_time(t), limit))
+            self.conn.commit()
+            total += self.cursor.rowcount
+            if self.cursor.rowcount < limit:
+                break
+        return total
+
+    ####### time partitions ########
+    def get_partitions(self):
+        """ return [(name, less_than), ...], less_than is None for MAXVALUE,
+        or None when vm_metric is not partitioned"""
+        self.__reconnect_db__()
+        self.cursor.execute('select partition_name,partition_description '
+                            'from information_schema.partitions '
+                            'where table_schema=database() and '
+                            "table_name='vm_metric' "
+                            'order by partition_ordinal_position')
+        ret = list()
+        for name, desc in self.cursor.fetchall():
+            if name is None:
+                return None
+            if desc is None or desc == 'MAXVALUE':
+                ret.append((name, None))
+            else:
+                ret.append((name, int(desc)))
+        return ret
+
+    def ensure_partitions(self, until):
+        """ split p_future so that daily chunks cover time ${until}
+        plus PARTITIONS_AHEAD days"""
+        if 0 < until < self.partition_end:
+            return
+        partitions = self.get_partitions()
+        if partitions is None or not ('p_future', None) in partitions:
+            # not partitioned(or managed by the admin), never check again
+            self.partition_end = 1 << 62
+            return
+        span = self.PARTITION_SPAN
+        bounds = [b for _, b in partitions if not b is None]
+        end = max(bounds) if bounds else (min(until, time.time()) // span) * span
+        end = int(end)
+        target = max(until, int(time.time())) + self.PARTITIONS_AHEAD * span
+        new = list()
+        while end <= target:
+            end += span
+            new.append('partition p%s values less than (%d)'
+                       % (time.strftime('%Y%m%d', time.gmtime(end - span)), end))
+        if new:
+            new.append('partition p_future values less than maxvalue')
+            self.cursor.execute('alter table vm_metric reorganize partition '
+                                'p_future into (%s)' % ','.join(new))
+            print 'vm_metric: %d partitions added, data before %s' \
+                  % (len(new) - 1, time.strftime('%F', time.gmtime(end)))
+        self.partition_end = end
+
+    def drop_partitions_before(self, t):
+        """ drop the chunks holding only samples older than ${t}"""
+        partitions = self.get_partitions()
+        if partitions is None:
+            return 0
+        old = [name for name, b in partitions
+               if not b is None and b <= to_unix_time(t)]
+        if old:
+            self.__reconnect_db__()
+            self.cursor.execute('alter table vm_metric drop partition %s'
+                                % ','.join(old))
+        return len(old)
+
+    ####### private ########
+    def insert_rows(self, rows):
+        sql_cmd = 'insert into vm_metric(uuid,metric,monitor_time,device,' \
+                  'value)values%s on duplicate key update value=values(value)' \
+                  % ','.join(['(%s,%s,%s,%s,%s)'] * len(rows))
+        params = list()
+        for row in rows:
+            params.extend(row)
+        self.cursor.execute(sql_cmd, params)
+
+    def touch_instances(self, instances):
+        sql_cmd = 'insert into vm_instance(uuid,instance_id,last_seen)' \
+                  'values%s on duplicate key update ' \
+                  'instance_id=values(instance_id),' \
+                  'last_seen=greatest(last_seen,values(last_seen))' \
+                  % ','.join(['(%s,%s,%s)'] * len(instances))
+        params = list()
+        for row in instances:
+            params.extend(row)
+        self.cursor.execute(sql_cmd, params)
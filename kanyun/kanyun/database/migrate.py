@@ -0,0 +1,60 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+from kanyun.common.vminfo import parse_vm_info
+from kanyun.database import DbError
+from kanyun.server.rollup import Rollup
+
+"""
+Copy the string-packed vm_monitor rows into the numeric vm_metric table.
+
+The copy walks vm_monitor by primary key, so it can be stopped and resumed
+with the last printed id, and may run while kanyun-server is writing.
+Every batch also goes through a Rollup, so that the reports served from
+the rollup tiers(see rollup.choose_tier) cover the migrated history.
+"""
+
+
+def migrate_vm_monitor(src, dst, batch_size=1000, after_id=0,
+                       retention=None):
+    """src: MysqlDb, dst: MetricDb, retention: see rollup.get_retention
+    return: (rows copied, rows skipped, last id)"""
+    rollup = Rollup(dst, retention=retention)
+    copied = 0
+    skipped = 0
+    pass_time = time.time()
+    while True:
+        rows = src.get_monitor_rows(after_id, batch_size)
+        if len(rows) == 0:
+            break
+        samples = list()
+        for row in rows:
+            try:
+                samples.append(parse_vm_info(row[1:]))
+            except (ValueError, TypeError, IndexError):
+                print 'skip invalid row:', row
+                skipped += 1
+        dst.insert_vm_samples(samples)
+        rollup.update(samples)
+        rollup.flush()
+        copied += len(samples)
+        after_id = rows[-1][0]
+        print '%d rows copied, last id=%d, %.1f rows/s' \
+              % (copied, after_id, copied / max(time.time() - pass_time, 0.001))
+    # the buckets of a failed flush are written with the next batch
+    if rollup.buckets and rollup.flush() is None:
+        raise DbError('rollups of the rows up to id %d not written'
+                      % after_id)
+    return copied, skipped, after_id
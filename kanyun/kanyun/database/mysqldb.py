@@ -4,8 +4,14 @@ import MySQLdb as mysql;
 import sys;
 import pdb
 from redisclient import CacheClient;
+from kanyun.common.vminfo import formate_vm_info;
 
 class MysqlDb(object):
+    ### one values() group per sample, monitor_time is converted by mysql
+    MONITOR_COLUMNS='instance_id,cpu_usage,mem_free,mem_max,nic_in,nic_out,\
+disk_read,disk_write,monitor_time,uuid';
+    MONITOR_VALUES='(%s,%s,%s,%s,%s,%s,%s,%s,from_unixtime(%s),%s)';
+
     def __init__(self,conn_dict):
         self.conn=mysql.connect(conn_dict['host'],conn_dict['user'],conn_dict['passwd'],conn_dict['db']);
         self.cursor=self.conn.cursor();
@@ -18,15 +24,27 @@ class MysqlDb(object):
         self.cursor=self.conn.cursor(); 
 
     def insert_monitor_data(self,data):
+        return self.insert_monitor_data_batch([data]);
+
+    def insert_monitor_data_batch(self,rows):
+        """ insert many formated vm info rows with a single multi-row
+        parameterized statement and a single commit"""
+        if not rows:
+            return True;
         self.__reconnect_db__();
-        sql_cmd='''insert into vm_monitor(instance_id,cpu_usage,mem_free,mem_max,nic_in,nic_out,\
-disk_read,disk_write,monitor_time,uuid)values('%s','%s',%s,%s,'%s','%s','%s','%s',from_unixtime('%s',\
-'%%Y-%%m-%%d %%T'),'%s');'''%tuple(data);
-        sys.stdout.flush();
-        self.cursor.execute(sql_cmd);
+        sql_cmd='insert into vm_monitor(%s)values%s;'%(self.MONITOR_COLUMNS,
+                ','.join([self.MONITOR_VALUES]*len(rows)));
+        params=[];
+        for row in rows:
+            params.extend(row[0:10]);
+        self.cursor.execute(sql_cmd,params);
         self.conn.commit();
         return True;
 
+    def insert_vm_samples(self,samples):
+        """ insert decoded samples(see kanyun.common.vminfo)"""
+        return self.insert_monitor_data_batch([formate_vm_info(s) for s in samples]);
+
     def get_all_instances(self,start_time):
         """ list all instances from time ${start_time} to now"""
         self.__reconnect_db__();
@@ -42,4 +60,13 @@ disk_read,disk_write,monitor_time,uuid)values('%s','%s',%s,%s,'%s','%s','%s','%s
         self.cursor.execute(sql_cmd);
         return self.cursor.fetchall();
 
-
+    def get_monitor_rows(self,after_id,limit):
+        """ raw vm_monitor rows with id>${after_id}, monitor_time as unix time
+        return: ((id,instance_id,cpu_usage,mem_free,mem_max,nic_in,nic_out,
+                  disk_read,disk_write,monitor_time,uuid), ...)"""
+        self.__reconnect_db__();
+        sql_cmd='''select id,instance_id,cpu_usage,mem_free,mem_max,nic_in,nic_out,\
+disk_read,disk_write,unix_timestamp(monitor_time),uuid from vm_monitor where id>%s \
+order by id limit %s''';
+        self.cursor.execute(sql_cmd,(after_id,limit));
+        return self.cursor.fetchall();
@@ -39,41 +39,113 @@ class RecordRemover(Thread):
         print "record remover thread stop work.";
 
 class CacheClient(object):
-    """memecached client object""";
+    """redis client object.
+    every vm has a list keyed by its uuid, holding its latest samples
+    ('$'-joined legacy row without instance_id and uuid), oldest first.
+    The list is trimmed to cache_length entries on every push, so it is a
+    ring buffer of the dashboard window; the keys also expire
+    cache_time_buffer seconds after the last push, so stopped vms go away.
+    INSTANCE_KEY maps instance_id to uuid. Nothing is flushed on start:
+    the history of a restarted server is still there.
+    config([mysql_db] section of kanyun.conf):
+        cache_server: localhost
+        cache_port: 6379
+        cache_time_buffer: 144000   # seconds
+        cache_length: 2400          # samples, default one per minute
+    """;
+    INSTANCE_KEY='kanyun:instance';
+
     def __init__(self,config):
-        self.client=Redis(host=config['cache_server']);
-        self.client.flushdb();
+        self.client=Redis(host=config['cache_server'],
+                          port=int(config.get('cache_port',6379)));
         ### assume kanyun-worker send vm info every 5 seconds,but actually not, the time gap maybe 1 minute.
         self.cache_time_buffer=int(config['cache_time_buffer']);
+        self.cache_length=int(config.get('cache_length',
+                                         max(1,self.cache_time_buffer/60)));
         #self.recordRemover=RecordRemover(self.client);
         #self.recordRemover.start();
 
+    @staticmethod
+    def formate_to_cache_info(info):
+        """ formate as dict """
+        dict_info=dict();
+        dict_info['instance_id']=str(info[0]);
+        dict_info['uuid']=str(info[9]);
+        dict_info['info']='$'.join(info[1:9]);
+        return dict_info;
+
     def push_vm_info(self,info):
-        """ push instance info into memcached server""";
-        def formate_to_cache_info(info):
-            """ formate as dict """
-            dict_info=dict();
-            dict_info['instance_id']=str(info[0]);
-            dict_info['uuid']=str(info[9]);
-            dict_info['info']='$'.join(info[1:9]);
-            return dict_info;
-        #### process vm info
-        dict_info=formate_to_cache_info(info);
-        recordTime=int(info[8]);
-        index_key=dict_info['uuid'];
-        self.client.rpush(index_key,dict_info['info']);
-        self.client.expire(index_key,self.cache_time_buffer);
-
-    def get_instance_info(self,instance_id):
-        """ get instance info from cache server"""
-        return self.client.lrange(instance_id,0,-1);
+        """ push instance info into redis server""";
+        self.push_vm_infos([info]);
+
+    def push_vm_infos(self,infos):
+        """ push many instance infos in one round trip""";
+        if not infos:
+            return;
+        pipe=self.client.pipeline(transaction=False);
+        instances=dict();
+        for info in infos:
+            dict_info=self.formate_to_cache_info(info);
+            index_key=dict_info['uuid'];
+            pipe.rpush(index_key,dict_info['info']);
+            pipe.ltrim(index_key,-self.cache_length,-1);
+            pipe.expire(index_key,self.cache_time_buffer);
+            instances[dict_info['instance_id']]=index_key;
+        pipe.hmset(self.INSTANCE_KEY,instances);
+        pipe.execute();
+
+    def get_uuid(self,instance_id):
+        """ instance_id or uuid --> uuid""";
+        uuid=self.client.hget(self.INSTANCE_KEY,instance_id);
+        if uuid is None:
+            return instance_id;
+        return uuid;
+
+    def get_uuids(self,ids):
+        """ instance_ids or uuids --> uuids, one round trip""";
+        if not ids:
+            return list();
+        uuids=self.client.hmget(self.INSTANCE_KEY,ids);
+        return [uuid or i for i,uuid in zip(ids,uuids)];
+
+    def get_instances(self):
+        """ instance_ids of the vms having samples in cache""";
+        instances=self.client.hgetall(self.INSTANCE_KEY);
+        if not instances:
+            return list();
+        items=instances.items();
+        pipe=self.client.pipeline(transaction=False);
+        for _,uuid in items:
+            pipe.exists(uuid);
+        ret=list();
+        gone=list();
+        for (instance_id,uuid),exists in zip(items,pipe.execute()):
+            if exists:
+                ret.append(instance_id);
+            else:
+                gone.append(instance_id);
+        if gone:
+            self.client.hdel(self.INSTANCE_KEY,*gone);
+        return sorted(ret);
+
+    def get_instance_info(self,instance_id,count=0):
+        """ get instance info from cache server, the latest ${count}
+        samples or all of them""";
+        return self.get_instances_info([self.get_uuid(instance_id)],
+                                       count).values()[0];
+
+    def get_instances_info(self,uuids,count=0):
+        """ recent history of many vms in one round trip
+        return: {uuid: [info, ...]}, oldest first""";
+        pipe=self.client.pipeline(transaction=False);
+        for uuid in uuids:
+            pipe.lrange(uuid,-count if count>0 else 0,-1);
+        return dict(zip(uuids,pipe.execute()));
 
 if __name__=='__main__':
     conf={}
     conf['cache_server'] = 'localhost'
     conf['cache_time_buffer'] = '3600'
     cc = CacheClient(conf)
-    print cc.get_instance_list()
-    #print cc.get_instance_info(cc.get_instance_list()[0])
-    
-
+    print cc.get_instances()
+    #print cc.get_instance_info(cc.get_instances()[0])
@@ -0,0 +1,353 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2012 Sina Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import sys
+import time
+import itertools
+from collections import OrderedDict
+from kanyun.common.const import *
+from kanyun.common.statistics import Statistics
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""
+Aggregation engine of the usage reports.
+
+Both raw samples and rollup rows are handled as buckets:
+    (time, min, max, sum, count, last, last_time)
+a raw sample being a bucket of count 1. With numpy the rows are loaded
+into one contiguous float64 array and every statistic of every period is
+computed by a sort and a few reduceat() calls; without numpy the same
+results come from the Statistics loop.
+
+statistics: avg, min, max, sum, sam(count), last, rate(change per second
+of the last value, for counters it is the throughput).
+
+When the rows of several devices are mixed(all the nics or disks of a
+vm), last and rate are computed per device and summed, one series of
+counters per device.
+
+'python -m kanyun.server.aggregate [rows] [period]' compares both engines.
+"""
+
+TIME, MIN, MAX, SUM, COUNT, LAST, LAST_TIME = range(7)
+# statistics of one series, summed over the devices
+PER_DEVICE = ('last', 'rate')
+
+
+def has_numpy():
+    return not numpy is None
+
+
+def load_raw(rows):
+    """rows: ((monitor_time, device, value), ...) of MetricDb"""
+    if numpy is None:
+        return [(t, v, v, v, 1, v, t) for t, _, v in rows]
+    if len(rows) == 0:
+        return numpy.zeros((0, 7))
+    t, _, v = zip(*rows)
+    t = numpy.array(t, dtype=numpy.float64)
+    v = numpy.array(v, dtype=numpy.float64)
+    return numpy.column_stack((t, v, v, v, numpy.ones(len(t)), v, t))
+
+
+def load_rollup(rows):
+    """rows: ((bucket_time, device, min, max, sum, count, last,
+               last_time), ...) of MetricDb"""
+    if numpy is None:
+        return [(row[0],) + tuple(row[2:]) for row in rows]
+    if len(rows) == 0:
+        return numpy.zeros((0, 7))
+    cols = zip(*rows)
+    del cols[1]
+    return numpy.array(cols, dtype=numpy.float64).T.copy()
+
+
+def load_devices(rows):
+    """the device column of the rows of MetricDb.get_*_range()"""
+    return [row[1] for row in rows]
+
+
+def load_raw_all(rows):
+    """rows: ((uuid, monitor_time, device, value), ...) of MetricDb
+    return: (uuids, devices, buckets)"""
+    if len(rows) == 0:
+        return list(), list(), load_raw(rows)
+    uuids, t, devices, v = zip(*rows)
+    return uuids, devices, load_raw(zip(t, devices, v))
+
+
+def load_rollup_all(rows):
+    """rows: ((uuid, bucket_time, device, min, max, sum, count, last,
+               last_time), ...) of MetricDb
+    return: (uuids, devices, buckets)"""
+    if len(rows) == 0:
+        return list(), list(), load_rollup(rows)
+    cols = zip(*rows)
+    uuids = cols[0]
+    devices = cols[2]
+    del cols[2]
+    if numpy is None:
+        return uuids, devices, zip(*cols[1:])
+    return uuids, devices, \
+        numpy.array(cols[1:], dtype=numpy.float64).T.copy()
+
+
+def split_devices(data, devices):
+    """return: [buckets of one device, ...]"""
+    if numpy is None:
+        parts = dict()
+        for row, device in zip(data, devices):
+            parts.setdefault(device, list()).append(row)
+        return parts.values()
+    devices = numpy.array(devices)
+    return [data[devices == device] for device in numpy.unique(devices)]
+
+
+def group_reduce(keys, data):
+    """reduce the buckets sharing a key.
+    keys: int/float array(n), data: array(n, 7)
+    return: (sorted unique keys, {statistic: array})"""
+    order = numpy.lexsort((data[:, LAST_TIME], keys))
+    keys = keys[order]
+    data = data[order]
+    starts = numpy.flatnonzero(numpy.r_[True, keys[1:] != keys[:-1]])
+    ends = numpy.r_[starts[1:], len(keys)] - 1
+    ret = dict()
+    ret['min'] = numpy.minimum.reduceat(data[:, MIN], starts)
+    ret['max'] = numpy.maximum.reduceat(data[:, MAX], starts)
+    ret['sum'] = numpy.add.reduceat(data[:, SUM], starts)
+    ret['sam'] = numpy.add.reduceat(data[:, COUNT], starts)
+    ret['avg'] = ret['sum'] / numpy.maximum(ret['sam'], 1)
+    ret['last'] = data[ends, LAST]
+    ret['last_time'] = data[ends, LAST_TIME]
+    ret['first'] = data[starts, LAST]
+    ret['first_time'] = data[starts, LAST_TIME]
+    return keys[starts], ret
+
+
+def rate(delta, seconds):
+    ret = numpy.zeros(len(delta))
+    ok = seconds > 0
+    ret[ok] = delta[ok] / seconds[ok]
+    return ret
+
+
+def aggregate(data, period):
+    """bucket ${data} into ${period} seconds
+    return: (bucket times, {statistic: array}), ordered by time"""
+    t = data[:, TIME]
+    buckets, ret = group_reduce(t - t % period, data)
+    # the first bucket has no predecessor, use its own first sample
+    prev = numpy.r_[ret['first'][:1], ret['last'][:-1]]
+    prev_time = numpy.r_[ret['first_time'][:1], ret['last_time'][:-1]]
+    ret['rate'] = rate(ret['last'] - prev, ret['last_time'] - prev_time)
+    return buckets, ret
+
+
+def aggregate_loop(rs, period, statistic):
+    """Statistics based reference of aggregate(), one row at a time"""
+    buckets = dict()
+    firsts = dict()
+    for row in rs:
+        t = row[TIME] - row[TIME] % period
+        if not buckets.has_key(t):
+            buckets[t] = Statistics()
+            firsts[t] = (row[LAST], row[LAST_TIME])
+        elif row[LAST_TIME] < firsts[t][1]:
+            firsts[t] = (row[LAST], row[LAST_TIME])
+        buckets[t].merge(*row[1:])
+    ret = OrderedDict()
+    prev = None
+    for t in sorted(buckets.keys()):
+        stat = buckets[t]
+        if statistic == 'rate' or statistic == STATISTIC.RATE:
+            if prev is None:
+                prev = firsts[t]
+            seconds = stat.last_time - prev[1]
+            if seconds > 0:
+                ret[t] = (stat.get_last() - prev[0]) / float(seconds)
+            else:
+                ret[t] = 0.0
+            prev = (stat.get_last(), stat.last_time)
+        else:
+            ret[t] = stat.get_value(statistic)
+    return ret
+
+
+def report(data, period, statistic, devices=None):
+    """devices: device of every row, None when they are of one device
+    return: OrderedDict{bucket_time: value of ${statistic}}"""
+    if not devices is None and statistic in PER_DEVICE \
+            and len(set(devices)) > 1:
+        totals = dict()
+        for part in split_devices(data, devices):
+            for t, value in report(part, period, statistic).iteritems():
+                totals[t] = totals.get(t, 0.0) + value
+        return OrderedDict(sorted(totals.iteritems()))
+    if numpy is None:
+        return aggregate_loop(data, period, statistic)
+    if len(data) == 0:
+        return OrderedDict()
+    buckets, ret = aggregate(data, period)
+    if not ret.has_key(statistic):
+        print 'error:', statistic
+        return OrderedDict()
+    return OrderedDict(zip(buckets.astype(int).tolist(),
+                           ret[statistic].tolist()))
+
+
+def sum_devices(values):
+    """[((uuid, device), value), ...] --> [(uuid, value), ...]"""
+    totals = dict()
+    for (uuid, _), value in values:
+        totals[uuid] = totals.get(uuid, 0.0) + value
+    return totals.items()
+
+
+def top_instances(uuids, data, statistic, limit=20, devices=None):
+    """rank the vms by ${statistic} over all their buckets.
+    uuids: sequence(n), data: array(n, 7), devices: sequence(n) or None
+    return: [(uuid, value), ...] highest first"""
+    if len(uuids) == 0:
+        return list()
+    per_device = not devices is None and statistic in PER_DEVICE
+    series = uuids
+    if per_device:
+        series = zip(uuids, devices)
+    # hash the series to ints in C, sorting the strings would cost more
+    index = dict()
+    codes = numpy.fromiter(itertools.imap(index.setdefault, series,
+                                          itertools.count()),
+                           dtype=numpy.int64, count=len(series))
+    codes, ret = group_reduce(codes, data)
+    ret['rate'] = rate(ret['last'] - ret['first'],
+                       ret['last_time'] - ret['first_time'])
+    if not ret.has_key(statistic):
+        print 'error:', statistic
+        return list()
+    values = ret[statistic]
+    names = dict([(code, key) for key, code in index.iteritems()])
+    if per_device:
+        values = sum_devices([(names[code], value) for code, value
+                              in zip(codes.tolist(), values.tolist())])
+        values.sort(key=lambda i: i[1], reverse=True)
+        return values[:limit]
+    top = numpy.argsort(-values, kind='mergesort')[:limit]
+    return [(names[code], value) for code, value
+            in zip(codes[top].tolist(), values[top].tolist())]
+
+
+def top(uuids, data, statistic, limit=20, devices=None):
+    """return: [(uuid, value), ...] highest ${statistic} first"""
+    if numpy is None:
+        return top_instances_loop(uuids, data, statistic, limit, devices)
+    return top_instances(uuids, data, statistic, limit, devices)
+
+
+def top_instances_loop(uuids, rs, statistic, limit=20, devices=None):
+    """Statistics based reference of top_instances()"""
+    per_device = not devices is None and statistic in PER_DEVICE
+    series = uuids
+    if per_device:
+        series = zip(uuids, devices)
+    stats = dict()
+    firsts = dict()
+    for key, row in zip(series, rs):
+        if not stats.has_key(key):
+            stats[key] = Statistics()
+            firsts[key] = (row[LAST], row[LAST_TIME])
+        elif row[LAST_TIME] < firsts[key][1]:
+            firsts[key] = (row[LAST], row[LAST_TIME])
+        stats[key].merge(*row[1:])
+    values = list()
+    for key, stat in stats.iteritems():
+        if statistic == 'rate' or statistic == STATISTIC.RATE:
+            first, first_time = firsts[key]
+            seconds = stat.last_time - first_time
+            value = 0.0
+            if seconds > 0:
+                value = (stat.get_last() - first) / float(seconds)
+        else:
+            value = stat.get_value(statistic)
+        values.append((key, value))
+    if per_device:
+        values = sum_devices(values)
+    values.sort(key=lambda i: i[1], reverse=True)
+    return values[:limit]
+
+
+
+def benchmark(rows=1000000, period=300, vms=1000, devices=2):
+    """compare the Statistics loop and the numpy engine on random samples.
+    the numpy time is split into loading the rows into the array and the
+    aggregation itself. the top-N of rate is per device, ${devices}
+    devices per vm."""
+    import random
+    now = int(time.time())
+    rs = [(now + i, v, v, v, 1, v, now + i)
+          for i, v in enumerate([random.random() * 100
+                                 for _ in xrange(rows)])]
+    uuids = ['vm-%d' % random.randint(0, vms - 1) for _ in xrange(rows)]
+    devs = ['vnet%d' % random.randint(0, devices - 1) for _ in xrange(rows)]
+    begin = time.time()
+    data = numpy.array(rs, dtype=numpy.float64)
+    load_spend = time.time() - begin
+
+    def show(s, loop_spend, vect_spend, same):
+        print '\t%-4s loop %.3fs, numpy %.3fs(x%.1f, load %.3fs), same=%s' \
+              % (s, loop_spend, vect_spend,
+                 loop_spend / max(vect_spend, 1e-6), load_spend, same)
+
+    print 'aggregate %d rows into %d seconds periods' % (rows, period)
+    for s in ['avg', 'max', 'rate']:
+        begin = time.time()
+        loop = aggregate_loop(rs, period, s)
+        loop_spend = time.time() - begin
+        begin = time.time()
+        vect = report(data, period, s)
+        vect_spend = time.time() - begin
+        same = loop.keys() == vect.keys() and \
+            numpy.allclose(loop.values(), vect.values())
+        show(s, loop_spend, vect_spend, same)
+
+    print 'top 20 of %d vms over %d rows' % (vms, rows)
+    for s in ['avg', 'max', 'rate']:
+        begin = time.time()
+        loop = top_instances_loop(uuids, rs, s, devices=devs)
+        loop_spend = time.time() - begin
+        begin = time.time()
+        vect = top_instances(uuids, data, s, devices=devs)
+        vect_spend = time.time() - begin
+        same = numpy.allclose([i[1] for i in loop], [i[1] for i in vect])
+        show(s, loop_spend, vect_spend, same)
+
+
+if __name__ == '__main__':
+    if numpy is None:
+        print 'numpy is not installed'
+        sys.exit(1)
+    rows = 1000000
+    period = 300
+    if len(sys.argv) > 1:
+        rows = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        period = int(sys.argv[2])
+    benchmark(rows, period)
@@ -27,9 +27,12 @@ import ConfigParser
 import zmq
 from collections import OrderedDict
 from kanyun.common.const import *
-from kanyun.common.buffer import HallBuffer
+from kanyun.common.buffer import ResultCache, bucket_range
+from kanyun.server import aggregate
+from kanyun.server.rollup import RAW, choose_tier, get_retention
 #from kanyun.database.cassadb import CassaDb
-from kanyun.database.mysqldb import MysqlDb;
+from kanyun.database import get_db
+from kanyun.database.redisclient import CacheClient
 
 """
 Save the vm's system info data to db.
@@ -39,84 +42,29 @@ protocol:
 [u'S', u'instance-000001@pyw.novalocal', u'cpu', u'total', 0, 5, 1332897600, 0]
 """
 
-class Statistics():
-
-    def __init__(self):
-        self.clean()
-        
-    def clean(self):
-        self.first = True
-        self.count = 0
-        self.sum = 0.0
-        self.min = 0.0
-        self.max = 0.0
-        self.previous = 0.0
-        self.diff = 0.0
-        
-    def update(self, value):
-        self.count += 1
-        self.sum += value
-        if self.first:
-            self.first = False
-            self.previous = value
-            self.max = value
-            self.min = value
-            return
-            
-        if value > self.previous:
-            self.max = value
-        elif value < self.previous:
-            self.min = value
-        self.diff = value - self.previous
-        self.previous = value
-        
-    def get_value(self, w):
-        if w == 'avg' or w == STATISTIC.AVERAGE:
-            return self.get_agerage()
-        elif w == 'min' or w == STATISTIC.MINIMUM:
-            return self.get_min()
-        elif w == 'max' or w == STATISTIC.MAXIMUM:
-            return self.get_max()
-        elif w == 'sum' or w == STATISTIC.SUM:
-            return self.get_sum()
-        elif w == 'sam' or w == STATISTIC.SAMPLES:
-            return self.get_samples()
-        else:
-            print 'error:', w
-            return 0
-            
-    def get_diff(self):
-        return self.diff
-        
-    def get_agerage(self):
-        if self.count == 0:
-            return 0
-        else:
-            return self.sum / self.count
-    def get_sum(self):
-        return self.sum
-        
-    def get_max(self):
-        return self.max
-        
-    def get_min(self):
-        return self.min
-        
-    def get_samples(self):
-        # TODO
-        return 0;
-
-
 class ApiServer():
 
     def __init__(self, 
                  mysql_cfg={}, 
                  log_file="/tmp/api-server.log",
-                 log_level=logging.NOTSET):
+                 log_level=logging.NOTSET,
+                 cache_size=100000,
+                 cache_ttl=300,
+                 subscriber=None):
         # cassandra database object
         self.db = None
         self.mysql_cfg=mysql_cfg;
-        self.buf = HallBuffer()
+        # redis, recent samples of every vm
+        self.cache = None
+        # report cache, size is counted in points
+        self.buf = ResultCache(int(cache_size), int(cache_ttl))
+        # SampleSubscriber of the data-server, invalidates self.buf
+        self.subscriber = subscriber
+        self.retention = get_retention(mysql_cfg)
+        # the rollup tiers are written this late after the samples
+        self.rollup_interval = 60
+        if mysql_cfg:
+            self.rollup_interval = int(mysql_cfg.get('rollup_interval', 60))
         self.logger = logging.getLogger()
         handler = logging.FileHandler(log_file)
         self.logger.addHandler(handler)
@@ -124,15 +72,19 @@ class ApiServer():
         
     def get_db(self):
         if self.db is None:
-             self.db=MysqlDb(self.mysql_cfg);
+             self.db=get_db(self.mysql_cfg);
 #            self.db = CassaDb('data', self.db_host)
         return self.db
+
+    def get_cache(self):
+        if self.cache is None:
+            self.cache=CacheClient(self.mysql_cfg);
+        return self.cache
    
 ### change by lanjinsong 2012-08-10
     def get_instances_list(self,start_time=time.strftime("%Y-%m-%d %T",time.gmtime(0))):
-        """ show all instances in the databases"""
-        db=self.get_db();
-        return self.db.get_instances_in_cache();
+        """ show all instances in the cache"""
+        return self.get_cache().get_instances();
         #result_set=db.get_all_instances(start_time);
         #print type(result_set),'result_set=',result_set;
         #instances=[];
@@ -192,11 +144,12 @@ class ApiServer():
     ##  change by lanjinsong
     def query_usage_report(self,args,**kwargs):
         """ query usage report modified by lanjinsong to use MySQL"""
+        if args.has_key('period'):
+            return self.__query_usage_report(args, **kwargs)
         instance_id=str(args['instance_id']);
         start_time=args['start_time'] if ('start_time' in args) else time.strftime("%Y-%m-%d %T",time.gmtime(0));
-        db=self.get_db();
         #result_set=db.get_instance_info(instance_id,start_time);
-        result_set=db.get_instance_info_in_cache(instance_id);
+        result_set=self.get_cache().get_instance_info(instance_id);
 #        print 'instance_id=%s start_time=%s'%(instance_id,start_time);
 #        print 'result_set=',result_set;
         return result_set;
@@ -240,44 +193,167 @@ class ApiServer():
         cf_str = args['metric']
         scf_str = args['metric_param']
         statistic = args['statistic']
-        period = int(args['period'])
-        timestamp_from = args['timestamp_from']
-        timestamp_to = args['timestamp_to']
-        time_from = iso8601.parse_date(timestamp_from)
-        time_from = int(time.mktime(time_from.timetuple()))
-        time_to = int(time.time())
-        if not timestamp_to is None:
-            time_to = iso8601.parse_date(timestamp_to)
-            time_to = int(time.mktime(time_to.timetuple()))
+        period = max(1, int(args['period']))
+        time_from, time_to = self.get_time_range(args)
+        # whole periods only, so that close dashboard queries share a key
+        time_from, time_to = bucket_range(time_from, time_to, period * 60)
             
+        self.sync_cache()
         bufkey = str([row_id, cf_str, scf_str, 
                       statistic, period, time_from, time_to])
-        if self.buf.hit_test(bufkey):
+        result = self.buf.get(bufkey)
+        if not result is None:
             print "buffer hit:", bufkey
-            return self.buf.get_buf(bufkey)
+            return result
             
         ret_len = 0
-        (rs, count, all_data) = self.get_data(row_id, cf_str, scf_str, 
-                                          time_from, time_to)
+        uuid = self.get_uuid(row_id)
+        # the coarsest rollup tier that still has the resolution asked for
+        tier = choose_tier(period * 60, time_from, self.retention)
+        (rs, count, all_data, devices) = self.get_data(uuid, cf_str, scf_str,
+                                                   time_from, time_to, tier)
         if not rs is None and count > 0:
-            buf = self.analyize_data(rs, 1, statistic)
-            ret = self.analyize_data(buf, period, statistic)
-            if ret is None:
-                ret_len = 0
-            else:
-                ret = OrderedDict(sorted(ret.items(), key=lambda t: t[0]))
-                ret_len = len(ret)
-            print ret_len, "result."
+            ret = self.analyize_data(rs, period * 60, statistic, devices)
+            ret_len = len(ret)
+            print ret_len, "result, tier", tier
         else:
             print "no result."
             ret = None
             ret_len = 0
             
         result = ret, ret_len, all_data
-        if (not result is None and time.time() - time_to > 120):
-            self.buf.cleanup()
-            self.buf.save(bufkey, result)
+        # without invalidation only the ranges no sample can land in anymore
+        settled = time.time() - time_to > 120
+        if tier != RAW:
+            settled = time.time() - time_to > 120 + self.rollup_interval
+        if not self.subscriber is None or settled:
+            self.buf.put(bufkey, result, size=ret_len + 1, uuid=uuid,
+                         time_from=time_from, time_to=time_to)
         return result
 
+    def query_top_instances(self, args, **kwargs):
+        """rank all vms by one metric
+        {
+            'metric': 'cpu',
+            'metric_param': 'total',
+            'statistic': 'avg',
+            'period': 1,        # resolution in minutes, selects the tier
+            'limit': 20,
+            'timestamp_from': '2012-02-20T12:12:12',
+            'timestamp_to': None,
+        }
+        return: [(uuid, value), ...] highest first
+        """
+        db = self.get_db()
+        if not hasattr(db, 'get_metric_all'):
+            print 'storage does not support top instances'
+            return list()
+        cf_str = args['metric']
+        if not metric_id.has_key(cf_str):
+            print 'unknown metric:', cf_str
+            return list()
+        metric = metric_id[cf_str]
+        device = args.get('metric_param')
+        if device in ('', 'total'):
+            device = None
+        statistic = args.get('statistic', STATISTIC.AVERAGE)
+        limit = int(args.get('limit', 20))
+        period = max(1, int(args.get('period', 1)))
+        time_from, time_to = self.get_time_range(args)
+
+        tier = choose_tier(period * 60, time_from, self.retention)
+        if tier == RAW:
+            rows = db.get_metric_all(metric, time_from, time_to, device)
+            uuids, devices, data = aggregate.load_raw_all(rows)
+        else:
+            rows = db.get_rollup_all(tier, metric, time_from, time_to, device)
+            uuids, devices, data = aggregate.load_rollup_all(rows)
+        print len(rows), "rows, tier", tier
+        return aggregate.top(uuids, data, statistic, limit, devices)
+
+    def query_recent(self, args, **kwargs):
+        """recent samples of many vms from the cache, two round trips
+        whatever the number of vms
+        {
+            'ids': ['instance-00000001', '76d6f296-...', ...],
+            'count': 60,        # latest samples per vm, 0 = all cached
+        }
+        return: {id: ['cpu$mem_free$mem_max$nic_in$nic_out$blk_read$'
+                      'blk_write$time', ...]}, oldest first
+        """
+        ids = [str(i) for i in args['ids']]
+        count = int(args.get('count', 0))
+        cache = self.get_cache()
+        uuids = cache.get_uuids(ids)
+        rs = cache.get_instances_info(uuids, count)
+        return dict([(i, rs[uuid]) for i, uuid in zip(ids, uuids)])
+
+    def get_cache_stats(self):
+        self.sync_cache()
+        return self.buf.get_stats()
+
     ##################### end public API interface ########################
 
+    def get_time_range(self, args):
+        """timestamp_from/timestamp_to(iso8601) --> unix time, to default now"""
+        time_from = iso8601.parse_date(args['timestamp_from'])
+        time_from = int(time.mktime(time_from.timetuple()))
+        time_to = int(time.time())
+        timestamp_to = args.get('timestamp_to')
+        if not timestamp_to is None:
+            time_to = iso8601.parse_date(timestamp_to)
+            time_to = int(time.mktime(time_to.timetuple()))
+        return time_from, time_to
+
+    def sync_cache(self):
+        """drop the cached reports the data-server wrote new samples into"""
+        if self.subscriber is None:
+            return
+        for uuid, time_from, time_to in self.subscriber.drain():
+            self.buf.invalidate(uuid, time_from, time_to)
+
+    def get_uuid(self, row_id):
+        """instance_id or uuid --> uuid"""
+        db = self.get_db()
+        uuid = None
+        if hasattr(db, 'get_uuid'):
+            uuid = db.get_uuid(row_id)
+        if uuid is None:
+            uuid = row_id
+        return uuid
+
+    def get_data(self, uuid, cf_str, scf_str, time_from, time_to, tier=RAW):
+        """return: (rs, count, all_data, devices)
+        rs: buckets of kanyun.server.aggregate, a raw sample is a bucket
+        of count 1, so both are aggregated alike
+        devices: the device of every bucket, None for a single device"""
+        db = self.get_db()
+        if not hasattr(db, 'get_metric_range'):
+            print 'storage does not support usage report'
+            return None, 0, True, None
+        if not metric_id.has_key(cf_str):
+            print 'unknown metric:', cf_str
+            return None, 0, True, None
+        metric = metric_id[cf_str]
+        device = None
+        if not scf_str in (None, '', 'total'):
+            device = scf_str
+
+        if tier == RAW:
+            rows = db.get_metric_range(uuid, metric, time_from, time_to,
+                                       device)
+            rs = aggregate.load_raw(rows)
+        else:
+            rows = db.get_rollup_range(tier, uuid, metric, time_from, time_to,
+                                       device)
+            rs = aggregate.load_rollup(rows)
+        devices = None
+        if device is None:
+            devices = aggregate.load_devices(rows)
+        return rs, len(rs), True, devices
+
+    def analyize_data(self, rs, period, statistic, devices=None):
+        """rs: buckets of get_data(), period: seconds
+        return: OrderedDict{bucket_time: value of ${statistic}}"""
+        return aggregate.report(rs, period, statistic, devices)
+
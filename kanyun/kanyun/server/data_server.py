@@ -16,6 +16,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import os
 import sys
 import time
 import signal
@@ -26,12 +27,23 @@ import json
 import zmq
 from kanyun.common.const import *
 from kanyun.common.app import *
+from kanyun.common.vminfo import decode_agent_data, formate_vm_info
+from kanyun.common.wire import PackedDecoder
 
 living_status = dict()
 
 app = App(conf="kanyun.conf", log="/tmp/kanyun-server.log")
 logger = app.get_logger()
-tool = None
+tool = None # NovaTools, set by kanyun-server when nova's db is configured
+running = True
+pipeline = None # IngestPipeline, set by kanyun-server
+decoder = PackedDecoder()
+# sharded server(see shard.py): the front has router, supervisor and
+# shard_pids, every shard process its shard_id
+router = None
+supervisor = None
+shard_pids = list()
+shard_id = None
 
 class LivingStatus():
 
@@ -83,6 +95,13 @@ def autotask_heartbeat():
             ls.on_die()
 
 
+def autotask_shards():
+    """start the dead shards again, SIGUSR1 goes to the new pids"""
+    global shard_pids
+    if not supervisor is None and supervisor.check():
+        shard_pids = supervisor.get_pids()
+
+
 def clean_die_warning():
     global config
     global living_status
@@ -101,10 +120,26 @@ def clean_die_warning():
     
 def list_workers():
     global living_status
-    print "-"*30, "list_workers", "-" * 30
-    for worker_id, ls in living_status.iteritems():
-        print 'worker', worker_id, "update @", ls.update_time
-    print len(living_status), "workers."
+    if shard_id is None:
+        print "-"*30, "list_workers", "-" * 30
+        for worker_id, ls in living_status.iteritems():
+            print 'worker', worker_id, "update @", ls.update_time
+        print len(living_status), "workers."
+    else:
+        print "-"*30, "shard", shard_id, "-" * 30
+    if not pipeline is None:
+        pipeline.report()
+    if not router is None:
+        print "router:", router.get_stats()
+        print "shards:", supervisor.get_stats()
+    else:
+        print "packed:", decoder.get_stats()
+    # the shards print their own pipeline
+    for pid in shard_pids:
+        try:
+            os.kill(pid, signal.SIGUSR1)
+        except OSError:
+            traceback.print_exc()
     
     
 def plugin_heartbeat(app, db, cache, data):
@@ -119,66 +154,50 @@ def plugin_heartbeat(app, db, cache, data):
         del living_status[worker_id]
 
 
+def fill_uuids(samples):
+    """uuid of the samples of the workers which do not send it, from the
+    in-memory copy of nova's instances, return the samples which have one"""
+    ret = list()
+    for sample in samples:
+        if not sample['uuid'] and not tool is None:
+            sample['uuid'] = tool.get_uuid_by_novaid(sample['instance_id'])
+        if not sample['uuid']:
+            print 'uuid of %s unknown, sample dropped' % sample['instance_id']
+            continue
+        ret.append(sample)
+    return ret
+
+
+def save_samples(db, cache, samples):
+    samples = fill_uuids(samples)
+    if len(samples) == 0:
+        return
+    # db is the IngestPipeline: samples are buffered and written in batches
+    db.insert_vm_samples(samples)
+    cache.push_vm_infos([formate_vm_info(sample) for sample in samples])
+
+
 def plugin_decoder_agent(app=None, db=None, cache=None, data=None):
     if data is None or len(data) <= 0:
         return
-    def formate_vm_info(info):
-        formated_info=[];
-        for instance in info:
-            ## create a list with length 10
-            data=range(10);
-            data[0]=instance;
-#            data[9]=tool.get_uuid_by_novaid(instance);
-            ## get uuid directly from worker
-            instance_info=info[instance];
-            data[9]=str(instance_info[-1]);
-           # print 'novaid(%s)--->uuid(%s)'%(data[0],data[9]);
-            nic_in_info="";
-            nic_out_info="";
-            blk_read_info="";
-            blk_write_info="";
-            for item_info in instance_info:
-                if item_info[0]==unicode("cpu"):
-                    cpu_usage=str(item_info[2][1]);
-                    ##print 'cpu_usage=',cpu_usage;
-                    data[1]=cpu_usage[0:5];
-                    data[8]=timestamp=str(int(item_info[2][0]));
-                elif item_info[0]==unicode("mem"):
-                    data[2]=mem_free=str(item_info[2][2]);
-                    data[3]=mem_max=str(item_info[2][1]);
-                elif item_info[0]==unicode("nic"):
-                    vnet_in=item_info[1]+":"+str(item_info[2][1]);
-                    vnet_out=item_info[1]+":"+str(item_info[2][2]);
-                    if nic_in_info is "" or nic_out_info is "":
-                        nic_in_info=vnet_in;
-                        nic_out_info=vnet_out;
-                    else:
-                        nic_in_info=nic_in_info+"#"+vnet_in;
-                        nic_out_info=nic_out_info+"#"+vnet_out;
-                elif item_info[0]==unicode("blk"):
-                    vd_read=item_info[1]+":"+str(item_info[2][1]);
-                    vd_write=item_info[1]+":"+str(item_info[2][2]);
-                    if blk_read_info is "" or blk_write_info is "":
-                        blk_read_info=vd_read;
-                        blk_write_info=vd_write;
-                    else:
-                        blk_read_info=blk_read_info+"#"+vd_read;
-                        blk_write_info=blk_write_info+"#"+vd_write;
-            data[4]=nic_in_info;
-            data[5]=nic_out_info;
-            data[6]=blk_read_info;
-            data[7]=blk_write_info; 
-            formated_info.append(data);
-        return formated_info;
-##################################
-    print "-"*30, "vminfo", "-" * 30
-    pass_time = time.time()
-    formated_info=formate_vm_info(data);
-    for info in formated_info:
- 	print info
-        db.insert_monitor_data(info);
-        cache.push_vm_info(info);
-    print 'spend \033[1;33m%f\033[0m seconds' % (time.time() - pass_time)
+    save_samples(db, cache, decode_agent_data(data))
+
+
+def plugin_agent_dict(app=None, db=None, cache=None, data=None):
+    if data is None or len(data) <= 0:
+        return
+    decoder.set_dictionary(data)
+
+
+def plugin_packed_agent(app=None, db=None, cache=None, data=None):
+    """data: [worker_id, frame], not json"""
+    if data is None or len(data) != 2:
+        return
+    worker_id, frame = data
+    samples = decoder.decode(worker_id, frame)
+    if len(samples) > 0:
+        save_samples(db, cache, samples)
+
     
 def SignalHandler(sig, id):
     global running
@@ -0,0 +1,253 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2012 Sina Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import Queue
+import threading
+import traceback
+from kanyun.database import DbError
+
+"""
+Buffered ingest of decoded vm samples.
+
+The decoder hands decoded samples to the pipeline and returns at once; a
+writer thread drains the queue and flushes multi-row batches to MySQL
+whenever flush_size samples are waiting or flush_interval seconds passed.
+The queue is bounded: when MySQL is slower than the workers the decoder
+blocks in put(), so the zmq PULL socket stops reading and the workers'
+high water mark pushes back instead of the server growing without limit.
+A batch MySQL refuses is written again after retry_interval seconds,
+doubled every attempt, up to flush_retries times before it is dropped;
+meanwhile the queue fills up and pushes back the same way.
+
+config([server] section of kanyun.conf, all optional):
+    flush_size: 500
+    flush_interval: 1
+    queue_size: 20000
+    report_interval: 60
+    flush_retries: 5
+    retry_interval: 1
+
+A Rollup(see rollup.py) given to the pipeline is fed every written batch
+and ticked by the same writer thread, so it shares the MySQL connection.
+A SamplePublisher(see notify.py) is told about every committed batch.
+"""
+
+
+class IngestStats():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.received = 0
+        self.written = 0
+        self.retries = 0
+        self.dropped = 0
+        self.batches = 0
+        self.write_time = 0.0
+        self.blocked_time = 0.0
+        self.clean_period()
+
+    def clean_period(self):
+        self.period_start = time.time()
+        self.period_written = 0
+
+    def on_receive(self, count, blocked):
+        with self.lock:
+            self.received += count
+            self.blocked_time += blocked
+
+    def on_flush(self, count, spend, ok=True):
+        with self.lock:
+            self.batches += 1
+            self.write_time += spend
+            if ok:
+                self.written += count
+                self.period_written += count
+            else:
+                self.dropped += count
+
+    def on_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def get_rate(self):
+        """samples/s written since the last report"""
+        elapsed = time.time() - self.period_start
+        if elapsed <= 0:
+            return 0.0
+        return self.period_written / elapsed
+
+    def get_stats(self):
+        with self.lock:
+            avg_batch = 0.0
+            if self.batches > 0:
+                avg_batch = float(self.written + self.dropped) / self.batches
+            return {'received': self.received,
+                    'written': self.written,
+                    'retries': self.retries,
+                    'dropped': self.dropped,
+                    'batches': self.batches,
+                    'avg_batch': avg_batch,
+                    'write_time': self.write_time,
+                    'blocked_time': self.blocked_time,
+                    'rate': self.get_rate(),
+                    'uptime': time.time() - self.start_time}
+
+
+class IngestPipeline(threading.Thread):
+    """Same insert interface as MysqlDb, so it can be handed to the
+    data_server plugins in place of the database object.
+    example:
+        pipeline = IngestPipeline(MysqlDb(cfg), flush_size=500)
+        pipeline.start()
+        pipeline.insert_vm_samples(samples)
+        ...
+        pipeline.stop()
+    """
+    def __init__(self, db, flush_size=500, flush_interval=1.0,
+                 queue_size=20000, report_interval=60, rollup=None,
+                 publisher=None, flush_retries=5, retry_interval=1.0):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.db = db
+        self.rollup = rollup
+        self.publisher = publisher
+        self.flush_size = max(1, int(flush_size))
+        self.flush_interval = float(flush_interval)
+        self.report_interval = float(report_interval)
+        self.flush_retries = max(0, int(flush_retries))
+        self.retry_interval = float(retry_interval)
+        self.queue = Queue.Queue(int(queue_size))
+        self.stats = IngestStats()
+        self.working = True
+        self.previous_report = time.time()
+
+    @staticmethod
+    def from_cfg(db, cfg, rollup=None, publisher=None):
+        if cfg is None:
+            cfg = dict()
+        return IngestPipeline(db,
+                    flush_size=cfg.get('flush_size', 500),
+                    flush_interval=cfg.get('flush_interval', 1.0),
+                    queue_size=cfg.get('queue_size', 20000),
+                    report_interval=cfg.get('report_interval', 60),
+                    rollup=rollup,
+                    publisher=publisher,
+                    flush_retries=cfg.get('flush_retries', 5),
+                    retry_interval=cfg.get('retry_interval', 1.0))
+
+    def insert_vm_samples(self, samples):
+        """queue the samples, block while the queue is full(backpressure)"""
+        begin = time.time()
+        for sample in samples:
+            self.queue.put(sample)
+        self.stats.on_receive(len(samples), time.time() - begin)
+        return True
+
+    def get_pending(self):
+        return self.queue.qsize()
+
+    def get_stats(self):
+        ret = self.stats.get_stats()
+        ret['pending'] = self.get_pending()
+        return ret
+
+    def run(self):
+        while self.working or not self.queue.empty():
+            batch = self.collect_batch()
+            if len(batch) > 0:
+                self.flush(batch)
+            if not self.rollup is None:
+                self.rollup.tick()
+            if time.time() - self.previous_report >= self.report_interval:
+                self.report()
+
+    def stop(self):
+        """stop receiving, flush whatever is left and wait for the writer"""
+        self.working = False
+        if self.isAlive():
+            self.join()
+        if not self.rollup is None:
+            self.rollup.flush()
+        self.report()
+
+    ####### private ########
+    def collect_batch(self):
+        """wait until flush_size samples are queued or flush_interval passed"""
+        batch = list()
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.flush_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(True, timeout))
+            except Queue.Empty:
+                break
+        return batch
+
+    def flush(self, batch):
+        begin = time.time()
+        if not self.write(batch):
+            self.stats.on_flush(len(batch), time.time() - begin, ok=False)
+            print 'ingest: %d samples dropped' % len(batch)
+            return
+        self.stats.on_flush(len(batch), time.time() - begin)
+        if not self.rollup is None:
+            self.rollup.update(batch)
+        if not self.publisher is None:
+            try:
+                self.publisher.publish(batch)
+            except:
+                traceback.print_exc()
+
+    def write(self, batch):
+        """insert the batch, retrying with backoff while the database
+        refuses it, return False if it has to be dropped"""
+        delay = self.retry_interval
+        attempt = 0
+        while True:
+            try:
+                self.db.insert_vm_samples(batch)
+                return True
+            except DbError:
+                traceback.print_exc()
+            except Exception:
+                # not the database, writing it again would fail the same way
+                traceback.print_exc()
+                return False
+            if attempt >= self.flush_retries:
+                return False
+            attempt += 1
+            self.stats.on_retry()
+            print 'ingest: write failed, retry %d/%d in %.1fs' \
+                  % (attempt, self.flush_retries, delay)
+            time.sleep(delay)
+            delay *= 2
+
+    def report(self):
+        s = self.get_stats()
+        print 'ingest: \033[1;33m%.1f\033[0m samples/s, %d received, ' \
+              '%d written, %d retries, %d dropped, ' \
+              '%d batches(avg %.1f samples), ' \
+              '%d pending, write %.2fs, blocked %.2fs' \
+              % (s['rate'], s['received'], s['written'], s['retries'],
+                 s['dropped'], s['batches'], s['avg_batch'], s['pending'],
+                 s['write_time'], s['blocked_time'])
+        self.stats.clean_period()
+        self.previous_report = time.time()
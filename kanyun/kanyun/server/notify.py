@@ -0,0 +1,98 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2012 Sina Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import zmq
+from kanyun.common.const import *
+
+"""
+data-server --> api-server notification of written samples.
+
+After every committed batch the data-server publishes, per vm, the time
+range of the samples it just wrote:
+    [MSG_TYPE.SAMPLES_WRITTEN, '[[uuid, time_from, time_to], ...]']
+and publishes the time range of the samples again once the Rollup wrote
+them to the rollup tiers(see rollup.py). The api-server drains the subscription before answering a request and
+drops the cached reports covering those ranges.
+
+config:
+    [server]
+    notify_port: 5552
+    [api]
+    notify_endpoint: tcp://127.0.0.1:5552
+"""
+
+
+class SamplePublisher():
+    """the socket is created by the first publish(), so it belongs to the
+    thread writing the samples(zmq sockets are not thread safe).
+    connect=True PUSHes to the front process of a sharded data-server
+    instead of publishing(see shard.py)"""
+    def __init__(self, context, endpoint, connect=False):
+        self.context = context
+        self.endpoint = endpoint
+        self.connect = connect
+        self.socket = None
+
+    def publish(self, samples):
+        """publish the time range of the samples of every vm"""
+        ranges = dict()
+        for sample in samples:
+            t = sample['time']
+            r = ranges.get(sample['uuid'])
+            if r is None:
+                ranges[sample['uuid']] = [t, t]
+            else:
+                r[0] = min(r[0], t)
+                r[1] = max(r[1], t)
+        self.publish_ranges(ranges)
+
+    def publish_ranges(self, ranges):
+        """ranges: {uuid: [time_from, time_to]}"""
+        if not ranges:
+            return
+        if self.socket is None:
+            if self.connect:
+                self.socket = self.context.socket(zmq.PUSH)
+                self.socket.connect(self.endpoint)
+            else:
+                self.socket = self.context.socket(zmq.PUB)
+                self.socket.bind(self.endpoint)
+        data = [[uuid, r[0], r[1]] for uuid, r in ranges.iteritems()]
+        self.socket.send_multipart([MSG_TYPE.SAMPLES_WRITTEN,
+                                    json.dumps(data)])
+
+
+class SampleSubscriber():
+
+    def __init__(self, context, endpoint):
+        self.socket = context.socket(zmq.SUB)
+        self.socket.setsockopt(zmq.SUBSCRIBE, MSG_TYPE.SAMPLES_WRITTEN)
+        self.socket.connect(endpoint)
+
+    def drain(self):
+        """return every pending [uuid, time_from, time_to], never blocks"""
+        ret = list()
+        while True:
+            try:
+                msg_type, data = self.socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.ZMQError, e:
+                if e.errno == zmq.EAGAIN:
+                    break
+                raise
+            ret.extend(json.loads(data))
+        return ret
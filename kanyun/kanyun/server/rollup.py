@@ -0,0 +1,188 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2012 Sina Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import traceback
+from kanyun.common.statistics import Statistics
+from kanyun.common.vminfo import sample_to_metrics
+from kanyun.database import DbError
+
+"""
+Downsampling of the raw samples into 1 minute, 1 hour and 1 day tiers.
+
+Rollup keeps one Statistics per (tier, vm, metric, device, bucket) for the
+samples written since the last flush, and every flush_interval seconds
+merges them into vm_rollup(min/max/sum/count/last, see vm_metric.sql).
+The merge is associative, so partially filled hour and day buckets can be
+flushed as often as needed and nothing is lost on restart except the
+samples of the current interval. A flush MySQL refuses keeps its buckets,
+the samples of the next interval are merged into them and they are
+written by the next flush. After a flush the time range of the samples
+it wrote is published again(see notify.py), the cached reports of the
+rollup tiers depend on them.
+
+config([mysql_db] section of kanyun.conf, seconds, retention 0 keeps forever):
+    rollup_interval: 60
+    retention_raw: 604800
+    retention_1m: 2592000
+    retention_1h: 31536000
+    retention_1d: 0
+"""
+
+RAW = 0
+# (name, period in seconds), finest first
+TIERS = [('1m', 60), ('1h', 60 * 60), ('1d', 24 * 60 * 60)]
+
+DEFAULT_RETENTION = {
+    'raw': 7 * 24 * 60 * 60,
+    '1m': 30 * 24 * 60 * 60,
+    '1h': 365 * 24 * 60 * 60,
+    '1d': 0,
+}
+
+
+def get_retention(cfg):
+    """return {period: seconds kept}, period RAW(0) is vm_metric"""
+    if cfg is None:
+        cfg = dict()
+    ret = dict()
+    ret[RAW] = int(cfg.get('retention_raw', DEFAULT_RETENTION['raw']))
+    for name, period in TIERS:
+        ret[period] = int(cfg.get('retention_' + name,
+                                  DEFAULT_RETENTION[name]))
+    return ret
+
+
+def choose_tier(period, time_from, retention, now=None):
+    """the coarsest tier whose buckets divide ${period} seconds evenly and
+    which still holds data at ${time_from}. RAW when no tier fits."""
+    if now is None:
+        now = time.time()
+    ret = RAW
+    for _, tier in TIERS:
+        if period < tier or period % tier != 0:
+            continue
+        keep = retention.get(tier, 0)
+        if keep > 0 and time_from < now - keep:
+            continue
+        ret = tier
+    return ret
+
+
+class Rollup():
+
+    def __init__(self, db, flush_interval=60, retention=None,
+                 enforce_interval=60 * 60, publisher=None):
+        self.db = db
+        self.publisher = publisher
+        self.flush_interval = float(flush_interval)
+        self.enforce_interval = float(enforce_interval)
+        self.retention = retention or get_retention(None)
+        # (period, uuid, metric, bucket_time, device) --> Statistics
+        self.buckets = dict()
+        # uuid --> [time_from, time_to] of the samples in the buckets
+        self.ranges = dict()
+        self.previous_flush = time.time()
+        self.previous_enforce = 0
+
+    @staticmethod
+    def from_cfg(db, cfg, publisher=None):
+        if cfg is None:
+            cfg = dict()
+        return Rollup(db,
+                      flush_interval=cfg.get('rollup_interval', 60),
+                      retention=get_retention(cfg),
+                      publisher=publisher)
+
+    def update(self, samples):
+        # the buckets past retention would only be deleted again
+        now = time.time()
+        horizons = dict()
+        for _, period in TIERS:
+            keep = self.retention.get(period, 0)
+            horizons[period] = now - keep if keep > 0 else 0
+        for sample in samples:
+            t = sample['time']
+            uuid = sample['uuid']
+            r = self.ranges.get(uuid)
+            if r is None:
+                self.ranges[uuid] = [t, t]
+            else:
+                r[0] = min(r[0], t)
+                r[1] = max(r[1], t)
+            for metric, device, value in sample_to_metrics(sample):
+                for _, period in TIERS:
+                    if t < horizons[period]:
+                        continue
+                    key = (period, uuid, metric, t - t % period, device)
+                    stat = self.buckets.get(key)
+                    if stat is None:
+                        stat = self.buckets[key] = Statistics()
+                    stat.update(value, t)
+
+    def tick(self):
+        """called by the writer thread between batches"""
+        now = time.time()
+        if now - self.previous_flush >= self.flush_interval:
+            self.flush()
+        if now - self.previous_enforce >= self.enforce_interval:
+            self.enforce_retention()
+
+    def flush(self):
+        """write the buckets, return the number of rows written or None
+        when they are kept for the next flush"""
+        rows = list()
+        for key, stat in self.buckets.iteritems():
+            rows.append(key + (stat.get_min(), stat.get_max(), stat.get_sum(),
+                               stat.get_samples(), stat.get_last(),
+                               stat.last_time))
+        self.previous_flush = time.time()
+        try:
+            self.db.insert_rollups(rows)
+        except DbError:
+            traceback.print_exc()
+            print 'rollup: %d buckets kept for the next flush' % len(rows)
+            return None
+        self.buckets = dict()
+        ranges = self.ranges
+        self.ranges = dict()
+        if not self.publisher is None:
+            try:
+                self.publisher.publish_ranges(ranges)
+            except Exception:
+                # the reports cached meanwhile expire with their ttl
+                traceback.print_exc()
+        return len(rows)
+
+    def enforce_retention(self):
+        """drop raw chunks and rollup buckets older than their retention"""
+        self.previous_enforce = now = time.time()
+        try:
+            keep = self.retention.get(RAW, 0)
+            if keep > 0:
+                n = self.db.drop_partitions_before(now - keep)
+                if n > 0:
+                    print 'rollup: %d raw partitions dropped' % n
+            for name, period in TIERS:
+                keep = self.retention.get(period, 0)
+                if keep <= 0:
+                    continue
+                n = self.db.delete_rollups_before(period, now - keep)
+                if n > 0:
+                    print 'rollup: %d %s buckets deleted' % (n, name)
+        except DbError:
+            traceback.print_exc()
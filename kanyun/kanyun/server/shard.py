@@ -0,0 +1,150 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2012 Sina Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import zlib
+import json
+import traceback
+import zmq
+from kanyun.common.const import *
+
+"""
+Sharded data-server.
+
+With shards > 1 kanyun-server forks N shard processes, each one with its
+own decoder, IngestPipeline and MySQL/Redis connections. The front process
+keeps the worker socket and routes:
+    heartbeats          handled by the front, so living_status and the
+                        SIGUSR2 cleanup see every worker
+    packed reports      by worker_id(the decoder state is per worker)
+    json agent reports  split by vm uuid
+so all the samples of one vm go through one shard, in order.
+The shards PUSH their written-samples notifications to the front, which
+publishes them on notify_port for the api-server.
+The front never blocks on a shard: a message for a shard whose queue is
+full(dead or stalled shard) is dropped and counted, and the shards which
+died are started again from the front's autotasks.
+
+config([server] section of kanyun.conf):
+    shards: 4
+    shard_endpoint: ipc:///tmp/kanyun-server-shard-%d
+    relay_endpoint: ipc:///tmp/kanyun-server-notify
+    shard_check_interval: 5     seconds between two checks of the shards
+"""
+
+DEFAULT_SHARD_ENDPOINT = 'ipc:///tmp/kanyun-server-shard-%d'
+DEFAULT_RELAY_ENDPOINT = 'ipc:///tmp/kanyun-server-notify'
+
+
+def get_shard(key, shards):
+    """stable across processes and restarts, unlike hash()"""
+    return (zlib.crc32(key) & 0xffffffff) % shards
+
+
+class ShardRouter():
+    """front side, one PUSH socket per shard"""
+
+    def __init__(self, context, endpoints):
+        self.sockets = list()
+        for endpoint in endpoints:
+            socket = context.socket(zmq.PUSH)
+            socket.connect(endpoint)
+            self.sockets.append(socket)
+        self.routed = [0] * len(endpoints)
+        self.dropped = [0] * len(endpoints)
+
+    def route(self, frames):
+        """send frames to its shard, return False if the front process
+        has to handle it itself"""
+        msg_type = frames[0]
+        try:
+            if msg_type == MSG_TYPE.AGENT_PACKED and len(frames) == 3:
+                self.send(self.get_shard(frames[1]), frames)
+            elif msg_type == MSG_TYPE.AGENT_DICT and len(frames) == 2:
+                worker_id = str(json.loads(frames[1])['worker_id'])
+                self.send(self.get_shard(worker_id), frames)
+            elif msg_type == MSG_TYPE.AGENT and len(frames) == 2:
+                self.route_agent(json.loads(frames[1]))
+            else:
+                return False
+        except (ValueError, KeyError, IndexError, TypeError):
+            print 'invaild data(%s):%s' % (msg_type, frames[1:])
+            traceback.print_exc()
+        return True
+
+    def route_agent(self, data):
+        """json agent data: {instance_id: [..., uuid]}, split by uuid"""
+        parts = dict()
+        for instance_id, items in data.iteritems():
+            n = self.get_shard(str(items[-1]))
+            parts.setdefault(n, dict())[instance_id] = items
+        for n, part in parts.iteritems():
+            self.send(n, [MSG_TYPE.AGENT, json.dumps(part)])
+
+    def get_shard(self, key):
+        return get_shard(key, len(self.sockets))
+
+    def send(self, n, frames):
+        try:
+            self.sockets[n].send_multipart(frames, zmq.NOBLOCK)
+        except zmq.ZMQError, e:
+            if e.errno != zmq.EAGAIN:
+                raise
+            # high water mark reached, do not stall the heartbeats
+            self.dropped[n] += 1
+            return
+        self.routed[n] += 1
+
+    def get_stats(self):
+        return {'shards': len(self.sockets), 'routed': self.routed,
+                'dropped': self.dropped}
+
+
+class ShardSupervisor():
+    """front side, starts the shard processes and starts again the ones
+    which died"""
+
+    def __init__(self, start, shards, check_interval=5):
+        """start: function(n) --> started multiprocessing.Process"""
+        self.start = start
+        self.check_interval = check_interval
+        self.processes = [start(n) for n in range(shards)]
+        self.restarts = [0] * shards
+        self.checked = time.time()
+
+    def check(self):
+        """return True if a shard was started again"""
+        now = time.time()
+        if now - self.checked < self.check_interval:
+            return False
+        self.checked = now
+        restarted = False
+        for n, p in enumerate(self.processes):
+            if p.is_alive():
+                continue
+            print 'shard %d(pid %s) died with exit code %s, restart' \
+                  % (n, p.pid, p.exitcode)
+            self.processes[n] = self.start(n)
+            self.restarts[n] += 1
+            restarted = True
+        return restarted
+
+    def get_pids(self):
+        return [p.pid for p in self.processes]
+
+    def get_stats(self):
+        return {'pids': self.get_pids(), 'restarts': self.restarts}
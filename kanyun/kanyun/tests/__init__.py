@@ -0,0 +1 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
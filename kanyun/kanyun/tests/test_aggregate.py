@@ -0,0 +1,134 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import random
+import unittest
+from kanyun.server import aggregate
+
+START = 1332465600
+
+
+def nic_rows(uuid=None, seconds=300):
+    """raw rows of two nics, counters growing 100/s on vnet0 and 10/s on
+    vnet1, one sample every 10 seconds"""
+    rows = list()
+    for t in range(START, START + seconds, 10):
+        for device, speed in (('vnet0', 100), ('vnet1', 10)):
+            row = (t, device, 1000000 * speed + (t - START) * speed)
+            if not uuid is None:
+                row = (uuid,) + row
+            rows.append(row)
+    return rows
+
+
+class AggregateTestCase(unittest.TestCase):
+    """runs with numpy if it is installed, AggregateLoopTestCase without"""
+
+    def setUp(self):
+        self.numpy = aggregate.numpy
+
+    def tearDown(self):
+        aggregate.numpy = self.numpy
+
+    def assertValues(self, values, expected):
+        self.assertEqual(len(values), len(expected))
+        for value, other in zip(values, expected):
+            self.assertAlmostEqual(value, other)
+
+    def test_report(self):
+        rows = [(START + 10, '', 1.0), (START + 50, '', 3.0),
+                (START + 70, '', 8.0), (START + 20, '', 2.0)]
+        rs = aggregate.load_raw(rows)
+        for statistic, expected in (('avg', [2.0, 8.0]), ('min', [1.0, 8.0]),
+                                    ('max', [3.0, 8.0]), ('sum', [6.0, 8.0]),
+                                    ('sam', [3, 1]), ('last', [3.0, 8.0]),
+                                    ('rate', [0.05, 0.25])):
+            ret = aggregate.report(rs, 60, statistic)
+            self.assertEqual(ret.keys(), [START, START + 60])
+            self.assertValues(ret.values(), expected)
+
+    def test_report_rollup(self):
+        # (bucket_time, device, min, max, sum, count, last, last_time)
+        rows = [(START, '', 1.0, 5.0, 6.0, 2, 5.0, START + 50),
+                (START + 60, '', 2.0, 2.0, 2.0, 1, 2.0, START + 70),
+                (START + 120, '', 0.0, 9.0, 9.0, 3, 0.0, START + 170)]
+        rs = aggregate.load_rollup(rows)
+        ret = aggregate.report(rs, 120, 'avg')
+        self.assertEqual(ret.keys(), [START, START + 120])
+        self.assertValues(ret.values(), [8.0 / 3, 3.0])
+        ret = aggregate.report(rs, 120, 'last')
+        self.assertValues(ret.values(), [2.0, 0.0])
+
+    def test_report_devices(self):
+        rows = nic_rows()
+        rs = aggregate.load_raw(rows)
+        devices = aggregate.load_devices(rows)
+        ret = aggregate.report(rs, 60, 'rate', devices)
+        self.assertEqual(len(ret), 5)
+        self.assertValues(ret.values(), [110.0] * 5)
+        ret = aggregate.report(rs, 60, 'last', devices)
+        self.assertValues(ret.values(), [110000000.0 + 110 * (t + 50)
+                                         for t in range(0, 300, 60)])
+        # the other statistics are over every sample
+        ret = aggregate.report(rs, 300, 'sam', devices)
+        self.assertValues(ret.values(), [60])
+
+    def test_top(self):
+        rows = list()
+        for n in range(5):
+            for t in range(START, START + 60, 10):
+                rows.append(('vm-%d' % n, t, '', float(n * 10 + t - START)))
+        random.shuffle(rows)
+        uuids, devices, data = aggregate.load_raw_all(rows)
+        ret = aggregate.top(uuids, data, 'max', 3, devices)
+        self.assertEqual([uuid for uuid, _ in ret], ['vm-4', 'vm-3', 'vm-2'])
+        self.assertValues([value for _, value in ret], [90.0, 80.0, 70.0])
+        ret = aggregate.top(uuids, data, 'avg', 1, devices)
+        self.assertEqual(ret[0][0], 'vm-4')
+        self.assertAlmostEqual(ret[0][1], 65.0)
+
+    def test_top_devices(self):
+        rows = nic_rows('vm-1') + [('vm-2', t, 'vnet0', 10000000 + t * 105)
+                                   for t in range(START, START + 300, 10)]
+        uuids, devices, data = aggregate.load_raw_all(rows)
+        ret = aggregate.top(uuids, data, 'rate', 2, devices)
+        self.assertEqual([uuid for uuid, _ in ret], ['vm-1', 'vm-2'])
+        self.assertValues([value for _, value in ret], [110.0, 105.0])
+
+    def test_top_rollup_devices(self):
+        # (uuid, bucket_time, device, min, max, sum, count, last, last_time)
+        rows = [('vm-1', START, 'vda', 0, 0, 0, 1, 1000.0, START + 10),
+                ('vm-1', START + 60, 'vda', 0, 0, 0, 1, 7000.0, START + 70),
+                ('vm-1', START, 'vdb', 0, 0, 0, 1, 5.0e9, START + 10),
+                ('vm-1', START + 60, 'vdb', 0, 0, 0, 1, 5.0e9, START + 70)]
+        uuids, devices, data = aggregate.load_rollup_all(rows)
+        self.assertEqual(devices, ('vda', 'vda', 'vdb', 'vdb'))
+        ret = aggregate.top(uuids, data, 'rate', 1, devices)
+        self.assertEqual(ret[0][0], 'vm-1')
+        self.assertAlmostEqual(ret[0][1], 100.0)
+
+    def test_empty(self):
+        self.assertEqual(aggregate.report(aggregate.load_raw([]), 60, 'avg'),
+                         dict())
+        uuids, devices, data = aggregate.load_raw_all([])
+        self.assertEqual(aggregate.top(uuids, data, 'avg', 10, devices),
+                         list())
+
+
+class AggregateLoopTestCase(AggregateTestCase):
+    """the Statistics based references"""
+
+    def setUp(self):
+        super(AggregateLoopTestCase, self).setUp()
+        aggregate.numpy = None
@@ -0,0 +1,108 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import unittest
+from kanyun.server.api_server import ApiServer
+
+
+def iso(t):
+    """unix time --> the local iso8601 time ApiServer.get_time_range reads"""
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(t))
+
+
+class FakeMetricDb():
+
+    def __init__(self):
+        self.queries = list()
+
+    def get_uuid(self, instance_id):
+        return None
+
+    def get_metric_range(self, uuid, metric, time_from, time_to=None,
+                         device=None):
+        self.queries.append((0, uuid, metric, device))
+        return [(time_from + 10, '', 1.0), (time_from + 20, '', 3.0)]
+
+    def get_rollup_range(self, period, uuid, metric, time_from, time_to=None,
+                         device=None):
+        self.queries.append((period, uuid, metric, device))
+        return [(time_from, 'vnet0', 0.0, 4.0, 4.0, 2, 4.0, time_from + 50),
+                (time_from, 'vnet1', 0.0, 2.0, 2.0, 2, 2.0, time_from + 50)]
+
+
+class FakeSubscriber():
+
+    def __init__(self):
+        self.pending = list()
+
+    def drain(self):
+        ret = self.pending
+        self.pending = list()
+        return ret
+
+
+class ApiServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.subscriber = FakeSubscriber()
+        self.api = ApiServer(log_file='/dev/null', subscriber=self.subscriber)
+        self.db = self.api.db = FakeMetricDb()
+        now = int(time.time())
+        self.time_from = now - now % 3600 - 3 * 3600
+
+    def query(self, period, metric_param='total', statistic='avg'):
+        return self.api.query_usage_report({
+            'id': 'vm1',
+            'metric': 'nic_incoming',
+            'metric_param': metric_param,
+            'statistic': statistic,
+            'period': period,
+            'timestamp_from': iso(self.time_from),
+            'timestamp_to': iso(self.time_from + 3600)})
+
+    def test_rollup_tier(self):
+        ret, count, _ = self.query(60, statistic='last')
+        self.assertEqual(self.db.queries, [(3600, 'vm1', 4, None)])
+        # the last values of both nics
+        self.assertEqual(ret.values(), [6.0])
+        self.assertEqual(count, 1)
+
+    def test_raw_tier(self):
+        # the 1m tier is gone, 1h does not divide 1 minute
+        self.time_from -= 40 * 24 * 3600
+        ret, count, _ = self.query(1, metric_param='vnet0')
+        self.assertEqual(self.db.queries, [(0, 'vm1', 4, 'vnet0')])
+        self.assertEqual(ret.values(), [2.0])
+
+    def test_cache_invalidation(self):
+        first = self.query(60)
+        self.assertEqual(self.query(60), first)
+        self.assertEqual(len(self.db.queries), 1)
+
+        # samples of another vm or outside the range
+        self.subscriber.pending = [['vm2', self.time_from, self.time_from],
+                                   ['vm1', self.time_from + 7200,
+                                    self.time_from + 7200]]
+        self.query(60)
+        self.assertEqual(len(self.db.queries), 1)
+
+        # written to the raw table, then to the rollup tiers
+        for i in range(2):
+            self.subscriber.pending = [['vm1', self.time_from + 30,
+                                        self.time_from + 30]]
+            self.assertEqual(self.query(60), first)
+            self.assertEqual(len(self.db.queries), 2 + i)
+        stats = self.api.get_cache_stats()
+        self.assertEqual(stats['invalidations'], 2)
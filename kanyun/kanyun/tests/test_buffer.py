@@ -0,0 +1,89 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import unittest
+from kanyun.common.buffer import ResultCache, bucket_range
+
+
+class ResultCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1332465600.0
+        self.time = time.time
+        time.time = lambda: self.now
+
+    def tearDown(self):
+        time.time = self.time
+
+    def test_get_put(self):
+        cache = ResultCache(max_size=10, ttl=60)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.put('a', [1, 2], size=2), [1, 2])
+        self.assertEqual(cache.get('a'), [1, 2])
+        cache.put('a', [3], size=1)
+        self.assertEqual(cache.get('a'), [3])
+        stats = cache.get_stats()
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_ttl(self):
+        cache = ResultCache(max_size=10, ttl=60)
+        cache.put('a', 'A')
+        cache.put('b', 'B', ttl=300)
+        self.now += 61
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 'B')
+        self.assertEqual(cache.get_stats()['expirations'], 1)
+        self.assertEqual(cache.size, 1)
+
+    def test_lru(self):
+        cache = ResultCache(max_size=3)
+        cache.put('a', 'A', uuid='vm1')
+        cache.put('b', 'B', size=2, uuid='vm2')
+        self.assertEqual(cache.get('a'), 'A')
+        # b is the least recently used one
+        cache.put('c', 'C')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertEqual(cache.get('c'), 'C')
+        self.assertEqual(cache.get_stats()['evictions'], 1)
+        self.assertFalse('vm2' in cache.by_uuid)
+        # bigger than the whole cache, not kept
+        cache.put('d', 'D', size=4)
+        self.assertEqual(cache.get('d'), None)
+        self.assertEqual(cache.size, 2)
+
+    def test_invalidate(self):
+        cache = ResultCache()
+        cache.put('a', 'A', uuid='vm1', time_from=0, time_to=60)
+        cache.put('b', 'B', uuid='vm1', time_from=60, time_to=120)
+        cache.put('c', 'C', uuid='vm2', time_from=0, time_to=60)
+        self.assertEqual(cache.invalidate('vm1', 200, 300), 0)
+        self.assertEqual(cache.invalidate('vm3', 0, 300), 0)
+        self.assertEqual(cache.invalidate('vm1', 30, 30), 1)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 'B')
+        self.assertEqual(cache.invalidate('vm1', 0, 300), 1)
+        self.assertFalse('vm1' in cache.by_uuid)
+        self.assertEqual(cache.get('c'), 'C')
+        self.assertEqual(cache.size, 1)
+        self.assertEqual(cache.get_stats()['invalidations'], 2)
+
+    def test_bucket_range(self):
+        self.assertEqual(bucket_range(61, 119, 60), (60, 120))
+        self.assertEqual(bucket_range(60, 120, 60), (60, 120))
+        self.assertEqual(bucket_range(0, 1, 300), (0, 300))
@@ -0,0 +1,103 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+from kanyun.common.vminfo import new_sample
+from kanyun.database import DbError
+from kanyun.server.ingest import IngestPipeline
+
+
+def make_samples(count, t=1332465360):
+    ret = list()
+    for i in range(count):
+        sample = new_sample('instance-%08x' % i, 'uuid-%d' % i)
+        sample['time'] = t
+        ret.append(sample)
+    return ret
+
+
+class FakeDb():
+    """fails the first ${failures} inserts with ${error}"""
+
+    def __init__(self, failures=0, error=DbError):
+        self.failures = failures
+        self.error = error
+        self.attempts = 0
+        self.samples = list()
+
+    def insert_vm_samples(self, samples):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise self.error('server has gone away')
+        self.samples.extend(samples)
+        return True
+
+
+class IngestPipelineTestCase(unittest.TestCase):
+
+    def get_pipeline(self, db, **kwargs):
+        kwargs.setdefault('flush_size', 10)
+        kwargs.setdefault('flush_interval', 0.01)
+        kwargs.setdefault('retry_interval', 0)
+        return IngestPipeline(db, **kwargs)
+
+    def test_batches(self):
+        db = FakeDb()
+        pipeline = self.get_pipeline(db)
+        pipeline.start()
+        pipeline.insert_vm_samples(make_samples(25))
+        pipeline.stop()
+        self.assertEqual(len(db.samples), 25)
+        stats = pipeline.get_stats()
+        self.assertEqual(stats['received'], 25)
+        self.assertEqual(stats['written'], 25)
+        self.assertEqual(stats['dropped'], 0)
+        self.assertEqual(stats['pending'], 0)
+        self.assertTrue(stats['batches'] >= 3)
+
+    def test_retry(self):
+        db = FakeDb(failures=2)
+        pipeline = self.get_pipeline(db, flush_retries=2)
+        samples = make_samples(5)
+        pipeline.flush(samples)
+        self.assertEqual(db.samples, samples)
+        stats = pipeline.get_stats()
+        self.assertEqual(stats['written'], 5)
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['dropped'], 0)
+
+    def test_dropped_after_retries(self):
+        db = FakeDb(failures=10)
+        pipeline = self.get_pipeline(db, flush_retries=3)
+        pipeline.flush(make_samples(5))
+        self.assertEqual(db.attempts, 4)
+        stats = pipeline.get_stats()
+        self.assertEqual(stats['written'], 0)
+        self.assertEqual(stats['retries'], 3)
+        self.assertEqual(stats['dropped'], 5)
+
+    def test_no_retry_when_not_database_error(self):
+        db = FakeDb(failures=1, error=TypeError)
+        pipeline = self.get_pipeline(db, flush_retries=3)
+        pipeline.flush(make_samples(5))
+        self.assertEqual(db.attempts, 1)
+        self.assertEqual(pipeline.get_stats()['dropped'], 5)
+
+    def test_from_cfg(self):
+        pipeline = IngestPipeline.from_cfg(FakeDb(), {'flush_size': '50',
+                                                      'flush_retries': '7',
+                                                      'retry_interval': '2'})
+        self.assertEqual(pipeline.flush_size, 50)
+        self.assertEqual(pipeline.flush_retries, 7)
+        self.assertEqual(pipeline.retry_interval, 2.0)
@@ -0,0 +1,181 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import unittest
+from kanyun.common.const import *
+from kanyun.common.vminfo import new_sample
+from kanyun.database import DbError
+
+try:
+    from kanyun.database.metricdb import MetricDb, to_unix_time
+except ImportError:
+    # the storage needs MySQLdb
+    MetricDb = None
+
+DAY = 24 * 60 * 60
+
+
+class FakeCursor():
+
+    def __init__(self):
+        self.executed = list()
+        self.results = list()
+        self.rowcount = 0
+
+    def execute(self, sql_cmd, params=None):
+        self.executed.append((sql_cmd, params))
+
+    def fetchall(self):
+        return self.results.pop(0)
+
+    def close(self):
+        pass
+
+
+class FakeConn():
+
+    def __init__(self):
+        self.pings = 0
+        self.commits = 0
+        self.rollbacks = 0
+
+    def ping(self, reconnect):
+        self.pings += 1
+
+    def cursor(self):
+        return self.cursor_
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+@unittest.skipIf(MetricDb is None, 'MySQLdb is not installed')
+class MetricDbTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = MetricDb.__new__(MetricDb)
+        self.db.conn = FakeConn()
+        self.db.cursor = self.db.conn.cursor_ = FakeCursor()
+        self.db.partition_end = 1 << 62
+
+    def sample(self, n, t):
+        sample = new_sample('instance-%08x' % n, 'uuid-%d' % n)
+        sample['time'] = t
+        sample['cpu'] = 1.5
+        sample['mem_max'] = 2048
+        sample['mem_free'] = 1024
+        sample['nic'].append(('vnet0', 10, 20))
+        sample['blk'].append(('vda', 30, 40))
+        return sample
+
+    def test_to_unix_time(self):
+        self.assertEqual(to_unix_time(None), 0)
+        self.assertEqual(to_unix_time(1332465600.5), 1332465600)
+        self.assertEqual(to_unix_time('2012-03-23 01:20:00'), 1332465600)
+
+    def test_insert_vm_samples(self):
+        self.db.INSERT_CHUNK = 4
+        self.assertTrue(self.db.insert_vm_samples(
+            [self.sample(n, 1332465600) for n in range(2)]))
+        # 7 metrics per sample in chunks of 4, then vm_instance
+        inserts = [params for sql_cmd, params in self.db.cursor.executed]
+        self.assertEqual([len(params) for params in inserts],
+                         [20, 20, 20, 10, 6])
+        self.assertEqual(inserts[0][:5],
+                         ['uuid-0', METRIC.CPU, 1332465600, '', 1.5])
+        self.assertEqual(self.db.conn.commits, 1)
+        self.assertTrue(self.db.insert_vm_samples([]))
+        self.assertEqual(self.db.conn.commits, 1)
+
+    def test_insert_rollups(self):
+        self.db.INSERT_CHUNK = 2
+        rows = [(60, 'uuid-%d' % n, METRIC.CPU, 1332465600, '',
+                 1.0, 2.0, 3.0, 2, 2.0, 1332465630) for n in range(3)]
+        self.assertTrue(self.db.insert_rollups(rows))
+        inserts = [params for sql_cmd, params in self.db.cursor.executed]
+        self.assertEqual([len(params) for params in inserts], [22, 11])
+        self.assertEqual(self.db.conn.commits, 1)
+
+    def test_insert_rollups_rollback(self):
+        self.db.INSERT_CHUNK = 1
+        rows = [(60, 'uuid-%d' % n, METRIC.CPU, 1332465600, '',
+                 1.0, 2.0, 3.0, 2, 2.0, 1332465630) for n in range(3)]
+        executed = list()
+
+        def execute(sql_cmd, params=None):
+            if executed:
+                raise DbError('lost connection')
+            executed.append(params)
+
+        self.db.cursor.execute = execute
+        self.assertRaises(DbError, self.db.insert_rollups, rows)
+        # the first chunk is not left behind to be merged twice
+        self.assertEqual(len(executed), 1)
+        self.assertEqual(self.db.conn.rollbacks, 1)
+        self.assertEqual(self.db.conn.commits, 0)
+
+    def test_ensure_partitions(self):
+        self.db.partition_end = 0
+        now = int(time.time()) // DAY * DAY
+        self.db.cursor.results.append(
+            [('p1', now), ('p_future', 'MAXVALUE')])
+        self.db.ensure_partitions(now + 100)
+        sql_cmd = self.db.cursor.executed[-1][0]
+        self.assertTrue(sql_cmd.startswith('alter table vm_metric '
+                                           'reorganize partition p_future'))
+        # today and PARTITIONS_AHEAD days, then p_future again
+        self.assertEqual(sql_cmd.count('partition p'),
+                         self.db.PARTITIONS_AHEAD + 3)
+        self.assertTrue(self.db.partition_end > now + 100)
+        executed = len(self.db.cursor.executed)
+        self.db.ensure_partitions(now + 200)
+        self.assertEqual(len(self.db.cursor.executed), executed)
+
+    def test_not_partitioned(self):
+        self.db.partition_end = 0
+        self.db.cursor.results.append([(None, None)])
+        self.db.ensure_partitions(1332465600)
+        self.assertEqual(self.db.partition_end, 1 << 62)
+        self.db.cursor.results.append([(None, None)])
+        self.assertEqual(self.db.drop_partitions_before(1332465600), 0)
+
+    def test_drop_partitions_before(self):
+        self.db.cursor.results.append([('p20120321', 1332374400),
+                                       ('p20120322', 1332460800),
+                                       ('p_future', None)])
+        pings = self.db.conn.pings
+        self.assertEqual(self.db.drop_partitions_before(1332374400), 1)
+        self.assertEqual(self.db.cursor.executed[-1][0],
+                         'alter table vm_metric drop partition p20120321')
+        # the connection may have gone away since get_partitions
+        self.assertTrue(self.db.conn.pings > pings + 1)
+
+    def test_delete_rollups_before(self):
+        counts = [10, 10, 3]
+
+        def execute(sql_cmd, params=None):
+            self.db.cursor.rowcount = counts.pop(0)
+
+        self.db.cursor.execute = execute
+        self.assertEqual(self.db.delete_rollups_before(60, 1332465600,
+                                                       limit=10), 23)
+        self.assertEqual(counts, [])
+        self.assertEqual(self.db.conn.commits, 3)
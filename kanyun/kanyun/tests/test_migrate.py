@@ -0,0 +1,98 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import unittest
+from kanyun.common.const import *
+from kanyun.database.migrate import migrate_vm_monitor
+
+UUID = '76d6f296-68b8-4a21-9a20-9f46ff48d6ef'
+
+
+class FakeMonitorDb():
+    """vm_monitor rows of one vm, one sample every 30 seconds"""
+
+    def __init__(self, count, start):
+        self.rows = list()
+        for i in range(count):
+            self.rows.append((i + 1, 'instance-00000001', '%.1f' % i,
+                              '1024', '2048', 'vnet0:%d' % (i * 100),
+                              'vnet0:%d' % (i * 10), 'vda:0', 'vda:0',
+                              start + i * 30, UUID))
+        # an unparsable row is skipped
+        self.rows.append((count + 1, 'instance-00000001', '1.0', 'x',
+                          '2048', '', '', '', '', start, UUID))
+
+    def get_monitor_rows(self, after_id, limit):
+        return [row for row in self.rows if row[0] > after_id][:limit]
+
+
+class FakeMetricDb():
+
+    def __init__(self):
+        self.samples = list()
+        self.rollups = list()
+
+    def insert_vm_samples(self, samples):
+        self.samples.extend(samples)
+
+    def insert_rollups(self, rows):
+        self.rollups.extend(rows)
+
+
+class MigrateTestCase(unittest.TestCase):
+
+    def test_migrate(self):
+        now = int(time.time())
+        start = now - now % 3600 - 3600
+        dst = FakeMetricDb()
+        copied, skipped, last_id = migrate_vm_monitor(FakeMonitorDb(4, start),
+                                                      dst, batch_size=2)
+        self.assertEqual((copied, skipped, last_id), (4, 1, 5))
+        self.assertEqual([s['time'] for s in dst.samples],
+                         [start, start + 30, start + 60, start + 90])
+        self.assertEqual(dst.samples[1]['nic'], [('vnet0', 100, 10)])
+
+        # the rows of a bucket are merged by insert_rollups
+        cpu = dict()
+        for row in dst.rollups:
+            period, uuid, metric, bucket_time, device, mn, mx, sm, count, \
+                last, last_time = row
+            if metric != METRIC.CPU:
+                continue
+            self.assertEqual(uuid, UUID)
+            key = (period, bucket_time)
+            if key in cpu:
+                old = cpu[key]
+                mn, mx = min(old[0], mn), max(old[1], mx)
+                sm, count = old[2] + sm, old[3] + count
+                if old[5] > last_time:
+                    last, last_time = old[4], old[5]
+            cpu[key] = (mn, mx, sm, count, last, last_time)
+        self.assertEqual(cpu[(60, start)], (0.0, 1.0, 1.0, 2, 1.0,
+                                            start + 30))
+        self.assertEqual(cpu[(60, start + 60)], (2.0, 3.0, 5.0, 2, 3.0,
+                                                 start + 90))
+        self.assertEqual(cpu[(3600, start)], (0.0, 3.0, 6.0, 4, 3.0,
+                                              start + 90))
+
+    def test_migrate_skips_tiers_past_retention(self):
+        now = int(time.time())
+        start = now - now % 3600 - 3 * 3600
+        dst = FakeMetricDb()
+        migrate_vm_monitor(FakeMonitorDb(2, start), dst,
+                           retention={60: 3600, 3600: 0, 86400: 0})
+        self.assertEqual(len(dst.samples), 2)
+        periods = set([row[0] for row in dst.rollups])
+        self.assertEqual(periods, set([3600, 86400]))
@@ -0,0 +1,58 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import unittest
+from kanyun.common.const import *
+from kanyun.common.vminfo import new_sample
+from kanyun.server.notify import SamplePublisher
+
+
+class FakeSocket():
+
+    def __init__(self):
+        self.sent = list()
+
+    def send_multipart(self, frames):
+        self.sent.append(frames)
+
+
+class SamplePublisherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.publisher = SamplePublisher(None, 'inproc://notify')
+        self.publisher.socket = FakeSocket()
+
+    def get_ranges(self):
+        ret = list()
+        for msg_type, data in self.publisher.socket.sent:
+            self.assertEqual(msg_type, MSG_TYPE.SAMPLES_WRITTEN)
+            ret.append(sorted(json.loads(data)))
+        return ret
+
+    def test_publish(self):
+        samples = list()
+        for uuid, t in (('vm1', 120), ('vm2', 60), ('vm1', 60),
+                        ('vm1', 180)):
+            sample = new_sample('instance-00000001', uuid)
+            sample['time'] = t
+            samples.append(sample)
+        self.publisher.publish(samples)
+        self.assertEqual(self.get_ranges(), [[['vm1', 60, 180],
+                                              ['vm2', 60, 60]]])
+
+    def test_publish_ranges(self):
+        self.publisher.publish_ranges({'vm1': [0, 60]})
+        self.publisher.publish_ranges(dict())
+        self.assertEqual(self.get_ranges(), [[['vm1', 0, 60]]])
@@ -0,0 +1,129 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import datetime
+import unittest
+from kanyun.common.nova_tools import NovaTools
+from kanyun.server import data_server
+
+
+class FakeApp():
+
+    def get_cfg(self, item):
+        return {'sql_connection': 'sqlite://'}
+
+
+class NovaToolsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1332465600.0
+        self.time = time.time
+        time.time = lambda: self.now
+        self.tool = NovaTools(FakeApp())
+        self.tool.instances.metadata.create_all()
+        self.t0 = datetime.datetime(2012, 3, 23)
+
+    def tearDown(self):
+        time.time = self.time
+
+    def insert(self, id, minutes, name='vm', deleted=False):
+        self.tool.instances.insert().execute(
+            id=id, uuid='uuid-%d' % id, display_name=name,
+            project_id='project-%d' % (id % 2), deleted=deleted,
+            created_at=self.t0 + datetime.timedelta(minutes=minutes))
+
+    def update(self, id, minutes, **values):
+        t = self.t0 + datetime.timedelta(minutes=minutes)
+        if values.get('deleted'):
+            values['deleted_at'] = t
+        else:
+            values['updated_at'] = t
+        c = self.tool.instances.c
+        self.tool.instances.update(c.id == id).execute(**values)
+
+    def test_lookup(self):
+        self.insert(1, 0, name='web')
+        self.insert(2, 0, deleted=True)
+        self.assertEqual(self.tool.get_instance(uuid='uuid-1'),
+                         (1, 'uuid-1', 'web', 'project-1'))
+        self.assertEqual(self.tool.get_instances(id=1), (1, 'uuid-1', 'web'))
+        self.assertEqual(self.tool.get_project('uuid-1'), 'project-1')
+        self.assertEqual(self.tool.get_uuid_by_novaid('instance-00000001'),
+                         'uuid-1')
+        self.assertEqual(self.tool.get_instance(uuid='uuid-2'), None)
+        self.assertEqual(self.tool.get_id('vm'), None)
+
+    def test_incremental(self):
+        self.insert(1, 0)
+        self.insert(2, 0)
+        self.assertTrue(self.tool.refresh())
+        self.assertFalse(self.tool.refresh())
+        self.insert(3, 1)
+        self.update(1, 2, display_name='renamed')
+        self.update(2, 3, deleted=True)
+        self.now += self.tool.refresh_interval
+        self.assertTrue(self.tool.refresh())
+        self.assertEqual(sorted(self.tool.by_id), [1, 3])
+        self.assertEqual(self.tool.by_uuid['uuid-1'][2], 'renamed')
+        self.assertEqual(self.tool.last_change,
+                         self.t0 + datetime.timedelta(minutes=3))
+
+    def test_miss_refresh(self):
+        self.insert(1, 0)
+        self.tool.refresh()
+        self.insert(2, 1)
+        self.now += self.tool.miss_interval
+        self.assertEqual(self.tool.get_instance(id=2)[1], 'uuid-2')
+
+    def test_full_refresh(self):
+        self.insert(1, 10)
+        self.tool.refresh()
+        # stamped by a host whose clock is late, the increments miss it
+        self.insert(2, 0)
+        self.now += self.tool.refresh_interval
+        self.tool.refresh()
+        self.assertEqual(self.tool.lookup('uuid-2', None), None)
+        # purged from nova, no deleted row to see
+        self.tool.instances.delete().execute()
+        self.insert(3, 20)
+        self.now += self.tool.full_refresh_interval
+        self.tool.refresh()
+        self.assertEqual(sorted(self.tool.by_id), [3])
+        self.assertEqual(sorted(self.tool.by_uuid), ['uuid-3'])
+
+
+class FillUuidsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tool = data_server.tool
+        data_server.tool = None
+
+    def tearDown(self):
+        data_server.tool = self.tool
+
+    def test_fill_uuids(self):
+        class FakeTool():
+            def get_uuid_by_novaid(self, instance_id):
+                return {'instance-00000001': 'uuid-1'}.get(instance_id)
+
+        samples = [{'instance_id': 'instance-00000001', 'uuid': ''},
+                   {'instance_id': 'instance-00000002', 'uuid': ''},
+                   {'instance_id': 'instance-00000003', 'uuid': 'uuid-3'}]
+        self.assertEqual([s['uuid'] for s in
+                          data_server.fill_uuids(list(samples))], ['uuid-3'])
+        data_server.tool = FakeTool()
+        self.assertEqual([s['uuid'] for s in
+                          data_server.fill_uuids(samples)],
+                         ['uuid-1', 'uuid-3'])
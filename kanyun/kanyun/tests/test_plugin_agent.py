@@ -0,0 +1,132 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+
+try:
+    from kanyun.worker import plugin_agent
+except ImportError:
+    # the agent needs the libvirt bindings
+    plugin_agent = None
+
+DOM_XML = """<domain type='kvm'>
+  <name>instance-00000001</name>
+  <devices>
+    <disk type='file' device='disk'><target dev='vda' bus='virtio'/></disk>
+    <disk type='file' device='cdrom'><source file='/tmp/x.iso'/></disk>
+    <interface type='bridge'><target dev='vnet0'/></interface>
+  </devices>
+</domain>"""
+
+
+class FakeDomain():
+
+    def __init__(self, dom_id):
+        self.dom_id = dom_id
+        self.xml_calls = 0
+
+    def name(self):
+        return 'instance-%08x' % self.dom_id
+
+    def UUIDString(self):
+        return 'uuid-%d' % self.dom_id
+
+    def XMLDesc(self, flags):
+        self.xml_calls += 1
+        return DOM_XML
+
+    def info(self):
+        return (1, 2048, 1024, 1, 10 ** 9)
+
+    def interfaceStats(self, dev):
+        return (100, 1, 0, 0, 200, 2, 0, 0)
+
+    def blockStats(self, dev):
+        return (1, 300, 2, 400, 0)
+
+
+class FakeConn():
+
+    def __init__(self):
+        self.domains = dict()
+
+    def getHostname(self):
+        return 'node1'
+
+    def listDomainsID(self):
+        return self.domains.keys()
+
+    def lookupByID(self, dom_id):
+        return self.domains[dom_id]
+
+
+@unittest.skipIf(plugin_agent is None, 'libvirt is not installed')
+class LibvirtMonitorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = FakeConn()
+        self.open = plugin_agent.libvirt.openReadOnly
+        plugin_agent.libvirt.openReadOnly = lambda uri: self.conn
+        self.monitor = plugin_agent.LibvirtMonitor()
+        self.monitor.get_pid = lambda name: None
+
+    def tearDown(self):
+        plugin_agent.libvirt.openReadOnly = self.open
+
+    def test_get_xml_nodes(self):
+        get = plugin_agent.LibvirtMonitor.get_xml_nodes
+        self.assertEqual(get(DOM_XML, './devices/disk'), ['vda'])
+        self.assertEqual(get(DOM_XML, './devices/interface'), ['vnet0'])
+        self.assertEqual(get('<not xml', './devices/disk'), [])
+
+    def test_collect_info(self):
+        self.conn.domains[1] = FakeDomain(1)
+        infos = self.monitor.collect_info()
+        self.assertEqual(infos.keys(), ['instance-00000001'])
+        info = infos['instance-00000001']
+        self.assertEqual(info[-1], 'uuid-1')
+        kinds = [(i[0], i[1]) for i in info[:-1]]
+        self.assertEqual(kinds, [('cpu', 'total'), ('mem', 'total'),
+                                 ('nic', 'vnet0'), ('blk', 'vda')])
+        # no rss from /proc: the balloon size is used
+        self.assertEqual(info[1][2][1:], (2048, 2048 - 1024))
+        self.assertEqual(info[2][2][1:], (100, 200))
+        self.assertEqual(info[3][2][1:], (300, 400))
+        self.assertEqual(self.monitor.get_stats()['cycles'], 1)
+
+    def test_topology_cached(self):
+        dom = FakeDomain(1)
+        self.conn.domains[1] = dom
+        self.monitor.collect_info()
+        self.monitor.collect_info()
+        self.assertEqual(dom.xml_calls, 1)
+        self.monitor.topologies[1].checked -= self.monitor.topology_ttl
+        self.monitor.collect_info()
+        self.assertEqual(dom.xml_calls, 2)
+
+    def test_forget_stopped(self):
+        self.conn.domains[1] = FakeDomain(1)
+        self.conn.domains[2] = FakeDomain(2)
+        self.monitor.collect_info()
+        self.assertEqual(sorted(self.monitor.topologies), [1, 2])
+        del self.conn.domains[1]
+        infos = self.monitor.collect_info()
+        self.assertEqual(infos.keys(), ['instance-00000002'])
+        self.assertEqual(self.monitor.topologies.keys(), [2])
+        self.assertEqual(self.monitor.diffs.keys(), [2])
+
+    def test_get_vm_rss(self):
+        get = plugin_agent.LibvirtMonitor.get_vm_rss
+        self.assertEqual(get(None), None)
+        self.assertTrue(get('self') > 0)
@@ -0,0 +1,156 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+from kanyun.database.redisclient import CacheClient
+
+
+class FakeRedis():
+    """the commands CacheClient uses, in memory. A pipeline is the client
+    itself queuing the results until execute()"""
+
+    def __init__(self):
+        self.data = dict()
+        self.ttl = dict()
+        self.round_trips = 0
+        self.queued = None
+
+    def pipeline(self, transaction=True):
+        pipe = FakeRedis()
+        pipe.data = self.data
+        pipe.ttl = self.ttl
+        pipe.queued = list()
+        pipe.client = self
+        return pipe
+
+    def execute(self):
+        self.client.round_trips += 1
+        ret, self.queued = self.queued, list()
+        return ret
+
+    def reply(self, value):
+        if self.queued is None:
+            self.round_trips += 1
+            return value
+        self.queued.append(value)
+        return self
+
+    def rpush(self, key, value):
+        self.data.setdefault(key, list()).append(value)
+        return self.reply(len(self.data[key]))
+
+    def ltrim(self, key, start, end):
+        items = self.data.get(key, list())
+        end = len(items) + end + 1 if end < 0 else end + 1
+        self.data[key] = items[start:end]
+        return self.reply(True)
+
+    def lrange(self, key, start, end):
+        items = self.data.get(key, list())
+        end = len(items) + end + 1 if end < 0 else end + 1
+        return self.reply(items[max(0, len(items) + start)
+                                if start < 0 else start:end])
+
+    def expire(self, key, seconds):
+        self.ttl[key] = seconds
+        return self.reply(True)
+
+    def exists(self, key):
+        return self.reply(key in self.data)
+
+    def hmset(self, key, mapping):
+        self.data.setdefault(key, dict()).update(mapping)
+        return self.reply(True)
+
+    def hget(self, key, field):
+        return self.reply(self.data.get(key, dict()).get(field))
+
+    def hmget(self, key, fields):
+        h = self.data.get(key, dict())
+        return self.reply([h.get(f) for f in fields])
+
+    def hgetall(self, key):
+        return self.reply(dict(self.data.get(key, dict())))
+
+    def hdel(self, key, *fields):
+        h = self.data.get(key, dict())
+        for f in fields:
+            h.pop(f, None)
+        return self.reply(len(fields))
+
+
+def vm_info(n, t):
+    return ['instance-%08x' % n, str(t), '1.0', '100', '200', '1', '2',
+            '3', '4', 'uuid-%d' % n]
+
+
+class CacheClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = CacheClient({'cache_server': 'localhost',
+                                  'cache_time_buffer': '3600',
+                                  'cache_length': '3'})
+        self.redis = FakeRedis()
+        self.cache.client = self.redis
+
+    def test_push_one_round_trip(self):
+        self.cache.push_vm_infos([vm_info(n, 60) for n in range(10)])
+        self.assertEqual(self.redis.round_trips, 1)
+        self.assertEqual(self.redis.data['uuid-3'],
+                         ['60$1.0$100$200$1$2$3$4'])
+        self.assertEqual(self.redis.ttl['uuid-3'], 3600)
+        self.assertEqual(self.redis.data[CacheClient.INSTANCE_KEY]
+                         ['instance-00000003'], 'uuid-3')
+        self.cache.push_vm_infos([])
+        self.assertEqual(self.redis.round_trips, 1)
+
+    def test_ring_buffer(self):
+        for t in range(5):
+            self.cache.push_vm_info(vm_info(1, t))
+        infos = self.cache.get_instance_info('instance-00000001')
+        self.assertEqual([i.split('$')[0] for i in infos], ['2', '3', '4'])
+        latest = self.cache.get_instance_info('uuid-1', count=2)
+        self.assertEqual([i.split('$')[0] for i in latest], ['3', '4'])
+
+    def test_default_length(self):
+        cache = CacheClient({'cache_server': 'localhost',
+                             'cache_time_buffer': '144000'})
+        self.assertEqual(cache.cache_length, 2400)
+
+    def test_get_uuids(self):
+        self.cache.push_vm_infos([vm_info(n, 60) for n in range(2)])
+        before = self.redis.round_trips
+        self.assertEqual(self.cache.get_uuids(['instance-00000001',
+                                               'uuid-0', 'unknown']),
+                         ['uuid-1', 'uuid-0', 'unknown'])
+        self.assertEqual(self.redis.round_trips, before + 1)
+        self.assertEqual(self.cache.get_uuids([]), [])
+
+    def test_get_instances_info(self):
+        self.cache.push_vm_infos([vm_info(n, 60) for n in range(3)])
+        before = self.redis.round_trips
+        infos = self.cache.get_instances_info(['uuid-0', 'uuid-2', 'x'])
+        self.assertEqual(self.redis.round_trips, before + 1)
+        self.assertEqual(len(infos['uuid-0']), 1)
+        self.assertEqual(len(infos['uuid-2']), 1)
+        self.assertEqual(infos['x'], [])
+
+    def test_get_instances_forgets_expired(self):
+        self.cache.push_vm_infos([vm_info(n, 60) for n in range(3)])
+        # the list of instance-00000001 expired
+        del self.redis.data['uuid-1']
+        self.assertEqual(self.cache.get_instances(),
+                         ['instance-00000000', 'instance-00000002'])
+        self.assertEqual(sorted(self.redis.data[CacheClient.INSTANCE_KEY]),
+                         ['instance-00000000', 'instance-00000002'])
@@ -0,0 +1,144 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import unittest
+from kanyun.common.const import *
+from kanyun.common.vminfo import new_sample
+from kanyun.database import DbError
+from kanyun.server.rollup import RAW, Rollup, choose_tier, get_retention
+
+
+def make_sample(t, cpu, uuid='uuid-1'):
+    sample = new_sample('instance-00000001', uuid)
+    sample['time'] = t
+    sample['cpu'] = cpu
+    sample['nic'] = [('vnet0', 100, 10)]
+    return sample
+
+
+class FakeDb():
+
+    def __init__(self):
+        self.fail = False
+        self.rows = list()
+
+    def insert_rollups(self, rows):
+        if self.fail:
+            raise DbError('server has gone away')
+        self.rows.extend(rows)
+
+
+class FakePublisher():
+
+    def __init__(self):
+        self.ranges = list()
+
+    def publish_ranges(self, ranges):
+        self.ranges.append(ranges)
+
+
+class RollupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        now = int(time.time())
+        self.start = now - now % 86400
+        self.db = FakeDb()
+        self.rollup = Rollup(self.db)
+
+    def get_rows(self, metric=METRIC.CPU):
+        """{(period, bucket_time): (min, max, sum, count, last, last_time)}"""
+        return dict([((row[0], row[3]), row[5:]) for row in self.db.rows
+                     if row[2] == metric])
+
+    def test_min_max_last(self):
+        t = self.start
+        self.rollup.update([make_sample(t + 10, 5.0),
+                            make_sample(t + 70, 2.0),
+                            make_sample(t + 40, 9.0),
+                            make_sample(t + 20, 1.0)])
+        # 5 metrics in 2 1m buckets, 1 1h and 1 1d bucket
+        self.assertEqual(self.rollup.flush(), 5 * 4)
+        rows = self.get_rows()
+        self.assertEqual(rows[(60, t)], (1.0, 9.0, 15.0, 3, 9.0, t + 40))
+        self.assertEqual(rows[(60, t + 60)], (2.0, 2.0, 2.0, 1, 2.0, t + 70))
+        self.assertEqual(rows[(3600, t)], (1.0, 9.0, 17.0, 4, 2.0, t + 70))
+        self.assertEqual(rows[(86400, t)], (1.0, 9.0, 17.0, 4, 2.0, t + 70))
+        self.assertEqual(self.rollup.buckets, dict())
+        # the devices are kept apart
+        self.assertEqual(set([row[4] for row in self.db.rows
+                              if row[2] == METRIC.NIC_IN]), set(['vnet0']))
+
+    def test_failed_flush_keeps_buckets(self):
+        t = self.start
+        self.rollup.update([make_sample(t + 10, 5.0)])
+        self.db.fail = True
+        self.assertEqual(self.rollup.flush(), None)
+        self.assertEqual(self.db.rows, list())
+
+        self.db.fail = False
+        self.rollup.update([make_sample(t + 20, 7.0)])
+        self.rollup.flush()
+        rows = self.get_rows()
+        self.assertEqual(rows[(60, t)], (5.0, 7.0, 12.0, 2, 7.0, t + 20))
+
+    def test_publish_after_flush(self):
+        t = self.start
+        self.rollup.publisher = FakePublisher()
+        self.rollup.update([make_sample(t + 10, 5.0),
+                            make_sample(t + 70, 2.0, uuid='uuid-2'),
+                            make_sample(t + 130, 2.0)])
+        self.db.fail = True
+        self.rollup.flush()
+        self.assertEqual(self.rollup.publisher.ranges, list())
+
+        self.db.fail = False
+        self.rollup.update([make_sample(t + 190, 5.0)])
+        self.rollup.flush()
+        self.assertEqual(self.rollup.publisher.ranges,
+                         [{'uuid-1': [t + 10, t + 190],
+                           'uuid-2': [t + 70, t + 70]}])
+        self.rollup.flush()
+        self.assertEqual(self.rollup.publisher.ranges[1], dict())
+
+    def test_tick(self):
+        self.rollup.update([make_sample(self.start, 1.0)])
+        self.rollup.enforce_retention = lambda: None
+        self.rollup.tick()
+        self.assertEqual(self.db.rows, list())
+        self.rollup.previous_flush -= self.rollup.flush_interval
+        self.rollup.tick()
+        self.assertNotEqual(self.db.rows, list())
+
+    def test_get_retention(self):
+        retention = get_retention({'retention_raw': '3600',
+                                   'retention_1d': '86400'})
+        self.assertEqual(retention[RAW], 3600)
+        self.assertEqual(retention[60], 30 * 24 * 60 * 60)
+        self.assertEqual(retention[86400], 86400)
+
+    def test_choose_tier(self):
+        now = 100 * 86400
+        retention = {RAW: 86400, 60: 2 * 86400, 3600: 10 * 86400, 86400: 0}
+        self.assertEqual(choose_tier(30, now - 3600, retention, now), RAW)
+        self.assertEqual(choose_tier(300, now - 3600, retention, now), 60)
+        self.assertEqual(choose_tier(90, now - 3600, retention, now), RAW)
+        self.assertEqual(choose_tier(7200, now - 3600, retention, now), 3600)
+        self.assertEqual(choose_tier(86400, now - 3600, retention, now),
+                         86400)
+        # the 1m buckets are gone, 1h still divides 2 hours
+        self.assertEqual(choose_tier(7200, now - 5 * 86400, retention, now),
+                         3600)
+        self.assertEqual(choose_tier(300, now - 5 * 86400, retention, now),
+                         RAW)
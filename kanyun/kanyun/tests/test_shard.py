@@ -0,0 +1,154 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import errno
+import unittest
+import zmq
+from kanyun.common.const import *
+from kanyun.server import data_server
+from kanyun.server.shard import get_shard, ShardRouter, ShardSupervisor
+
+
+class FakeSocket():
+
+    def __init__(self):
+        self.sent = list()
+        self.full = False
+
+    def connect(self, endpoint):
+        self.endpoint = endpoint
+
+    def send_multipart(self, frames, flags=0):
+        if self.full:
+            if flags & zmq.NOBLOCK:
+                raise zmq.ZMQError(errno.EAGAIN)
+            raise AssertionError('would block')
+        self.sent.append(frames)
+
+
+class FakeContext():
+
+    def socket(self, kind):
+        return FakeSocket()
+
+
+class FakeProcess():
+
+    pids = 100
+
+    def __init__(self):
+        FakeProcess.pids += 1
+        self.pid = FakeProcess.pids
+        self.alive = True
+        self.exitcode = None
+
+    def is_alive(self):
+        return self.alive
+
+
+class ShardRouterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.router = ShardRouter(FakeContext(), ['inproc://%d' % n
+                                                  for n in range(4)])
+
+    def test_get_shard(self):
+        # crc32, the same in every process
+        self.assertEqual(get_shard('worker_1', 4), get_shard('worker_1', 4))
+        self.assertEqual(get_shard('worker_1', 1), 0)
+        shards = set([get_shard('uuid-%d' % n, 4) for n in range(100)])
+        self.assertEqual(shards, set(range(4)))
+
+    def test_route_packed(self):
+        frames = [MSG_TYPE.AGENT_PACKED, 'worker_1', 'frame']
+        self.assertTrue(self.router.route(frames))
+        n = get_shard('worker_1', 4)
+        self.assertEqual(self.router.sockets[n].sent, [frames])
+        dictionary = [MSG_TYPE.AGENT_DICT, json.dumps({'worker_id': 'worker_1'})]
+        self.assertTrue(self.router.route(dictionary))
+        self.assertEqual(self.router.sockets[n].sent, [frames, dictionary])
+
+    def test_route_agent(self):
+        data = dict([('instance-%d' % n, [['cpu', 'total', [0, 1.0]],
+                                          'uuid-%d' % n]) for n in range(20)])
+        self.assertTrue(self.router.route([MSG_TYPE.AGENT, json.dumps(data)]))
+        for n, socket in enumerate(self.router.sockets):
+            for msg_type, part in socket.sent:
+                for instance_id, items in json.loads(part).iteritems():
+                    self.assertEqual(get_shard(str(items[-1]), 4), n)
+                    self.assertEqual(data.pop(instance_id), items)
+        self.assertEqual(data, {})
+
+    def test_heartbeat_stays(self):
+        self.assertFalse(self.router.route([MSG_TYPE.HEART_BEAT, '[]']))
+
+    def test_full_shard_dropped(self):
+        n = get_shard('worker_1', 4)
+        self.router.sockets[n].full = True
+        frames = [MSG_TYPE.AGENT_PACKED, 'worker_1', 'frame']
+        self.assertTrue(self.router.route(frames))
+        self.router.sockets[n].full = False
+        self.assertTrue(self.router.route(frames))
+        stats = self.router.get_stats()
+        self.assertEqual(stats['dropped'][n], 1)
+        self.assertEqual(stats['routed'][n], 1)
+        self.assertEqual(sum(stats['dropped']), 1)
+
+
+class ShardSupervisorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.started = list()
+        self.supervisor = ShardSupervisor(self.start, 3, check_interval=0)
+
+    def start(self, n):
+        self.started.append(n)
+        return FakeProcess()
+
+    def test_restart_dead(self):
+        self.assertEqual(self.started, [0, 1, 2])
+        self.assertFalse(self.supervisor.check())
+        pids = self.supervisor.get_pids()
+        self.supervisor.processes[1].alive = False
+        self.assertTrue(self.supervisor.check())
+        self.assertEqual(self.started, [0, 1, 2, 1])
+        new_pids = self.supervisor.get_pids()
+        self.assertEqual(new_pids[0], pids[0])
+        self.assertNotEqual(new_pids[1], pids[1])
+        self.assertEqual(self.supervisor.get_stats()['restarts'], [0, 1, 0])
+
+    def test_check_interval(self):
+        self.supervisor.check_interval = 60
+        self.supervisor.processes[0].alive = False
+        self.assertFalse(self.supervisor.check())
+        self.supervisor.checked -= 60
+        self.assertTrue(self.supervisor.check())
+
+    def test_autotask_updates_shard_pids(self):
+        saved = data_server.supervisor, data_server.shard_pids
+        try:
+            data_server.supervisor = self.supervisor
+            data_server.shard_pids = self.supervisor.get_pids()
+            dead = self.supervisor.processes[2]
+            dead.alive = False
+            data_server.autotask_shards()
+            new = self.supervisor.processes[2]
+            self.assertNotEqual(new.pid, dead.pid)
+            self.assertEqual(data_server.shard_pids,
+                             self.supervisor.get_pids())
+            self.assertTrue(new.pid in data_server.shard_pids)
+            self.assertFalse(dead.pid in data_server.shard_pids)
+        finally:
+            data_server.supervisor, data_server.shard_pids = saved
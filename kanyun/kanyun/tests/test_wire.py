@@ -0,0 +1,127 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import unittest
+from kanyun.common.const import *
+from kanyun.common.vminfo import decode_agent_data
+from kanyun.common.wire import PackedEncoder, PackedDecoder, HEADER, \
+    FLAG_KEY, FLAG_WIDE
+
+
+def agent_data(t, vms, counter):
+    data = dict()
+    for n in xrange(vms):
+        data['instance-%08x' % n] = [
+            ['cpu', 'total', [t, 12.5 * n]],
+            ['mem', 'total', [t, 2097152, 1048576 + n]],
+            ['nic', 'vnet%d' % n, [t, counter, counter * 2]],
+            ['blk', 'vda', [t, counter * 3, counter * 4]],
+            'uuid-%d' % n]
+    return data
+
+
+def by_instance(samples):
+    return sorted(samples, key=lambda s: s['instance_id'])
+
+
+class WireTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.encoder = PackedEncoder('worker_1', keyframe_interval=3)
+        self.decoder = PackedDecoder()
+
+    def deliver(self, messages, skip_dict=False):
+        samples = None
+        for msg in messages:
+            if msg[0] == MSG_TYPE.AGENT_DICT:
+                if not skip_dict:
+                    self.decoder.set_dictionary(json.loads(msg[1]))
+            else:
+                self.assertEqual(msg[0], MSG_TYPE.AGENT_PACKED)
+                samples = self.decoder.decode(msg[1], msg[2])
+        return samples
+
+    def test_round_trip(self):
+        for cycle in xrange(7):
+            data = agent_data(1332465600 + cycle * 60, 3, 1000 * cycle)
+            samples = self.deliver(self.encoder.encode(data))
+            self.assertEqual(by_instance(samples),
+                             by_instance(decode_agent_data(data)))
+        stats = self.decoder.get_stats()
+        self.assertEqual(stats['frames'], 7)
+        self.assertEqual(stats['dropped'], 0)
+
+    def test_keyframes(self):
+        flags = list()
+        for cycle in xrange(7):
+            messages = self.encoder.encode(agent_data(cycle * 60, 2, cycle))
+            flags.append(HEADER.unpack_from(messages[-1][2])[1])
+            # the dictionary goes with every keyframe
+            self.assertEqual(len(messages), 2 if flags[-1] & FLAG_KEY else 1)
+        self.assertEqual([f & FLAG_KEY for f in flags],
+                         [FLAG_KEY, 0, 0, FLAG_KEY, 0, 0, FLAG_KEY])
+
+    def test_new_device_sends_dictionary(self):
+        self.deliver(self.encoder.encode(agent_data(0, 2, 0)))
+        data = agent_data(60, 2, 10)
+        data['instance-00000000'].insert(0, ['nic', 'vnet9', [60, 5, 6]])
+        messages = self.encoder.encode(data)
+        self.assertEqual(messages[0][0], MSG_TYPE.AGENT_DICT)
+        samples = self.deliver(messages)
+        self.assertEqual(by_instance(samples),
+                         by_instance(decode_agent_data(data)))
+
+    def test_wide_counters(self):
+        self.deliver(self.encoder.encode(agent_data(0, 1, 0)))
+        data = agent_data(60, 1, 1 << 40)
+        messages = self.encoder.encode(data)
+        flags = HEADER.unpack_from(messages[-1][2])[1]
+        self.assertEqual(flags, FLAG_WIDE)
+        self.assertEqual(self.deliver(messages), decode_agent_data(data))
+
+    def test_missing_frame(self):
+        self.deliver(self.encoder.encode(agent_data(0, 2, 0)))
+        self.encoder.encode(agent_data(60, 2, 10))
+        # the deltas are dropped until the next keyframe
+        self.assertEqual(self.deliver(
+            self.encoder.encode(agent_data(120, 2, 20))), [])
+        self.assertEqual(self.decoder.get_stats()['dropped'], 1)
+        data = agent_data(180, 2, 30)
+        samples = self.deliver(self.encoder.encode(data))
+        self.assertEqual(by_instance(samples),
+                         by_instance(decode_agent_data(data)))
+
+    def test_unknown_dictionary(self):
+        # a data-server restarted between two keyframes
+        messages = self.encoder.encode(agent_data(0, 2, 0))
+        self.assertEqual(self.deliver(messages, skip_dict=True), [])
+        self.assertEqual(self.deliver(
+            self.encoder.encode(agent_data(60, 2, 10))), [])
+        self.assertEqual(self.decoder.get_stats()['dropped'], 2)
+
+    def test_bad_frame(self):
+        self.deliver(self.encoder.encode(agent_data(0, 2, 0)))
+        messages = self.encoder.encode(agent_data(60, 2, 10))
+        self.assertEqual(self.decoder.decode('worker_1',
+                                             messages[-1][2][:-1]), [])
+        self.assertEqual(self.decoder.get_stats()['dropped'], 1)
+
+    def test_agent_data_without_uuid(self):
+        # an old worker: the data-server looks the uuid up in nova
+        data = agent_data(0, 1, 0)
+        data['instance-00000000'].pop()
+        samples = decode_agent_data(data)
+        self.assertEqual(samples[0]['uuid'], '')
+        self.assertEqual(samples[0]['blk'], [('vda', 0, 0)])
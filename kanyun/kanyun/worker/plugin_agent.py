@@ -16,12 +16,17 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import os
 import datetime
 import time
+import traceback
+from multiprocessing.pool import ThreadPool
 from xml.etree import ElementTree
 
 import libvirt
 
+from kanyun.common.app import App
+
 # add by pyw
 class Diff():
     """TODO:same as class Statistics() in server, merge."""
@@ -55,70 +60,163 @@ class Diff():
         return self.time_pass
 
 
+class DomainTopology():
+    """devices of one running domain, parsed from its XML once.
+    A domain gets a new ID every time it is started, and the XML is only
+    parsed again when its text changed(device hot plug)."""
+    def __init__(self, dom_id, name, uuid, dom_xml):
+        self.dom_id = dom_id
+        self.name = name
+        self.uuid = uuid
+        self.xml_hash = hash(dom_xml)
+        self.nics = LibvirtMonitor.get_xml_nodes(dom_xml, './devices/interface')
+        self.disks = LibvirtMonitor.get_xml_nodes(dom_xml, './devices/disk')
+        self.checked = time.time()
+        self.pid = None
+
+
 class LibvirtMonitor(object):
+    # seconds before a cached domain XML is compared again
+    topology_ttl = 60
+    pid_dir = '/var/run/libvirt/qemu'
 
-    def __init__(self, uri='qemu:///system'):
+    def __init__(self, uri='qemu:///system', threads=0):
         self.conn = libvirt.openReadOnly(uri)
         self.hostname = self.conn.getHostname()
         self.diffs = dict()
-	self.uri = uri
+        self.uri = uri
+        # dom_id --> DomainTopology
+        self.topologies = dict()
+        self.pool = None
+        if threads > 1:
+            self.pool = ThreadPool(threads)
+        self.cycles = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
         """
         (model, memory_kb, cpus, mhz, nodes,
          sockets, cores, threads) = conn.getInfo()
         """
-    def __get_pid_of_instances(self):
-        from os import popen;
-        cmd='''ps ax|egrep  '(/usr/bin/kvm|/usr/bin/qemu)'|grep -v 'egrep'|awk '{
-    pid=$1;
-    for(i=2;i<NF;i++){
-        if($i=="-name" && match($(i+1),/instance-[a-z0-9]+/))
-	    instance=$(i+1);
-    }
-#    print $0;
-    if(instance!="")
-        print pid"\t"instance;    
-}' '''
-        pid_map=dict();
-        for line in popen(cmd).readlines():
-            paras=line[:-1].split("\t");
-            pid=paras[0];
-            instance_id=paras[1];
-            pid_map[instance_id]=pid;
-        return pid_map;
 
     def collect_info(self):
-        infos_by_dom_name = dict()
-	try:
-	        domainIDList=self.conn.listDomainsID();
-	except Exception, e:
-		self.conn = libvirt.openReadOnly(self.uri)
-	        domainIDList=self.conn.listDomainsID();
-				
-        pid_map=self.__get_pid_of_instances();
-        for dom_id in domainIDList:
+        begin = time.time()
+        try:
+            domainIDList = self.conn.listDomainsID()
+        except libvirt.libvirtError:
+            self.conn = libvirt.openReadOnly(self.uri)
+            domainIDList = self.conn.listDomainsID()
+        self.forget_stopped(domainIDList)
+
+        if self.pool is None:
+            results = map(self.collect_domain, domainIDList)
+        else:
+            results = self.pool.map(self.collect_domain, domainIDList)
+        infos_by_dom_name = dict([r for r in results if not r is None])
+
+        self.update_latency(len(domainIDList), time.time() - begin)
+        return infos_by_dom_name
+
+    def get_stats(self):
+        avg = 0.0
+        if self.cycles > 0:
+            avg = self.total_latency / self.cycles
+        return {'cycles': self.cycles,
+                'domains': len(self.topologies),
+                'last_latency': self.last_latency,
+                'avg_latency': avg,
+                'max_latency': self.max_latency}
+
+    def collect_domain(self, dom_id):
+        """one pass over one domain, return (dom_name, infos) or None if
+        the domain went away meanwhile"""
+        try:
             dom_conn = self.conn.lookupByID(dom_id)
-            dom_key = dom_conn.name()
-            dom_xml = dom_conn.XMLDesc(0)
+            topo = self.get_topology(dom_id, dom_conn)
             infos = list()
             # get domain's cpu, memory info
-            infos.extend(self._collect_cpu_mem_info(dom_id,pid_map[dom_key],dom_conn))
+            infos.extend(self._collect_cpu_mem_info(dom_id, topo.pid, dom_conn))
             # get domain's network info
-            nic_devs = self.get_xml_nodes(dom_xml, './devices/interface')
-            if not nic_devs:
-                # TODO(lzyeval): handle exception
-                pass
-            for nic_dev in nic_devs:
+            for nic_dev in topo.nics:
                 infos.extend(self._collect_nic_dev_info(dom_conn, nic_dev))
             # get domain's stroage info
-            blk_devs = self.get_xml_nodes(dom_xml, './devices/disk')
-            if not blk_devs:
-                # TODO(lzyeval): handle exception
-                pass
-            for blk_dev in blk_devs:
+            for blk_dev in topo.disks:
                 infos.extend(self._collect_blk_dev_info(dom_conn, blk_dev))
-            infos.append(dom_conn.UUIDString());
-            infos_by_dom_name[dom_key] = infos
-        return infos_by_dom_name
+            infos.append(topo.uuid)
+            return topo.name, infos
+        except libvirt.libvirtError:
+            traceback.print_exc()
+            return None
+
+    def get_topology(self, dom_id, dom_conn):
+        topo = self.topologies.get(dom_id)
+        now = time.time()
+        if topo is None or now - topo.checked >= self.topology_ttl:
+            dom_xml = dom_conn.XMLDesc(0)
+            if topo is None or topo.xml_hash != hash(dom_xml):
+                topo = DomainTopology(dom_id, dom_conn.name(),
+                                      dom_conn.UUIDString(), dom_xml)
+                self.topologies[dom_id] = topo
+            topo.checked = now
+        if topo.pid is None or not os.path.exists('/proc/%s' % topo.pid):
+            topo.pid = self.get_pid(topo.name)
+        return topo
+
+    def forget_stopped(self, domainIDList):
+        alive = set(domainIDList)
+        for dom_id in self.topologies.keys():
+            if not dom_id in alive:
+                del self.topologies[dom_id]
+                self.diffs.pop(dom_id, None)
+
+    def update_latency(self, count, spend):
+        self.cycles += 1
+        self.last_latency = spend
+        self.total_latency += spend
+        if spend > self.max_latency:
+            self.max_latency = spend
+        print "collect %d domains in \033[1;33m%f\033[0m seconds" % (count, spend)
+
+    def get_pid(self, dom_name):
+        """pid of the qemu process of a domain: libvirt's pid file, else
+        the -name argument in /proc/*/cmdline. None if not found."""
+        try:
+            with open(os.path.join(self.pid_dir, dom_name + '.pid')) as f:
+                return int(f.read().strip())
+        except (IOError, ValueError):
+            pass
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open('/proc/%s/cmdline' % pid) as f:
+                    args = f.read().split('\0')
+            except IOError:
+                continue
+            for i, arg in enumerate(args[:-1]):
+                if arg != '-name':
+                    continue
+                # "-name instance-00000001" or "-name guest=instance-...,..."
+                name = args[i + 1].split(',')[0]
+                if name.startswith('guest='):
+                    name = name[len('guest='):]
+                if name == dom_name:
+                    return int(pid)
+        return None
+
+    @staticmethod
+    def get_vm_rss(pid):
+        """VmRSS(kB) from /proc/<pid>/status, None if unknown"""
+        if pid is None:
+            return None
+        try:
+            with open('/proc/%s/status' % pid) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1])
+        except (IOError, ValueError, IndexError):
+            pass
+        return None
 
     @staticmethod
     def get_utc_sec():
@@ -149,10 +247,10 @@ class LibvirtMonitor(object):
         """
         (dom_run_state, dom_max_mem_kb, dom_memory_kb,
          dom_nr_virt_cpu, dom_cpu_time) = dom_conn.info()
-        from os import popen;
-        cmd=''' awk '/VmRSS:/ { print $2;}' /proc/'''+pid+'/status';
-        mem_used=int(popen(cmd).readlines()[0]);
-        mem_free=dom_max_mem_kb-mem_used;
+        mem_used = self.get_vm_rss(pid)
+        if mem_used is None:
+            mem_used = dom_memory_kb
+        mem_free = dom_max_mem_kb - mem_used
         if not dom_run_state:
             pass
         timestamp = self.get_utc_sec()
@@ -188,7 +286,8 @@ agent = None
 def plugin_call():
     global agent
     if agent is None:
-        agent = LibvirtMonitor()
+        cfg = App(conf="kanyun.conf").get_cfg('worker') or dict()
+        agent = LibvirtMonitor(threads=int(cfg.get('collector_threads', 0)))
     ret = agent.collect_info()
     return ret
     
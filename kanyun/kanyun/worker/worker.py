@@ -27,6 +27,7 @@ import ConfigParser
 
 from kanyun.common.app import *
 from kanyun.common.const import *
+from kanyun.common.wire import PackedEncoder
 
 # plugin
 def plugin_heartbeat(worker_id, status=1):
@@ -67,6 +68,11 @@ class Worker:
         self.socket = ctx.socket(zmq.PUSH)
         self.socket.connect("tcp://%s:%s" % (server_host, server_port))
         print "server is %s:%s" % (server_host, server_port)
+        # wire_format: json(default) or packed, see kanyun.common.wire
+        self.encoder = None
+        if self.cfg.get('wire_format') == 'packed':
+            self.encoder = PackedEncoder(self.worker_id,
+                                self.cfg.get('keyframe_interval', 5))
     
     def clear_plugin(self):
         self.plugins = list()
@@ -90,6 +96,12 @@ class Worker:
         """PUSH the msg(msg is a list)"""
         self.socket.send_multipart(msg)
     
+    def encode(self, msg_type, info):
+        """return the list of messages carrying info"""
+        if msg_type == MSG_TYPE.AGENT and not self.encoder is None:
+            return self.encoder.encode(info)
+        return [[msg_type, json.dumps(info)]]
+        
     def get_leaving_time(self):
         """return leaving seconds before next work time"""
         ret = 60 - time.localtime().tm_sec
@@ -115,8 +127,9 @@ class Worker:
             try:
                 msg_type, info = plugin(self.worker_id)
                 if (not info is None) and len(info) > 0:
-                    self.send([msg_type, json.dumps(info)])
-		    print msg_type, json.dumps(info)
+                    for msg in self.encode(msg_type, info):
+                        self.send(msg)
+                        print msg_type, len(msg[-1]), "bytes"
             except:
                 traceback.print_exc()
                 enable = False
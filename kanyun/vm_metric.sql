@@ -0,0 +1,59 @@
+--
+-- kanyun numeric time-series storage(storage: metric in [mysql_db])
+--
+-- one row per (vm, metric, device, sample time), every value is numeric.
+-- metric ids are METRIC.* in kanyun/common/const.py:
+--   1 cpu_usage, 2 mem_free, 3 mem_max, 4 nic_in, 5 nic_out,
+--   6 disk_read, 7 disk_write
+-- device is '' for cpu/mem, the target dev(vnet0, vda...) otherwise.
+--
+-- vm_metric is partitioned by day on monitor_time(unix time). MetricDb
+-- splits p_future into daily partitions ahead of the incoming samples,
+-- so a time range query only opens the chunks it covers and old chunks
+-- are dropped instead of deleted row by row.
+--
+
+SET SQL_MODE="NO_AUTO_VALUE_ON_ZERO";
+SET time_zone = "+00:00";
+
+CREATE TABLE IF NOT EXISTS `vm_metric` (
+  `uuid` char(36) NOT NULL,
+  `metric` tinyint(3) unsigned NOT NULL,
+  `monitor_time` int(10) unsigned NOT NULL,
+  `device` varchar(16) NOT NULL DEFAULT '',
+  `value` double NOT NULL,
+  PRIMARY KEY (`uuid`,`metric`,`monitor_time`,`device`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1
+PARTITION BY RANGE (`monitor_time`) (
+  PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+CREATE TABLE IF NOT EXISTS `vm_instance` (
+  `uuid` char(36) NOT NULL,
+  `instance_id` char(20) NOT NULL,
+  `last_seen` int(10) unsigned NOT NULL,
+  PRIMARY KEY (`uuid`),
+  KEY `instance_id` (`instance_id`),
+  KEY `last_seen` (`last_seen`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+--
+-- rollup tiers, one row per (period, vm, metric, bucket, device).
+-- period is the bucket length in seconds: 60, 3600 or 86400.
+-- rows are merged on write, avg is sum_value/count.
+--
+CREATE TABLE IF NOT EXISTS `vm_rollup` (
+  `period` int(10) unsigned NOT NULL,
+  `uuid` char(36) NOT NULL,
+  `metric` tinyint(3) unsigned NOT NULL,
+  `bucket_time` int(10) unsigned NOT NULL,
+  `device` varchar(16) NOT NULL DEFAULT '',
+  `min_value` double NOT NULL,
+  `max_value` double NOT NULL,
+  `sum_value` double NOT NULL,
+  `count` int(10) unsigned NOT NULL,
+  `last_value` double NOT NULL,
+  `last_time` int(10) unsigned NOT NULL,
+  PRIMARY KEY (`period`,`uuid`,`metric`,`bucket_time`,`device`),
+  KEY `period_time` (`period`,`bucket_time`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
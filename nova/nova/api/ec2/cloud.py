@@ -50,6 +50,13 @@ LOG = logging.getLogger(__name__)
 
 QUOTAS = quota.QUOTAS
 
+# What _format_instances() renders of the instances it lists
+EC2_INSTANCE_COLUMNS = ['image_ref', 'kernel_id', 'ramdisk_id', 'vm_state',
+                        'shutdown_terminate', 'hostname', 'key_name',
+                        'project_id', 'host', 'created_at', 'launch_index',
+                        'root_device_name', 'reservation_id']
+EC2_INSTANCE_JOINS = ['info_cache', 'security_groups', 'instance_type']
+
 
 def validate_ec2_id(val):
     if not validator.validate_str()(val):
@@ -255,6 +262,10 @@ class CloudController(object):
 
             host_services.setdefault(service.host, [])
             host_services[service.host].append(service)
+        alive_services = set(service.id for service, alive
+                             in zip(enabled_services,
+                                    utils.services_are_up(enabled_services))
+                             if alive)
 
         result = []
         for zone in available_zones:
@@ -265,7 +276,7 @@ class CloudController(object):
                                'zoneState': ''})
 
                 for service in host_services[host]:
-                    alive = utils.service_is_up(service)
+                    alive = service.id in alive_services
                     art = (alive and ":-)") or "XXX"
                     active = 'enabled'
                     if service['disabled']:
@@ -857,6 +868,19 @@ class CloudController(object):
         result[key] = ec2utils.glance_id_to_ec2_id(context, ramdisk_uuid,
                                                    'ari')
 
+    @staticmethod
+    def _format_image_ids(instance_ref, image_ids, result):
+        """Like _format_kernel_id() and _format_ramdisk_id(), with the
+        internal ids of the images looked up already"""
+        kernel_uuid = instance_ref['kernel_id']
+        if kernel_uuid:
+            result['kernelId'] = ec2utils.image_ec2_id(image_ids[kernel_uuid],
+                                                       'aki')
+        ramdisk_uuid = instance_ref['ramdisk_id']
+        if ramdisk_uuid:
+            result['ramdiskId'] = ec2utils.image_ec2_id(
+                    image_ids[ramdisk_uuid], 'ari')
+
     def describe_instance_attribute(self, context, instance_id, attribute,
                                     **kwargs):
         def _unsupported_attribute(instance, result):
@@ -967,12 +991,14 @@ class CloudController(object):
         return {'instancesSet': instances_set}
 
     def _format_instance_bdm(self, context, instance_uuid, root_device_name,
-                             result):
+                             result, bdms=None):
         """Format InstanceBlockDeviceMappingResponseItemType"""
         root_device_type = 'instance-store'
         mapping = []
-        for bdm in db.block_device_mapping_get_all_by_instance(context,
-                                                               instance_uuid):
+        if bdms is None:
+            bdms = db.block_device_mapping_get_all_by_instance(context,
+                                                               instance_uuid)
+        for bdm in bdms:
             volume_id = bdm['volume_id']
             if (volume_id is None or bdm['no_device']):
                 continue
@@ -1041,22 +1067,48 @@ class CloudController(object):
                 # always filter out deleted instances
                 search_opts['deleted'] = False
                 instances = self.compute_api.get_all(context,
-                                                     search_opts=search_opts,
-                                                     sort_dir='asc')
+                        search_opts=search_opts, sort_dir='asc',
+                        columns_to_join=EC2_INSTANCE_JOINS,
+                        columns=EC2_INSTANCE_COLUMNS)
             except exception.NotFound:
                 instances = []
+        if not context.is_admin:
+            instances = [instance for instance in instances
+                         if instance['image_ref'] != str(FLAGS.vpn_image_id)]
+
+        # NOTE: the ec2 ids, block device mappings and zones are looked up
+        # for all the instances at once rather than for each of them
+        instance_uuids = [instance['uuid'] for instance in instances]
+        ec2_inst_ids = ec2utils.get_int_ids_from_instance_uuids(
+                context.elevated(),
+                [instance_uuid for instance_uuid in instance_uuids
+                 if utils.is_uuid_like(instance_uuid)])
+        glance_ids = []
+        for instance in instances:
+            glance_ids.append(instance['image_ref'])
+            glance_ids.append(instance['kernel_id'] or None)
+            glance_ids.append(instance['ramdisk_id'] or None)
+        image_ids = ec2utils.glance_ids_to_ids(context, glance_ids)
+        bdms = {}
+        for bdm in db.block_device_mapping_get_all_by_instances(
+                context, instance_uuids):
+            bdms.setdefault(bdm['instance_uuid'], []).append(bdm)
+        hosts = list(set(instance['host'] for instance in instances))
+        services = {}
+        for service in db.service_get_all_by_hosts(context.elevated(), hosts):
+            services.setdefault(service['host'], []).append(service)
+
         for instance in instances:
-            if not context.is_admin:
-                if instance['image_ref'] == str(FLAGS.vpn_image_id):
-                    continue
             i = {}
             instance_uuid = instance['uuid']
-            ec2_id = ec2utils.id_to_ec2_inst_id(instance_uuid)
+            if instance_uuid in ec2_inst_ids:
+                ec2_id = ec2utils.id_to_ec2_id(ec2_inst_ids[instance_uuid])
+            else:
+                ec2_id = ec2utils.id_to_ec2_inst_id(instance_uuid)
             i['instanceId'] = ec2_id
             image_uuid = instance['image_ref']
-            i['imageId'] = ec2utils.glance_id_to_ec2_id(context, image_uuid)
-            self._format_kernel_id(context, instance, i, 'kernelId')
-            self._format_ramdisk_id(context, instance, i, 'ramdiskId')
+            i['imageId'] = ec2utils.image_ec2_id(image_ids.get(image_uuid))
+            self._format_image_ids(instance, image_ids, i)
             i['instanceState'] = _state_description(
                 instance['vm_state'], instance['shutdown_terminate'])
 
@@ -1090,10 +1142,11 @@ class CloudController(object):
             i['amiLaunchIndex'] = instance['launch_index']
             self._format_instance_root_device_name(instance, i)
             self._format_instance_bdm(context, instance['uuid'],
-                                      i['rootDeviceName'], i)
+                                      i['rootDeviceName'], i,
+                                      bdms=bdms.get(instance['uuid'], []))
             host = instance['host']
-            services = db.service_get_all_by_host(context.elevated(), host)
-            zone = ec2utils.get_availability_zone_by_host(services, host)
+            zone = ec2utils.get_availability_zone_by_host(
+                    services.get(host, []), host)
             i['placement'] = {'availabilityZone': zone}
             if instance['reservation_id'] not in reservations:
                 r = {}
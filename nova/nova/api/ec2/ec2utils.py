@@ -63,6 +63,23 @@ def glance_id_to_id(context, glance_id):
         return db.s3_image_create(context, glance_id)['id']
 
 
+def glance_ids_to_ids(context, glance_ids):
+    """Convert glance ids to internal (db) ids at once.
+
+    Returns a dict, the ids are created in the order of glance_ids like
+    glance_id_to_id() would for each of them.
+    """
+    glance_ids = [glance_id for glance_id in glance_ids
+                  if glance_id is not None]
+    ids = {}
+    for s3_image in db.s3_image_get_all_by_uuids(context, glance_ids):
+        ids.setdefault(s3_image['uuid'], s3_image['id'])
+    for glance_id in glance_ids:
+        if glance_id not in ids:
+            ids[glance_id] = db.s3_image_create(context, glance_id)['id']
+    return ids
+
+
 def ec2_id_to_glance_id(context, ec2_id):
     image_id = ec2_id_to_id(ec2_id)
     return id_to_glance_id(context, image_id)
@@ -185,6 +202,22 @@ def get_int_id_from_instance_uuid(context, instance_uuid):
         return db.ec2_instance_create(context, instance_uuid)['id']
 
 
+def get_int_ids_from_instance_uuids(context, instance_uuids):
+    """Get or create the ec2 instance ids (int) of the uuids at once.
+
+    Returns a dict, the ids are created in the order of instance_uuids like
+    get_int_id_from_instance_uuid() would for each of them.
+    """
+    instance_uuids = [instance_uuid for instance_uuid in instance_uuids
+                      if instance_uuid is not None]
+    ids = db.get_ec2_instance_ids_by_uuids(context, instance_uuids)
+    for instance_uuid in instance_uuids:
+        if instance_uuid not in ids:
+            ids[instance_uuid] = db.ec2_instance_create(context,
+                                                        instance_uuid)['id']
+    return ids
+
+
 def get_int_id_from_volume_uuid(context, volume_uuid):
     if volume_uuid is None:
         return
@@ -376,10 +376,19 @@ class InstanceMetadata():
 
 
 def get_metadata_by_address(address):
+    instance_uuid = get_instance_uuid_by_address(address)
+    return get_metadata_by_instance_uuid(instance_uuid, address)
+
+
+def get_instance_uuid_by_address(address):
     ctxt = context.get_admin_context()
     fixed_ip = network.API().get_fixed_ip_by_address(ctxt, address)
+    return fixed_ip['instance_uuid']
 
-    instance = db.instance_get_by_uuid(ctxt, fixed_ip['instance_uuid'])
+
+def get_metadata_by_instance_uuid(instance_uuid, address):
+    ctxt = context.get_admin_context()
+    instance = db.instance_get_by_uuid(ctxt, instance_uuid)
     return InstanceMetadata(instance, address)
 
 
@@ -0,0 +1,48 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Notification driver invalidating the cached metadata of instances.
+
+Add it to notification_driver on the services updating instances. The
+metadata API processes only see the invalidation through memcache, so
+memcached_servers needs to be set.
+"""
+
+from nova.api.metadata import handler
+from nova import flags
+
+
+FLAGS = flags.FLAGS
+
+_cache = None
+
+
+def notify(_context, message):
+    """Invalidates the cached metadata of the instance of a
+    compute.instance.* notification.
+    """
+    global _cache
+
+    if not message['event_type'].startswith('compute.instance.'):
+        return
+    instance_uuid = message['payload'].get('instance_id')
+    if not instance_uuid:
+        return
+
+    if _cache is None:
+        _cache = handler.memcache.Client(FLAGS.memcached_servers, debug=0)
+    handler.invalidate(_cache, instance_uuid)
@@ -17,19 +17,48 @@
 #    under the License.
 
 """Metadata request handler."""
+import itertools
 import os
 
+from eventlet import event
 import webob.dec
 import webob.exc
 
 from nova.api.metadata import base
 from nova import exception
 from nova import flags
+from nova.openstack.common import cfg
+from nova.openstack.common import excutils
 from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
+from nova import utils
 from nova import wsgi
 
 LOG = logging.getLogger(__name__)
+
+metadata_cache_opts = [
+    cfg.IntOpt('metadata_cache_expiration',
+               default=15,
+               help='Time in seconds to cache the metadata of an instance, '
+                    '0 to not cache it'),
+    cfg.IntOpt('metadata_local_cache_size',
+               default=1000,
+               help='Number of addresses each metadata API process caches '
+                    'the metadata of in memory, in front of memcache'),
+    cfg.IntOpt('metadata_local_cache_expiration',
+               default=5,
+               help='Time in seconds each metadata API process serves the '
+                    'metadata of an address from memory, without asking '
+                    'memcache whether the instance changed. A change can '
+                    'take that long to be seen, 0 to not cache in memory'),
+    cfg.IntOpt('metadata_negative_cache_expiration',
+               default=2,
+               help='Time in seconds to remember an address has no '
+                    'metadata'),
+]
+
 FLAGS = flags.FLAGS
+FLAGS.register_opts(metadata_cache_opts)
 flags.DECLARE('use_forwarded_for', 'nova.api.auth')
 
 if FLAGS.memcached_servers:
@@ -38,27 +67,130 @@ else:
     from nova.common import memorycache as memcache
 
 
+def _generation_key(instance_uuid):
+    return 'metadata-generation-%s' % instance_uuid
+
+
+def invalidate(cache, instance_uuid):
+    """Invalidates the cached metadata of an instance.
+
+    The metadata is cached along with the generation of the instance, which
+    this changes.
+    """
+    cache.set(_generation_key(instance_uuid), str(utils.gen_uuid()))
+
+
+class _LocalCache(object):
+    """In memory cache of the least recently used keys, with expiration."""
+
+    def __init__(self, size):
+        self.size = size
+        # key --> [expiration time, last use, value]
+        self._entries = {}
+        self._uses = itertools.count()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= timeutils.utcnow_ts():
+            del self._entries[key]
+            return None
+        entry[1] = self._uses.next()
+        return entry[2]
+
+    def set(self, key, value, time):
+        if not self.size or not time:
+            return
+        if key not in self._entries and len(self._entries) >= self.size:
+            self._evict()
+        self._entries[key] = [timeutils.utcnow_ts() + time,
+                              self._uses.next(), value]
+
+    def _evict(self):
+        """Drops the expired entries, or else the least recently used
+        tenth of them.
+        """
+        now = timeutils.utcnow_ts()
+        keys = [key for key, entry in self._entries.iteritems()
+                if entry[0] <= now]
+        if not keys:
+            keys = sorted(self._entries, key=lambda k: self._entries[k][1])
+            keys = keys[:max(1, self.size / 10)]
+        for key in keys:
+            del self._entries[key]
+
+
 class MetadataRequestHandler(wsgi.Application):
     """Serve metadata."""
 
     def __init__(self):
         self._cache = memcache.Client(FLAGS.memcached_servers, debug=0)
+        # address --> metadata, or None when the address has no metadata
+        self._local_cache = _LocalCache(FLAGS.metadata_local_cache_size)
+        # address --> event sent its metadata, while it is looked up
+        self._lookups = {}
+
+    def _generation(self, instance_uuid):
+        return self._cache.get(_generation_key(instance_uuid))
 
     def get_metadata(self, address):
         if not address:
             raise exception.FixedIpNotFoundForAddress(address=address)
 
+        # Not checked against the generation, the entries expire soon
+        entry = self._local_cache.get(address)
+        if entry is not None:
+            return entry[0]
+
+        # Concurrent requests from an address share one lookup
+        lookup = self._lookups.get(address)
+        if lookup is not None:
+            return lookup.wait()
+
+        lookup = event.Event()
+        self._lookups[address] = lookup
+        try:
+            data = self._get_metadata(address)
+        except Exception as e:
+            with excutils.save_and_reraise_exception():
+                lookup.send(exc=e)
+        finally:
+            del self._lookups[address]
+        lookup.send(data)
+        return data
+
+    def _get_metadata(self, address):
+        """Returns the metadata of an address from memcache, or else from
+        the database, and caches it in both.
+        """
         cache_key = 'metadata-%s' % address
-        data = self._cache.get(cache_key)
-        if data:
-            return data
+        entry = self._cache.get(cache_key)
+        if isinstance(entry, tuple):
+            generation, data = entry
+            if self._generation(data.instance['uuid']) == generation:
+                self._local_cache.set(address, (data,),
+                                      FLAGS.metadata_local_cache_expiration)
+                return data
 
         try:
-            data = base.get_metadata_by_address(address)
+            instance_uuid = base.get_instance_uuid_by_address(address)
+            # Read before the instance, so that a change made meanwhile
+            # leaves the cached metadata with an old generation
+            generation = self._generation(instance_uuid)
+            data = base.get_metadata_by_instance_uuid(instance_uuid,
+                                                      address)
         except exception.NotFound:
+            self._local_cache.set(address, (None,),
+                                  FLAGS.metadata_negative_cache_expiration)
             return None
 
-        self._cache.set(cache_key, data, 15)
+        if FLAGS.metadata_cache_expiration:
+            self._cache.set(cache_key, (generation, data),
+                            FLAGS.metadata_cache_expiration)
+            self._local_cache.set(address, (data,),
+                                  min(FLAGS.metadata_cache_expiration,
+                                      FLAGS.metadata_local_cache_expiration))
 
         return data
 
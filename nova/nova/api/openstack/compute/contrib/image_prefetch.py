@@ -0,0 +1,95 @@
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""The image prefetch extension."""
+
+import webob
+import webob.exc
+
+from nova.api.openstack import extensions
+from nova.compute import api as compute_api
+from nova import db
+from nova import exception
+from nova import flags
+from nova.image import glance
+from nova.openstack.common import log as logging
+
+
+FLAGS = flags.FLAGS
+LOG = logging.getLogger(__name__)
+authorize = extensions.extension_authorizer('compute', 'image_prefetch')
+
+
+class ImagePrefetchController(object):
+    """Fetches images into the image cache of compute hosts ahead of the
+    instances booting from them.
+    """
+
+    def __init__(self):
+        self.host_api = compute_api.HostAPI()
+        self.image_service = glance.get_default_image_service()
+        super(ImagePrefetchController, self).__init__()
+
+    def create(self, req, body):
+        """Prefetch an image on a list of compute hosts.
+
+        The body looks like::
+
+            {'prefetch': {'image_id': 'uuid', 'hosts': ['host1', ...]}}
+        """
+        context = req.environ['nova.context']
+        authorize(context)
+        try:
+            image_id = body['prefetch']['image_id']
+            hosts = body['prefetch']['hosts']
+        except (KeyError, TypeError):
+            msg = _("Missing image_id or hosts")
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+        if not isinstance(hosts, list) or not hosts:
+            msg = _("hosts must be a non empty list")
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+
+        services = db.service_get_all_by_topic(context, FLAGS.compute_topic)
+        compute_hosts = set(service['host'] for service in services)
+        for host in hosts:
+            if host not in compute_hosts:
+                msg = _("Compute host %s could not be found.") % host
+                raise webob.exc.HTTPNotFound(explanation=msg)
+
+        try:
+            self.image_service.show(context, image_id)
+        except exception.ImageNotFound:
+            msg = _("Image %s could not be found.") % image_id
+            raise webob.exc.HTTPNotFound(explanation=msg)
+
+        LOG.audit(_("Prefetching image %(image_id)s on %(hosts)s") %
+                  {'image_id': image_id, 'hosts': ', '.join(hosts)},
+                  context=context)
+        self.host_api.prefetch_image(context, hosts, image_id)
+        return webob.Response(status_int=202)
+
+
+class Image_prefetch(extensions.ExtensionDescriptor):
+    """Admin-only prefetching of images into compute host image caches"""
+
+    name = "ImagePrefetch"
+    alias = "os-image-prefetch"
+    namespace = "http://docs.openstack.org/compute/ext/image_prefetch/api/v1.1"
+    updated = "2012-10-18T00:00:00+00:00"
+
+    def get_resources(self):
+        resources = [extensions.ResourceExtension('os-image-prefetch',
+                ImagePrefetchController())]
+        return resources
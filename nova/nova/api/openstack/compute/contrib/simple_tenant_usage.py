@@ -28,6 +28,9 @@ from nova.openstack.common import timeutils
 
 
 FLAGS = flags.FLAGS
+# What the usages are computed from
+USAGE_COLUMNS = ['display_name', 'project_id', 'instance_type_id',
+                 'launched_at', 'terminated_at', 'vm_state']
 authorize_show = extensions.extension_authorizer('compute',
                                                  'simple_tenant_usage:show')
 authorize_list = extensions.extension_authorizer('compute',
@@ -111,7 +114,8 @@ class SimpleTenantUsageController(object):
         instances = compute_api.get_active_by_window(context,
                                                      period_start,
                                                      period_stop,
-                                                     tenant_id)
+                                                     tenant_id,
+                                                     columns=USAGE_COLUMNS)
         rval = {}
         flavors = {}
 
@@ -526,12 +526,19 @@ class Controller(wsgi.Controller):
             else:
                 search_opts['user_id'] = context.user_id
 
+        if is_detail:
+            columns_to_join = columns = None
+        else:
+            # NOTE: the index view only shows the uuid and the name, there
+            # is no point in reading and joining the rest of the instances
+            columns_to_join = []
+            columns = ['uuid', 'display_name']
+
         limit, marker = common.get_limit_and_marker(req)
         try:
             instance_list = self.compute_api.get_all(context,
-                                                     search_opts=search_opts,
-                                                     limit=limit,
-                                                     marker=marker)
+                    search_opts=search_opts, limit=limit, marker=marker,
+                    columns_to_join=columns_to_join, columns=columns)
         except exception.MarkerNotFound as e:
             msg = _('marker [%s] not found') % marker
             raise webob.exc.HTTPBadRequest(explanation=msg)
@@ -40,6 +40,15 @@ class Client(object):
 
         return self.cache.get(key, (0, None))[1]
 
+    def get_multi(self, keys):
+        """Retrieves the values of the keys which have one, by key."""
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
     def set(self, key, value, time=0, min_compress_len=0):
         """Sets the value for a key."""
         timeout = 0
@@ -54,6 +63,10 @@ class Client(object):
             return False
         return self.set(key, value, time, min_compress_len)
 
+    def delete(self, key):
+        """Deletes the value for a key."""
+        return self.cache.pop(key, None) is not None
+
     def incr(self, key, delta=1):
         """Increments the value for a key."""
         value = self.get(key)
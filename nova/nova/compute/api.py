@@ -1001,10 +1001,15 @@ class API(base.Base):
 
     #NOTE(bcwaldon): no policy check here since it should be rolled in to
     # search_opts in get_all
-    def get_active_by_window(self, context, begin, end=None, project_id=None):
-        """Get instances that were continuously active over a window."""
+    def get_active_by_window(self, context, begin, end=None, project_id=None,
+                             columns=None):
+        """Get instances that were continuously active over a window.
+
+        If columns is given, only those columns are read from the database.
+        """
         return self.db.instance_get_active_by_window(context, begin, end,
-                                                     project_id)
+                                                     project_id,
+                                                     columns=columns)
 
     #NOTE(bcwaldon): this doesn't really belong in this class
     def get_instance_type(self, context, instance_type_id):
@@ -1027,7 +1032,8 @@ class API(base.Base):
         return inst
 
     def get_all(self, context, search_opts=None, sort_key='created_at',
-                sort_dir='desc', limit=None, marker=None):
+                sort_dir='desc', limit=None, marker=None,
+                columns_to_join=None, columns=None):
         """Get all instances filtered by one of the given parameters.
 
         If there is no filter and the context is an admin, it will retrieve
@@ -1039,6 +1045,10 @@ class API(base.Base):
         The results will be returned sorted in the order specified by the
         'sort_dir' parameter using the key specified in the 'sort_key'
         parameter.
+
+        Callers rendering only part of the instances may pass the columns
+        (which may include 'name') and the relations (columns_to_join) they
+        need; the instances then only have those keys, plus id and uuid.
         """
 
         #TODO(bcwaldon): determine the best argument for target here
@@ -1104,24 +1114,33 @@ class API(base.Base):
                         return []
 
         inst_models = self._get_instances_by_filters(context, filters,
-                                                     sort_key, sort_dir,
-                                                     limit=limit,
-                                                     marker=marker)
+                sort_key, sort_dir, limit=limit, marker=marker,
+                columns_to_join=columns_to_join, columns=columns)
 
         # Convert the models to dictionaries
         instances = []
-        for inst_model in inst_models:
-            instance = dict(inst_model.iteritems())
-            # NOTE(comstud): Doesn't get returned by iteritems
-            instance['name'] = inst_model['name']
-            instances.append(instance)
+        if columns is None:
+            for inst_model in inst_models:
+                instance = dict(inst_model.iteritems())
+                # NOTE(comstud): Doesn't get returned by iteritems
+                instance['name'] = inst_model['name']
+                instances.append(instance)
+        else:
+            # NOTE: iteritems() would load every deferred column, one query
+            # per instance, so only the keys asked for are copied
+            keys = set(columns) | set(['id', 'uuid'])
+            keys.update(columns_to_join or [])
+            for inst_model in inst_models:
+                instances.append(dict((key, inst_model[key]) for key in keys))
 
         return instances
 
     def _get_instances_by_filters(self, context, filters,
                                   sort_key, sort_dir,
                                   limit=None,
-                                  marker=None):
+                                  marker=None,
+                                  columns_to_join=None,
+                                  columns=None):
         if 'ip6' in filters or 'ip' in filters:
             res = self.network_api.get_instance_uuids_by_ip_filter(context,
                                                                    filters)
@@ -1131,8 +1150,8 @@ class API(base.Base):
             filters['uuid'] = uuids
 
         return self.db.instance_get_all_by_filters(context, filters,
-                                                   sort_key, sort_dir,
-                                                   limit=limit, marker=marker)
+                sort_key, sort_dir, limit=limit, marker=marker,
+                columns_to_join=columns_to_join, columns=columns)
 
     @wrap_check_policy
     @check_instance_state(vm_state=[vm_states.ACTIVE, vm_states.STOPPED])
@@ -2018,6 +2037,12 @@ class HostAPI(base.Base):
         return self.compute_rpcapi.host_maintenance_mode(context,
                 host_param=host, mode=mode, host=host)
 
+    def prefetch_image(self, context, hosts, image_id):
+        """Fetches an image into the image cache of the specified hosts."""
+        for host in hosts:
+            self.compute_rpcapi.prefetch_image(context, image_id=image_id,
+                    host=host)
+
 
 class AggregateAPI(base.Base):
     """Sub-set of the Compute Manager API for managing host aggregates."""
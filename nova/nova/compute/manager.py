@@ -141,6 +141,12 @@ compute_opts = [
                default=60,
                help="Number of seconds between instance info_cache self "
                         "healing updates"),
+    cfg.IntOpt("heal_instance_info_cache_batch_size",
+               default=0,
+               help="Number of instances whose info_cache is healed on "
+                    "each update, the least recently healed first, with "
+                    "one call to the network API. 0 heals one instance "
+                    "per update, in turn"),
     cfg.BoolOpt('instance_usage_audit',
                default=False,
                help="Generate periodic compute.instance.exists notifications"),
@@ -213,7 +219,7 @@ def _get_image_meta(context, image_ref):
 class ComputeManager(manager.SchedulerDependentManager):
     """Manages the running instances from creation to destruction."""
 
-    RPC_API_VERSION = '2.2'
+    RPC_API_VERSION = '2.3'
 
     def __init__(self, compute_driver=None, *args, **kwargs):
         """Load configuration options and connect to the hypervisor."""
@@ -238,6 +244,10 @@ class ComputeManager(manager.SchedulerDependentManager):
         self._last_host_check = 0
         self._last_bw_usage_poll = 0
         self._last_info_cache_heal = 0
+        # Timing of the last _sync_power_states pass
+        self._last_power_sync = {}
+        # Results of the last batched info_cache healing
+        self._last_info_cache_heal_batch = {}
         self.compute_api = compute.API()
         self.compute_rpcapi = compute_rpcapi.ComputeAPI()
         self.scheduler_rpcapi = scheduler_rpcapi.SchedulerAPI()
@@ -1801,6 +1811,11 @@ class ComputeManager(manager.SchedulerDependentManager):
         """Returns the result of calling "uptime" on the target host."""
         return self.driver.get_host_uptime(host)
 
+    @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
+    def prefetch_image(self, context, image_id):
+        """Fetch an image into the local image cache in the background."""
+        self.driver.prefetch_image(context, image_id)
+
     @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
     @wrap_instance_fault
     def get_diagnostics(self, context, instance):
@@ -2391,6 +2406,9 @@ class ComputeManager(manager.SchedulerDependentManager):
         list, pull the DB record, and try the call to the network API.
         If anything errors, we don't care.  It's possible the instance
         has been deleted, etc.
+
+        With heal_instance_info_cache_batch_size set, the instances whose
+        info_cache is the oldest are healed in batches instead.
         """
         heal_interval = FLAGS.heal_instance_info_cache_interval
         if not heal_interval:
@@ -2400,6 +2418,11 @@ class ComputeManager(manager.SchedulerDependentManager):
             return
         self._last_info_cache_heal = curr_time
 
+        batch_size = FLAGS.heal_instance_info_cache_batch_size
+        if batch_size > 0:
+            self._heal_instance_info_cache_batch(context, batch_size)
+            return
+
         instance_uuids = getattr(self, '_instance_uuids_to_heal', None)
         instance = None
 
@@ -2433,6 +2456,40 @@ class ComputeManager(manager.SchedulerDependentManager):
             # We don't care about any failures
             pass
 
+    def _heal_instance_info_cache_batch(self, context, batch_size):
+        """Update the info_cache of the batch_size instances of this host
+        whose info_cache was updated the longest ago, with one call to
+        the network API.
+        """
+        instances = self.db.instance_get_all_by_host_oldest_info_cache(
+                context, self.host, limit=batch_size)
+        if not instances:
+            return
+
+        # instances are sorted oldest first
+        oldest_age = None
+        info_cache = instances[0]['info_cache']
+        if info_cache:
+            cache_time = info_cache['updated_at'] or info_cache['created_at']
+            oldest_age = utils.total_seconds(timeutils.utcnow() - cache_time)
+
+        try:
+            nw_infos = self.network_api.get_instance_nw_info_bulk(context,
+                                                                  instances)
+        except Exception:
+            # We don't care about any failures
+            LOG.debug(_('Failed to update the info_cache of %d instances'),
+                      len(instances))
+            nw_infos = {}
+
+        self._last_info_cache_heal_batch = {'instances': len(instances),
+                                            'updated': len(nw_infos),
+                                            'oldest_age': oldest_age}
+        LOG.debug(_("Updated the info_cache of %(updated)d of "
+                    "%(instances)d instances, the oldest one was "
+                    "%(oldest_age)s seconds old") %
+                  self._last_info_cache_heal_batch)
+
     @manager.periodic_task
     def _poll_rebooting_instances(self, context):
         if FLAGS.reboot_timeout > 0:
@@ -2594,16 +2651,16 @@ class ComputeManager(manager.SchedulerDependentManager):
     def _sync_power_states(self, context):
         """Align power states between the database and the hypervisor.
 
-        To sync power state data we make a DB call to get the number of
-        virtual machines known by the hypervisor and if the number matches the
-        number of virtual machines known by the database, we proceed in a lazy
-        loop, one database record at a time, checking if the hypervisor has the
-        same power state as is in the database. We call eventlet.sleep(0) after
+        To sync power state data we get the power states of all the virtual
+        machines from the hypervisor in one call, then read again in one
+        call the database records without a pending task, and compare the
+        two, one instance at a time. We call eventlet.sleep(0) after
         each loop to allow the periodic task eventlet to do other work.
 
         If the instance is not found on the hypervisor, but is in the database,
         then a stop() API will be called on the instance.
         """
+        start_time = time.time()
         db_instances = self.db.instance_get_all_by_host(context, self.host)
 
         num_vm_instances = self.driver.get_num_instances()
@@ -2613,6 +2670,23 @@ class ComputeManager(manager.SchedulerDependentManager):
             LOG.warn(_("Found %(num_db_instances)s in the database and "
                        "%(num_vm_instances)s on the hypervisor.") % locals())
 
+        driver_start_time = time.time()
+        vm_power_states = self.driver.get_power_states(db_instances)
+        driver_time = time.time() - driver_start_time
+
+        # Note(maoy): the above get_power_states call might take a long
+        # time, for example, because of a broken libvirt driver.
+        # We re-query the DB to get the latest instance info to minimize
+        # (not eliminate) race condition.
+        db_start_time = time.time()
+        uuids = [db_instance['uuid'] for db_instance in db_instances
+                 if db_instance['task_state'] is None]
+        latest_instances = dict((u['uuid'], u) for u in
+                self.db.instance_get_all_by_uuids(context, uuids,
+                                                  columns_to_join=[]))
+        db_time = time.time() - db_start_time
+        num_updated = 0
+
         for db_instance in db_instances:
             # Allow other periodic tasks to do some work...
             greenthread.sleep(0)
@@ -2622,17 +2696,12 @@ class ComputeManager(manager.SchedulerDependentManager):
                            "pending task. Skip."), instance=db_instance)
                 continue
             # No pending tasks. Now try to figure out the real vm_power_state.
-            try:
-                vm_instance = self.driver.get_info(db_instance)
-                vm_power_state = vm_instance['state']
-            except exception.InstanceNotFound:
-                vm_power_state = power_state.NOSTATE
-            # Note(maoy): the above get_info call might take a long time,
-            # for example, because of a broken libvirt driver.
-            # We re-query the DB to get the latest instance info to minimize
-            # (not eliminate) race condition.
-            u = self.db.instance_get_by_uuid(context,
-                                             db_instance['uuid'])
+            vm_power_state = vm_power_states.get(db_instance['name'],
+                                                 power_state.NOSTATE)
+            u = latest_instances.get(db_instance['uuid'])
+            if u is None:
+                # The instance was deleted in the meantime
+                continue
             db_power_state = u["power_state"]
             vm_state = u['vm_state']
             if self.host != u['host']:
@@ -2665,6 +2734,7 @@ class ComputeManager(manager.SchedulerDependentManager):
                                       db_instance['uuid'],
                                       power_state=vm_power_state)
                 db_power_state = vm_power_state
+                num_updated += 1
             # Note(maoy): Now resolve the discrepancy between vm_state and
             # vm_power_state. We go through all possible vm_states.
             if vm_state in (vm_states.BUILDING,
@@ -2731,6 +2801,16 @@ class ComputeManager(manager.SchedulerDependentManager):
                     LOG.warn(_("Instance is not (soft-)deleted."),
                              instance=db_instance)
 
+        self._last_power_sync = {'instances': num_db_instances,
+                                 'updated': num_updated,
+                                 'driver_time': driver_time,
+                                 'db_time': db_time,
+                                 'total_time': time.time() - start_time}
+        LOG.debug(_("Synced the power states of %(instances)d instances "
+                    "(%(updated)d updated) in %(total_time).3fs: "
+                    "%(driver_time).3fs in the hypervisor, %(db_time).3fs "
+                    "re-reading the database") % self._last_power_sync)
+
     @manager.periodic_task
     def _reclaim_queued_deletes(self, context):
         """Reclaim instances that are queued for deletion."""
@@ -143,11 +143,24 @@ def service_get_all_by_topic(context, topic):
     return IMPL.service_get_all_by_topic(context, topic)
 
 
+def service_get_all_by_topic_since(context, topic, since):
+    """Get all services for a given topic updated at or after since.
+
+    Disabled and deleted services are included.
+    """
+    return IMPL.service_get_all_by_topic_since(context, topic, since)
+
+
 def service_get_all_by_host(context, host):
     """Get all services for a given host."""
     return IMPL.service_get_all_by_host(context, host)
 
 
+def service_get_all_by_hosts(context, hosts):
+    """Get all services for the given hosts."""
+    return IMPL.service_get_all_by_hosts(context, hosts)
+
+
 def service_get_all_compute_by_host(context, host):
     """Get all compute services for a given host."""
     return IMPL.service_get_all_compute_by_host(context, host)
@@ -203,6 +216,15 @@ def compute_node_get_all(context):
     return IMPL.compute_node_get_all(context)
 
 
+def compute_node_get_all_since(context, since):
+    """Get all computeNodes created, updated or deleted at or after since.
+
+    Deleted computeNodes are included so that callers caching them can
+    forget them.
+    """
+    return IMPL.compute_node_get_all_since(context, since)
+
+
 def compute_node_search_by_hypervisor(context, hypervisor_match):
     """Get computeNodes given a hypervisor hostname match string."""
     return IMPL.compute_node_search_by_hypervisor(context, hypervisor_match)
@@ -447,6 +469,17 @@ def fixed_ip_associate_pool(context, network_id, instance_uuid=None,
                                         instance_uuid, host)
 
 
+def fixed_ip_associate_if_free(context, address, network_id,
+                               instance_uuid=None, host=None):
+    """Associate a fixed ip to instance or host if it is still free.
+
+    Returns whether it was, without locking it.
+
+    """
+    return IMPL.fixed_ip_associate_if_free(context, address, network_id,
+                                           instance_uuid, host)
+
+
 def fixed_ip_create(context, values):
     """Create a fixed ip from the values dictionary."""
     return IMPL.fixed_ip_create(context, values)
@@ -477,6 +510,11 @@ def fixed_ip_get_all(context):
     return IMPL.fixed_ip_get_all(context)
 
 
+def fixed_ip_get_free_by_network(context, network_id, limit):
+    """Get up to limit addresses of free fixed ips in network."""
+    return IMPL.fixed_ip_get_free_by_network(context, network_id, limit)
+
+
 def fixed_ip_get_by_address(context, address):
     """Get a fixed ip by address or raise if it does not exist."""
     return IMPL.fixed_ip_get_by_address(context, address)
@@ -581,6 +619,12 @@ def instance_get_by_uuid(context, uuid):
     return IMPL.instance_get_by_uuid(context, uuid)
 
 
+def instance_get_all_by_uuids(context, uuids, columns_to_join=None):
+    """Get the instances of a list of uuids, leaving out missing ones."""
+    return IMPL.instance_get_all_by_uuids(context, uuids,
+                                          columns_to_join=columns_to_join)
+
+
 def instance_get(context, instance_id):
     """Get an instance or raise if it does not exist."""
     return IMPL.instance_get(context, instance_id)
@@ -592,22 +636,32 @@ def instance_get_all(context, columns_to_join=None):
 
 
 def instance_get_all_by_filters(context, filters, sort_key='created_at',
-                                sort_dir='desc', limit=None, marker=None):
-    """Get all instances that match all filters."""
+                                sort_dir='desc', limit=None, marker=None,
+                                columns_to_join=None, columns=None):
+    """Get all instances that match all filters.
+
+    Only the relations in columns_to_join are loaded with the instances,
+    by default info_cache, security_groups, metadata and instance_type.
+    If columns is given, only those columns (and id and uuid) are read.
+    """
     return IMPL.instance_get_all_by_filters(context, filters, sort_key,
                                             sort_dir, limit=limit,
-                                            marker=marker)
+                                            marker=marker,
+                                            columns_to_join=columns_to_join,
+                                            columns=columns)
 
 
 def instance_get_active_by_window(context, begin, end=None, project_id=None,
-                                  host=None):
+                                  host=None, columns=None):
     """Get instances active during a certain time window.
 
     Specifying a project_id will filter for a certain project.
     Specifying a host will filter for instances on a given compute host.
+    If columns is given, only those columns (and id and uuid) are read.
     """
     return IMPL.instance_get_active_by_window(context, begin, end,
-                                              project_id, host)
+                                              project_id, host,
+                                              columns=columns)
 
 
 def instance_get_active_by_window_joined(context, begin, end=None,
@@ -630,6 +684,14 @@ def instance_get_all_by_host(context, host):
     """Get all instances belonging to a host."""
     return IMPL.instance_get_all_by_host(context, host)
 
+
+def instance_get_all_by_host_oldest_info_cache(context, host, limit=None):
+    """Get the instances of a host, the least recently updated
+    info_cache first."""
+    return IMPL.instance_get_all_by_host_oldest_info_cache(context, host,
+                                                           limit=limit)
+
+
 def instance_get_all_by_host_and_node(context, host, node):
     """Get all instances belonging to a node."""
     return IMPL.instance_get_all_by_host_and_node(context, host, node)
@@ -1044,6 +1106,16 @@ def quota_reserve(context, resources, quotas, deltas, expire,
                               until_refresh, max_age)
 
 
+def quota_reserve_conditional(context, quotas, deltas, expire, max_age):
+    """Create reservations if the usages allow them without a refresh.
+
+    Returns None if they do not, without changing anything.
+
+    """
+    return IMPL.quota_reserve_conditional(context, quotas, deltas, expire,
+                                          max_age)
+
+
 def reservation_commit(context, reservations):
     """Commit quota reservations."""
     return IMPL.reservation_commit(context, reservations)
@@ -1233,6 +1305,12 @@ def block_device_mapping_get_all_by_instance(context, instance_uuid):
                                                          instance_uuid)
 
 
+def block_device_mapping_get_all_by_instances(context, instance_uuids):
+    """Get all block device mapping belonging to the instances"""
+    return IMPL.block_device_mapping_get_all_by_instances(context,
+                                                          instance_uuids)
+
+
 def block_device_mapping_destroy(context, bdm_id):
     """Destroy the block device mapping."""
     return IMPL.block_device_mapping_destroy(context, bdm_id)
@@ -1673,6 +1751,11 @@ def s3_image_get_by_uuid(context, image_uuid):
     return IMPL.s3_image_get_by_uuid(context, image_uuid)
 
 
+def s3_image_get_all_by_uuids(context, image_uuids):
+    """Find the local s3 images represented by the provided uuids"""
+    return IMPL.s3_image_get_all_by_uuids(context, image_uuids)
+
+
 def s3_image_create(context, image_uuid):
     """Create local s3 image represented by provided uuid"""
     return IMPL.s3_image_create(context, image_uuid)
@@ -1866,6 +1949,12 @@ def get_ec2_instance_id_by_uuid(context, instance_id):
     return IMPL.get_ec2_instance_id_by_uuid(context, instance_id)
 
 
+def get_ec2_instance_ids_by_uuids(context, instance_uuids):
+    """Get ec2 ids by uuid from instance_id_mappings table, a dict of the
+    uuids which have one"""
+    return IMPL.get_ec2_instance_ids_by_uuids(context, instance_uuids)
+
+
 def get_instance_uuid_by_ec2_id(context, ec2_id):
     """Get uuid through ec2 id from instance_id_mappings table"""
     return IMPL.get_instance_uuid_by_ec2_id(context, ec2_id)
@@ -39,9 +39,12 @@ from nova import utils
 from sqlalchemy import and_
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import or_
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.orm import defer
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
 from sqlalchemy.sql.expression import asc
+from sqlalchemy.sql.expression import case
 from sqlalchemy.sql.expression import desc
 from sqlalchemy.sql.expression import literal_column
 from sqlalchemy.sql import func
@@ -366,6 +369,16 @@ def service_get_all_by_topic(context, topic):
                 all()
 
 
+@require_admin_context
+def service_get_all_by_topic_since(context, topic, since):
+    return model_query(context, models.Service, read_deleted="yes").\
+                filter_by(topic=topic).\
+                filter(or_(models.Service.created_at >= since,
+                           models.Service.updated_at >= since,
+                           models.Service.deleted_at >= since)).\
+                all()
+
+
 @require_admin_context
 def service_get_by_host_and_topic(context, host, topic):
     return model_query(context, models.Service, read_deleted="no").\
@@ -382,6 +395,15 @@ def service_get_all_by_host(context, host):
                 all()
 
 
+@require_admin_context
+def service_get_all_by_hosts(context, hosts):
+    if not hosts:
+        return []
+    return model_query(context, models.Service, read_deleted="no").\
+                filter(models.Service.host.in_(hosts)).\
+                all()
+
+
 @require_admin_context
 def service_get_all_compute_by_host(context, host):
     result = model_query(context, models.Service, read_deleted="no").\
@@ -507,6 +529,18 @@ def compute_node_get_all(context, session=None):
             all()
 
 
+@require_admin_context
+def compute_node_get_all_since(context, since, session=None):
+    return model_query(context, models.ComputeNode, session=session,
+                       read_deleted="yes").\
+            options(joinedload('service')).\
+            options(joinedload('stats')).\
+            filter(or_(models.ComputeNode.created_at >= since,
+                       models.ComputeNode.updated_at >= since,
+                       models.ComputeNode.deleted_at >= since)).\
+            all()
+
+
 @require_admin_context
 def compute_node_search_by_hypervisor(context, hypervisor_match):
     field = models.ComputeNode.hypervisor_hostname
@@ -1100,6 +1134,36 @@ def fixed_ip_associate_pool(context, network_id, instance_uuid=None,
     return fixed_ip_ref['address']
 
 
+@require_admin_context
+def fixed_ip_associate_if_free(context, address, network_id,
+                               instance_uuid=None, host=None):
+    if instance_uuid and not utils.is_uuid_like(instance_uuid):
+        raise exception.InvalidUUID(uuid=instance_uuid)
+
+    values = {'network_id': network_id,
+              'updated_at': timeutils.utcnow()}
+    if instance_uuid:
+        values['instance_uuid'] = instance_uuid
+    if host:
+        values['host'] = host
+
+    session = get_session()
+    with session.begin():
+        network_or_none = or_(models.FixedIp.network_id == network_id,
+                              models.FixedIp.network_id == None)
+        # NOTE: the conditions are checked again by the update, so it only
+        #       associates the fixed ip if nothing else did in between
+        count = model_query(context, models.FixedIp, session=session,
+                            read_deleted="no").\
+                        filter(network_or_none).\
+                        filter_by(address=address).\
+                        filter_by(reserved=False).\
+                        filter_by(instance_uuid=None).\
+                        filter_by(host=None).\
+                        update(values, synchronize_session=False)
+    return count == 1
+
+
 @require_context
 def fixed_ip_create(context, values):
     fixed_ip_ref = models.FixedIp()
@@ -1192,6 +1256,21 @@ def fixed_ip_get_all(context, session=None):
     return result
 
 
+@require_admin_context
+def fixed_ip_get_free_by_network(context, network_id, limit):
+    network_or_none = or_(models.FixedIp.network_id == network_id,
+                          models.FixedIp.network_id == None)
+    result = model_query(context, models.FixedIp.address,
+                         read_deleted="no").\
+                     filter(network_or_none).\
+                     filter_by(reserved=False).\
+                     filter_by(instance_uuid=None).\
+                     filter_by(host=None).\
+                     limit(limit).\
+                     all()
+    return [row[0] for row in result]
+
+
 @require_context
 def fixed_ip_get_by_address(context, address, session=None):
     result = model_query(context, models.FixedIp, session=session).\
@@ -1503,6 +1582,20 @@ def instance_get_by_uuid(context, uuid, session=None):
     return result
 
 
+@require_context
+def instance_get_all_by_uuids(context, uuids, columns_to_join=None):
+    if not uuids:
+        return []
+    if columns_to_join is None:
+        columns_to_join = ['info_cache', 'security_groups',
+                           'metadata', 'instance_type']
+    query = model_query(context, models.Instance, project_only=True).\
+                filter(models.Instance.uuid.in_(uuids))
+    for column in columns_to_join:
+        query = query.options(joinedload(column))
+    return query.all()
+
+
 @require_context
 def instance_get(context, instance_id, session=None):
     result = _build_instance_get(context, session=session).\
@@ -1536,22 +1629,43 @@ def instance_get_all(context, columns_to_join=None):
     return query.all()
 
 
+def _instance_project_columns(query, columns):
+    """Defers the loading of the instance columns which are not in columns.
+
+    'id' and 'uuid' are always loaded, so 'name' may be listed too.
+    Reading a deferred column from an instance returned by the query
+    loads it with one more query, if its session is still around.
+    """
+    if columns is None:
+        return query
+    keep = set(columns) | set(['id', 'uuid'])
+    for column in class_mapper(models.Instance).columns.keys():
+        if column not in keep:
+            query = query.options(defer(column))
+    return query
+
+
 @require_context
 def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
-                                limit=None, marker=None):
+                                limit=None, marker=None, columns_to_join=None,
+                                columns=None):
     """Return instances that match all filters.  Deleted instances
     will be returned by default, unless there's a filter that says
     otherwise"""
 
     sort_fn = {'desc': desc, 'asc': asc}
 
+    if columns_to_join is None:
+        columns_to_join = ['info_cache', 'security_groups',
+                           'metadata', 'instance_type']
+
     session = get_session()
-    query_prefix = session.query(models.Instance).\
-            options(joinedload('info_cache')).\
-            options(joinedload('security_groups')).\
-            options(joinedload('metadata')).\
-            options(joinedload('instance_type')).\
-            order_by(sort_fn[sort_dir](getattr(models.Instance, sort_key)))
+    query_prefix = session.query(models.Instance)
+    for column in columns_to_join:
+        query_prefix = query_prefix.options(joinedload(column))
+    query_prefix = _instance_project_columns(query_prefix, columns)
+    query_prefix = query_prefix.order_by(
+            sort_fn[sort_dir](getattr(models.Instance, sort_key)))
 
     # Make a copy of the filters dictionary to use going forward, as we'll
     # be modifying it and we shouldn't affect the caller's use of it.
@@ -1640,10 +1754,11 @@ def regex_filter(query, model, filters):
 
 @require_context
 def instance_get_active_by_window(context, begin, end=None,
-                                  project_id=None, host=None):
+                                  project_id=None, host=None, columns=None):
     """Return instances that were active during window."""
     session = get_session()
     query = session.query(models.Instance)
+    query = _instance_project_columns(query, columns)
 
     query = query.filter(or_(models.Instance.terminated_at == None,
                              models.Instance.terminated_at > begin))
@@ -1693,6 +1808,22 @@ def _instance_get_all_query(context, project_only=False):
 def instance_get_all_by_host(context, host):
     return _instance_get_all_query(context).filter_by(host=host).all()
 
+
+@require_admin_context
+def instance_get_all_by_host_oldest_info_cache(context, host, limit=None):
+    cache_time = func.coalesce(models.InstanceInfoCache.updated_at,
+                               models.InstanceInfoCache.created_at)
+    query = _instance_get_all_query(context).\
+                filter_by(host=host).\
+                outerjoin(models.InstanceInfoCache,
+                          models.InstanceInfoCache.instance_uuid ==
+                          models.Instance.uuid).\
+                order_by(asc(cache_time))
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
 @require_admin_context
 def instance_get_all_by_host_and_node(context, host, node):
     return _instance_get_all_query(context).filter_by(host=host).\
@@ -2790,6 +2921,74 @@ def quota_reserve(context, resources, quotas, deltas, expire,
     return reservations
 
 
+class _UsagesNeedRefresh(Exception):
+    pass
+
+
+@require_context
+def quota_reserve_conditional(context, quotas, deltas, expire, max_age):
+    usage = models.QuotaUsage
+
+    # NOTE: each usage is only updated if the delta keeps it within its
+    #       quota, in one statement. If any of them is not, because it is
+    #       over quota, missing, or due for a refresh, quota_reserve()
+    #       sorts it out.
+    conditions = []
+    for resource, delta in deltas.items():
+        if delta < 0:
+            condition = usage.in_use + delta >= 0
+        elif quotas[resource] >= 0:
+            condition = (usage.in_use + usage.reserved + delta <=
+                         quotas[resource])
+        else:
+            condition = usage.in_use >= 0
+        conditions.append(and_(usage.resource == resource,
+                               usage.in_use >= 0, condition))
+
+    values = {'updated_at': timeutils.utcnow()}
+    increments = [(usage.resource == resource, usage.reserved + delta)
+                  for resource, delta in deltas.items() if delta > 0]
+    if increments:
+        values['reserved'] = case(increments, else_=usage.reserved)
+
+    session = get_session()
+    try:
+        with session.begin():
+            query = model_query(context, usage, read_deleted="no",
+                                session=session).\
+                            filter_by(project_id=context.project_id).\
+                            filter_by(until_refresh=None).\
+                            filter(or_(*conditions))
+            if max_age:
+                oldest = timeutils.utcnow() - datetime.timedelta(
+                        seconds=max_age)
+                query = query.filter(usage.updated_at >= oldest)
+            if query.update(values, synchronize_session=False) != len(deltas):
+                raise _UsagesNeedRefresh()
+
+            usage_rows = model_query(context, usage.resource, usage.id,
+                                     read_deleted="no", session=session).\
+                                 filter_by(project_id=context.project_id).\
+                                 filter(usage.resource.in_(deltas.keys())).\
+                                 all()
+            usage_ids = dict(usage_rows)
+
+            reservations = []
+            rows = []
+            for resource, delta in deltas.items():
+                reservations.append(str(utils.gen_uuid()))
+                rows.append(dict(uuid=reservations[-1],
+                                 usage_id=usage_ids[resource],
+                                 project_id=context.project_id,
+                                 resource=resource, delta=delta,
+                                 expire=expire))
+            session.execute(models.Reservation.__table__.insert(), rows)
+    except _UsagesNeedRefresh:
+        return None
+
+    return reservations
+
+
 def _quota_reservations(session, context, reservations):
     """Return the relevant reservations."""
 
@@ -2871,18 +3070,36 @@ def reservation_expire(context):
     session = get_session()
     with session.begin():
         current_time = timeutils.utcnow()
-        results = model_query(context, models.Reservation, session=session,
+        results = model_query(context, models.Reservation.id,
+                              models.Reservation.usage_id,
+                              models.Reservation.delta, session=session,
                               read_deleted="no").\
                           filter(models.Reservation.expire < current_time).\
                           all()
+        if not results:
+            return
 
-        if results:
-            for reservation in results:
-                if reservation.delta >= 0:
-                    reservation.usage.reserved -= reservation.delta
-                    reservation.usage.save(session=session)
-
-                reservation.delete(session=session)
+        # Release what the reservations of each usage reserved at once
+        released = {}
+        for _id, usage_id, delta in results:
+            if delta >= 0:
+                released[usage_id] = released.get(usage_id, 0) + delta
+        for usage_id, delta in released.iteritems():
+            model_query(context, models.QuotaUsage, session=session,
+                        read_deleted="no").\
+                    filter_by(id=usage_id).\
+                    update({'reserved': models.QuotaUsage.reserved - delta,
+                            'updated_at': current_time},
+                           synchronize_session=False)
+
+        reservation_ids = [row[0] for row in results]
+        model_query(context, models.Reservation, session=session,
+                    read_deleted="no").\
+                filter(models.Reservation.id.in_(reservation_ids)).\
+                update({'deleted': True,
+                        'deleted_at': current_time,
+                        'updated_at': current_time},
+                       synchronize_session=False)
 
 
 ###################
@@ -3364,6 +3581,16 @@ def block_device_mapping_get_all_by_instance(context, instance_uuid):
                  all()
 
 
+@require_context
+def block_device_mapping_get_all_by_instances(context, instance_uuids):
+    if not instance_uuids:
+        return []
+    return _block_device_mapping_get_query(context).\
+                 filter(models.BlockDeviceMapping.instance_uuid.in_(
+                        instance_uuids)).\
+                 all()
+
+
 @require_context
 def block_device_mapping_destroy(context, bdm_id):
     session = get_session()
@@ -4668,6 +4895,15 @@ def s3_image_get_by_uuid(context, image_uuid):
     return result
 
 
+def s3_image_get_all_by_uuids(context, image_uuids):
+    """Find the local s3 images represented by the provided uuids"""
+    if not image_uuids:
+        return []
+    return model_query(context, models.S3Image, read_deleted="yes").\
+                 filter(models.S3Image.uuid.in_(image_uuids)).\
+                 all()
+
+
 def s3_image_create(context, image_uuid):
     """Create local s3 image represented by provided uuid"""
     try:
@@ -5192,6 +5428,20 @@ def get_ec2_instance_id_by_uuid(context, instance_id, session=None):
     return result['id']
 
 
+@require_context
+def get_ec2_instance_ids_by_uuids(context, instance_uuids):
+    if not instance_uuids:
+        return {}
+    result = _ec2_instance_get_query(context).\
+                    filter(models.InstanceIdMapping.uuid.in_(instance_uuids)).\
+                    all()
+    # NOTE: the first mapping of a uuid wins, like with .first() above
+    ids = {}
+    for mapping in result:
+        ids.setdefault(mapping['uuid'], mapping['id'])
+    return ids
+
+
 @require_context
 def get_instance_uuid_by_ec2_id(context, ec2_id, session=None):
     result = _ec2_instance_get_query(context,
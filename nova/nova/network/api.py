@@ -25,6 +25,7 @@ from nova import flags
 from nova.network import model as network_model
 from nova.openstack.common import log as logging
 from nova.openstack.common import rpc
+from nova.openstack.common import timeutils
 
 
 FLAGS = flags.FLAGS
@@ -80,6 +81,19 @@ def update_instance_cache_with_nw_info(api, context, instance,
         LOG.debug(_('kwargs: %s') % (kwargs or {}))
 
 
+def refresh_instance_cache(api, context, instance, nw_info):
+    """Store nw_info in the instance's info_cache and mark the cache as
+    refreshed even when nw_info did not change, so that the age of the
+    cache tells when it was last checked.
+    """
+    try:
+        cache = {'network_info': nw_info.json(),
+                 'updated_at': timeutils.utcnow()}
+        api.db.instance_info_cache_update(context, instance['uuid'], cache)
+    except Exception:
+        LOG.exception(_('Failed storing info cache'), instance=instance)
+
+
 class API(base.Base):
     """API for interacting with the network manager."""
 
@@ -293,17 +307,44 @@ class API(base.Base):
 
     def _get_instance_nw_info(self, context, instance):
         """Returns all network info related to an instance."""
-        args = {'instance_id': instance['id'],
-                'instance_uuid': instance['uuid'],
-                'rxtx_factor': instance['instance_type']['rxtx_factor'],
-                'host': instance['host'],
-                'project_id': instance['project_id']}
+        args = self._get_instance_nw_info_args(instance)
         nw_info = rpc.call(context, FLAGS.network_topic,
                            {'method': 'get_instance_nw_info',
                             'args': args})
 
         return network_model.NetworkInfo.hydrate(nw_info)
 
+    def get_instance_nw_info_bulk(self, context, instances):
+        """Returns the network info of many instances, by uuid, with a
+        single call to the network manager, and refreshes their
+        info_cache. Instances whose network info could not be built are
+        left out.
+        """
+        if not instances:
+            return {}
+        args = {'instances': [self._get_instance_nw_info_args(instance)
+                              for instance in instances]}
+        nw_infos = rpc.call(context, FLAGS.network_topic,
+                            {'method': 'get_instance_nw_info_bulk',
+                             'args': args})
+
+        result = {}
+        for instance in instances:
+            nw_info = nw_infos.get(instance['uuid'])
+            if nw_info is None:
+                continue
+            nw_info = network_model.NetworkInfo.hydrate(nw_info)
+            refresh_instance_cache(self, context, instance, nw_info)
+            result[instance['uuid']] = nw_info
+        return result
+
+    def _get_instance_nw_info_args(self, instance):
+        return {'instance_id': instance['id'],
+                'instance_uuid': instance['uuid'],
+                'rxtx_factor': instance['instance_type']['rxtx_factor'],
+                'host': instance['host'],
+                'project_id': instance['project_id']}
+
     def validate_networks(self, context, requested_networks):
         """validate the networks passed at the time of creating
         the server
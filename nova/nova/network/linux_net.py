@@ -23,11 +23,15 @@ import calendar
 import inspect
 import netaddr
 import os
+import time
+
+from eventlet import greenthread
 
 from nova import db
 from nova import exception
 from nova import flags
 from nova.openstack.common import cfg
+from nova.openstack.common import excutils
 from nova.openstack.common import importutils
 from nova.openstack.common import log as logging
 from nova import utils
@@ -83,6 +87,17 @@ linux_net_opts = [
                 default=False,
                 help='Use single default gateway. Only first nic of vm will '
                      'get default gateway from dhcp server'),
+    cfg.FloatOpt('iptables_apply_coalesce_window',
+                 default=0.0,
+                 help='Seconds an iptables apply waits for more changes, so '
+                      'that the changes made meanwhile are applied together. '
+                      '0 applies right away'),
+    cfg.IntOpt('iptables_full_apply_interval',
+               default=300,
+               help='Seconds after which an iptables apply reads and '
+                    'restores every table, not only the ones nova changed, '
+                    'so rules changed or flushed outside of nova are put '
+                    'back. 0 only applies the changed tables'),
     ]
 
 FLAGS = flags.FLAGS
@@ -123,6 +138,9 @@ class IptablesRule(object):
     def __ne__(self, other):
         return not self == other
 
+    def __hash__(self):
+        return hash((self.chain, self.rule, self.top, self.wrap))
+
     def __str__(self):
         if self.wrap:
             chain = '%s-%s' % (binary_name, self.chain)
@@ -141,6 +159,8 @@ class IptablesTable(object):
         self.chains = set()
         self.unwrapped_chains = set()
         self.remove_chains = set()
+        # whether the table changed since it was last applied
+        self.dirty = True
 
     def add_chain(self, name, wrap=True):
         """Adds a named chain to the table.
@@ -158,6 +178,7 @@ class IptablesTable(object):
             self.chains.add(name)
         else:
             self.unwrapped_chains.add(name)
+        self.dirty = True
 
     def remove_chain(self, name, wrap=True):
         """Remove named chain.
@@ -178,6 +199,7 @@ class IptablesTable(object):
                      name)
             return
 
+        self.dirty = True
         # non-wrapped chains and rules need to be dealt with specially,
         # so we keep a list of them to be iterated over in apply()
         if not wrap:
@@ -215,6 +237,7 @@ class IptablesTable(object):
             rule = ' '.join(map(self._wrap_target_chain, rule.split(' ')))
 
         self.rules.append(IptablesRule(chain, rule, wrap, top))
+        self.dirty = True
 
     def _wrap_target_chain(self, s):
         if s.startswith('$'):
@@ -233,6 +256,7 @@ class IptablesTable(object):
             self.rules.remove(IptablesRule(chain, rule, wrap, top))
             if not wrap:
                 self.remove_rules.append(IptablesRule(chain, rule, wrap, top))
+            self.dirty = True
         except ValueError:
             LOG.warn(_('Tried to remove rule that was not there:'
                        ' %(chain)r %(rule)r %(wrap)r %(top)r'),
@@ -241,10 +265,9 @@ class IptablesTable(object):
 
     def empty_chain(self, chain, wrap=True):
         """Remove all rules from a chain."""
-        chained_rules = [rule for rule in self.rules
-                              if rule.chain == chain and rule.wrap == wrap]
-        for rule in chained_rules:
-            self.rules.remove(rule)
+        self.rules = [rule for rule in self.rules
+                      if rule.chain != chain or rule.wrap != wrap]
+        self.dirty = True
 
 
 class IptablesManager(object):
@@ -281,6 +304,8 @@ class IptablesManager(object):
         self.ipv6 = {'filter': IptablesTable()}
 
         self.iptables_apply_deferred = False
+        # time of the last apply of all the tables, see _apply()
+        self._last_full_apply = 0
 
         # Add a nova-filter-top chain. It's intended to be shared
         # among the various nova components. It sits at the very top
@@ -342,6 +367,11 @@ class IptablesManager(object):
         if self.iptables_apply_deferred:
             return
 
+        if FLAGS.iptables_apply_coalesce_window:
+            # Let the other greenthreads changing rules catch up, the first
+            # one to get the lock then applies all the changes and the
+            # tables are no longer dirty for the others.
+            greenthread.sleep(FLAGS.iptables_apply_coalesce_window)
         self._apply()
 
     @utils.synchronized('iptables', external=True)
@@ -352,24 +382,58 @@ class IptablesManager(object):
         same component of Nova, and replace them with our current set of
         rules. This happens atomically, thanks to iptables-restore.
 
+        Tables which did not change since they were last applied are
+        skipped, except every iptables_full_apply_interval seconds, as are
+        the tables whose current rules already are the ones we want.
+
         """
+        start = time.time()
+        full = (FLAGS.iptables_full_apply_interval > 0 and
+                start - self._last_full_apply >=
+                FLAGS.iptables_full_apply_interval)
+        if full:
+            self._last_full_apply = start
+        stats = {'tables': 0, 'skipped': 0, 'unchanged': 0, 'lines': 0,
+                 'full': full}
         s = [('iptables', self.ipv4)]
         if FLAGS.use_ipv6:
             s += [('ip6tables', self.ipv6)]
 
         for cmd, tables in s:
             for table in tables:
+                if not tables[table].dirty and not full:
+                    stats['skipped'] += 1
+                    continue
                 current_table, _err = self.execute('%s-save' % (cmd,), '-c',
                                                    '-t', '%s' % (table,),
                                                    run_as_root=True,
                                                    attempts=5)
                 current_lines = current_table.split('\n')
-                new_filter = self._modify_rules(current_lines,
-                                                tables[table])
-                self.execute('%s-restore' % (cmd,), '-c', run_as_root=True,
-                             process_input='\n'.join(new_filter),
-                             attempts=5)
-        LOG.debug(_("IPTablesManager.apply completed with success"))
+                # NOTE: changes made from here on are applied by the next
+                # apply, there is no yielding before the rules are read
+                tables[table].dirty = False
+                try:
+                    new_filter = self._modify_rules(current_lines,
+                                                    tables[table])
+                    stats['tables'] += 1
+                    if (map(_strip_packet_counts, new_filter) ==
+                        map(_strip_packet_counts, current_lines)):
+                        stats['unchanged'] += 1
+                        continue
+                    self.execute('%s-restore' % (cmd,), '-c',
+                                 run_as_root=True,
+                                 process_input='\n'.join(new_filter),
+                                 attempts=5)
+                except Exception:
+                    with excutils.save_and_reraise_exception():
+                        tables[table].dirty = True
+                stats['lines'] += len(new_filter)
+        stats['time'] = time.time() - start
+        self._last_apply = stats
+        LOG.debug(_("IPTablesManager.apply completed with success: "
+                    "%(tables)d tables read, %(unchanged)d already up to "
+                    "date, %(skipped)d unchanged since the last apply, "
+                    "%(lines)d lines restored in %(time).3f seconds") % stats)
 
     def _modify_rules(self, current_lines, table, binary=None):
         unwrapped_chains = table.unwrapped_chains
@@ -379,8 +443,8 @@ class IptablesManager(object):
         remove_rules = table.remove_rules
 
         # Remove any trace of our rules
-        new_filter = filter(lambda line: binary_name not in line,
-                            current_lines)
+        new_filter = [line for line in current_lines
+                      if binary_name not in line]
 
         seen_chains = False
         rules_index = 0
@@ -392,41 +456,32 @@ class IptablesManager(object):
                 if not rule.startswith(':'):
                     break
 
+        # rule.top == True means we want this rule to be at the top. The
+        # current lines of the top rules are moved up rather than replaced,
+        # so that their [packet:byte] counts are kept.
+        top_rules = set(_strip_packet_counts(str(rule))
+                        for rule in rules if rule.top)
+        current_top_lines = {}
+        if top_rules:
+            kept = []
+            for line in new_filter:
+                key = _strip_packet_counts(line)
+                if key in top_rules:
+                    # grab the last entry, if there is more than one
+                    current_top_lines[key] = line
+                else:
+                    kept.append(line)
+            new_filter = kept
+
         our_rules = []
         bot_rules = []
         for rule in rules:
             rule_str = str(rule)
             if rule.top:
-                # rule.top == True means we want this rule to be at the top.
-                # Further down, we weed out duplicates from the bottom of the
-                # list, so here we remove the dupes ahead of time.
-
-                # We don't want to remove an entry if it has non-zero
-                # [packet:byte] counts and replace it with [0:0], so let's
-                # go look for a duplicate, and over-ride our table rule if
-                # found.
-
-                # ignore [packet:byte] counts at beginning of line
-                if rule_str.startswith('['):
-                    rule_str = rule_str.split(']', 1)[1]
-                dup_filter = filter(lambda s: rule_str.strip() in s.strip(),
-                                    new_filter)
-
-                new_filter = filter(lambda s:
-                                    rule_str.strip() not in s.strip(),
-                                    new_filter)
-                # if no duplicates, use original rule
-                if dup_filter:
-                    # grab the last entry, if there is one
-                    dup = dup_filter[-1]
-                    rule_str = str(dup)
-                else:
-                    rule_str = str(rule)
-                rule_str.strip()
-
-                our_rules += [rule_str]
+                our_rules.append(current_top_lines.get(
+                        _strip_packet_counts(rule_str), rule_str))
             else:
-                bot_rules += [rule_str]
+                bot_rules.append(rule_str)
 
         our_rules += bot_rules
 
@@ -438,62 +493,51 @@ class IptablesManager(object):
                                                (binary_name, name,)
                                                for name in chains]
 
-        seen_lines = set()
+        # NOTE: removals are counted, every remove rule removes one line
+        remove_counts = {}
+        for rule in remove_rules:
+            key = _strip_packet_counts(str(rule))
+            remove_counts[key] = remove_counts.get(key, 0) + 1
 
-        def _weed_out_duplicates(line):
-            # ignore [packet:byte] counts at beginning of lines
-            if line.startswith('['):
-                line = line.split(']', 1)[1]
-            line = line.strip()
-            if line in seen_lines:
-                return False
-            else:
-                seen_lines.add(line)
-                return True
+        # We filter duplicates, letting the *last* occurrence take
+        # precendence.  We also filter out anything in the "remove"
+        # lists.
+        seen_lines = set()
+        kept = []
+        for line in reversed(new_filter):
+            key = _strip_packet_counts(line)
+            if key in seen_lines:
+                continue
+            seen_lines.add(key)
 
-        def _weed_out_removes(line):
             # We need to find exact matches here
             if line.startswith(':'):
                 # it's a chain, for example, ":nova-billing - [0:0]"
                 # strip off everything except the chain name
-                line = line.split(':')[1]
-                line = line.split('- [')[0]
-                line = line.strip()
-                for chain in remove_chains:
-                    if chain == line:
-                        remove_chains.remove(chain)
-                        return False
-            elif line.startswith('['):
-                # it's a rule
-                # ignore [packet:byte] counts at beginning of lines
-                line = line.split(']', 1)[1]
-                line = line.strip()
-                for rule in remove_rules:
-                    # ignore [packet:byte] counts at beginning of rules
-                    rule_str = str(rule)
-                    rule_str = rule_str.split(' ', 1)[1]
-                    rule_str = rule_str.strip()
-                    if rule_str == line:
-                        remove_rules.remove(rule)
-                        return False
+                chain = line.split(':')[1].split('- [')[0].strip()
+                if chain in remove_chains:
+                    remove_chains.remove(chain)
+                    continue
+            elif line.startswith('[') and remove_counts.get(key):
+                remove_counts[key] -= 1
+                continue
 
             # Leave it alone
-            return True
-
-        # We filter duplicates, letting the *last* occurrence take
-        # precendence.  We also filter out anything in the "remove"
-        # lists.
-        new_filter.reverse()
-        new_filter = filter(_weed_out_duplicates, new_filter)
-        new_filter = filter(_weed_out_removes, new_filter)
-        new_filter.reverse()
+            kept.append(line)
+        kept.reverse()
 
         # flush lists, just in case we didn't find something
         remove_chains.clear()
-        for rule in remove_rules:
-            remove_rules.remove(rule)
+        del remove_rules[:]
+
+        return kept
+
 
-        return new_filter
+def _strip_packet_counts(line):
+    """An iptables-save line without its [packet:byte] counts."""
+    if line.startswith('['):
+        line = line.split(']', 1)[1]
+    return line.strip()
 
 
 # NOTE(jkoelker) This is just a nice little stub point since mocking
@@ -47,6 +47,7 @@ import datetime
 import functools
 import itertools
 import math
+import random
 import re
 import socket
 
@@ -156,7 +157,12 @@ network_opts = [
                help='domain to use for building the hostnames'),
     cfg.StrOpt('l3_lib',
                default='nova.network.l3.LinuxNetL3',
-               help="Indicates underlying L3 management library")
+               help="Indicates underlying L3 management library"),
+    cfg.IntOpt('fixed_ip_pool_size',
+               default=0,
+               help='Number of free fixed ips of a network to look up at '
+                    'once and allocate from without locking them, 0 to '
+                    'lock the free fixed ip allocated instead'),
     ]
 
 
@@ -803,6 +809,8 @@ class NetworkManager(manager.SchedulerDependentManager):
             self._import_ipam_lib('nova.network.nova_ipam_lib')
         l3_lib = kwargs.get("l3_lib", FLAGS.l3_lib)
         self.l3driver = importutils.import_object(l3_lib)
+        # network id --> addresses of fixed ips which were free
+        self._free_fixed_ips = {}
 
         super(NetworkManager, self).__init__(service_name='network',
                                                 *args, **kwargs)
@@ -810,6 +818,38 @@ class NetworkManager(manager.SchedulerDependentManager):
     def _import_ipam_lib(self, ipam_lib):
         self.ipam = importutils.import_module(ipam_lib).get_ipam_lib(self)
 
+    def _associate_free_fixed_ip(self, context, network_id,
+                                 instance_uuid=None, host=None):
+        """Associates a free fixed ip of a network to an instance or host.
+
+        With fixed_ip_pool_size set, the free fixed ips of the network are
+        looked up in batches and associated only if they are still free,
+        instead of locking one. Concurrent allocations then only collide
+        when they try the same address, and the loser tries the next one.
+        """
+        if not FLAGS.fixed_ip_pool_size:
+            return self.db.fixed_ip_associate_pool(context, network_id,
+                                                   instance_uuid, host)
+
+        free = self._free_fixed_ips.setdefault(network_id, [])
+        while True:
+            if not free:
+                addresses = self.db.fixed_ip_get_free_by_network(context,
+                        network_id, FLAGS.fixed_ip_pool_size)
+                if not addresses:
+                    raise exception.NoMoreFixedIps()
+                # NOTE: the other network hosts look up the same addresses,
+                #       so they try them in another order
+                random.shuffle(addresses)
+                free.extend(addresses)
+            address = free.pop()
+            if self.db.fixed_ip_associate_if_free(context, address,
+                                                  network_id, instance_uuid,
+                                                  host):
+                return address
+            LOG.debug(_("Fixed ip %(address)s was allocated concurrently, "
+                        "trying another one"), locals())
+
     @utils.synchronized('get_dhcp')
     def _get_dhcp_ip(self, context, network_ref, host=None):
         """Get the proper dhcp address to listen on."""
@@ -827,9 +867,8 @@ class NetworkManager(manager.SchedulerDependentManager):
             return fip['address']
         except exception.FixedIpNotFoundForNetworkHost:
             elevated = context.elevated()
-            return self.db.fixed_ip_associate_pool(elevated,
-                                                   network_id,
-                                                   host=host)
+            return self._associate_free_fixed_ip(elevated, network_id,
+                                                 host=host)
 
     def get_dhcp_leases(self, ctxt, network_ref):
         """Broker the request to the driver to fetch the dhcp leases"""
@@ -1043,6 +1082,26 @@ class NetworkManager(manager.SchedulerDependentManager):
                                                          rxtx_factor, host)
         return nw_info
 
+    @wrap_check_policy
+    def get_instance_nw_info_bulk(self, context, instances):
+        """Creates the network info lists of many instances.
+
+        called by network_api
+        :param instances: list of dicts of get_instance_nw_info() args
+        :returns: dict of instance uuid to network info list, the
+                  instances whose network info could not be built are
+                  left out
+        """
+        nw_infos = {}
+        for args in instances:
+            try:
+                nw_infos[args['instance_uuid']] = \
+                        self.get_instance_nw_info(context, **args)
+            except Exception:
+                LOG.exception(_("Failed to get nw_info for instance "
+                                "%(instance_uuid)s") % args)
+        return nw_infos
+
     def build_network_info_model(self, context, vifs, networks,
                                  rxtx_factor, instance_host):
         """Builds a NetworkInfo object containing all network information
@@ -1260,9 +1319,9 @@ class NetworkManager(manager.SchedulerDependentManager):
                                                      instance_ref['uuid'],
                                                      network['id'])
             else:
-                address = self.db.fixed_ip_associate_pool(context.elevated(),
-                                                          network['id'],
-                                                          instance_ref['uuid'])
+                address = self._associate_free_fixed_ip(context.elevated(),
+                                                        network['id'],
+                                                        instance_ref['uuid'])
             self._do_trigger_security_group_members_refresh_for_instance(
                                                                    instance_id)
             get_vif = self.db.virtual_interface_get_by_instance_and_network
@@ -1985,9 +2044,9 @@ class VlanManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
                                                      instance['uuid'],
                                                      network['id'])
             else:
-                address = self.db.fixed_ip_associate_pool(context,
-                                                          network['id'],
-                                                          instance['uuid'])
+                address = self._associate_free_fixed_ip(context,
+                                                        network['id'],
+                                                        instance['uuid'])
             self._do_trigger_security_group_members_refresh_for_instance(
                                                                    instance_id)
 
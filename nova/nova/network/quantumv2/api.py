@@ -20,6 +20,7 @@ from nova.db import base
 from nova import exception
 from nova import flags
 from nova.network.api import refresh_cache
+from nova.network.api import refresh_instance_cache
 from nova.network import model as network_model
 from nova.network import quantumv2
 from nova.openstack.common import cfg
@@ -173,6 +174,22 @@ class API(base.Base):
     def get_instance_nw_info(self, context, instance, networks=None):
         return self._get_instance_nw_info(context, instance, networks)
 
+    def get_instance_nw_info_bulk(self, context, instances):
+        """Returns the network info of many instances, by uuid, and
+        refreshes their info_cache. Quantum has no bulk call, the
+        instances are looked up one at a time.
+        """
+        result = {}
+        for instance in instances:
+            try:
+                nw_info = self._get_instance_nw_info(context, instance)
+            except Exception:
+                LOG.exception(_('Failed to get nw_info'), instance=instance)
+                continue
+            refresh_instance_cache(self, context, instance, nw_info)
+            result[instance['uuid']] = nw_info
+        return result
+
     def _get_instance_nw_info(self, context, instance, networks=None):
         LOG.debug(_('get_instance_nw_info() for %s'),
                   instance['display_name'])
@@ -83,12 +83,30 @@ quota_opts = [
     cfg.StrOpt('quota_driver',
                default='nova.quota.DbQuotaDriver',
                help='default driver to use for quota checks'),
+    cfg.IntOpt('quota_cache_expiration',
+               default=0,
+               help='number of seconds the quotas of projects and quota '
+                    'classes are cached for quota checks, 0 to not cache '
+                    'them'),
+    cfg.BoolOpt('quota_conditional_reserve',
+                default=False,
+                help='reserve with a single conditional update of the '
+                     'usages when they do not need a refresh, instead of '
+                     'locking them'),
     ]
 
 FLAGS = flags.FLAGS
 FLAGS.register_opts(quota_opts)
 
 
+def _project_key(project_id):
+    return 'quotas-project-%s' % project_id
+
+
+def _class_key(quota_class):
+    return 'quotas-class-%s' % quota_class
+
+
 class DbQuotaDriver(object):
     """
     Driver to perform necessary checks to enforce quotas and obtain
@@ -96,6 +114,28 @@ class DbQuotaDriver(object):
     database.
     """
 
+    def __init__(self):
+        self._cache = None
+
+    def _get_cache(self):
+        if self._cache is None:
+            if FLAGS.memcached_servers:
+                import memcache
+            else:
+                from nova.common import memorycache as memcache
+            self._cache = memcache.Client(FLAGS.memcached_servers, debug=0)
+        return self._cache
+
+    def _get_cached(self, key, fetch):
+        """Returns the quotas cached under key, or caches them."""
+
+        cache = self._get_cache()
+        quotas = cache.get(key)
+        if quotas is None:
+            quotas = fetch()
+            cache.set(key, quotas, FLAGS.quota_cache_expiration)
+        return quotas
+
     def get_by_project(self, context, project_id, resource):
         """Get a specific quota by project."""
 
@@ -234,12 +274,28 @@ class DbQuotaDriver(object):
             unknown = desired - set(sub_resources.keys())
             raise exception.QuotaResourceUnknown(unknown=sorted(unknown))
 
-        # Grab and return the quotas (without usages)
-        quotas = self.get_project_quotas(context, sub_resources,
-                                         context.project_id,
-                                         context.quota_class, usages=False)
+        if not FLAGS.quota_cache_expiration:
+            # Grab and return the quotas (without usages)
+            quotas = self.get_project_quotas(context, sub_resources,
+                                             context.project_id,
+                                             context.quota_class,
+                                             usages=False)
 
-        return dict((k, v['limit']) for k, v in quotas.items())
+            return dict((k, v['limit']) for k, v in quotas.items())
+
+        project_id = context.project_id
+        project_quotas = self._get_cached(_project_key(project_id),
+                lambda: db.quota_get_all_by_project(context, project_id))
+        class_quotas = {}
+        if context.quota_class:
+            quota_class = context.quota_class
+            class_quotas = self._get_cached(_class_key(quota_class),
+                    lambda: db.quota_class_get_all_by_name(context,
+                                                           quota_class))
+
+        return dict((k, project_quotas.get(k, class_quotas.get(k,
+                                                               v.default)))
+                    for k, v in sub_resources.items())
 
     def limit_check(self, context, resources, values):
         """Check simple quota limits.
@@ -334,6 +390,13 @@ class DbQuotaDriver(object):
         #            which means access to the session.  Since the
         #            session isn't available outside the DBAPI, we
         #            have to do the work there.
+        if FLAGS.quota_conditional_reserve:
+            reservations = db.quota_reserve_conditional(context, quotas,
+                                                        deltas, expire,
+                                                        FLAGS.max_age)
+            if reservations is not None:
+                return reservations
+
         return db.quota_reserve(context, resources, quotas, deltas, expire,
                                 FLAGS.until_refresh, FLAGS.max_age)
 
@@ -367,6 +430,23 @@ class DbQuotaDriver(object):
         """
 
         db.quota_destroy_all_by_project(context, project_id)
+        self.invalidate(context, project_id=project_id)
+
+    def invalidate(self, context, project_id=None, quota_class=None):
+        """
+        Drop the cached quotas of a project or of a quota class, after
+        they were changed.
+
+        :param context: The request context, for access checks.
+        :param project_id: The ID of the project whose quotas changed.
+        :param quota_class: The name of the quota class whose quotas
+                            changed.
+        """
+
+        if project_id:
+            self._get_cache().delete(_project_key(project_id))
+        if quota_class:
+            self._get_cache().delete(_class_key(quota_class))
 
     def expire(self, context):
         """Expire reservations.
@@ -745,6 +825,20 @@ class QuotaEngine(object):
 
         self._driver.destroy_all_by_project(context, project_id)
 
+    def invalidate(self, context, project_id=None, quota_class=None):
+        """
+        Drop the cached quotas of a project or of a quota class, after
+        they were changed.
+
+        :param context: The request context, for access checks.
+        :param project_id: The ID of the project whose quotas changed.
+        :param quota_class: The name of the quota class whose quotas
+                            changed.
+        """
+
+        self._driver.invalidate(context, project_id=project_id,
+                                quota_class=quota_class)
+
     def expire(self, context):
         """Expire reservations.
 
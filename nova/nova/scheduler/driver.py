@@ -196,8 +196,9 @@ class Scheduler(object):
 
         services = db.service_get_all_by_topic(context, topic)
         return [service['host']
-                for service in services
-                if utils.service_is_up(service)]
+                for service, is_up in zip(services,
+                                          utils.services_are_up(services))
+                if is_up]
 
     def schedule_prep_resize(self, context, image, request_spec,
                              filter_properties, instance, instance_type,
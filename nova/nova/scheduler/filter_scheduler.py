@@ -24,6 +24,7 @@ import pdb
 
 from nova import exception
 from nova import flags
+from nova.openstack.common import cfg
 from nova.openstack.common import importutils
 from nova.openstack.common import log as logging
 from nova.openstack.common.notifier import api as notifier
@@ -32,7 +33,18 @@ from nova.scheduler import least_cost
 from nova.scheduler import scheduler_options
 
 
+filter_scheduler_opts = [
+    cfg.BoolOpt('scheduler_use_host_table',
+                default=False,
+                help='Filter and weigh the hosts once per request instead '
+                     'of once per instance, over host columns. Chooses '
+                     'the same hosts as long as the filters and cost '
+                     'functions only depend on the host state and the '
+                     'request.'),
+    ]
+
 FLAGS = flags.FLAGS
+FLAGS.register_opts(filter_scheduler_opts)
 LOG = logging.getLogger(__name__)
 
 
@@ -278,6 +290,23 @@ class FilterScheduler(driver.Scheduler):
             num_instances = len(instance_uuids)
         else:
             num_instances = request_spec.get('num_instances', 1)
+
+        if FLAGS.scheduler_use_host_table:
+            table = self.host_manager.get_host_table(hosts,
+                    filter_properties, cost_functions)
+            for num in xrange(num_instances):
+                weighted_host = table.get_best_host()
+                if weighted_host is None:
+                    break
+                LOG.debug(_("Weighted %(weighted_host)s") % locals())
+                selected_hosts.append(weighted_host)
+                weighted_host.host_state.consume_from_instance(
+                        instance_properties)
+                table.update(weighted_host.host_state)
+
+            selected_hosts.sort(key=operator.attrgetter('weight'))
+            return selected_hosts
+
         for num in xrange(num_instances):
             # Filter local hosts based on requirements ...
             hosts = self.host_manager.filter_hosts(hosts,
@@ -17,8 +17,8 @@
 Manage hosts in the current zone.
 """
 
+import datetime
 import UserDict
-import pdb
 
 from nova import db
 from nova import exception
@@ -27,6 +27,8 @@ from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
 from nova.scheduler import filters
+from nova.scheduler import host_table
+from nova import utils
 
 host_manager_opts = [
     cfg.MultiStrOpt('scheduler_available_filters',
@@ -46,6 +48,21 @@ host_manager_opts = [
                   ],
                 help='Which filter class names to use for filtering hosts '
                       'when not specified in the request.'),
+    cfg.IntOpt('scheduler_host_state_refresh_interval',
+               default=10,
+               help='Seconds between incremental refreshes of the cached '
+                    'host states from the compute nodes and services '
+                    'changed since the last one. 0 refreshes on every '
+                    'request.'),
+    cfg.IntOpt('scheduler_host_state_full_refresh_interval',
+               default=600,
+               help='Seconds between full reloads of the cached host '
+                    'states.'),
+    cfg.IntOpt('scheduler_claim_timeout',
+               default=300,
+               help='Seconds a resource claim of the scheduler is applied '
+                    'to a host state whose compute node has not reported '
+                    'since.'),
     ]
 
 FLAGS = flags.FLAGS
@@ -98,13 +115,7 @@ class HostState(object):
         self.nodename = node
 
         # Read-only capability dicts
-
-        if capabilities is None:
-            capabilities = {}
-        self.capabilities = ReadOnlyDict(capabilities.get(topic, None))
-        if service is None:
-            service = {}
-        self.service = ReadOnlyDict(service)
+        self.update_capabilities(capabilities, service)
         # Mutable available resources.
         # These will change as resources are virtually "consumed".
         self.total_usable_disk_gb = 0
@@ -117,6 +128,21 @@ class HostState(object):
         # Resource oversubscription values for the compute host:
         self.limits = {}
 
+        # Resources consumed by the scheduler which the compute node
+        # record may not reflect yet: [(time, ram_mb, disk_mb, vcpus)]
+        self.claims = []
+        # When the compute node record was last written
+        self.updated_at = None
+
+    def update_capabilities(self, capabilities=None, service=None):
+        """Update the capabilities and the service record of the host."""
+        if capabilities is None:
+            capabilities = {}
+        self.capabilities = ReadOnlyDict(capabilities.get(self.topic, None))
+        if service is None:
+            service = {}
+        self.service = ReadOnlyDict(service)
+
     def update_from_compute_node(self, compute):
         """Update information about a host from its compute_node info."""
         all_ram_mb = compute['memory_mb']
@@ -136,15 +162,38 @@ class HostState(object):
         self.vcpus_total = compute['vcpus']
         self.vcpus_used = compute['vcpus_used']
 
+        self.updated_at = (compute.get('updated_at') or
+                           compute.get('created_at'))
+        self._apply_claims()
+
     def consume_from_instance(self, instance):
         """Incrementally update host state from an instance"""
         disk_mb = (instance['root_gb'] + instance['ephemeral_gb']) * 1024
         ram_mb = instance['memory_mb']
         vcpus = instance['vcpus']
+        self._consume(ram_mb, disk_mb, vcpus)
+        self.claims.append((timeutils.utcnow(), ram_mb, disk_mb, vcpus))
+
+    def _consume(self, ram_mb, disk_mb, vcpus):
         self.free_ram_mb -= ram_mb
         self.free_disk_mb -= disk_mb
         self.vcpus_used += vcpus
 
+    def _apply_claims(self):
+        """Apply again the claims the compute node record does not
+        account for: the ones made after it was written, and not older
+        than scheduler_claim_timeout.
+        """
+        if not self.claims:
+            return
+        cutoff = timeutils.utcnow() - datetime.timedelta(
+                seconds=FLAGS.scheduler_claim_timeout)
+        if self.updated_at is not None and self.updated_at > cutoff:
+            cutoff = self.updated_at
+        self.claims = [claim for claim in self.claims if claim[0] > cutoff]
+        for _claimed_at, ram_mb, disk_mb, vcpus in self.claims:
+            self._consume(ram_mb, disk_mb, vcpus)
+
     def passes_filters(self, filter_fns, filter_properties):
         """Return whether or not this host passes filters."""
 
@@ -182,10 +231,23 @@ class HostManager(object):
     # Can be overridden in a subclass
     host_state_cls = HostState
 
+    # Seconds of clock skew between the hosts writing updated_at
+    refresh_margin = 5
+
     def __init__(self):
         self.service_states = {}  # { <host> : { <service> : { cap k : v }}}
         self.filter_classes = filters.get_filter_classes(
                 FLAGS.scheduler_available_filters)
+        # Cached compute host states, kept up to date incrementally
+        self.host_state_map = {}  # { <host> : HostState }
+        self.compute_hosts = {}  # { <compute node id> : <host> }
+        # Newest created_at/updated_at/deleted_at seen in the db
+        self.last_change = None
+        self.last_refresh = None
+        self.last_full_refresh = None
+        self.full_refreshes = 0
+        self.incremental_refreshes = 0
+        self.rows_read = 0
 
     def _choose_host_filters(self, filters):
         """Since the caller may specify which filters to use we need
@@ -227,6 +289,15 @@ class HostManager(object):
                 filtered_hosts.append(host)
         return filtered_hosts
 
+    def get_host_table(self, hosts, filter_properties, weighted_fns,
+                       filters=None):
+        """Returns a HostTable of the hosts, to filter and weigh them
+        for several instances at once.
+        """
+        filter_fns = self._choose_host_filters(filters)
+        return host_table.HostTable(hosts, filter_fns, weighted_fns,
+                                    filter_properties)
+
     def update_service_capabilities(self, service_name, host, capabilities):
         """Update the per-service capabilities based on this notification."""
         LOG.debug(_("Received %(service_name)s service update from "
@@ -238,6 +309,11 @@ class HostManager(object):
         service_caps[service_name] = capab_copy
         self.service_states[host] = service_caps
 
+        host_state = self.host_state_map.get(host)
+        if host_state is not None and service_name == host_state.topic:
+            host_state.update_capabilities(service_caps,
+                                           dict(host_state.service))
+
     def get_all_host_states(self, context, topic):
         """Returns a dict of all the hosts the HostManager
         knows about. Also, each of the consumable resources in HostState
@@ -246,7 +322,13 @@ class HostManager(object):
         For example:
         {'192.168.1.100': HostState(), ...}
 
-        Note: this can be very slow with a lot of instances.
+        The host states are cached: they are reloaded every
+        scheduler_host_state_full_refresh_interval seconds, and only the
+        compute nodes and services changed since the last refresh are
+        read every scheduler_host_state_refresh_interval seconds. The
+        resources consumed by the scheduler are kept as claims until the
+        compute node reports them.
+
         InstanceType table isn't required since a copy is stored
         with the instance (in case the InstanceType changed since the
         instance was created)."""
@@ -255,21 +337,121 @@ class HostManager(object):
             raise NotImplementedError(_(
                 "host_manager only implemented for 'compute'"))
 
+        if (self.last_full_refresh is None or
+            timeutils.is_older_than(self.last_full_refresh,
+                    FLAGS.scheduler_host_state_full_refresh_interval)):
+            self._full_refresh(context, topic)
+        elif timeutils.is_older_than(self.last_refresh,
+                FLAGS.scheduler_host_state_refresh_interval):
+            self._incremental_refresh(context, topic)
+
+        # A copy, the cache may be refreshed while the caller iterates
+        return dict(self.host_state_map)
+
+    def get_host_state_stats(self):
+        """Returns how fresh the cached host states are."""
+        now = timeutils.utcnow()
+
+        def age(t):
+            if t is None:
+                return None
+            return utils.total_seconds(now - t)
+
+        updates = [host_state.updated_at
+                   for host_state in self.host_state_map.itervalues()
+                   if host_state.updated_at is not None]
+        return {'hosts': len(self.host_state_map),
+                'claims': sum(len(host_state.claims) for host_state
+                              in self.host_state_map.itervalues()),
+                'refresh_age': age(self.last_refresh),
+                'full_refresh_age': age(self.last_full_refresh),
+                'oldest_compute_update_age': age(min(updates)
+                                                 if updates else None),
+                'full_refreshes': self.full_refreshes,
+                'incremental_refreshes': self.incremental_refreshes,
+                'rows_read': self.rows_read}
+
+    def _full_refresh(self, context, topic):
+        """Reload every host state, keeping the claims."""
+        now = timeutils.utcnow()
         host_state_map = {}
+        self.compute_hosts = {}
 
         # Get resource usage across the available compute nodes:
         compute_nodes = db.compute_node_get_all(context)
         for compute in compute_nodes:
-            service = compute['service']
-            if not service:
-                LOG.warn(_("No service for compute ID %s") % compute['id'])
+            self._update_compute_node(host_state_map, compute, topic)
+
+        self.host_state_map = host_state_map
+        self.last_full_refresh = self.last_refresh = now
+        self.full_refreshes += 1
+        self.rows_read += len(compute_nodes)
+        LOG.debug(_("Loaded %(count)d host states") %
+                  {'count': len(host_state_map)})
+
+    def _incremental_refresh(self, context, topic):
+        """Read the compute nodes and services changed since the last
+        refresh.
+        """
+        now = timeutils.utcnow()
+        # Nothing seen yet (no compute node registered at the last
+        # refresh): everything changed since that refresh
+        since = self.last_change or self.last_refresh
+        since -= datetime.timedelta(seconds=self.refresh_margin)
+
+        compute_nodes = db.compute_node_get_all_since(context, since)
+        for compute in compute_nodes:
+            if compute.get('deleted'):
+                host = self.compute_hosts.pop(compute['id'], None)
+                self.host_state_map.pop(host, None)
+                self._note_change(compute)
+                continue
+            self._update_compute_node(self.host_state_map, compute, topic)
+
+        services = db.service_get_all_by_topic_since(context, topic, since)
+        for service in services:
+            self._note_change(service)
+            host_state = self.host_state_map.get(service['host'])
+            if host_state is None:
                 continue
-            host = service['host']
-            capabilities = self.service_states.get(host, None)
+            if service.get('deleted'):
+                del self.host_state_map[service['host']]
+                continue
+            host_state.update_capabilities(
+                    self.service_states.get(service['host'], None),
+                    dict(service.iteritems()))
+
+        self.last_refresh = now
+        self.incremental_refreshes += 1
+        self.rows_read += len(compute_nodes) + len(services)
+        LOG.debug(_("Refreshed host states: %(nodes)d compute nodes and "
+                    "%(services)d services changed") %
+                  {'nodes': len(compute_nodes), 'services': len(services)})
+
+    def _update_compute_node(self, host_state_map, compute, topic):
+        service = compute['service']
+        if not service:
+            LOG.warn(_("No service for compute ID %s") % compute['id'])
+            return
+        host = service['host']
+        capabilities = self.service_states.get(host, None)
+        host_state = self.host_state_map.get(host)
+        if host_state is None:
             host_state = self.host_state_cls(host, topic,
                     capabilities=capabilities,
                     service=dict(service.iteritems()))
-            host_state.update_from_compute_node(compute)
-            host_state_map[host] = host_state
-
-        return host_state_map
+        else:
+            host_state.update_capabilities(capabilities,
+                                           dict(service.iteritems()))
+        host_state.update_from_compute_node(compute)
+        host_state_map[host] = host_state
+        self.compute_hosts[compute['id']] = host
+        self._note_change(compute)
+        self._note_change(service)
+
+    def _note_change(self, record):
+        for key in ('created_at', 'updated_at', 'deleted_at'):
+            t = record.get(key)
+            if t is not None and (self.last_change is None or
+                                  t > self.last_change):
+                self.last_change = t
@@ -0,0 +1,255 @@
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Column oriented filtering and weighing of host states.
+
+The FilterScheduler normally filters and weighs every host once per
+instance it places. A HostTable keeps the host states as columns instead:
+the hosts are filtered and weighed once, the common resource filters and
+cost functions over whole columns, and after a host is chosen and consumed
+only that host is filtered and weighed again. The hosts are kept in a heap
+ordered like least_cost.weighted_sum() would choose them, so the same
+hosts are chosen in the same order.
+
+Filters and cost functions without a column version are evaluated per
+host. Like the vectorized ones they are assumed to depend only on the host
+state and the request, which is what lets the other hosts be skipped
+between instances.
+"""
+
+import heapq
+
+from nova import flags
+from nova.openstack.common import log as logging
+from nova.scheduler.filters import availability_zone_filter
+from nova.scheduler.filters import compute_filter
+from nova.scheduler.filters import core_filter
+from nova.scheduler.filters import disk_filter
+from nova.scheduler.filters import ram_filter
+from nova.scheduler import least_cost
+from nova import utils
+
+
+FLAGS = flags.FLAGS
+LOG = logging.getLogger(__name__)
+
+
+def _ram_filter(table, rows, filter_properties):
+    """RamFilter over the rows."""
+    instance_type = filter_properties.get('instance_type')
+    requested_ram = instance_type['memory_mb']
+    ratio = FLAGS.ram_allocation_ratio
+    free = table.free_ram_mb
+    total = table.total_usable_ram_mb
+    passed = []
+    for i in rows:
+        memory_mb_limit = total[i] * ratio
+        if memory_mb_limit - (total[i] - free[i]) >= requested_ram:
+            table.host_states[i].limits['memory_mb'] = memory_mb_limit
+            passed.append(i)
+    return passed
+
+
+def _disk_filter(table, rows, filter_properties):
+    """DiskFilter over the rows."""
+    instance_type = filter_properties.get('instance_type')
+    requested_disk = 1024 * (instance_type['root_gb'] +
+                             instance_type['ephemeral_gb'])
+    ratio = FLAGS.disk_allocation_ratio
+    free = table.free_disk_mb
+    total_gb = table.total_usable_disk_gb
+    passed = []
+    for i in rows:
+        total_usable_disk_mb = total_gb[i] * 1024
+        disk_mb_limit = total_usable_disk_mb * ratio
+        if disk_mb_limit - (total_usable_disk_mb - free[i]) >= requested_disk:
+            table.host_states[i].limits['disk_gb'] = disk_mb_limit / 1024
+            passed.append(i)
+    return passed
+
+
+def _core_filter(table, rows, filter_properties):
+    """CoreFilter over the rows."""
+    instance_type = filter_properties.get('instance_type')
+    instance_vcpus = instance_type['vcpus']
+    ratio = FLAGS.cpu_allocation_ratio
+    vcpus_total = table.vcpus_total
+    vcpus_used = table.vcpus_used
+    passed = []
+    for i in rows:
+        if table.topic[i] != 'compute' or not vcpus_total[i]:
+            passed.append(i)
+            continue
+        limit = vcpus_total[i] * ratio
+        if limit > 0:
+            table.host_states[i].limits['vcpu'] = limit
+        if limit - vcpus_used[i] >= instance_vcpus:
+            passed.append(i)
+    return passed
+
+
+def _compute_filter(table, rows, filter_properties):
+    """ComputeFilter over the rows."""
+    passed = []
+    computes = [i for i in rows if table.topic[i] == 'compute']
+    is_up = dict(zip(computes, utils.services_are_up(
+            [table.host_states[i].service for i in computes])))
+    for i in rows:
+        if table.topic[i] != 'compute':
+            passed.append(i)
+            continue
+        service = table.host_states[i].service
+        if not is_up[i]:
+            continue
+        if service['disabled']:
+            continue
+        if not table.host_states[i].capabilities.get("enabled", True):
+            continue
+        passed.append(i)
+    return passed
+
+
+def _availability_zone_filter(table, rows, filter_properties):
+    """AvailabilityZoneFilter over the rows."""
+    spec = filter_properties.get('request_spec', {})
+    props = spec.get('instance_properties', {})
+    availability_zone = props.get('availability_zone')
+    if not availability_zone:
+        return rows
+    return [i for i in rows if availability_zone ==
+            table.host_states[i].service['availability_zone']]
+
+
+# filter class --> function(table, rows, filter_properties) returning the
+# rows passing, in order. They are only used when the request has an
+# instance_type. Subclasses may override host_passes() so only the exact
+# classes are looked up.
+COLUMN_FILTERS = {
+    ram_filter.RamFilter: _ram_filter,
+    disk_filter.DiskFilter: _disk_filter,
+    core_filter.CoreFilter: _core_filter,
+    compute_filter.ComputeFilter: _compute_filter,
+    availability_zone_filter.AvailabilityZoneFilter:
+            _availability_zone_filter,
+}
+
+# cost function --> function(table) returning its column
+COLUMN_COST_FNS = {
+    least_cost.noop_cost_fn: lambda table: [1] * len(table.host_states),
+    least_cost.compute_fill_first_cost_fn: lambda table: table.free_ram_mb,
+}
+
+
+class HostTable(object):
+    """Host states filtered and weighed for one request."""
+
+    def __init__(self, host_states, filter_fns, weighted_fns,
+                 filter_properties):
+        self.host_states = list(host_states)
+        self.filter_fns = filter_fns
+        self.weighted_fns = weighted_fns
+        self.filter_properties = filter_properties
+        self.index = dict((id(host_state), i)
+                          for i, host_state in enumerate(self.host_states))
+
+        self.topic = [hs.topic for hs in self.host_states]
+        self.free_ram_mb = [hs.free_ram_mb for hs in self.host_states]
+        self.total_usable_ram_mb = [hs.total_usable_ram_mb
+                                    for hs in self.host_states]
+        self.free_disk_mb = [hs.free_disk_mb for hs in self.host_states]
+        self.total_usable_disk_gb = [hs.total_usable_disk_gb
+                                     for hs in self.host_states]
+        self.vcpus_total = [hs.vcpus_total for hs in self.host_states]
+        self.vcpus_used = [hs.vcpus_used for hs in self.host_states]
+
+        self.passes = [False] * len(self.host_states)
+        for i in self._filter_rows():
+            self.passes[i] = True
+        self.scores = self._weigh_rows()
+        self.heap = [(self.scores[i], i)
+                     for i in xrange(len(self.host_states)) if self.passes[i]]
+        heapq.heapify(self.heap)
+        LOG.debug(_("%(passed)d of %(hosts)d hosts passed the filters") %
+                  {'passed': len(self.heap), 'hosts': len(self.host_states)})
+
+    def get_best_host(self):
+        """Returns the WeightedHost least_cost.weighted_sum() would choose
+        among the hosts passing the filters, or None.
+        """
+        while self.heap:
+            score, i = self.heap[0]
+            if self.passes[i] and self.scores[i] == score:
+                return least_cost.WeightedHost(score,
+                        host_state=self.host_states[i])
+            # The host was consumed since
+            heapq.heappop(self.heap)
+        return None
+
+    def update(self, host_state):
+        """Filter and weigh again a host state which changed."""
+        i = self.index[id(host_state)]
+        if not self.passes[i]:
+            return
+        self.passes[i] = host_state.passes_filters(self.filter_fns,
+                                                   self.filter_properties)
+        if not self.passes[i]:
+            return
+        self.scores[i] = sum(weight * fn(host_state, self.filter_properties)
+                             for weight, fn in self.weighted_fns)
+        heapq.heappush(self.heap, (self.scores[i], i))
+
+    def _filter_rows(self):
+        """Returns the rows passing all the filters, like
+        HostState.passes_filters() for each host.
+        """
+        properties = self.filter_properties
+        rows = xrange(len(self.host_states))
+        ignore_hosts = properties.get('ignore_hosts', [])
+        rows = [i for i in rows
+                if self.host_states[i].host not in ignore_hosts]
+        force_hosts = properties.get('force_hosts', [])
+        if force_hosts:
+            return [i for i in rows
+                    if self.host_states[i].host in force_hosts]
+
+        for filter_fn in self.filter_fns:
+            column_filter = COLUMN_FILTERS.get(
+                    type(getattr(filter_fn, 'im_self', None)))
+            if column_filter is not None and properties.get('instance_type'):
+                rows = column_filter(self, rows, properties)
+            else:
+                rows = [i for i in rows
+                        if filter_fn(self.host_states[i], properties)]
+        return rows
+
+    def _weigh_rows(self):
+        """Returns the score of every row passing the filters, summed in
+        the order least_cost.weighted_sum() does.
+        """
+        properties = self.filter_properties
+        rows = [i for i in xrange(len(self.host_states)) if self.passes[i]]
+        scores = [0] * len(self.host_states)
+        for weight, fn in self.weighted_fns:
+            column_cost_fn = COLUMN_COST_FNS.get(fn)
+            if column_cost_fn is not None:
+                column = column_cost_fn(self)
+                for i in rows:
+                    scores[i] = scores[i] + weight * column[i]
+            else:
+                for i in rows:
+                    scores[i] = scores[i] + weight * fn(self.host_states[i],
+                                                        properties)
+        return scores
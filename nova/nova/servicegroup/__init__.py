@@ -0,0 +1,49 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Membership of the nova services.
+
+Services report their state to the servicegroup driver every
+report_interval seconds, and whether a service is up is asked to the same
+driver, see nova.utils.service_is_up().
+"""
+
+from nova import flags
+from nova.openstack.common import cfg
+from nova.openstack.common import importutils
+
+
+servicegroup_opts = [
+    cfg.StrOpt('servicegroup_driver',
+               default='nova.servicegroup.db_driver.DbDriver',
+               help='The driver the services report their state to, and '
+                    'which tells whether they are up'),
+]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(servicegroup_opts)
+
+_drivers = {}
+
+
+def API():
+    """Returns the servicegroup driver, one instance per process."""
+    driver_name = FLAGS.servicegroup_driver
+    if driver_name not in _drivers:
+        _drivers[driver_name] = importutils.import_object(driver_name)
+    return _drivers[driver_name]
@@ -0,0 +1,76 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Heartbeats in the services table."""
+
+from nova import context
+from nova import db
+from nova import exception
+from nova import flags
+from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
+from nova.servicegroup import driver
+from nova import utils
+
+
+FLAGS = flags.FLAGS
+LOG = logging.getLogger(__name__)
+
+
+class DbDriver(driver.ServiceGroupDriver):
+    """Every report updates the row of the service, a service is up while
+    its row was updated in the last service_down_time seconds.
+    """
+
+    def report_state(self, service):
+        """Update the state of the service in the datastore."""
+        ctxt = context.get_admin_context()
+        zone = FLAGS.node_availability_zone
+        state_catalog = {}
+        try:
+            try:
+                service_ref = db.service_get(ctxt, service.service_id)
+            except exception.NotFound:
+                LOG.debug(_('The service database object disappeared, '
+                            'Recreating it.'))
+                service._create_service_ref(ctxt)
+                service_ref = db.service_get(ctxt, service.service_id)
+
+            state_catalog['report_count'] = service_ref['report_count'] + 1
+            if zone != service_ref['availability_zone']:
+                state_catalog['availability_zone'] = zone
+
+            db.service_update(ctxt,
+                             service.service_id, state_catalog)
+
+            # TODO(termie): make this pattern be more elegant.
+            if getattr(service, 'model_disconnected', False):
+                service.model_disconnected = False
+                LOG.error(_('Recovered model server connection!'))
+
+        # TODO(vish): this should probably only catch connection errors
+        except Exception:  # pylint: disable=W0702
+            if not getattr(service, 'model_disconnected', False):
+                service.model_disconnected = True
+                LOG.exception(_('model server went away'))
+
+    def is_up(self, service_ref):
+        """Check whether a service is up based on last heartbeat."""
+        last_heartbeat = service_ref['updated_at'] or service_ref['created_at']
+        # Timestamps in DB are UTC.
+        elapsed = utils.total_seconds(timeutils.utcnow() - last_heartbeat)
+        return abs(elapsed) <= FLAGS.service_down_time
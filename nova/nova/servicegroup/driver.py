@@ -0,0 +1,43 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Base class of the servicegroup drivers."""
+
+
+class ServiceGroupDriver(object):
+    """What the servicegroup drivers must implement."""
+
+    def report_state(self, service):
+        """Report that a service is alive.
+
+        :param service: the nova.service.Service reporting
+        """
+        raise NotImplementedError()
+
+    def is_up(self, service_ref):
+        """Whether a service is up.
+
+        :param service_ref: the row of the service in the services table
+        """
+        raise NotImplementedError()
+
+    def are_up(self, service_refs):
+        """Whether each of the services is up, in the same order.
+
+        :param service_refs: rows of the services table
+        """
+        return [self.is_up(service_ref) for service_ref in service_refs]
@@ -0,0 +1,93 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Heartbeats in memcached, written behind to the services table."""
+
+from nova import exception
+from nova import flags
+from nova.openstack.common import cfg
+from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
+from nova.servicegroup import db_driver
+
+
+mc_driver_opts = [
+    cfg.IntOpt('servicegroup_db_report_interval',
+               default=300,
+               help='Seconds between the reports of a service to the '
+                    'services table when its heartbeats go to memcached'),
+]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(mc_driver_opts)
+LOG = logging.getLogger(__name__)
+
+
+def _memcache_client():
+    import memcache
+    return memcache.Client(FLAGS.memcached_servers, debug=0)
+
+
+class MemcachedDriver(db_driver.DbDriver):
+    """Every report sets a key of the service expiring after
+    service_down_time seconds, a service is up while its key is there.
+
+    The row of the service is only updated every
+    servicegroup_db_report_interval seconds, so the services table keeps
+    its zone and a rough updated_at without taking a write per report.
+    The keys must be shared by all the services, so memcached_servers
+    is required.
+    """
+
+    def __init__(self):
+        if not FLAGS.memcached_servers:
+            raise exception.NovaException(
+                    _('The memcached servicegroup driver needs '
+                      'memcached_servers, an in process cache would only '
+                      'see the services of its own process'))
+        self.mc = _memcache_client()
+        # (topic, host) --> time of the last report to the services table
+        self.db_reported_at = {}
+
+    @staticmethod
+    def _key(topic, host):
+        return str('servicegroup-%s-%s' % (topic, host))
+
+    def report_state(self, service):
+        """Set the key of the service, and update its row if due."""
+        now = timeutils.utcnow_ts()
+        self.mc.set(self._key(service.topic, service.host), now,
+                    time=FLAGS.service_down_time)
+
+        reported_at = self.db_reported_at.get((service.topic, service.host))
+        if (reported_at is None or
+            now - reported_at >= FLAGS.servicegroup_db_report_interval):
+            super(MemcachedDriver, self).report_state(service)
+            self.db_reported_at[(service.topic, service.host)] = now
+
+    def is_up(self, service_ref):
+        """Check whether the key of a service is still there."""
+        return self.are_up([service_ref])[0]
+
+    def are_up(self, service_refs):
+        """Check the keys of all the services with one get_multi."""
+        keys = [self._key(service_ref['topic'], service_ref['host'])
+                for service_ref in service_refs]
+        if not keys:
+            return []
+        found = self.mc.get_multi(keys)
+        return [key in found for key in keys]
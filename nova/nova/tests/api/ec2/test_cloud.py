@@ -858,6 +858,69 @@ class CloudTestCase(test.TestCase):
         db.service_destroy(self.context, comp1['id'])
         db.service_destroy(self.context, comp2['id'])
 
+    def test_describe_instances_looks_up_in_bulk(self):
+        """Makes sure describe_instances doesn't query for each instance."""
+        self._stub_instance_get_with_fixed_ips('get_all')
+
+        image_uuid = 'cedef40a-ed67-4d10-800e-17455edce175'
+        kernel_uuid = 'cedef40a-ed67-4d10-800e-17455edce176'
+        ramdisk_uuid = 'cedef40a-ed67-4d10-800e-17455edce177'
+        insts = []
+        for host, kernel_id, ramdisk_id in [('host1', kernel_uuid, None),
+                                            ('host2', '', ramdisk_uuid),
+                                            ('host3', kernel_uuid, None)]:
+            insts.append(db.instance_create(self.context,
+                                            {'reservation_id': 'a',
+                                             'image_ref': image_uuid,
+                                             'kernel_id': kernel_id,
+                                             'ramdisk_id': ramdisk_id,
+                                             'instance_type_id': 1,
+                                             'host': host,
+                                             'vm_state': 'active'}))
+        comp1 = db.service_create(self.context, {'host': 'host1',
+                                                 'availability_zone': 'zone1',
+                                                 'topic': "compute"})
+        comp2 = db.service_create(self.context, {'host': 'host2',
+                                                 'availability_zone': 'zone2',
+                                                 'topic': "compute"})
+
+        def not_called(*args, **kwargs):
+            self.fail('looked up for a single instance')
+
+        names = ('get_ec2_instance_id_by_uuid', 's3_image_get_by_uuid',
+                 'block_device_mapping_get_all_by_instance',
+                 'service_get_all_by_host')
+        orig_funcs = dict((name, getattr(db, name)) for name in names)
+        for name in names:
+            self.stubs.Set(db, name, not_called)
+        result = self.cloud.describe_instances(self.context)
+        for name in names:
+            self.stubs.Set(db, name, orig_funcs[name])
+
+        result = result['reservationSet'][0]['instancesSet']
+        self.assertEqual(len(result), 3)
+        for inst, zone, instance in zip(insts, ['zone1', 'zone2',
+                                                'unknown zone'], result):
+            self.assertEqual(instance['instanceId'],
+                             ec2utils.id_to_ec2_inst_id(inst['uuid']))
+            self.assertEqual(instance['imageId'],
+                    ec2utils.glance_id_to_ec2_id(self.context, image_uuid))
+            self.assertEqual(instance['placement']['availabilityZone'], zone)
+            self.assertEqual(instance['rootDeviceType'], 'instance-store')
+        self.assertEqual(result[0]['kernelId'],
+                ec2utils.glance_id_to_ec2_id(self.context, kernel_uuid, 'aki'))
+        self.assertEqual(result[0]['kernelId'], result[2]['kernelId'])
+        self.assertFalse('kernelId' in result[1])
+        self.assertEqual(result[1]['ramdiskId'],
+                ec2utils.glance_id_to_ec2_id(self.context, ramdisk_uuid,
+                                             'ari'))
+        self.assertFalse('ramdiskId' in result[0])
+
+        for inst in insts:
+            db.instance_destroy(self.context, inst['uuid'])
+        db.service_destroy(self.context, comp1['id'])
+        db.service_destroy(self.context, comp2['id'])
+
     def test_describe_instances_sorting(self):
         """Makes sure describe_instances works and is sorted as expected."""
         self.flags(use_ipv6=True)
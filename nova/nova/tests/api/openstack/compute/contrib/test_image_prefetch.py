@@ -0,0 +1,77 @@
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import webob.exc
+
+from nova.api.openstack.compute.contrib import image_prefetch
+from nova.compute import api as compute_api
+from nova import db
+from nova import test
+from nova.tests.api.openstack import fakes
+import nova.tests.image.fake
+
+
+IMAGE_ID = '155d900f-4e14-4e4c-a73d-069cbf4541e6'
+SERVICES_LIST = [
+        {"host": "host_c1", "topic": "compute"},
+        {"host": "host_c2", "topic": "compute"}]
+
+
+class ImagePrefetchTest(test.TestCase):
+
+    def setUp(self):
+        super(ImagePrefetchTest, self).setUp()
+        nova.tests.image.fake.stub_out_image_service(self.stubs)
+        self.stubs.Set(db, 'service_get_all_by_topic',
+                       lambda context, topic: SERVICES_LIST)
+        self.prefetches = []
+        self.stubs.Set(compute_api.HostAPI, 'prefetch_image',
+                       lambda api, context, hosts, image_id:
+                           self.prefetches.append((hosts, image_id)))
+        self.controller = image_prefetch.ImagePrefetchController()
+        self.req = fakes.HTTPRequest.blank('/v2/fake/os-image-prefetch',
+                                           use_admin_context=True)
+
+    def tearDown(self):
+        nova.tests.image.fake.FakeImageService_reset()
+        super(ImagePrefetchTest, self).tearDown()
+
+    def test_prefetch(self):
+        body = {'prefetch': {'image_id': IMAGE_ID,
+                             'hosts': ['host_c1', 'host_c2']}}
+        res = self.controller.create(self.req, body)
+        self.assertEqual(res.status_int, 202)
+        self.assertEqual(self.prefetches,
+                         [(['host_c1', 'host_c2'], IMAGE_ID)])
+
+    def test_prefetch_bad_body(self):
+        for body in [{}, {'prefetch': {'image_id': IMAGE_ID}},
+                     {'prefetch': {'image_id': IMAGE_ID, 'hosts': []}}]:
+            self.assertRaises(webob.exc.HTTPBadRequest,
+                              self.controller.create, self.req, body)
+        self.assertEqual(self.prefetches, [])
+
+    def test_prefetch_unknown_host(self):
+        body = {'prefetch': {'image_id': IMAGE_ID,
+                             'hosts': ['host_c1', 'host_v1']}}
+        self.assertRaises(webob.exc.HTTPNotFound,
+                          self.controller.create, self.req, body)
+        self.assertEqual(self.prefetches, [])
+
+    def test_prefetch_unknown_image(self):
+        body = {'prefetch': {'image_id': 'bogus', 'hosts': ['host_c1']}}
+        self.assertRaises(webob.exc.HTTPNotFound,
+                          self.controller.create, self.req, body)
+        self.assertEqual(self.prefetches, [])
@@ -69,7 +69,8 @@ def get_fake_db_instance(start, end, instance_id, tenant_id):
             'terminated_at': end}
 
 
-def fake_instance_get_active_by_window(self, context, begin, end, project_id):
+def fake_instance_get_active_by_window(self, context, begin, end, project_id,
+                                       columns=None):
             return [get_fake_db_instance(START,
                                          STOP,
                                          x,
@@ -178,6 +178,7 @@ class ExtensionControllerTest(ExtensionTestCase):
             "FloatingIpPools",
             "Fox In Socks",
             "Hosts",
+            "ImagePrefetch",
             "Keypairs",
             "Multinic",
             "MultipleCreate",
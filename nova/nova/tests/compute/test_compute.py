@@ -2245,6 +2245,32 @@ class ComputeTestCase(BaseTestCase):
         self.assertEqual(len(instances), 1)
         self.assertEqual(task_states.STOPPING, instances[0]['task_state'])
 
+    def test_sync_power_states_in_bulk(self):
+        """Power states are read from the driver and the db in bulk"""
+        self.stubs.Set(compute_manager.ComputeManager,
+                '_report_driver_status', nop_report_driver_status)
+
+        instance = jsonutils.to_primitive(self._create_fake_instance())
+        self.compute.run_instance(self.context, instance=instance)
+        self.compute.driver.instances[instance['name']].state = \
+                power_state.SHUTDOWN
+
+        def fail(*args, **kwargs):
+            self.fail('unexpected per instance call')
+
+        self.stubs.Set(self.compute.driver, 'get_info', fail)
+        self.stubs.Set(db, 'instance_get_by_uuid', fail)
+
+        ctxt = context.get_admin_context()
+        self.compute._sync_power_states(ctxt)
+
+        instances = db.instance_get_all(ctxt)
+        self.assertEqual(len(instances), 1)
+        self.assertEqual(power_state.SHUTDOWN, instances[0]['power_state'])
+        self.assertEqual(task_states.STOPPING, instances[0]['task_state'])
+        self.assertEqual(self.compute._last_power_sync['instances'], 1)
+        self.assertEqual(self.compute._last_power_sync['updated'], 1)
+
     def test_add_instance_fault(self):
         exc_info = None
         instance_uuid = str(utils.gen_uuid())
@@ -2452,6 +2478,38 @@ class ComputeTestCase(BaseTestCase):
         self.assertEqual(call_info['get_by_uuid'], 3)
         self.assertEqual(call_info['get_nw_info'], 4)
 
+    def test_heal_instance_info_cache_batch(self):
+        self.flags(heal_instance_info_cache_interval=-1,
+                   heal_instance_info_cache_batch_size=2)
+        ctxt = context.get_admin_context()
+        now = timeutils.utcnow()
+        instances = [{'uuid': 'fake-uuid-%s' % x, 'host': FLAGS.host,
+                      'info_cache': {'created_at': now,
+                                     'updated_at': now - datetime.timedelta(
+                                            seconds=600 - x)}}
+                     for x in xrange(2)]
+
+        def fake_get_oldest(context, host, limit=None):
+            self.assertEqual(host, FLAGS.host)
+            self.assertEqual(limit, 2)
+            return instances
+
+        def fake_get_instance_nw_info_bulk(context, bulk_instances):
+            self.assertEqual(bulk_instances, instances)
+            return {'fake-uuid-0': []}
+
+        self.stubs.Set(db, 'instance_get_all_by_host_oldest_info_cache',
+                fake_get_oldest)
+        self.stubs.Set(self.compute.network_api, 'get_instance_nw_info_bulk',
+                fake_get_instance_nw_info_bulk)
+        timeutils.set_time_override(now)
+        try:
+            self.compute._heal_instance_info_cache(ctxt)
+        finally:
+            timeutils.clear_time_override()
+        self.assertEqual(self.compute._last_info_cache_heal_batch,
+                         {'instances': 2, 'updated': 1, 'oldest_age': 600})
+
     def test_poll_unconfirmed_resizes(self):
         instances = [{'uuid': 'fake_uuid1', 'vm_state': vm_states.RESIZED,
                       'task_state': None},
@@ -3779,6 +3837,25 @@ class ComputeAPITestCase(BaseTestCase):
         db.instance_destroy(c, instance2['uuid'])
         db.instance_destroy(c, instance3['uuid'])
 
+    def test_get_all_columns(self):
+        """Test listing only some columns of the instances"""
+        c = context.get_admin_context()
+        instance = self._create_fake_instance({'display_name': 'woot'})
+
+        instances = self.compute_api.get_all(c, columns_to_join=[],
+                columns=['display_name', 'name'])
+        self.assertEqual(instances, [{'id': instance['id'],
+                                      'uuid': instance['uuid'],
+                                      'display_name': 'woot',
+                                      'name': instance['name']}])
+
+        instances = self.compute_api.get_all(c,
+                columns_to_join=['info_cache'], columns=['host'])
+        self.assertEqual(sorted(instances[0].keys()),
+                         ['host', 'id', 'info_cache', 'uuid'])
+
+        db.instance_destroy(c, instance['uuid'])
+
     def test_get_all_by_multiple_options_at_once(self):
         """Test searching by multiple options at once"""
         c = context.get_admin_context()
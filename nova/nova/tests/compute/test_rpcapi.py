@@ -212,6 +212,10 @@ class ComputeRpcAPITestCase(test.TestCase):
                 instance=self.fake_instance, block_migration='block_migration',
                 disk='disk', host='host')
 
+    def test_prefetch_image(self):
+        self._test_compute_api('prefetch_image', 'cast',
+                image_id='fake_image', host='host', version='2.3')
+
     def test_prep_resize(self):
         self._test_compute_api('prep_resize', 'cast',
                 instance=self.fake_instance, instance_type='fake_type',
@@ -68,6 +68,11 @@ VIR_DOMAIN_SHUTDOWN = 4
 VIR_DOMAIN_SHUTOFF = 5
 VIR_DOMAIN_CRASHED = 6
 
+VIR_CONNECT_LIST_DOMAINS_RUNNING = 16
+VIR_CONNECT_LIST_DOMAINS_PAUSED = 32
+VIR_CONNECT_LIST_DOMAINS_SHUTOFF = 64
+VIR_CONNECT_LIST_DOMAINS_OTHER = 128
+
 VIR_DOMAIN_XML_SECURE = 1
 VIR_DOMAIN_UNDEFINE_MANAGED_SAVE = 1
 
@@ -297,6 +302,12 @@ class Domain(object):
     def name(self):
         return self._def['name']
 
+    def ID(self):
+        for (k, v) in self._connection._running_vms.iteritems():
+            if v == self:
+                return k
+        return -1
+
     def UUIDString(self):
         return self._def['uuid']
 
@@ -526,6 +537,27 @@ class Connection(object):
     def listDomainsID(self):
         return self._running_vms.keys()
 
+    def listAllDomains(self, flags=0):
+        states = {VIR_CONNECT_LIST_DOMAINS_RUNNING: [VIR_DOMAIN_RUNNING],
+                  VIR_CONNECT_LIST_DOMAINS_PAUSED: [VIR_DOMAIN_PAUSED],
+                  VIR_CONNECT_LIST_DOMAINS_SHUTOFF: [VIR_DOMAIN_SHUTOFF]}
+        domains = self._vms.values()
+        if not flags:
+            return domains
+        if flags & VIR_CONNECT_LIST_DOMAINS_OTHER:
+            known = sum(states.values(), [])
+            return [dom for dom in domains if dom._state not in known]
+        wanted = []
+        for flag, flag_states in states.iteritems():
+            if flags & flag:
+                wanted.extend(flag_states)
+        return [dom for dom in domains if dom._state in wanted]
+
+    def listDefinedDomains(self):
+        running = self._running_vms.values()
+        return [name for name, dom in self._vms.iteritems()
+                if dom not in running]
+
     def lookupByID(self, id):
         if id in self._running_vms:
             return self._running_vms[id]
@@ -216,6 +216,14 @@
             "namespace": "http://docs.openstack.org/compute/ext/hypervisors/api/v1.1",
             "updated": "%(timestamp)s"
         },
+        {
+            "alias": "os-image-prefetch",
+            "description": "%(text)s",
+            "links": [],
+            "name": "ImagePrefetch",
+            "namespace": "http://docs.openstack.org/compute/ext/image_prefetch/api/v1.1",
+            "updated": "%(timestamp)s"
+        },
         {
             "alias": "os-instance_usage_audit_log",
             "description": "%(text)s",
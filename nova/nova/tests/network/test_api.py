@@ -78,3 +78,34 @@ class ApiTestCase(test.TestCase):
 
     def test_associate_unassociated_floating_ip(self):
         self._do_test_associate_floating_ip(None)
+
+    def test_get_instance_nw_info_bulk(self):
+        instances = [{'id': x, 'uuid': 'uuid-%d' % x, 'host': 'host1',
+                      'project_id': 'fake-project',
+                      'instance_type': {'rxtx_factor': 1.0}}
+                     for x in xrange(3)]
+        calls = []
+
+        def fake_rpc_call(context, topic, msg):
+            calls.append(msg)
+            # uuid-1 failed in the network manager
+            return {'uuid-0': [], 'uuid-2': []}
+
+        self.stubs.Set(rpc, 'call', fake_rpc_call)
+
+        updated = []
+
+        def fake_instance_info_cache_update(context, instance_uuid, cache):
+            self.assertTrue(cache['updated_at'] is not None)
+            updated.append(instance_uuid)
+
+        self.stubs.Set(self.network_api.db, 'instance_info_cache_update',
+                       fake_instance_info_cache_update)
+
+        nw_infos = self.network_api.get_instance_nw_info_bulk(self.context,
+                                                              instances)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0]['method'], 'get_instance_nw_info_bulk')
+        self.assertEqual(len(calls[0]['args']['instances']), 3)
+        self.assertEqual(sorted(nw_infos.keys()), ['uuid-0', 'uuid-2'])
+        self.assertEqual(updated, ['uuid-0', 'uuid-2'])
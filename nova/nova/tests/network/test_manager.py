@@ -15,6 +15,7 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import eventlet
 import mox
 import shutil
 import sys
@@ -292,7 +293,8 @@ class FlatNetworkTestCase(test.TestCase):
                                                              [{'id': 0}]})
         db.fixed_ip_associate_pool(mox.IgnoreArg(),
                                    mox.IgnoreArg(),
-                                   mox.IgnoreArg()).AndReturn('192.168.0.101')
+                                   mox.IgnoreArg(),
+                                   None).AndReturn('192.168.0.101')
         db.network_get(mox.IgnoreArg(),
                        mox.IgnoreArg(),
                        project_only=mox.IgnoreArg()).AndReturn(networks[0])
@@ -324,7 +326,8 @@ class FlatNetworkTestCase(test.TestCase):
                                                              [{'id': 0}]})
         db.fixed_ip_associate_pool(mox.IgnoreArg(),
                                    mox.IgnoreArg(),
-                                   mox.IgnoreArg()).AndReturn('192.168.0.101')
+                                   mox.IgnoreArg(),
+                                   None).AndReturn('192.168.0.101')
         db.network_get_by_uuid(mox.IgnoreArg(),
                                mox.IgnoreArg()).AndReturn(networks[0])
         db.network_update(mox.IgnoreArg(), mox.IgnoreArg(), mox.IgnoreArg())
@@ -391,7 +394,8 @@ class FlatNetworkTestCase(test.TestCase):
 
         db.fixed_ip_associate_pool(mox.IgnoreArg(),
                                    mox.IgnoreArg(),
-                                   mox.IgnoreArg()).AndReturn(fixedip)
+                                   mox.IgnoreArg(),
+                                   None).AndReturn(fixedip)
         db.network_get(mox.IgnoreArg(),
                        mox.IgnoreArg(),
                        project_only=mox.IgnoreArg()).AndReturn(networks[0])
@@ -472,7 +476,8 @@ class VlanNetworkTestCase(test.TestCase):
                                                              [{'id': 0}]})
         db.fixed_ip_associate_pool(mox.IgnoreArg(),
                                    mox.IgnoreArg(),
-                                   mox.IgnoreArg()).AndReturn('192.168.0.1')
+                                   mox.IgnoreArg(),
+                                   None).AndReturn('192.168.0.1')
         db.fixed_ip_update(mox.IgnoreArg(),
                            mox.IgnoreArg(),
                            mox.IgnoreArg())
@@ -876,7 +881,8 @@ class VlanNetworkTestCase(test.TestCase):
                                                     'uuid': FAKEUUID})
         db.fixed_ip_associate_pool(mox.IgnoreArg(),
                                    mox.IgnoreArg(),
-                                   mox.IgnoreArg()).AndReturn('192.168.0.101')
+                                   mox.IgnoreArg(),
+                                   None).AndReturn('192.168.0.101')
         db.network_get(mox.IgnoreArg(),
                        mox.IgnoreArg(),
                        project_only=mox.IgnoreArg()).AndReturn(networks[0])
@@ -1542,6 +1548,83 @@ class AllocateTestCase(test.TestCase):
                                              project_id=project_id)
 
 
+class FreeFixedIpPoolTestCase(test.TestCase):
+    """Tests allocating fixed ips with fixed_ip_pool_size"""
+    def setUp(self):
+        super(FreeFixedIpPoolTestCase, self).setUp()
+        self.flags(fixed_ip_pool_size=4)
+        self.network = network_manager.FlatManager(host=HOST)
+        self.network.db = db
+        self.context = context.get_admin_context()
+        self.network_ref = db.network_create_safe(self.context, {})
+        self.addresses = ['10.1.0.%d' % i for i in xrange(1, 11)]
+        for address in self.addresses:
+            db.fixed_ip_create(self.context,
+                               {'address': address,
+                                'network_id': self.network_ref['id']})
+
+    def _instance_uuids(self, count):
+        return [db.instance_create(self.context, {})['uuid']
+                for i in xrange(count)]
+
+    def test_allocates_free_fixed_ips(self):
+        uuids = self._instance_uuids(10)
+        addresses = [self.network._associate_free_fixed_ip(self.context,
+                        self.network_ref['id'], uuid) for uuid in uuids]
+        self.assertEqual(sorted(addresses), sorted(self.addresses))
+        for address, uuid in zip(addresses, uuids):
+            fixed_ip = db.fixed_ip_get_by_address(self.context, address)
+            self.assertEqual(fixed_ip['instance_uuid'], uuid)
+
+        self.assertRaises(exception.NoMoreFixedIps,
+                          self.network._associate_free_fixed_ip,
+                          self.context, self.network_ref['id'],
+                          self._instance_uuids(1)[0])
+
+    def test_skips_fixed_ips_allocated_since(self):
+        uuids = self._instance_uuids(2)
+        address = self.network._associate_free_fixed_ip(self.context,
+                self.network_ref['id'], uuids[0])
+        free = self.network._free_fixed_ips[self.network_ref['id']]
+        # Another network host allocates the next one
+        taken = free[-1]
+        db.fixed_ip_associate(self.context, taken, uuids[1],
+                              self.network_ref['id'])
+        other_address = self.network._associate_free_fixed_ip(self.context,
+                self.network_ref['id'], uuids[0])
+        self.assertFalse(other_address in (address, taken))
+        self.assertEqual(len(free), 1)
+
+    def test_concurrent_allocations(self):
+        associate_if_free = db.fixed_ip_associate_if_free
+
+        def fake_associate_if_free(*args, **kwargs):
+            # Lets the other allocations try the same fixed ip
+            eventlet.sleep(0)
+            return associate_if_free(*args, **kwargs)
+
+        self.stubs.Set(db, 'fixed_ip_associate_if_free',
+                       fake_associate_if_free)
+        # Each host looks up the same free fixed ips
+        hosts = [network_manager.FlatManager(host='host%d' % i)
+                 for i in xrange(3)]
+        threads = []
+        for uuid in self._instance_uuids(12):
+            host = hosts[len(threads) % len(hosts)]
+            threads.append(eventlet.spawn(host._associate_free_fixed_ip,
+                                          self.context,
+                                          self.network_ref['id'], uuid))
+        addresses = []
+        failures = 0
+        for thread in threads:
+            try:
+                addresses.append(thread.wait())
+            except exception.NoMoreFixedIps:
+                failures += 1
+        self.assertEqual(sorted(addresses), sorted(self.addresses))
+        self.assertEqual(failures, 2)
+
+
 class FloatingIPTestCase(test.TestCase):
     """Tests nova.network.manager.FloatingIP"""
     def setUp(self):
@@ -16,6 +16,9 @@
 Tests For HostManager
 """
 
+import datetime
+
+import mox
 
 from nova import db
 from nova import exception
@@ -157,6 +160,177 @@ class HostManagerTestCase(test.TestCase):
         self.assertEqual(host_states['host4'].free_disk_mb, 8388608)
 
 
+class HostManagerCacheTestCase(test.TestCase):
+    """Test case for the cached host states of HostManager"""
+
+    def setUp(self):
+        super(HostManagerCacheTestCase, self).setUp()
+        self.host_manager = host_manager.HostManager()
+        self.context = 'fake_context'
+        self.now = datetime.datetime(2012, 10, 1, 12, 0, 0)
+        timeutils.set_time_override(self.now)
+        # fakes.COMPUTE_NODES has a compute node without service
+        self.stubs.Set(host_manager.LOG, 'warn', lambda *args: None)
+
+    def tearDown(self):
+        timeutils.clear_time_override()
+        super(HostManagerCacheTestCase, self).tearDown()
+
+    def _compute_node(self, index, **kwargs):
+        compute = dict(fakes.COMPUTE_NODES[index])
+        compute['service'] = dict(compute['service'])
+        compute.update(kwargs)
+        return compute
+
+    def _load(self):
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(self.context).AndReturn(fakes.COMPUTE_NODES)
+
+    def test_get_all_host_states_cached(self):
+        # Only the first call reads the db
+        self._load()
+
+        self.mox.ReplayAll()
+        host_states1 = self.host_manager.get_all_host_states(self.context,
+                                                             'compute')
+        timeutils.advance_time_seconds(1)
+        host_states2 = self.host_manager.get_all_host_states(self.context,
+                                                             'compute')
+
+        self.assertEqual(host_states1, host_states2)
+        self.assertEqual(len(host_states2), 4)
+        stats = self.host_manager.get_host_state_stats()
+        self.assertEqual(stats['hosts'], 4)
+        self.assertEqual(stats['full_refreshes'], 1)
+        self.assertEqual(stats['incremental_refreshes'], 0)
+        self.assertEqual(stats['refresh_age'], 1)
+
+    def test_get_all_host_states_incremental(self):
+        self.flags(scheduler_host_state_refresh_interval=5)
+        self._load()
+        self.mox.StubOutWithMock(db, 'compute_node_get_all_since')
+        self.mox.StubOutWithMock(db, 'service_get_all_by_topic_since')
+        changed = self._compute_node(0, free_ram_mb=256,
+                                     updated_at=self.now)
+        deleted = self._compute_node(3, deleted=True, deleted_at=self.now)
+        db.compute_node_get_all_since(self.context,
+                mox.IgnoreArg()).AndReturn([changed, deleted])
+        disabled = dict(host='host3', disabled=True, updated_at=self.now)
+        db.service_get_all_by_topic_since(self.context, 'compute',
+                mox.IgnoreArg()).AndReturn([disabled])
+
+        self.mox.ReplayAll()
+        self.host_manager.get_all_host_states(self.context, 'compute')
+        timeutils.advance_time_seconds(10)
+        host_states = self.host_manager.get_all_host_states(self.context,
+                                                            'compute')
+
+        self.assertEqual(sorted(host_states.keys()),
+                         ['host1', 'host2', 'host3'])
+        self.assertEqual(host_states['host1'].free_ram_mb, 256)
+        self.assertTrue(host_states['host3'].service['disabled'])
+        self.assertEqual(self.host_manager.last_change, self.now)
+
+    def test_get_all_host_states_node_added_to_empty_table(self):
+        self.flags(scheduler_host_state_refresh_interval=5)
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(self.context).AndReturn([])
+        self.mox.StubOutWithMock(db, 'compute_node_get_all_since')
+        self.mox.StubOutWithMock(db, 'service_get_all_by_topic_since')
+        added = self._compute_node(0, created_at=self.now +
+                                   datetime.timedelta(seconds=3))
+        # Since the full refresh, not since the incremental one
+        since = self.now - datetime.timedelta(
+                seconds=self.host_manager.refresh_margin)
+        db.compute_node_get_all_since(self.context,
+                                      since).AndReturn([added])
+        db.service_get_all_by_topic_since(self.context, 'compute',
+                                          since).AndReturn([])
+
+        self.mox.ReplayAll()
+        self.assertEqual(self.host_manager.get_all_host_states(
+                self.context, 'compute'), {})
+        timeutils.advance_time_seconds(10)
+        host_states = self.host_manager.get_all_host_states(self.context,
+                                                            'compute')
+
+        self.assertEqual(host_states.keys(), ['host1'])
+
+    def test_get_all_host_states_full_refresh(self):
+        self.flags(scheduler_host_state_full_refresh_interval=60)
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(self.context).AndReturn(fakes.COMPUTE_NODES)
+        db.compute_node_get_all(self.context).AndReturn(
+                fakes.COMPUTE_NODES[:2])
+
+        self.mox.ReplayAll()
+        self.host_manager.get_all_host_states(self.context, 'compute')
+        timeutils.advance_time_seconds(120)
+        host_states = self.host_manager.get_all_host_states(self.context,
+                                                            'compute')
+
+        self.assertEqual(sorted(host_states.keys()), ['host1', 'host2'])
+
+    def test_claims_survive_refresh(self):
+        self.flags(scheduler_host_state_refresh_interval=0)
+        self._load()
+        self.mox.StubOutWithMock(db, 'compute_node_get_all_since')
+        self.mox.StubOutWithMock(db, 'service_get_all_by_topic_since')
+        # Written before the claim, then after it
+        before = self._compute_node(2, updated_at=self.now)
+        after = self._compute_node(2, free_ram_mb=2560,
+                updated_at=self.now + datetime.timedelta(seconds=2))
+        db.compute_node_get_all_since(self.context,
+                mox.IgnoreArg()).AndReturn([before])
+        db.compute_node_get_all_since(self.context,
+                mox.IgnoreArg()).AndReturn([after])
+        db.service_get_all_by_topic_since(self.context, 'compute',
+                mox.IgnoreArg()).MultipleTimes().AndReturn([])
+
+        self.mox.ReplayAll()
+        host_states = self.host_manager.get_all_host_states(self.context,
+                                                            'compute')
+        timeutils.advance_time_seconds(1)
+        host_states['host3'].consume_from_instance(fakes.INSTANCES[3])
+        self.assertEqual(host_states['host3'].free_ram_mb, 2048)
+
+        timeutils.advance_time_seconds(1)
+        host_states = self.host_manager.get_all_host_states(self.context,
+                                                            'compute')
+        self.assertEqual(host_states['host3'].free_ram_mb, 2048)
+        self.assertEqual(host_states['host3'].vcpus_used, 2)
+        self.assertEqual(len(host_states['host3'].claims), 1)
+
+        timeutils.advance_time_seconds(1)
+        host_states = self.host_manager.get_all_host_states(self.context,
+                                                            'compute')
+        self.assertEqual(host_states['host3'].free_ram_mb, 2560)
+        self.assertEqual(host_states['host3'].vcpus_used, 1)
+        self.assertEqual(host_states['host3'].claims, [])
+
+    def test_claims_time_out(self):
+        self.flags(scheduler_claim_timeout=60)
+        host_state = host_manager.HostState('host1', 'compute')
+        host_state.consume_from_instance(fakes.INSTANCES[0])
+        timeutils.advance_time_seconds(120)
+        host_state.update_from_compute_node(fakes.COMPUTE_NODES[0])
+        self.assertEqual(host_state.free_ram_mb, 512)
+        self.assertEqual(host_state.claims, [])
+
+    def test_update_service_capabilities_updates_host_state(self):
+        self._load()
+
+        self.mox.ReplayAll()
+        host_states = self.host_manager.get_all_host_states(self.context,
+                                                            'compute')
+        self.host_manager.update_service_capabilities('compute', 'host1',
+                dict(free_memory=1234))
+
+        self.assertEqual(host_states['host1'].capabilities['free_memory'],
+                         1234)
+        self.assertEqual(host_states['host1'].service['host'], 'host1')
+
+
 class HostStateTestCase(test.TestCase):
     """Test case for HostState class"""
 
@@ -0,0 +1,194 @@
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For HostTable.
+"""
+
+import datetime
+import random
+
+from nova import context
+from nova.openstack.common import timeutils
+from nova.scheduler import host_manager
+from nova.scheduler import least_cost
+from nova import test
+from nova.tests.scheduler import fakes
+
+
+FILTERS = ['RetryFilter', 'AvailabilityZoneFilter', 'RamFilter',
+           'CoreFilter', 'DiskFilter', 'ComputeFilter',
+           'ComputeCapabilitiesFilter']
+
+
+def free_disk_cost_fn(host_state, weighing_properties):
+    return host_state.free_disk_mb
+
+
+def get_host_states(seed, count=60):
+    rand = random.Random(seed)
+    now = timeutils.utcnow()
+    host_states = []
+    for i in xrange(count):
+        total_ram_mb = rand.choice([2048, 4096, 8192])
+        total_disk_gb = rand.choice([40, 80, 160])
+        vcpus = rand.choice([0, 2, 4])
+        updated_at = now - datetime.timedelta(
+                seconds=rand.choice([0, 10, 3600]))
+        service = dict(host='host%d' % i, disabled=rand.random() < 0.1,
+                       availability_zone=rand.choice(['nova', 'az2']),
+                       updated_at=updated_at, created_at=updated_at)
+        host_states.append(fakes.FakeHostState('host%d' % i, 'compute',
+                dict(free_ram_mb=rand.randint(-512, total_ram_mb),
+                     total_usable_ram_mb=total_ram_mb,
+                     free_disk_mb=rand.randint(0, total_disk_gb * 1024),
+                     total_usable_disk_gb=total_disk_gb,
+                     vcpus_total=vcpus,
+                     vcpus_used=rand.randint(0, vcpus * 16),
+                     capabilities=dict(enabled=rand.random() > 0.05),
+                     service=service)))
+    return host_states
+
+
+class HostTableTestCase(test.TestCase):
+    """Test case for HostTable class"""
+
+    def setUp(self):
+        super(HostTableTestCase, self).setUp()
+        self.host_manager = host_manager.HostManager()
+        self.instance_type = dict(memory_mb=512, root_gb=20, ephemeral_gb=0,
+                                  vcpus=2)
+
+    def _get_filter_properties(self, **kwargs):
+        filter_properties = dict(
+                instance_type=self.instance_type,
+                request_spec=dict(instance_properties=dict(
+                        availability_zone=kwargs.pop('availability_zone',
+                                                     None))),
+                retry=dict(num_attempts=1, hosts=['host3']))
+        filter_properties.update(kwargs)
+        return filter_properties
+
+    def _schedule_per_host(self, host_states, filter_properties,
+                           weighted_fns, num_instances):
+        """What FilterScheduler._schedule() does without a HostTable"""
+        selected = []
+        hosts = host_states
+        for num in xrange(num_instances):
+            hosts = self.host_manager.filter_hosts(hosts, filter_properties,
+                                                   FILTERS)
+            if not hosts:
+                break
+            weighted_host = least_cost.weighted_sum(weighted_fns, hosts,
+                                                    filter_properties)
+            selected.append((weighted_host.weight,
+                             weighted_host.host_state.host,
+                             dict(weighted_host.host_state.limits)))
+            weighted_host.host_state.consume_from_instance(self.instance_type)
+        return selected
+
+    def _schedule_table(self, host_states, filter_properties,
+                        weighted_fns, num_instances):
+        selected = []
+        table = self.host_manager.get_host_table(host_states,
+                filter_properties, weighted_fns, FILTERS)
+        for num in xrange(num_instances):
+            weighted_host = table.get_best_host()
+            if weighted_host is None:
+                break
+            selected.append((weighted_host.weight,
+                             weighted_host.host_state.host,
+                             dict(weighted_host.host_state.limits)))
+            weighted_host.host_state.consume_from_instance(self.instance_type)
+            table.update(weighted_host.host_state)
+        return selected
+
+    def _assert_same_hosts(self, weighted_fns, num_instances=40, **kwargs):
+        expected = self._schedule_per_host(get_host_states(42),
+                self._get_filter_properties(**kwargs), weighted_fns,
+                num_instances)
+        selected = self._schedule_table(get_host_states(42),
+                self._get_filter_properties(**kwargs), weighted_fns,
+                num_instances)
+        self.assertTrue(expected)
+        self.assertEqual(selected, expected)
+
+    def test_fill_first(self):
+        self._assert_same_hosts([(1.0, least_cost.compute_fill_first_cost_fn)])
+
+    def test_spread_first(self):
+        self._assert_same_hosts([(-1.0,
+                                  least_cost.compute_fill_first_cost_fn)])
+
+    def test_ties(self):
+        self._assert_same_hosts([(1.0, least_cost.noop_cost_fn)])
+
+    def test_per_host_cost_fn(self):
+        self._assert_same_hosts([(-1.0, least_cost.compute_fill_first_cost_fn),
+                                 (0.5, free_disk_cost_fn)])
+
+    def test_runs_out_of_hosts(self):
+        self._assert_same_hosts([(-1.0,
+                                  least_cost.compute_fill_first_cost_fn)],
+                                num_instances=1000)
+
+    def test_availability_zone(self):
+        self._assert_same_hosts([(-1.0,
+                                  least_cost.compute_fill_first_cost_fn)],
+                                availability_zone='az2')
+
+    def test_ignore_and_force_hosts(self):
+        weighted_fns = [(-1.0, least_cost.compute_fill_first_cost_fn)]
+        self._assert_same_hosts(weighted_fns,
+                                ignore_hosts=['host%d' % i for i in xrange(9)])
+        self._assert_same_hosts(weighted_fns,
+                                force_hosts=['host1', 'host2', 'host3'])
+
+    def test_no_host_passes(self):
+        self.instance_type['memory_mb'] = 1024 * 1024
+        table = self.host_manager.get_host_table(get_host_states(42),
+                self._get_filter_properties(),
+                [(1.0, least_cost.compute_fill_first_cost_fn)], FILTERS)
+        self.assertEqual(table.get_best_host(), None)
+
+
+class FilterSchedulerHostTableTestCase(test.TestCase):
+    """Test case for FilterScheduler with scheduler_use_host_table"""
+
+    def _schedule(self, use_host_table):
+        self.flags(scheduler_use_host_table=use_host_table,
+                   compute_fill_first_cost_fn_weight=-1.0,
+                   scheduler_default_filters=FILTERS)
+        sched = fakes.FakeFilterScheduler()
+        host_states = get_host_states(7)
+        self.stubs.Set(sched.host_manager, 'get_all_host_states',
+                       lambda ctxt, topic: dict((host_state.host, host_state)
+                                                for host_state in host_states))
+        fake_context = context.RequestContext('user', 'project',
+                                              is_admin=True)
+        instance_properties = dict(project_id=1, root_gb=20, ephemeral_gb=0,
+                                   memory_mb=512, vcpus=2)
+        request_spec = dict(num_instances=30,
+                            instance_type=dict(memory_mb=512, root_gb=20,
+                                               ephemeral_gb=0, vcpus=2),
+                            instance_properties=instance_properties)
+        weighted_hosts = sched._schedule(fake_context, 'compute',
+                                         request_spec, {})
+        return [(weighted_host.weight, weighted_host.host_state.host)
+                for weighted_host in weighted_hosts]
+
+    def test_schedule_same_hosts(self):
+        expected = self._schedule(False)
+        self.assertEqual(len(expected), 30)
+        self.assertEqual(self._schedule(True), expected)
@@ -293,12 +293,11 @@ class SchedulerTestCase(test.TestCase):
         services = [service1, service2]
 
         self.mox.StubOutWithMock(db, 'service_get_all_by_topic')
-        self.mox.StubOutWithMock(utils, 'service_is_up')
+        self.mox.StubOutWithMock(utils, 'services_are_up')
 
         db.service_get_all_by_topic(self.context,
                 self.topic).AndReturn(services)
-        utils.service_is_up(service1).AndReturn(False)
-        utils.service_is_up(service2).AndReturn(True)
+        utils.services_are_up(services).AndReturn([False, True])
 
         self.mox.ReplayAll()
         result = self.driver.hosts_up(self.context, self.topic)
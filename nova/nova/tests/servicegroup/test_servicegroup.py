@@ -0,0 +1,142 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for the servicegroup drivers.
+"""
+
+from nova.common import memorycache
+from nova import context
+from nova import db
+from nova import exception
+from nova.openstack.common import timeutils
+from nova import service
+from nova import servicegroup
+from nova.servicegroup import db_driver
+from nova.servicegroup import mc_driver
+from nova import test
+from nova import utils
+
+
+class ServiceGroupTestCase(test.TestCase):
+    """Test case for the servicegroup drivers"""
+
+    def setUp(self):
+        super(ServiceGroupTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.flags(service_down_time=60,
+                   servicegroup_db_report_interval=300)
+        timeutils.set_time_override()
+        self.stubs.Set(servicegroup, '_drivers', {})
+        self.mc = memorycache.Client()
+        self.stubs.Set(mc_driver, '_memcache_client', lambda: self.mc)
+        self.service = service.Service('host1', 'nova-fake', 'fake',
+                                       'nova.tests.test_service.FakeManager')
+        self.service._create_service_ref(self.context)
+
+    def tearDown(self):
+        timeutils.clear_time_override()
+        super(ServiceGroupTestCase, self).tearDown()
+
+    def _service_ref(self):
+        return db.service_get(self.context, self.service.service_id)
+
+    def test_api(self):
+        self.assertTrue(isinstance(servicegroup.API(), db_driver.DbDriver))
+        self.assertTrue(servicegroup.API() is servicegroup.API())
+        self.flags(servicegroup_driver=
+                   'nova.servicegroup.mc_driver.MemcachedDriver',
+                   memcached_servers=['127.0.0.1:11211'])
+        self.assertTrue(isinstance(servicegroup.API(),
+                                   mc_driver.MemcachedDriver))
+
+    def test_mc_driver_needs_servers(self):
+        self.assertRaises(exception.NovaException, mc_driver.MemcachedDriver)
+
+    def test_db_driver(self):
+        driver = db_driver.DbDriver()
+        driver.report_state(self.service)
+        service_ref = self._service_ref()
+        self.assertEqual(service_ref['report_count'], 1)
+        self.assertTrue(driver.is_up(service_ref))
+
+        timeutils.advance_time_seconds(61)
+        self.assertFalse(driver.is_up(service_ref))
+
+    def test_mc_driver(self):
+        self.flags(memcached_servers=['127.0.0.1:11211'])
+        driver = mc_driver.MemcachedDriver()
+        service_ref = self._service_ref()
+        self.assertFalse(driver.is_up(service_ref))
+
+        driver.report_state(self.service)
+        self.assertTrue(driver.is_up(service_ref))
+        self.assertEqual(self._service_ref()['report_count'], 1)
+
+        # Only in memory until servicegroup_db_report_interval passed
+        for i in xrange(29):
+            timeutils.advance_time_seconds(10)
+            driver.report_state(self.service)
+            self.assertTrue(driver.is_up(service_ref))
+        self.assertEqual(self._service_ref()['report_count'], 1)
+        timeutils.advance_time_seconds(10)
+        driver.report_state(self.service)
+        self.assertEqual(self._service_ref()['report_count'], 2)
+
+        timeutils.advance_time_seconds(59)
+        self.assertTrue(driver.is_up(service_ref))
+        timeutils.advance_time_seconds(1)
+        self.assertFalse(driver.is_up(service_ref))
+
+    def test_mc_driver_are_up(self):
+        self.flags(memcached_servers=['127.0.0.1:11211'])
+        driver = mc_driver.MemcachedDriver()
+        other = service.Service('host2', 'nova-fake', 'fake',
+                                'nova.tests.test_service.FakeManager')
+        other._create_service_ref(self.context)
+        service_refs = [self._service_ref(),
+                        db.service_get(self.context, other.service_id)]
+        driver.report_state(other)
+
+        get_multi = self.mc.get_multi
+        multi_gets = []
+
+        def fake_get_multi(keys):
+            multi_gets.append(keys)
+            return get_multi(keys)
+
+        self.stubs.Set(self.mc, 'get_multi', fake_get_multi)
+        self.assertEqual(driver.are_up(service_refs), [False, True])
+        self.assertEqual(len(multi_gets), 1)
+        self.assertEqual(len(multi_gets[0]), 2)
+        self.assertEqual(driver.are_up([]), [])
+
+    def test_db_driver_are_up(self):
+        driver = db_driver.DbDriver()
+        driver.report_state(self.service)
+        self.assertEqual(driver.are_up([self._service_ref()]), [True])
+        self.assertEqual(utils.services_are_up([self._service_ref()]),
+                         [True])
+
+    def test_service_is_up_uses_driver(self):
+        self.flags(servicegroup_driver=
+                   'nova.servicegroup.mc_driver.MemcachedDriver',
+                   memcached_servers=['127.0.0.1:11211'])
+        service_ref = self._service_ref()
+        # The row was just created, it is memcached that tells
+        self.assertFalse(utils.service_is_up(service_ref))
+        self.service.report_state()
+        self.assertTrue(utils.service_is_up(service_ref))
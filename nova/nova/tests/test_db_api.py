@@ -60,6 +60,15 @@ class DbApiTestCase(test.TestCase):
         check_exc_format(db.get_ec2_instance_id_by_uuid)
         check_exc_format(db.get_instance_uuid_by_ec2_id)
 
+    def test_ec2_ids_by_uuids(self):
+        uuids = [str(utils.gen_uuid()) for i in xrange(3)]
+        ids = [db.ec2_instance_create(self.context, uuid)['id']
+               for uuid in uuids[:2]]
+        result = db.get_ec2_instance_ids_by_uuids(self.context, uuids)
+        self.assertEqual(result, dict(zip(uuids, ids)))
+        self.assertEqual(db.get_ec2_instance_ids_by_uuids(self.context, []),
+                         {})
+
     def test_instance_get_all_by_filters(self):
         self.create_instances_with_args()
         self.create_instances_with_args()
@@ -100,6 +109,29 @@ class DbApiTestCase(test.TestCase):
                                                 {'display_name': u'test'})
         self.assertEqual(1, len(result))
 
+    def test_instance_get_all_by_filters_columns(self):
+        self.create_instances_with_args(display_name='test1',
+                                        metadata={'foo': 'bar'})
+        result = db.instance_get_all_by_filters(self.context, {},
+                columns_to_join=[], columns=['display_name', 'name'])
+        self.assertEqual(1, len(result))
+        loaded = result[0].__dict__
+        for key in ('id', 'uuid', 'display_name'):
+            self.assertIn(key, loaded)
+        for key in ('host', 'image_ref', 'metadata', 'info_cache'):
+            self.assertNotIn(key, loaded)
+        self.assertEqual(result[0]['display_name'], 'test1')
+        self.assertEqual(result[0]['name'], 'instance-%08x' % result[0]['id'])
+
+    def test_instance_get_all_by_filters_columns_to_join(self):
+        self.create_instances_with_args(metadata={'foo': 'bar'})
+        result = db.instance_get_all_by_filters(self.context, {},
+                                                columns_to_join=['metadata'])
+        loaded = result[0].__dict__
+        self.assertIn('host', loaded)
+        self.assertEqual(loaded['metadata'][0]['key'], 'foo')
+        self.assertNotIn('info_cache', loaded)
+
     def test_instance_get_all_by_filters_deleted(self):
         inst1 = self.create_instances_with_args()
         inst2 = self.create_instances_with_args(reservation_id='b')
@@ -113,6 +145,25 @@ class DbApiTestCase(test.TestCase):
         else:
             self.assertTrue(result[1].deleted)
 
+    def test_instance_get_all_by_host_oldest_info_cache(self):
+        ctxt = context.get_admin_context()
+        inst1 = self.create_instances_with_args()
+        inst2 = self.create_instances_with_args()
+        self.create_instances_with_args(host='host2')
+        later = timeutils.utcnow() + datetime.timedelta(seconds=60)
+        db.instance_info_cache_update(ctxt, inst1['uuid'],
+                                      {'network_info': '[]',
+                                       'updated_at': later})
+
+        result = db.instance_get_all_by_host_oldest_info_cache(ctxt, 'host1')
+        self.assertEqual([inst2['uuid'], inst1['uuid']],
+                         [instance['uuid'] for instance in result])
+        result = db.instance_get_all_by_host_oldest_info_cache(ctxt, 'host1',
+                                                               limit=1)
+        self.assertEqual([inst2['uuid']],
+                         [instance['uuid'] for instance in result])
+        self.assertTrue(result[0]['info_cache'] is not None)
+
     def test_instance_get_all_by_filters_paginate(self):
         self.flags(sql_connection="notdb://")
         test1 = self.create_instances_with_args(display_name='test1')
@@ -1035,6 +1086,44 @@ class TestIpAllocation(test.TestCase):
         self.assertEqual(fixed_ip.instance_uuid, self.instance.uuid)
         self.assertEqual(fixed_ip.network_id, self.network.id)
 
+    def test_fixed_ip_get_free_by_network(self):
+        self.create_fixed_ip(address='192.168.0.1')
+        self.create_fixed_ip(address='192.168.0.2',
+                             network_id=self.network.id)
+        self.create_fixed_ip(address='192.168.0.3',
+                             network_id=self.network.id,
+                             instance_uuid=self.instance.uuid)
+        self.create_fixed_ip(address='192.168.0.4',
+                             network_id=self.network.id, reserved=True)
+        addresses = db.fixed_ip_get_free_by_network(self.ctxt,
+                                                    self.network.id, 10)
+        self.assertEqual(sorted(addresses), ['192.168.0.1', '192.168.0.2'])
+        self.assertEqual(len(db.fixed_ip_get_free_by_network(self.ctxt,
+                                                 self.network.id, 1)), 1)
+
+    def test_fixed_ip_associate_if_free(self):
+        address = self.create_fixed_ip()
+        self.assertTrue(db.fixed_ip_associate_if_free(self.ctxt, address,
+                self.network.id, instance_uuid=self.instance.uuid))
+        fixed_ip = db.fixed_ip_get_by_address(self.ctxt, address)
+        self.assertEqual(fixed_ip.instance_uuid, self.instance.uuid)
+        self.assertEqual(fixed_ip.network_id, self.network.id)
+
+        other = db.instance_create(self.ctxt, {})
+        self.assertFalse(db.fixed_ip_associate_if_free(self.ctxt, address,
+                self.network.id, instance_uuid=other.uuid))
+        fixed_ip = db.fixed_ip_get_by_address(self.ctxt, address)
+        self.assertEqual(fixed_ip.instance_uuid, self.instance.uuid)
+
+    def test_fixed_ip_associate_if_free_to_host(self):
+        address = self.create_fixed_ip(network_id=self.network.id)
+        self.assertTrue(db.fixed_ip_associate_if_free(self.ctxt, address,
+                self.network.id, host='host1'))
+        self.assertFalse(db.fixed_ip_associate_if_free(self.ctxt, address,
+                self.network.id, host='host2'))
+        fixed_ip = db.fixed_ip_get_by_address(self.ctxt, address)
+        self.assertEqual(fixed_ip.host, 'host1')
+
 
 class InstanceDestroyConstraints(test.TestCase):
 
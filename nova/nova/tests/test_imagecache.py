@@ -26,6 +26,7 @@ import time
 from nova import test
 
 from nova.compute import vm_states
+from nova import context
 from nova import db
 from nova import flags
 from nova.openstack.common import log
@@ -898,3 +899,68 @@ class ImageCacheManagerTestCase(test.TestCase):
 
             self.assertTrue(os.path.exists(base_filename))
             self.assertTrue(os.path.exists(base_filename + '.info'))
+
+    def test_prefetch_image(self):
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir, image_prefetch_max_rate=100)
+            image_cache_manager = imagecache.ImageCacheManager()
+            rates = []
+
+            def fake_fetch_image(context, target, image_id, user_id,
+                                 project_id, max_rate=None):
+                rates.append(max_rate())
+                image_cache_manager.record_image_use(image_id)
+                rates.append(max_rate())
+                f = open(target, 'w')
+                f.write('image')
+                f.close()
+
+            self.stubs.Set(virtutils, 'fetch_image', fake_fetch_image)
+            ctxt = context.get_admin_context()
+            self.assertTrue(image_cache_manager.prefetch_image(ctxt, 'img'))
+            base_file = os.path.join(tmpdir, '_base',
+                                     hashlib.sha1('img').hexdigest())
+            self.assertTrue(os.path.exists(base_file))
+            # A spawn waiting for the prefetch lifts its rate limit
+            self.assertEqual(rates, [100, None])
+            self.assertEqual(image_cache_manager.image_spawns, {'img': 1})
+            self.assertEqual(image_cache_manager.prefetching, {})
+
+            # Already fetched
+            self.assertFalse(image_cache_manager.prefetch_image(ctxt, 'img'))
+            self.assertEqual(len(rates), 2)
+
+    def test_verify_base_images_prefetches_popular_images(self):
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir, image_prefetch_popular_count=2,
+                       remove_unused_base_images=True)
+            os.mkdir(os.path.join(tmpdir, '_base'))
+
+            instances = [{'image_ref': image_ref,
+                          'host': 'remote_host',
+                          'name': 'instance-%d' % i,
+                          'uuid': str(i),
+                          'vm_state': '',
+                          'task_state': ''}
+                         for i, image_ref in enumerate(['1', '2', '2', '3',
+                                                        '3', '3'])]
+            self.stubs.Set(db, 'instance_get_all', lambda x: instances)
+
+            # An old base file of a popular image stays
+            old = time.time() - (25 * 3600)
+            base_file = os.path.join(tmpdir, '_base',
+                                     hashlib.sha1('2').hexdigest())
+            f = open(base_file, 'w')
+            f.write('image')
+            f.close()
+            os.utime(base_file, (old, old))
+
+            image_cache_manager = imagecache.ImageCacheManager()
+            prefetched = []
+            self.stubs.Set(image_cache_manager, 'prefetch_images',
+                           lambda context, image_ids:
+                               prefetched.append(image_ids))
+            image_cache_manager.verify_base_images(None)
+
+            self.assertTrue(os.path.exists(base_file))
+            self.assertEqual(prefetched, [['3']])
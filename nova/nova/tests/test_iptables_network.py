@@ -170,3 +170,85 @@ class IptablesManagerTestCase(test.TestCase):
             self.assertTrue('[0:0] -A %s -j %s-%s' %
                             (chain, self.binary_name, chain) in new_lines,
                             "Built-in chain %s not wrapped" % (chain,))
+
+    def _fake_execute(self, *cmd, **kwargs):
+        self.executed.append(cmd)
+        if cmd[0] == 'iptables-save':
+            return '\n'.join(self.current[cmd[-1]]), ''
+        if cmd[0] == 'iptables-restore':
+            lines = kwargs['process_input'].split('\n')
+            self.current[lines[1][1:]] = lines
+        return '', ''
+
+    def test_apply_only_dirty_tables(self):
+        self.flags(use_ipv6=False)
+        self.executed = []
+        self.current = {'filter': self.sample_filter, 'nat': self.sample_nat}
+        self.manager.execute = self._fake_execute
+
+        self.manager.apply()
+        self.assertEqual(len(self.executed), 4)
+        self.assertEqual(self.manager._last_apply['tables'], 2)
+
+        self.executed = []
+        self.manager.apply()
+        self.assertEqual(self.executed, [])
+        self.assertEqual(self.manager._last_apply['skipped'], 2)
+
+        self.manager.ipv4['filter'].add_rule('FORWARD', '-s 1.2.3.4/5 -j DROP')
+        self.manager.apply()
+        self.assertEqual([cmd[0] for cmd in self.executed],
+                         ['iptables-save', 'iptables-restore'])
+        self.assertTrue('[0:0] -A %s-FORWARD -s 1.2.3.4/5 -j DROP' %
+                        self.binary_name in self.current['filter'])
+
+    def test_apply_skips_restore_when_up_to_date(self):
+        self.flags(use_ipv6=False)
+        self.executed = []
+        self.current = {'filter': self.sample_filter, 'nat': self.sample_nat}
+        self.manager.execute = self._fake_execute
+        self.manager.apply()
+
+        # The rules are there already, only the counts differ
+        self.current['filter'] = [line.replace('[0:0] -A', '[7:42] -A')
+                                  for line in self.current['filter']]
+        self.manager.ipv4['filter'].dirty = True
+        self.executed = []
+        self.manager.apply()
+        self.assertEqual([cmd[0] for cmd in self.executed], ['iptables-save'])
+        self.assertEqual(self.manager._last_apply['unchanged'], 1)
+
+    def test_apply_all_tables_periodically(self):
+        self.flags(use_ipv6=False, iptables_full_apply_interval=300)
+        self.executed = []
+        self.current = {'filter': self.sample_filter, 'nat': self.sample_nat}
+        self.manager.execute = self._fake_execute
+        self.manager.apply()
+        self.assertTrue(self.manager._last_apply['full'])
+
+        # Flushed outside of nova, nothing changed in nova
+        self.current['filter'] = self.sample_filter
+        self.manager.apply()
+        self.assertEqual(self.manager._last_apply['skipped'], 2)
+        self.assertFalse(self.manager._last_apply['full'])
+
+        self.manager._last_full_apply -= 300
+        self.executed = []
+        self.manager.apply()
+        self.assertTrue(self.manager._last_apply['full'])
+        self.assertEqual(self.manager._last_apply['skipped'], 0)
+        self.assertEqual([cmd[0] for cmd in self.executed],
+                         ['iptables-save', 'iptables-restore',
+                          'iptables-save'])
+        self.assertTrue('[0:0] -A FORWARD -j %s-FORWARD' %
+                        self.binary_name in self.current['filter'])
+
+    def test_remove_rules_are_flushed(self):
+        current_lines = self.sample_filter
+        table = self.manager.ipv4['filter']
+        for i in xrange(3):
+            table.add_rule('FORWARD', '-s 10.0.0.%d -j DROP' % i, wrap=False)
+            table.remove_rule('FORWARD', '-s 10.0.0.%d -j DROP' % i,
+                              wrap=False)
+        self.manager._modify_rules(current_lines, table)
+        self.assertEqual(table.remove_rules, [])
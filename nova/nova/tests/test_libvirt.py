@@ -991,6 +991,50 @@ class LibvirtConnTestCase(test.TestCase):
         # None should be listed, since we fake deleted the last one
         self.assertEquals(len(instances), 0)
 
+    def test_get_power_states(self):
+        info_calls = []
+
+        class FakeDomain(object):
+            def __init__(self, id, name, state=None):
+                self._id = id
+                self._name = name
+                self._state = state
+
+            def ID(self):
+                return self._id
+
+            def name(self):
+                return self._name
+
+            def info(self):
+                info_calls.append(self._name)
+                return [self._state, None, None, None, None]
+
+        domains = {
+            libvirt_driver.VIR_CONNECT_LIST_DOMAINS_RUNNING: [
+                FakeDomain(0, 'Domain-0'), FakeDomain(1, 'running')],
+            libvirt_driver.VIR_CONNECT_LIST_DOMAINS_PAUSED: [
+                FakeDomain(2, 'paused')],
+            libvirt_driver.VIR_CONNECT_LIST_DOMAINS_SHUTOFF: [
+                FakeDomain(-1, 'shutoff')],
+            libvirt_driver.VIR_CONNECT_LIST_DOMAINS_OTHER: [
+                FakeDomain(3, 'crashed', libvirt_driver.VIR_DOMAIN_CRASHED)],
+        }
+
+        self.mox.StubOutWithMock(libvirt_driver.LibvirtDriver, '_conn')
+        libvirt_driver.LibvirtDriver._conn.listAllDomains = domains.get
+
+        self.mox.ReplayAll()
+        conn = libvirt_driver.LibvirtDriver(False)
+        power_states = conn.get_power_states([])
+        self.assertEqual(power_states,
+                         {'running': power_state.RUNNING,
+                          'paused': power_state.PAUSED,
+                          'shutoff': power_state.SHUTDOWN,
+                          'crashed': power_state.CRASHED})
+        # only the domains in an unlisted state are asked
+        self.assertEqual(info_calls, ['crashed'])
+
     def test_get_all_block_devices(self):
         xml = [
             # NOTE(vish): id 0 is skipped
@@ -3217,6 +3261,107 @@ class IptablesFirewallTestCase(test.TestCase):
                       if rule.chain == 'provider']
         self.assertEqual(1, len(rules))
 
+    def test_shared_security_group_chains(self):
+        self.flags(firewall_shared_security_group_chains=True)
+        admin_ctxt = context.get_admin_context()
+        secgroup = db.security_group_create(admin_ctxt,
+                                            {'user_id': 'fake',
+                                             'project_id': 'fake',
+                                             'name': 'testgroup',
+                                             'description': 'test group'})
+        src_secgroup = db.security_group_create(admin_ctxt,
+                                                {'user_id': 'fake',
+                                                 'project_id': 'fake',
+                                                 'name': 'testsourcegroup',
+                                                 'description': 'src group'})
+        db.security_group_rule_create(admin_ctxt,
+                                      {'parent_group_id': secgroup['id'],
+                                       'protocol': 'tcp',
+                                       'from_port': 22,
+                                       'to_port': 22,
+                                       'cidr': '192.168.10.0/24'})
+        db.security_group_rule_create(admin_ctxt,
+                                      {'parent_group_id': secgroup['id'],
+                                       'protocol': 'tcp',
+                                       'from_port': 80,
+                                       'to_port': 80,
+                                       'group_id': src_secgroup['id']})
+
+        instance_refs = [self._create_instance_ref() for i in xrange(2)]
+        for instance_ref in instance_refs:
+            db.instance_add_security_group(admin_ctxt, instance_ref['uuid'],
+                                           secgroup['id'])
+        src_instance_ref = self._create_instance_ref()
+        db.instance_add_security_group(admin_ctxt, src_instance_ref['uuid'],
+                                       src_secgroup['id'])
+
+        class FakeNetworkInfo(object):
+            def __init__(self, instance):
+                self.instance = instance
+
+            def fixed_ips(self):
+                return [{'address': '10.0.0.%s' % self.instance['id'],
+                         'version': 4}]
+
+        _fake_stub_out_get_nw_info(self.stubs,
+                lambda self, ctxt, instance: FakeNetworkInfo(instance))
+        cmds = []
+        self.stubs.Set(self.fw.iptables, 'execute',
+                       lambda *cmd, **kwargs: cmds.append(cmd))
+        applies = []
+        self.stubs.Set(self.fw.iptables, 'apply',
+                       lambda: applies.append(True))
+        self.stubs.Set(self.fw.nwfilter, 'unfilter_instance',
+                       lambda *args: None)
+
+        network_info = _fake_network_info(self.stubs, 1)
+        for instance_ref in instance_refs:
+            self.fw.prepare_instance_filter(instance_ref, network_info)
+
+        # The group is rendered once, matching the set of its source group
+        chain_name = 'nova-sg-%s' % secgroup['id']
+        set_name = 'nova-sg-members-%s' % src_secgroup['id']
+        rules = [rule.rule for rule in self.fw.iptables.ipv4['filter'].rules
+                 if rule.chain == chain_name]
+        self.assertEqual(rules,
+                ['-j ACCEPT -p tcp --dport 22 -s 192.168.10.0/24',
+                 '-j ACCEPT -p tcp --dport 80 -m set --match-set %s src' %
+                 set_name])
+        for instance_ref in instance_refs:
+            inst_chain = 'inst-%s' % instance_ref['id']
+            jumps = [rule for rule in self.fw.iptables.ipv4['filter'].rules
+                     if rule.chain == inst_chain and
+                        rule.rule.endswith('-%s' % chain_name)]
+            self.assertEqual(len(jumps), 1)
+        address = '10.0.0.%s' % src_instance_ref['id']
+        self.assertEqual(cmds,
+                [('ipset', 'create', set_name, 'hash:ip', '-exist'),
+                 ('ipset', 'flush', set_name),
+                 ('ipset', 'add', set_name, address, '-exist')])
+
+        # A new member only touches the set
+        new_instance_ref = self._create_instance_ref()
+        db.instance_add_security_group(admin_ctxt, new_instance_ref['uuid'],
+                                       src_secgroup['id'])
+        del cmds[:]
+        del applies[:]
+        self.fw.refresh_security_group_members(src_secgroup['id'])
+        self.assertEqual(cmds,
+                [('ipset', 'add', set_name,
+                  '10.0.0.%s' % new_instance_ref['id'], '-exist')])
+        self.assertEqual(applies, [])
+
+        # The chain and the set go with the last instance using them
+        del cmds[:]
+        self.fw.unfilter_instance(instance_refs[0], network_info)
+        self.assertTrue(chain_name in self.fw.iptables.ipv4['filter'].chains)
+        self.assertEqual(cmds, [])
+        self.fw.unfilter_instance(instance_refs[1], network_info)
+        self.assertFalse(chain_name in
+                         self.fw.iptables.ipv4['filter'].chains)
+        self.assertEqual(cmds, [('ipset', 'flush', set_name)])
+        self.assertEqual(self.fw.ipsets, {})
+
 
 class NWFilterTestCase(test.TestCase):
     def setUp(self):
@@ -3584,12 +3729,28 @@ disk size: 4.4M''', ''))
         image_id = '4'
         user_id = 'fake'
         project_id = 'fake'
-        images.fetch_to_raw(context, image_id, target, user_id, project_id)
+        images.fetch_to_raw(context, image_id, target, user_id, project_id,
+                            max_rate=None)
 
         self.mox.ReplayAll()
         libvirt_utils.fetch_image(context, target, image_id,
                                   user_id, project_id)
 
+    def test_fetch_image_stores_checksum(self):
+        self.flags(checksum_base_images=True)
+        self.mox.StubOutWithMock(images, 'fetch_to_raw')
+        self.mox.StubOutWithMock(libvirt_utils, 'write_stored_info')
+
+        target = '/tmp/targetfile'
+        images.fetch_to_raw('opaque context', '4', target, 'fake', 'fake',
+                            max_rate=None).AndReturn('fake-sha1')
+        libvirt_utils.write_stored_info(target, field='sha1',
+                                        value='fake-sha1')
+
+        self.mox.ReplayAll()
+        libvirt_utils.fetch_image('opaque context', target, '4',
+                                  'fake', 'fake')
+
     def test_get_disk_backing_file(self):
         with_actual_path = False
 
@@ -23,9 +23,11 @@ from copy import copy
 import json
 import re
 
+import eventlet
 import webob
 
 from nova.api.metadata import base
+from nova.api.metadata import cache_notifier
 from nova.api.metadata import handler
 from nova import block_device
 from nova import db
@@ -33,6 +35,7 @@ from nova.db.sqlalchemy import api
 from nova import exception
 from nova import flags
 from nova import network
+from nova.openstack.common import timeutils
 from nova import test
 from nova.tests import fake_network
 
@@ -405,3 +408,130 @@ class MetadataHandlerTestCase(test.TestCase):
                                 fake_get_metadata=fake_get_metadata,
                                 headers=None)
         self.assertEqual(response.status_int, 500)
+
+
+class MetadataCacheTestCase(test.TestCase):
+    """Test the caching of metadata by the handler."""
+
+    def setUp(self):
+        super(MetadataCacheTestCase, self).setUp()
+
+        fake_network.stub_out_nw_api_get_instance_nw_info(self.stubs,
+                                                          spectacular=True)
+        self.mdinst = fake_InstanceMetadata(self.stubs, INSTANCES[0])
+        self.lookups = []
+        timeutils.set_time_override()
+
+        def fake_get_instance_uuid_by_address(address):
+            self.lookups.append(address)
+            # Lets the concurrent requests run
+            eventlet.sleep(0)
+            if address != '127.0.0.1':
+                raise exception.NotFound()
+            return self.mdinst.instance['uuid']
+
+        def fake_get_metadata_by_instance_uuid(instance_uuid, address):
+            return self.mdinst
+
+        self.stubs.Set(base, 'get_instance_uuid_by_address',
+                       fake_get_instance_uuid_by_address)
+        self.stubs.Set(base, 'get_metadata_by_instance_uuid',
+                       fake_get_metadata_by_instance_uuid)
+        self.app = handler.MetadataRequestHandler()
+
+    def tearDown(self):
+        timeutils.clear_time_override()
+        super(MetadataCacheTestCase, self).tearDown()
+
+    def _expire_local_cache(self):
+        timeutils.advance_time_seconds(FLAGS.metadata_local_cache_expiration)
+
+    def test_local_cache_hit(self):
+        self.assertEqual(self.app.get_metadata('127.0.0.1'), self.mdinst)
+        gets = []
+        self.stubs.Set(self.app._cache, 'get', gets.append)
+        self.assertEqual(self.app.get_metadata('127.0.0.1'), self.mdinst)
+        self.assertEqual(self.lookups, ['127.0.0.1'])
+        # Not even the generation is read from memcache
+        self.assertEqual(gets, [])
+
+    def test_memcache_hit(self):
+        self.app.get_metadata('127.0.0.1')
+        self.app._local_cache = handler._LocalCache(10)
+        self.assertEqual(self.app.get_metadata('127.0.0.1'), self.mdinst)
+        self.assertEqual(self.lookups, ['127.0.0.1'])
+
+    def test_negative_cache(self):
+        self.assertEqual(self.app.get_metadata('127.0.0.2'), None)
+        self.assertEqual(self.app.get_metadata('127.0.0.2'), None)
+        self.assertEqual(self.lookups, ['127.0.0.2'])
+
+    def test_concurrent_misses_share_lookup(self):
+        threads = [eventlet.spawn(self.app.get_metadata, '127.0.0.1')
+                   for i in xrange(3)]
+        for thread in threads:
+            self.assertEqual(thread.wait(), self.mdinst)
+        self.assertEqual(self.lookups, ['127.0.0.1'])
+        self.assertEqual(self.app._lookups, {})
+
+    def test_concurrent_misses_share_error(self):
+        def fake_get_instance_uuid_by_address(address):
+            self.lookups.append(address)
+            eventlet.sleep(0)
+            raise test.TestingException()
+
+        self.stubs.Set(base, 'get_instance_uuid_by_address',
+                       fake_get_instance_uuid_by_address)
+        threads = [eventlet.spawn(self.app.get_metadata, '127.0.0.1')
+                   for i in xrange(2)]
+        for thread in threads:
+            self.assertRaises(test.TestingException, thread.wait)
+        self.assertEqual(self.lookups, ['127.0.0.1'])
+
+    def test_local_cache_size(self):
+        self.flags(metadata_local_cache_size=2)
+        self.app = handler.MetadataRequestHandler()
+        for address in ('127.0.0.2', '127.0.0.3', '127.0.0.4'):
+            self.app.get_metadata(address)
+        self.assertEqual(len(self.app._local_cache._entries), 2)
+
+    def test_no_cache(self):
+        self.flags(metadata_cache_expiration=0)
+        self.app.get_metadata('127.0.0.1')
+        self.app.get_metadata('127.0.0.1')
+        self.assertEqual(self.lookups, ['127.0.0.1', '127.0.0.1'])
+
+    def test_instance_update_invalidates(self):
+        self.stubs.Set(cache_notifier, '_cache', self.app._cache)
+        self.app.get_metadata('127.0.0.1')
+
+        payload = {'instance_id': self.mdinst.instance['uuid']}
+        cache_notifier.notify(None, {'event_type': 'compute.instance.update',
+                                     'payload': payload})
+        # Served from memory until the local entry expires
+        self.app.get_metadata('127.0.0.1')
+        self.assertEqual(self.lookups, ['127.0.0.1'])
+        self._expire_local_cache()
+        self.app.get_metadata('127.0.0.1')
+        self.assertEqual(self.lookups, ['127.0.0.1', '127.0.0.1'])
+
+        cache_notifier.notify(None, {'event_type': 'volume.create.end',
+                                     'payload': {}})
+        self._expire_local_cache()
+        self.app.get_metadata('127.0.0.1')
+        self.assertEqual(self.lookups, ['127.0.0.1', '127.0.0.1'])
+
+    def test_invalidated_during_lookup(self):
+        self.stubs.Set(cache_notifier, '_cache', self.app._cache)
+
+        def fake_get_metadata_by_instance_uuid(instance_uuid, address):
+            # The instance changes after the generation was read
+            handler.invalidate(self.app._cache, instance_uuid)
+            return self.mdinst
+
+        self.stubs.Set(base, 'get_metadata_by_instance_uuid',
+                       fake_get_metadata_by_instance_uuid)
+        self.app.get_metadata('127.0.0.1')
+        self._expire_local_cache()
+        self.app.get_metadata('127.0.0.1')
+        self.assertEqual(self.lookups, ['127.0.0.1', '127.0.0.1'])
@@ -328,6 +328,9 @@ class FakeDriver(object):
     def destroy_all_by_project(self, context, project_id):
         self.called.append(('destroy_all_by_project', context, project_id))
 
+    def invalidate(self, context, project_id=None, quota_class=None):
+        self.called.append(('invalidate', context, project_id, quota_class))
+
     def expire(self, context):
         self.called.append(('expire', context))
 
@@ -695,6 +698,16 @@ class QuotaEngineTestCase(test.TestCase):
                 ('destroy_all_by_project', context, 'test_project'),
                 ])
 
+    def test_invalidate(self):
+        context = FakeContext(None, None)
+        driver = FakeDriver()
+        quota_obj = self._make_quota_obj(driver)
+        quota_obj.invalidate(context, project_id='test_project')
+
+        self.assertEqual(driver.called, [
+                ('invalidate', context, 'test_project', None),
+                ])
+
     def test_expire(self):
         context = FakeContext(None, None)
         driver = FakeDriver()
@@ -1385,6 +1398,98 @@ class DbQuotaDriverTestCase(test.TestCase):
                 ])
         self.assertEqual(result, ['resv-1', 'resv-2', 'resv-3'])
 
+    def _stub_quota_reserve_conditional(self, result):
+        def fake_quota_reserve_conditional(context, quotas, deltas, expire,
+                                           max_age):
+            self.calls.append(('quota_reserve_conditional', expire, max_age))
+            return result
+        self.stubs.Set(db, 'quota_reserve_conditional',
+                       fake_quota_reserve_conditional)
+
+    def test_reserve_conditional(self):
+        self._stub_get_project_quotas()
+        self._stub_quota_reserve()
+        self._stub_quota_reserve_conditional(['resv-4'])
+        self.flags(quota_conditional_reserve=True)
+        expire = timeutils.utcnow() + datetime.timedelta(seconds=120)
+        result = self.driver.reserve(FakeContext('test_project', 'test_class'),
+                                     quota.QUOTAS._resources,
+                                     dict(instances=2), expire=expire)
+
+        self.assertEqual(self.calls, [
+                'get_project_quotas',
+                ('quota_reserve_conditional', expire, 0),
+                ])
+        self.assertEqual(result, ['resv-4'])
+
+    def test_reserve_conditional_needs_refresh(self):
+        self._stub_get_project_quotas()
+        self._stub_quota_reserve()
+        self._stub_quota_reserve_conditional(None)
+        self.flags(quota_conditional_reserve=True)
+        expire = timeutils.utcnow() + datetime.timedelta(seconds=120)
+        result = self.driver.reserve(FakeContext('test_project', 'test_class'),
+                                     quota.QUOTAS._resources,
+                                     dict(instances=2), expire=expire)
+
+        self.assertEqual(self.calls, [
+                'get_project_quotas',
+                ('quota_reserve_conditional', expire, 0),
+                ('quota_reserve', expire, 0, 0),
+                ])
+        self.assertEqual(result, ['resv-1', 'resv-2', 'resv-3'])
+
+    def _stub_get_all_quotas(self):
+        def fake_quota_get_all_by_project(context, project_id):
+            self.calls.append(('quota_get_all_by_project', project_id))
+            return dict(project_id=project_id, instances=5)
+
+        def fake_quota_class_get_all_by_name(context, quota_class):
+            self.calls.append(('quota_class_get_all_by_name', quota_class))
+            return dict(class_name=quota_class, instances=7, cores=30)
+
+        self.stubs.Set(db, 'quota_get_all_by_project',
+                       fake_quota_get_all_by_project)
+        self.stubs.Set(db, 'quota_class_get_all_by_name',
+                       fake_quota_class_get_all_by_name)
+
+    def test_get_quotas_cached(self):
+        self._stub_get_all_quotas()
+        self.flags(quota_cache_expiration=60)
+        context = FakeContext('test_project', 'test_class')
+        for i in xrange(2):
+            result = self.driver._get_quotas(context,
+                                             quota.QUOTAS._resources,
+                                             ['instances', 'cores', 'ram'],
+                                             True)
+            self.assertEqual(result, dict(instances=5, cores=30,
+                                          ram=50 * 1024))
+
+        self.assertEqual(self.calls, [
+                ('quota_get_all_by_project', 'test_project'),
+                ('quota_class_get_all_by_name', 'test_class'),
+                ])
+
+    def test_invalidate(self):
+        self._stub_get_all_quotas()
+        self.flags(quota_cache_expiration=60)
+        context = FakeContext('test_project', 'test_class')
+        self.driver._get_quotas(context, quota.QUOTAS._resources,
+                                ['instances'], True)
+        self.driver.invalidate(context, project_id='test_project')
+        self.driver._get_quotas(context, quota.QUOTAS._resources,
+                                ['instances'], True)
+        self.driver.invalidate(context, quota_class='test_class')
+        self.driver._get_quotas(context, quota.QUOTAS._resources,
+                                ['instances'], True)
+
+        self.assertEqual(self.calls, [
+                ('quota_get_all_by_project', 'test_project'),
+                ('quota_class_get_all_by_name', 'test_class'),
+                ('quota_get_all_by_project', 'test_project'),
+                ('quota_class_get_all_by_name', 'test_class'),
+                ])
+
 
 class FakeSession(object):
     def begin(self):
@@ -1940,3 +2045,93 @@ class QuotaReserveSqlAlchemyTestCase(test.TestCase):
                      project_id='test_project',
                      delta=-2 * 1024),
                 ])
+
+
+class QuotaReserveConditionalTestCase(test.TestCase):
+    """Tests the conditional reservations against the database."""
+
+    def setUp(self):
+        super(QuotaReserveConditionalTestCase, self).setUp()
+        self.context = context.RequestContext('fake_user', 'test_project')
+        self.admin_context = context.get_admin_context()
+        self.usages = {}
+        for resource, in_use, reserved in (('instances', 2, 1),
+                                           ('cores', 4, 2)):
+            self.usages[resource] = db.quota_usage_create(self.admin_context,
+                    'test_project', resource, in_use, reserved, None)['id']
+        self.quotas = dict(instances=5, cores=10)
+        self.expire = timeutils.utcnow() + datetime.timedelta(seconds=60)
+
+    def tearDown(self):
+        timeutils.clear_time_override()
+        super(QuotaReserveConditionalTestCase, self).tearDown()
+
+    def _get_usages(self):
+        usages = db.quota_usage_get_all_by_project(self.context,
+                                                   'test_project')
+        return dict((resource, usages[resource]['reserved'])
+                    for resource in self.usages)
+
+    def test_reserve(self):
+        result = db.quota_reserve_conditional(self.context, self.quotas,
+                dict(instances=2, cores=-1), self.expire, 0)
+
+        self.assertEqual(len(result), 2)
+        self.assertEqual(self._get_usages(), dict(instances=3, cores=2))
+        reservations = [db.reservation_get(self.context, uuid)
+                        for uuid in result]
+        self.assertEqual(sorted((r['resource'], r['usage_id'], r['delta'])
+                                for r in reservations),
+                         [('cores', self.usages['cores'], -1),
+                          ('instances', self.usages['instances'], 2)])
+
+        db.reservation_commit(self.context, result)
+        self.assertEqual(self._get_usages(), dict(instances=1, cores=2))
+
+    def test_reserve_unlimited(self):
+        self.quotas['instances'] = -1
+        result = db.quota_reserve_conditional(self.context, self.quotas,
+                dict(instances=20), self.expire, 0)
+
+        self.assertEqual(len(result), 1)
+        self.assertEqual(self._get_usages(), dict(instances=21, cores=2))
+
+    def test_reserve_over_quota(self):
+        result = db.quota_reserve_conditional(self.context, self.quotas,
+                dict(instances=1, cores=5), self.expire, 0)
+
+        self.assertEqual(result, None)
+        self.assertEqual(self._get_usages(), dict(instances=1, cores=2))
+
+    def test_reserve_missing_usage(self):
+        result = db.quota_reserve_conditional(self.context,
+                dict(instances=5, ram=1024), dict(instances=1, ram=512),
+                self.expire, 0)
+
+        self.assertEqual(result, None)
+        self.assertEqual(self._get_usages(), dict(instances=1, cores=2))
+
+    def test_reserve_until_refresh(self):
+        db.quota_usage_update(self.admin_context, 'test_project', 'cores',
+                              4, 2, 5)
+        result = db.quota_reserve_conditional(self.context, self.quotas,
+                dict(instances=1, cores=1), self.expire, 0)
+
+        self.assertEqual(result, None)
+
+    def test_reservation_expire(self):
+        db.quota_reserve_conditional(self.context, self.quotas,
+                dict(instances=1, cores=2), self.expire, 0)
+        db.quota_reserve_conditional(self.context, self.quotas,
+                dict(instances=1, cores=-1),
+                self.expire + datetime.timedelta(seconds=60), 0)
+        self.assertEqual(self._get_usages(), dict(instances=3, cores=4))
+
+        timeutils.set_time_override(self.expire +
+                                    datetime.timedelta(seconds=1))
+        db.reservation_expire(self.admin_context)
+        self.assertEqual(self._get_usages(), dict(instances=2, cores=2))
+
+        timeutils.advance_time_seconds(60)
+        db.reservation_expire(self.admin_context)
+        self.assertEqual(self._get_usages(), dict(instances=1, cores=2))
@@ -30,6 +30,7 @@ from nova import flags
 from nova import manager
 from nova.openstack.common import cfg
 from nova import service
+from nova.servicegroup import db_driver
 from nova import test
 from nova import wsgi
 
@@ -110,6 +111,7 @@ class ServiceTestCase(test.TestCase):
     def setUp(self):
         super(ServiceTestCase, self).setUp()
         self.mox.StubOutWithMock(service, 'db')
+        self.stubs.Set(db_driver, 'db', service.db)
 
     def test_create(self):
         host = 'foo'
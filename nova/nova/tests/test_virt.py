@@ -15,15 +15,18 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
 import os
 import platform
 
 from nova import exception
 from nova import flags
+from nova.image import glance
 from nova import test
 from nova import utils
 from nova.virt.disk import api as disk_api
 from nova.virt import driver
+from nova.virt import images
 
 from nova.openstack.common import jsonutils
 
@@ -194,3 +197,60 @@ class TestVirtDiskPaths(test.TestCase):
             json_file = os.path.join(tmpdir, 'meta.js')
             json_data = jsonutils.loads(open(json_file).read())
             self.assertEqual(metadata, json_data)
+
+
+class FakeImageService(object):
+    def __init__(self, chunks, checksum):
+        self.chunks = chunks
+        self.checksum = checksum
+
+    def show(self, context, image_id):
+        return {'id': image_id, 'checksum': self.checksum}
+
+    def download(self, context, image_id, data):
+        for chunk in self.chunks:
+            data.write(chunk)
+
+
+class FakeFile(object):
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+
+class TestVirtImages(test.TestCase):
+    def _stub_image_service(self, chunks, checksum):
+        image_service = FakeImageService(chunks, checksum)
+        self.stubs.Set(glance, 'get_remote_image_service',
+                       lambda context, image_href: (image_service,
+                                                    image_href))
+
+    def test_fetch_checks_and_returns_checksum(self):
+        chunks = ['a' * 5, 'b' * 7, 'c' * 3]
+        data = ''.join(chunks)
+        self._stub_image_service(chunks, hashlib.md5(data).hexdigest())
+        self.flags(image_download_buffer_size=4)
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image')
+            checksum = images.fetch(None, 'fake', path, None, None)
+            self.assertEqual(open(path).read(), data)
+        self.assertEqual(checksum, hashlib.sha1(data).hexdigest())
+
+    def test_fetch_bad_checksum(self):
+        self._stub_image_service(['data'], hashlib.md5('other').hexdigest())
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image')
+            self.assertRaises(exception.ImageUnacceptable,
+                              images.fetch, None, 'fake', path, None, None)
+            self.assertFalse(os.path.exists(path))
+
+    def test_image_writer_writes_whole_buffers(self):
+        image_file = FakeFile()
+        writer = images._ImageWriter(image_file, 4)
+        for chunk in ['a' * 5, 'b' * 2, 'c' * 3, 'd']:
+            writer.write(chunk)
+        writer.flush()
+        self.assertEqual(image_file.writes, ['aaaa', 'abbc', 'ccd'])
+        self.assertEqual(writer.size, 11)
@@ -405,6 +405,19 @@ class _VirtDriverTestCase(_FakeDriverBackendTestCase):
                           self.connection.get_info,
                           {'name': 'I just made this name up'})
 
+    @catch_notimplementederror
+    def test_get_power_states(self):
+        instance_ref, network_info = self._get_running_instance()
+        power_states = self.connection.get_power_states([instance_ref])
+        info = self.connection.get_info(instance_ref)
+        self.assertEqual(power_states[instance_ref['name']], info['state'])
+
+    @catch_notimplementederror
+    def test_get_power_states_for_unknown_instance(self):
+        power_states = self.connection.get_power_states(
+                [{'name': 'I just made this name up'}])
+        self.assertFalse('I just made this name up' in power_states)
+
     @catch_notimplementederror
     def test_get_diagnostics(self):
         instance_ref, network_info = self._get_running_instance()
@@ -1192,11 +1192,17 @@ def temporary_mutation(obj, **kwargs):
 
 
 def service_is_up(service):
-    """Check whether a service is up based on last heartbeat."""
-    last_heartbeat = service['updated_at'] or service['created_at']
-    # Timestamps in DB are UTC.
-    elapsed = total_seconds(timeutils.utcnow() - last_heartbeat)
-    return abs(elapsed) <= FLAGS.service_down_time
+    """Check whether a service is up, as told by the servicegroup driver."""
+    # NOTE: the servicegroup drivers import this module
+    from nova import servicegroup
+    return servicegroup.API().is_up(service)
+
+
+def services_are_up(services):
+    """Whether each of the services is up, asked to the servicegroup
+    driver at once."""
+    from nova import servicegroup
+    return servicegroup.API().are_up(services)
 
 
 def generate_mac_address():
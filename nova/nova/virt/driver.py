@@ -22,6 +22,7 @@ Driver base-classes:
     types that support that contract
 """
 
+from nova import exception
 from nova import flags
 from nova.openstack.common import log as logging
 
@@ -123,6 +124,31 @@ class ComputeDriver(object):
         """
         return len(self.list_instances())
 
+    def get_power_states(self, instances):
+        """Return the power states of instances, in one call if possible.
+
+        :param instances: list of instances, as given to get_info()
+
+        Returns a dict of instance name to power_state code. Instances not
+        found on the hypervisor are left out; other virtual machines the
+        hypervisor knows about may be included.
+
+        .. note::
+
+            This implementation works for all drivers, but it is
+            not particularly efficient. Maintainers of the virt drivers are
+            encouraged to override this method with something more
+            efficient.
+        """
+        power_states = {}
+        for instance in instances:
+            try:
+                power_states[instance['name']] = \
+                        self.get_info(instance)['state']
+            except exception.InstanceNotFound:
+                pass
+        return power_states
+
     def instance_exists(self, instance_id):
         """Checks existence of an instance on the host.
 
@@ -651,6 +677,12 @@ class ComputeDriver(object):
         the cache and remove images which are no longer of interest.
         """
 
+    def prefetch_image(self, context, image_id):
+        """Fetch an image into the driver's local image cache ahead of the
+        instances booting from it.
+        """
+        raise NotImplementedError()
+
     def add_to_aggregate(self, context, aggregate, host, **kwargs):
         """Add a compute host to an aggregate."""
         #NOTE(jogo) Currently only used for XenAPI-Pool
@@ -183,6 +183,9 @@ class FakeDriver(driver.ComputeDriver):
                 'num_cpu': 2,
                 'cpu_time': 0}
 
+    def get_power_states(self, instances):
+        return dict((name, i.state) for name, i in self.instances.iteritems())
+
     def get_diagnostics(self, instance_name):
         return 'FAKE_DIAGNOSTICS'
 
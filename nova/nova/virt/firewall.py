@@ -37,6 +37,12 @@ firewall_opts = [
     cfg.BoolOpt('allow_same_net_traffic',
                 default=True,
                 help='Whether to allow network traffic from same network'),
+    cfg.BoolOpt('firewall_shared_security_group_chains',
+                default=False,
+                help='Whether the iptables firewall renders each security '
+                     'group once into a chain shared by its instances, '
+                     'matching the members of source groups with ipset sets '
+                     '(requires ipset)'),
 ]
 
 FLAGS = flags.FLAGS
@@ -143,6 +149,13 @@ class IptablesFirewallDriver(FirewallDriver):
         self.instances = {}
         self.network_infos = {}
         self.basicly_filtered = False
+        # With shared security group chains: instance id --> ids of the
+        # security groups its chain jumps to, security group id --> ids of
+        # the groups whose set its chain matches, and security group id -->
+        # addresses in the set of its members
+        self.instance_security_groups = {}
+        self.security_group_sources = {}
+        self.ipsets = {}
 
         self.iptables.ipv4['filter'].add_chain('sg-fallback')
         self.iptables.ipv4['filter'].add_rule('sg-fallback', '-j DROP')
@@ -236,6 +249,8 @@ class IptablesFirewallDriver(FirewallDriver):
         self.iptables.ipv4['filter'].remove_chain(chain_name)
         if FLAGS.use_ipv6:
             self.iptables.ipv6['filter'].remove_chain(chain_name)
+        if instance['id'] not in self.instances:
+            self._purge_security_group_chains()
 
     @staticmethod
     def _security_group_chain_name(security_group_id):
@@ -319,6 +334,164 @@ class IptablesFirewallDriver(FirewallDriver):
                     '--dports', '%s:%s' % (rule.from_port,
                                            rule.to_port)]
 
+    def _security_group_rules(self, ctxt, security_group_id, ipv4_rules,
+                              ipv6_rules, instance=None, sources=None):
+        """Appends the rules of a security group to ipv4_rules and
+        ipv6_rules.
+
+        With sources set, a rule granting access to another group matches
+        the ipset set of its members, whose id is added to sources, rather
+        than expanding into one rule per member address.
+        """
+        rules = db.security_group_rule_get_by_security_group(ctxt,
+                                                      security_group_id)
+
+        for rule in rules:
+            LOG.debug(_('Adding security group rule: %r'), rule,
+                      instance=instance)
+
+            if not rule.cidr:
+                version = 4
+            else:
+                version = netutils.get_ip_version(rule.cidr)
+
+            if version == 4:
+                fw_rules = ipv4_rules
+            else:
+                fw_rules = ipv6_rules
+
+            protocol = rule.protocol
+
+            if protocol:
+                protocol = rule.protocol.lower()
+
+            if version == 6 and protocol == 'icmp':
+                protocol = 'icmpv6'
+
+            args = ['-j ACCEPT']
+            if protocol:
+                args += ['-p', protocol]
+
+            if protocol in ['udp', 'tcp']:
+                args += self._build_tcp_udp_rule(rule, version)
+            elif protocol == 'icmp':
+                args += self._build_icmp_rule(rule, version)
+            if rule.cidr:
+                LOG.debug('Using cidr %r', rule.cidr, instance=instance)
+                args += ['-s', rule.cidr]
+                fw_rules += [' '.join(args)]
+            elif rule['grantee_group'] and sources is not None:
+                grantee_group = rule['grantee_group']
+                if grantee_group['id'] not in self.ipsets:
+                    self._add_ipset(ctxt, grantee_group)
+                sources.add(grantee_group['id'])
+                args += ['-m set --match-set %s src' %
+                         self._ipset_name(grantee_group['id'])]
+                fw_rules += [' '.join(args)]
+            elif rule['grantee_group']:
+                for member in rule['grantee_group']['instances']:
+                    ips = self._instance_addresses(ctxt, member, version)
+                    LOG.debug('ips: %r', ips, instance=member)
+                    for ip in ips:
+                        subrule = args + ['-s %s' % ip]
+                        fw_rules += [' '.join(subrule)]
+
+            LOG.debug('Using fw_rules: %r', fw_rules, instance=instance)
+
+    def _instance_addresses(self, ctxt, instance, version):
+        """Returns the fixed addresses of an instance of an IP version."""
+        # FIXME(jkoelker) This needs to be ported up into
+        #                 the compute manager which already
+        #                 has access to a nw_api handle,
+        #                 and should be the only one making
+        #                 making rpc calls.
+        import nova.network
+        nw_api = nova.network.API()
+        nw_info = nw_api.get_instance_nw_info(ctxt, instance)
+        return [ip['address'] for ip in nw_info.fixed_ips()
+                if ip['version'] == version]
+
+    @staticmethod
+    def _ipset_name(security_group_id):
+        return 'nova-sg-members-%s' % (security_group_id,)
+
+    def _add_ipset(self, ctxt, security_group):
+        """Creates the ipset set of the members of a security group.
+
+        The set may be left over from a previous run, so it is emptied
+        before being filled.
+        """
+        name = self._ipset_name(security_group['id'])
+        self.iptables.execute('ipset', 'create', name, 'hash:ip', '-exist',
+                              run_as_root=True)
+        self.iptables.execute('ipset', 'flush', name, run_as_root=True)
+        self.ipsets[security_group['id']] = set()
+        self._update_ipset(ctxt, security_group['id'],
+                           security_group['instances'])
+
+    def _update_ipset(self, ctxt, security_group_id, instances):
+        """Adds and removes the addresses which changed in a set."""
+        name = self._ipset_name(security_group_id)
+        members = self.ipsets[security_group_id]
+        addresses = set()
+        for instance in instances:
+            addresses.update(self._instance_addresses(ctxt, instance, 4))
+        for address in sorted(addresses - members):
+            self.iptables.execute('ipset', 'add', name, address, '-exist',
+                                  run_as_root=True)
+        for address in sorted(members - addresses):
+            self.iptables.execute('ipset', 'del', name, address, '-exist',
+                                  run_as_root=True)
+        self.ipsets[security_group_id] = addresses
+
+    def _add_security_group_chain(self, ctxt, security_group_id):
+        """Renders a security group into the chain its instances share."""
+        chain_name = self._security_group_chain_name(security_group_id)
+        ipv4_rules = []
+        ipv6_rules = []
+        sources = set()
+        self._security_group_rules(ctxt, security_group_id, ipv4_rules,
+                                   ipv6_rules, sources=sources)
+        self.iptables.ipv4['filter'].add_chain(chain_name)
+        self.iptables.ipv4['filter'].empty_chain(chain_name)
+        if FLAGS.use_ipv6:
+            self.iptables.ipv6['filter'].add_chain(chain_name)
+            self.iptables.ipv6['filter'].empty_chain(chain_name)
+        self._add_filters(chain_name, ipv4_rules, ipv6_rules)
+        self.security_group_sources[security_group_id] = sources
+
+    def _purge_security_group_chains(self):
+        """Removes the shared chains no filtered instance jumps to anymore,
+        and empties the sets they were the last to match.
+
+        The sets are not destroyed: a deferred apply may still have to
+        remove rules matching them.
+        """
+        for instance_id in self.instance_security_groups.keys():
+            if instance_id not in self.instances:
+                del self.instance_security_groups[instance_id]
+        in_use = set()
+        for security_group_ids in self.instance_security_groups.values():
+            in_use.update(security_group_ids)
+        for security_group_id in self.security_group_sources.keys():
+            if security_group_id not in in_use:
+                chain_name = self._security_group_chain_name(
+                        security_group_id)
+                self.iptables.ipv4['filter'].remove_chain(chain_name)
+                if FLAGS.use_ipv6:
+                    self.iptables.ipv6['filter'].remove_chain(chain_name)
+                del self.security_group_sources[security_group_id]
+
+        sources = set()
+        for security_group_ids in self.security_group_sources.values():
+            sources.update(security_group_ids)
+        for security_group_id in self.ipsets.keys():
+            if security_group_id not in sources:
+                self.iptables.execute('ipset', 'flush',
+                                      self._ipset_name(security_group_id),
+                                      run_as_root=True)
+                del self.ipsets[security_group_id]
+
     def instance_rules(self, instance, network_info):
         # make sure this is legacy nw_info
         network_info = self._handle_network_info_model(network_info)
@@ -348,67 +521,22 @@ class IptablesFirewallDriver(FirewallDriver):
                                                             instance['id'])
 
         # then, security group chains and rules
-        for security_group in security_groups:
-            rules = db.security_group_rule_get_by_security_group(ctxt,
-                                                          security_group['id'])
-
-            for rule in rules:
-                LOG.debug(_('Adding security group rule: %r'), rule,
-                          instance=instance)
-
-                if not rule.cidr:
-                    version = 4
-                else:
-                    version = netutils.get_ip_version(rule.cidr)
-
-                if version == 4:
-                    fw_rules = ipv4_rules
-                else:
-                    fw_rules = ipv6_rules
-
-                protocol = rule.protocol
-
-                if protocol:
-                    protocol = rule.protocol.lower()
-
-                if version == 6 and protocol == 'icmp':
-                    protocol = 'icmpv6'
-
-                args = ['-j ACCEPT']
-                if protocol:
-                    args += ['-p', protocol]
-
-                if protocol in ['udp', 'tcp']:
-                    args += self._build_tcp_udp_rule(rule, version)
-                elif protocol == 'icmp':
-                    args += self._build_icmp_rule(rule, version)
-                if rule.cidr:
-                    LOG.debug('Using cidr %r', rule.cidr, instance=instance)
-                    args += ['-s', rule.cidr]
-                    fw_rules += [' '.join(args)]
-                else:
-                    if rule['grantee_group']:
-                        # FIXME(jkoelker) This needs to be ported up into
-                        #                 the compute manager which already
-                        #                 has access to a nw_api handle,
-                        #                 and should be the only one making
-                        #                 making rpc calls.
-                        import nova.network
-                        nw_api = nova.network.API()
-                        for instance in rule['grantee_group']['instances']:
-                            nw_info = nw_api.get_instance_nw_info(ctxt,
-                                                                  instance)
-
-                            ips = [ip['address']
-                                for ip in nw_info.fixed_ips()
-                                    if ip['version'] == version]
-
-                            LOG.debug('ips: %r', ips, instance=instance)
-                            for ip in ips:
-                                subrule = args + ['-s %s' % ip]
-                                fw_rules += [' '.join(subrule)]
-
-                LOG.debug('Using fw_rules: %r', fw_rules, instance=instance)
+        if FLAGS.firewall_shared_security_group_chains:
+            self.instance_security_groups[instance['id']] = [
+                    security_group['id'] for security_group in security_groups]
+            for security_group in security_groups:
+                if security_group['id'] not in self.security_group_sources:
+                    self._add_security_group_chain(ctxt, security_group['id'])
+                chain_name = self._security_group_chain_name(
+                        security_group['id'])
+                ipv4_rules += ['-j $%s' % chain_name]
+                ipv6_rules += ['-j $%s' % chain_name]
+            self._purge_security_group_chains()
+        else:
+            for security_group in security_groups:
+                self._security_group_rules(ctxt, security_group['id'],
+                                           ipv4_rules, ipv6_rules,
+                                           instance=instance)
 
         ipv4_rules += ['-j $sg-fallback']
         ipv6_rules += ['-j $sg-fallback']
@@ -419,11 +547,18 @@ class IptablesFirewallDriver(FirewallDriver):
         pass
 
     def refresh_security_group_members(self, security_group):
+        if FLAGS.firewall_shared_security_group_chains:
+            # Only the set of the members changes
+            self.do_refresh_security_group_members(security_group)
+            return
         self.do_refresh_security_group_rules(security_group)
         self.iptables.apply()
 
     def refresh_security_group_rules(self, security_group):
-        self.do_refresh_security_group_rules(security_group)
+        if FLAGS.firewall_shared_security_group_chains:
+            self.do_refresh_security_group_chain(security_group)
+        else:
+            self.do_refresh_security_group_rules(security_group)
         self.iptables.apply()
 
     def refresh_instance_security_rules(self, instance):
@@ -443,6 +578,22 @@ class IptablesFirewallDriver(FirewallDriver):
                                                          network_info)
             self._inner_do_refresh_rules(instance, ipv4_rules, ipv6_rules)
 
+    def do_refresh_security_group_members(self, security_group_id):
+        if security_group_id not in self.ipsets:
+            return
+        ctxt = context.get_admin_context()
+        security_group = db.security_group_get(ctxt, security_group_id)
+        self._update_ipset(ctxt, security_group_id,
+                           security_group['instances'])
+
+    @utils.synchronized('iptables', external=True)
+    def do_refresh_security_group_chain(self, security_group_id):
+        if security_group_id not in self.security_group_sources:
+            return
+        ctxt = context.get_admin_context()
+        self._add_security_group_chain(ctxt, security_group_id)
+        self._purge_security_group_chains()
+
     def do_refresh_instance_rules(self, instance):
         network_info = self.network_infos[instance['id']]
         ipv4_rules, ipv6_rules = self.instance_rules(instance, network_info)
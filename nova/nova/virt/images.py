@@ -21,7 +21,9 @@
 Handling of VM disk images.
 """
 
+import hashlib
 import os
+import time
 
 from nova import exception
 from nova import flags
@@ -37,6 +39,10 @@ image_opts = [
     cfg.BoolOpt('force_raw_images',
                 default=True,
                 help='Force backing images to raw format'),
+    cfg.IntOpt('image_download_buffer_size',
+               default=4 * 1024 * 1024,
+               help='Size in bytes of the writes made while downloading '
+                    'an image'),
 ]
 
 FLAGS = flags.FLAGS
@@ -60,21 +66,100 @@ def qemu_img_info(path):
     return data
 
 
-def fetch(context, image_href, path, _user_id, _project_id):
+class _ImageWriter(object):
+    """File-like object hashing the data written to it, and writing it to
+    image_file in whole multiples of buffer_size.
+
+    max_rate is None or a function returning the rate in bytes/sec the data
+    may be written at, or None for no limit. It is called as the data
+    streams so that the limit can be lifted during a download.
+    """
+
+    def __init__(self, image_file, buffer_size, max_rate=None):
+        self.image_file = image_file
+        self.buffer_size = buffer_size
+        self.max_rate = max_rate
+        self.start = time.time()
+        self.md5 = hashlib.md5()
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+        self._chunks = []
+        self._buffered = 0
+
+    def write(self, data):
+        self.md5.update(data)
+        self.sha1.update(data)
+        self.size += len(data)
+        self._chunks.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.buffer_size:
+            self.flush(final=False)
+        if self.max_rate is not None:
+            rate = self.max_rate()
+            if rate:
+                delay = self.size / float(rate) - (time.time() - self.start)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def flush(self, final=True):
+        data = ''.join(self._chunks)
+        end = len(data)
+        if not final:
+            end -= end % self.buffer_size
+        if end:
+            self.image_file.write(data[:end])
+        self._chunks = [data[end:]]
+        self._buffered = len(data) - end
+
+
+def fetch(context, image_href, path, _user_id, _project_id,
+          max_rate=None):
+    """Download an image to path.
+
+    The data is checked against the checksum glance has for the image while
+    it streams. Returns the sha1 hex digest of the data. See _ImageWriter
+    for max_rate.
+    """
     # TODO(vish): Improve context handling and add owner and auth data
     #             when it is added to glance.  Right now there is no
     #             auth checking in glance, so we assume that access was
     #             checked before we got here.
     (image_service, image_id) = glance.get_remote_image_service(context,
                                                                 image_href)
+    image_meta = image_service.show(context, image_id)
     with utils.remove_path_on_error(path):
         with open(path, "wb") as image_file:
-            image_service.download(context, image_id, image_file)
+            writer = _ImageWriter(image_file,
+                                  FLAGS.image_download_buffer_size,
+                                  max_rate=max_rate)
+            image_service.download(context, image_id, writer)
+            writer.flush()
+
+        expected = image_meta.get('checksum')
+        actual = writer.md5.hexdigest()
+        if expected and actual != expected:
+            raise exception.ImageUnacceptable(image_id=image_href,
+                reason=_("checksum %(actual)s does not match the expected "
+                         "%(expected)s") % locals())
+
+    elapsed = max(time.time() - writer.start, 0.001)
+    LOG.info(_("Downloaded image %(image_href)s: %(size)d bytes in "
+               "%(elapsed).1f seconds (%(rate)d bytes/sec)") %
+             {'image_href': image_href, 'size': writer.size,
+              'elapsed': elapsed, 'rate': writer.size / elapsed})
+    return writer.sha1.hexdigest()
+
 
+def fetch_to_raw(context, image_href, path, user_id, project_id,
+                 max_rate=None):
+    """Download an image to path, converting it to raw if needed.
 
-def fetch_to_raw(context, image_href, path, user_id, project_id):
+    Returns the sha1 hex digest of path when it holds the image data as
+    downloaded, or None when it was converted.
+    """
     path_tmp = "%s.part" % path
-    fetch(context, image_href, path_tmp, user_id, project_id)
+    checksum = fetch(context, image_href, path_tmp, user_id, project_id,
+                     max_rate=max_rate)
 
     with utils.remove_path_on_error(path_tmp):
         data = qemu_img_info(path_tmp)
@@ -104,6 +189,9 @@ def fetch_to_raw(context, image_href, path, user_id, project_id):
                         data.get('file format'))
 
                 os.rename(staged, path)
+                os.unlink(path_tmp)
+                return None
 
         else:
             os.rename(path_tmp, path)
+            return checksum
@@ -247,6 +247,21 @@ LIBVIRT_POWER_STATE = {
     VIR_DOMAIN_PMSUSPENDED: power_state.SUSPENDED,
 }
 
+# listAllDomains() flags (libvirt >= 0.9.13)
+VIR_CONNECT_LIST_DOMAINS_RUNNING = 16
+VIR_CONNECT_LIST_DOMAINS_PAUSED = 32
+VIR_CONNECT_LIST_DOMAINS_SHUTOFF = 64
+VIR_CONNECT_LIST_DOMAINS_OTHER = 128
+
+# the power state of every domain a listAllDomains() state flag selects;
+# the other states (blocked, shutting down, crashed, suspended) are read
+# from each domain
+LIST_DOMAINS_POWER_STATE = (
+    (VIR_CONNECT_LIST_DOMAINS_RUNNING, power_state.RUNNING),
+    (VIR_CONNECT_LIST_DOMAINS_PAUSED, power_state.PAUSED),
+    (VIR_CONNECT_LIST_DOMAINS_SHUTOFF, power_state.SHUTDOWN),
+)
+
 MIN_LIBVIRT_VERSION = (0, 9, 6)
 # When the above version matches/exceeds this version
 # delete it & corresponding code using it
@@ -434,6 +449,54 @@ class LibvirtDriver(driver.ComputeDriver):
                 pass
         return names
 
+    def get_power_states(self, instances):
+        """Efficient override of base get_power_states method.
+
+        Lists the domains of each power state once, instead of looking
+        up every instance by name and asking for its info.
+        """
+        if not hasattr(self._conn, 'listAllDomains'):
+            # libvirt < 0.9.13 can only filter active and inactive
+            # domains, ask each one for its state
+            return self._get_power_states(self._list_all_domains())
+
+        power_states = {}
+        for flag, state in LIST_DOMAINS_POWER_STATE:
+            for domain in self._conn.listAllDomains(flag):
+                # ID() and name() are not remote calls
+                if domain.ID() != 0:
+                    power_states[domain.name()] = state
+        power_states.update(self._get_power_states(
+                self._conn.listAllDomains(VIR_CONNECT_LIST_DOMAINS_OTHER)))
+        return power_states
+
+    def _get_power_states(self, domains):
+        power_states = {}
+        for domain in domains:
+            try:
+                if domain.ID() == 0:
+                    continue
+                state = domain.info()[0]
+                power_states[domain.name()] = LIBVIRT_POWER_STATE[state]
+            except libvirt.libvirtError:
+                # Instance was deleted while listing... ignore it
+                pass
+        return power_states
+
+    def _list_all_domains(self):
+        domains = []
+        for domain_id in self.list_instance_ids():
+            try:
+                domains.append(self._conn.lookupByID(domain_id))
+            except libvirt.libvirtError:
+                pass
+        for name in self._conn.listDefinedDomains():
+            try:
+                domains.append(self._conn.lookupByName(name))
+            except libvirt.libvirtError:
+                pass
+        return domains
+
     def plug_vifs(self, instance, network_info):
         """Plug VIFs into networks."""
         for (network, mapping) in network_info:
@@ -1353,6 +1416,7 @@ class LibvirtDriver(driver.ComputeDriver):
                                      project_id=instance['project_id'])
 
         root_fname = hashlib.sha1(str(disk_images['image_id'])).hexdigest()
+        self.image_cache_manager.record_image_use(disk_images['image_id'])
         size = instance['root_gb'] * 1024 * 1024 * 1024
 
         inst_type_id = instance['instance_type_id']
@@ -2865,6 +2929,10 @@ class LibvirtDriver(driver.ComputeDriver):
         """Manage the local cache of images."""
         self.image_cache_manager.verify_base_images(context)
 
+    def prefetch_image(self, context, image_id):
+        """Fetch an image into the local cache of images."""
+        self.image_cache_manager.prefetch_images(context, [image_id])
+
     @exception.wrap_exception()
     def migrate_disk_and_power_off(self, context, instance, dest,
                                    instance_type, network_info,
@@ -22,11 +22,14 @@ http://wiki.openstack.org/nova-image-cache-management.
 
 """
 
+import functools
 import hashlib
 import os
 import re
 import time
 
+from eventlet import greenthread
+
 from nova.compute import task_states
 from nova.compute import vm_states
 from nova import db
@@ -51,9 +54,15 @@ imagecache_opts = [
                default=(24 * 3600),
                help='Unused unresized base images younger than this will not '
                     'be removed'),
-    cfg.BoolOpt('checksum_base_images',
-                default=False,
-                help='Write a checksum for files in _base to disk'),
+    cfg.IntOpt('image_prefetch_popular_count',
+               default=0,
+               help='Number of the images most used by instances across '
+                    'all compute nodes to fetch into the image cache ahead '
+                    'of time'),
+    cfg.IntOpt('image_prefetch_max_rate',
+               default=0,
+               help='Maximum rate in bytes/sec at which images are '
+                    'prefetched, 0 for no limit'),
     ]
 
 flags.DECLARE('instances_path', 'nova.compute.manager')
@@ -85,6 +94,11 @@ class ImageCacheManager(object):
     def __init__(self):
         self._reset_state()
 
+        # image id --> spawns from it on this node
+        self.image_spawns = {}
+        # image id --> whether its prefetch is rate limited, while running
+        self.prefetching = {}
+
     def _reset_state(self):
         """Reset state variables used for each pass."""
 
@@ -249,8 +263,8 @@ class ImageCacheManager(object):
                       'base_file': base_file})
 
             # NOTE(mikal): If the checksum file is missing, then we should
-            # create one. We don't create checksums when we download images
-            # from glance because that would delay VM startup.
+            # create one. Images downloaded from glance get theirs as they
+            # stream, but converted or older base files have none.
             if FLAGS.checksum_base_images and create_if_missing:
                 write_stored_checksum(base_file)
 
@@ -357,6 +371,89 @@ class ImageCacheManager(object):
                     virtutils.chown(base_file, os.getuid())
                     os.utime(base_file, None)
 
+    def _base_file(self, image_id):
+        """Returns the path of the base file of an image."""
+        return os.path.join(FLAGS.instances_path, FLAGS.base_dir_name,
+                            hashlib.sha1(str(image_id)).hexdigest())
+
+    def _popular_images(self):
+        """Returns the ids of the images to keep fetched, most used first."""
+        if not FLAGS.image_prefetch_popular_count:
+            return []
+        image_ids = [img for img in self.image_popularity if img]
+        image_ids.sort(key=lambda img: (self.image_popularity[img],
+                                        self.image_spawns.get(img, 0)),
+                       reverse=True)
+        return image_ids[:FLAGS.image_prefetch_popular_count]
+
+    def record_image_use(self, image_id):
+        """Counts a spawn from an image on this node.
+
+        A running prefetch of the image stops being rate limited, since the
+        spawn waits for it.
+        """
+        image_id = str(image_id)
+        self.image_spawns[image_id] = self.image_spawns.get(image_id, 0) + 1
+        if image_id in self.prefetching:
+            self.prefetching[image_id] = False
+
+    def _prefetch_rate(self, image_id):
+        if self.prefetching.get(image_id):
+            return FLAGS.image_prefetch_max_rate
+        return None
+
+    def prefetch_image(self, context, image_id):
+        """Fetch an image into the base directory, unless it is there.
+
+        The fetch takes the lock Image.cache() takes, so spawns from the
+        image wait for it and use its download rather than making their own.
+        Returns whether the image was fetched.
+        """
+        image_id = str(image_id)
+        target = self._base_file(image_id)
+        if image_id in self.prefetching or os.path.exists(target):
+            return False
+
+        lock_path = os.path.join(FLAGS.instances_path, 'locks')
+
+        @utils.synchronized(os.path.basename(target), external=True,
+                            lock_path=lock_path)
+        def fetch_if_not_exists():
+            if os.path.exists(target):
+                return False
+            utils.ensure_tree(os.path.dirname(target))
+            virtutils.fetch_image(context, target, image_id,
+                                  context.user_id, context.project_id,
+                                  max_rate=functools.partial(
+                                      self._prefetch_rate, image_id))
+            return True
+
+        self.prefetching[image_id] = True
+        try:
+            fetched = fetch_if_not_exists()
+        except Exception:
+            LOG.exception(_('Failed to prefetch image %s'), image_id)
+            return False
+        finally:
+            del self.prefetching[image_id]
+
+        if fetched:
+            LOG.info(_('Prefetched image %(id)s to %(base_file)s'),
+                     {'id': image_id,
+                      'base_file': target})
+        return fetched
+
+    def _prefetch_images(self, context, image_ids):
+        for image_id in image_ids:
+            self.prefetch_image(context, image_id)
+
+    def prefetch_images(self, context, image_ids):
+        """Prefetch images one after the other, in the background."""
+        image_ids = [str(img) for img in image_ids
+                     if not str(img) in self.prefetching]
+        if image_ids:
+            greenthread.spawn_n(self._prefetch_images, context, image_ids)
+
     def verify_base_images(self, context):
         """Verify that base images are in a reasonable state."""
 
@@ -405,6 +502,16 @@ class ImageCacheManager(object):
             LOG.warning(_('Unknown base file: %s'), img)
             self.removable_base_files.append(img)
 
+        # Popular images are kept fetched even if not in use here
+        popular_images = self._popular_images()
+        for img in popular_images:
+            base_file = self._base_file(img)
+            if base_file in self.removable_base_files:
+                LOG.debug(_('%(id)s (%(base_file)s): image is popular'),
+                          {'id': img,
+                           'base_file': base_file})
+                self.removable_base_files.remove(base_file)
+
         # Dump these lists
         if self.active_base_files:
             LOG.info(_('Active base files: %s'),
@@ -421,5 +528,12 @@ class ImageCacheManager(object):
                 for base_file in self.removable_base_files:
                     self._remove_base_file(base_file)
 
+        missing_images = [img for img in popular_images
+                          if not os.path.exists(self._base_file(img))]
+        if missing_images:
+            LOG.info(_('Prefetching popular images: %s'),
+                     ' '.join(missing_images))
+            self.prefetch_images(context, missing_images)
+
         # That's it
         LOG.debug(_('Verification complete'))
@@ -40,7 +40,10 @@ util_opts = [
     cfg.StrOpt('image_info_filename_pattern',
                default='$instances_path/$base_dir_name/%(image)s.info',
                help='Allows image information files to be stored in '
-                    'non-standard locations')
+                    'non-standard locations'),
+    cfg.BoolOpt('checksum_base_images',
+                default=False,
+                help='Write a checksum for files in _base to disk'),
     ]
 
 flags.DECLARE('instances_path', 'nova.compute.manager')
@@ -391,9 +394,13 @@ def get_fs_info(path):
             'used': used}
 
 
-def fetch_image(context, target, image_id, user_id, project_id):
+def fetch_image(context, target, image_id, user_id, project_id,
+                max_rate=None):
     """Grab image"""
-    images.fetch_to_raw(context, image_id, target, user_id, project_id)
+    checksum = images.fetch_to_raw(context, image_id, target, user_id,
+                                   project_id, max_rate=max_rate)
+    if checksum and FLAGS.checksum_base_images:
+        write_stored_info(target, field='sha1', value=checksum)
 
 
 def get_info_filename(base_path):
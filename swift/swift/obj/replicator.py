@@ -24,19 +24,21 @@ import itertools
 import cPickle as pickle
 import errno
 import uuid
+from urllib import quote
 
 import eventlet
 from eventlet import GreenPool, tpool, Timeout, sleep, hubs
 from eventlet.green import subprocess
+from eventlet.semaphore import Semaphore
 from eventlet.support.greenlets import GreenletExit
 
 from swift.common.ring import Ring
 from swift.common.utils import whataremyips, unlink_older_than, lock_path, \
     compute_eta, get_logger, write_pickle, renamer, dump_recon_cache, \
-    rsync_ip, mkdirs, config_true_value, list_from_csv, get_hub
-from swift.common.bufferedhttp import http_connect
+    rsync_ip, mkdirs, config_true_value, list_from_csv, get_hub, json
+from swift.common.bufferedhttp import http_connect, BufferedHTTPConnection
 from swift.common.daemon import Daemon
-from swift.common.http import HTTP_OK, HTTP_INSUFFICIENT_STORAGE
+from swift.common.http import HTTP_OK, HTTP_INSUFFICIENT_STORAGE, is_success
 from swift.common.exceptions import PathNotDir
 
 hubs.use_hub(get_hub())
@@ -216,6 +218,55 @@ def get_hashes(partition_dir, recalculate=[], do_listdir=False,
         return hashed, hashes
 
 
+def get_suffix_listing(partition_dir, suffixes):
+    """
+    Lists the object files in suffix directories of a partition.
+
+    :param partition_dir: absolute path of partition to list
+    :param suffixes: list of suffixes to list
+    :returns: a dict of suffix to a dict of object hash to the sorted list of
+              its file names, for the suffix directories which exist
+    """
+    listing = {}
+    for suffix in suffixes:
+        suffix_dir = join(partition_dir, suffix)
+        try:
+            hashes = os.listdir(suffix_dir)
+        except OSError, err:
+            if err.errno in (errno.ENOTDIR, errno.ENOENT):
+                continue
+            raise
+        listing[suffix] = {}
+        for hsh in hashes:
+            try:
+                listing[suffix][hsh] = sorted(
+                    os.listdir(join(suffix_dir, hsh)))
+            except OSError, err:
+                if err.errno in (errno.ENOTDIR, errno.ENOENT):
+                    continue
+                raise
+    return listing
+
+
+def files_to_push(local_files, remote_files):
+    """
+    Returns the files of an object a remote node is missing and would keep:
+    .data and .ts files newer than its .data or .ts file, and .meta files
+    newer than all its files.
+
+    :param local_files: sorted file names of the object on this node
+    :param remote_files: file names of the object on the remote node
+    """
+    remote_files = set(remote_files)
+    newest = max([''] + [f for f in remote_files
+                         if f.endswith('.data') or f.endswith('.ts')])
+    newest_meta = max([''] + [f for f in remote_files
+                              if f.endswith('.meta')])
+    return [f for f in local_files
+            if f not in remote_files and f > newest and
+            (not f.endswith('.meta') or f > newest_meta)]
+
+
 def tpool_reraise(func, *args, **kwargs):
     """
     Hack to work around Eventlet's tpool not catching and reraising Timeouts.
@@ -262,6 +313,13 @@ class ObjectReplicator(Daemon):
         self.run_pause = int(conf.get('run_pause', 30))
         self.rsync_timeout = int(conf.get('rsync_timeout', 900))
         self.rsync_io_timeout = conf.get('rsync_io_timeout', '30')
+        self.sync_method = conf.get('sync_method', 'rsync')
+        self.http_sync_device_concurrency = \
+            int(conf.get('http_sync_device_concurrency', 1))
+        self.http_sync_chunk_size = \
+            int(conf.get('http_sync_chunk_size', 65536))
+        # (ip, port, device) -> semaphore of the http syncs to the device
+        self.device_semaphores = {}
         self.http_timeout = int(conf.get('http_timeout', 60))
         self.lockup_timeout = int(conf.get('lockup_timeout', 1800))
         self.recon_cache_path = conf.get('recon_cache_path',
@@ -351,6 +409,151 @@ class ObjectReplicator(Daemon):
                     'objects', job['partition']))
         return self._rsync(args) == 0
 
+    def _replicate_request(self, conn, path, headers, body=()):
+        """
+        Send a REPLICATE request on a connection to an object server, which
+        is kept open for the next requests.
+
+        :param conn: the BufferedHTTPConnection to the object server
+        :param path: request path, starting with the device and partition
+        :param headers: dictionary of headers
+        :param body: iterable of the chunks of the request body
+
+        :returns: tuple of the response status and body
+        """
+        conn.putrequest('REPLICATE', quote(path))
+        for header, value in headers.iteritems():
+            conn.putheader(header, str(value))
+        conn.endheaders()
+        for chunk in body:
+            conn.send(chunk)
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+
+    def _push_file(self, conn, node, job, suffix, hsh, filename):
+        """
+        Push an object file to a remote node with a REPLICATE request.  Its
+        body is the metadata of the file as JSON followed by its contents.
+
+        :returns: the size of the file pushed, -1 if the file is gone, or
+                  None on failure
+        """
+        # swift.obj.server imports this module
+        from swift.obj.server import read_metadata
+        try:
+            fp = open(join(job['path'], suffix, hsh, filename), 'rb')
+        except IOError, err:
+            if err.errno == errno.ENOENT:
+                # Reclaimed since it was listed
+                return -1
+            raise
+        with fp:
+            try:
+                metadata = json.dumps(read_metadata(fp))
+            except UnicodeDecodeError:
+                self.logger.error(_("Metadata of %s is not UTF-8"),
+                                  join(suffix, hsh, filename))
+                return None
+            size = os.fstat(fp.fileno()).st_size
+            body = itertools.chain(
+                [metadata],
+                iter(lambda: fp.read(self.http_sync_chunk_size), ''))
+            status, _junk = self._replicate_request(
+                conn, '/'.join(('', node['device'], job['partition'],
+                                suffix, hsh, filename)),
+                {'X-Object-Replication': 'put',
+                 'X-Object-Metadata-Length': len(metadata),
+                 'Content-Length': len(metadata) + size},
+                body)
+        if not is_success(status):
+            self.logger.error(_("Invalid response %(resp)s from %(ip)s "
+                                "pushing %(file)s"),
+                              {'resp': status, 'ip': node['ip'],
+                               'file': join(suffix, hsh, filename)})
+            return None
+        return size
+
+    def http_sync(self, node, job, suffixes):
+        """
+        Synchronize local suffix directories from a partition with a remote
+        node through its object server.  The remote node lists the files of
+        the objects in the suffix directories, and only the files it is
+        missing and would keep are pushed to it, over one connection.
+
+        :param node: the "dev" entry for the remote node to sync with
+        :param job: information about the partition being synced
+        :param suffixes: a list of suffixes which need to be pushed
+
+        :returns: boolean indicating success or failure
+        """
+        if not os.path.exists(job['path']):
+            return False
+        listing = tpool_reraise(get_suffix_listing, job['path'], suffixes)
+        if not listing:
+            return False
+        start_time = time.time()
+        files_pushed = bytes_pushed = 0
+        key = (node['ip'], node['port'], node['device'])
+        if key not in self.device_semaphores:
+            self.device_semaphores[key] = \
+                Semaphore(self.http_sync_device_concurrency)
+        with self.device_semaphores[key]:
+            conn = BufferedHTTPConnection('%s:%s' % (node['ip'],
+                                                     node['port']))
+            try:
+                with Timeout(self.rsync_timeout):
+                    status, body = self._replicate_request(
+                        conn, '/%s/%s/%s' % (node['device'], job['partition'],
+                                             '-'.join(sorted(listing))),
+                        {'X-Object-Replication': 'list',
+                         'Content-Length': '0'})
+                    if status != HTTP_OK:
+                        self.logger.error(_("Invalid response %(resp)s "
+                                            "from %(ip)s"),
+                                          {'resp': status, 'ip': node['ip']})
+                        return False
+                    remote_listing = pickle.loads(body)
+                    for suffix in sorted(listing):
+                        remote_hashes = remote_listing.get(suffix, {})
+                        for hsh, local_files in \
+                                sorted(listing[suffix].iteritems()):
+                            for filename in files_to_push(
+                                    local_files, remote_hashes.get(hsh, [])):
+                                size = self._push_file(conn, node, job,
+                                                       suffix, hsh, filename)
+                                if size is None:
+                                    return False
+                                if size < 0:
+                                    continue
+                                files_pushed += 1
+                                bytes_pushed += size
+            except Timeout:
+                self.logger.error(_("Killing long-running http sync of "
+                                    "%(path)s with %(ip)s"),
+                                  {'path': job['path'], 'ip': node['ip']})
+                return False
+            finally:
+                conn.close()
+        self.logger.update_stats('http_sync.files', files_pushed)
+        self.logger.update_stats('http_sync.bytes', bytes_pushed)
+        self.logger.info(
+            _("Successful http sync of %(src)s at %(dst)s: %(files)d files, "
+              "%(bytes)d bytes (%(time).03f)"),
+            {'src': job['path'], 'dst': node['ip'], 'files': files_pushed,
+             'bytes': bytes_pushed, 'time': time.time() - start_time})
+        return True
+
+    def sync(self, node, job, suffixes):
+        """
+        Synchronize local suffix directories from a partition with a remote
+        node, with rsync or http depending on sync_method.
+
+        :returns: boolean indicating success or failure
+        """
+        if self.sync_method == 'http':
+            return self.http_sync(node, job, suffixes)
+        return self.rsync(node, job, suffixes)
+
     def check_ring(self):
         """
         Check to see if the ring has been updated
@@ -382,7 +585,7 @@ class ObjectReplicator(Daemon):
             suffixes = tpool.execute(tpool_get_suffixes, job['path'])
             if suffixes:
                 for node in job['nodes']:
-                    success = self.rsync(node, job, suffixes)
+                    success = self.sync(node, job, suffixes)
                     if success:
                         with Timeout(self.http_timeout):
                             http_connect(
@@ -459,7 +662,7 @@ class ObjectReplicator(Daemon):
                     suffixes = [suffix for suffix in local_hash if
                                 local_hash[suffix] !=
                                 remote_hash.get(suffix, -1)]
-                    self.rsync(node, job, suffixes)
+                    self.sync(node, job, suffixes)
                     with Timeout(self.http_timeout):
                         conn = http_connect(
                             node['ip'], node['port'],
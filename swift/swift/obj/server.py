@@ -33,14 +33,14 @@ from eventlet import sleep, Timeout, tpool
 from swift.common.utils import mkdirs, normalize_timestamp, public, \
     storage_directory, hash_path, renamer, fallocate, fsync, \
     split_path, drop_buffer_cache, get_logger, write_pickle, \
-    config_true_value, validate_device_partition, timing_stats
+    config_true_value, validate_device_partition, timing_stats, json
 from swift.common.bufferedhttp import http_connect
 from swift.common.constraints import check_object_creation, check_mount, \
     check_float, check_utf8
 from swift.common.exceptions import ConnectionTimeout, DiskFileError, \
     DiskFileNotExist
 from swift.obj.replicator import tpool_reraise, invalidate_hash, \
-    quarantine_renamer, get_hashes
+    quarantine_renamer, get_hashes, get_suffix_listing
 from swift.common.http import is_success
 from swift.common.swob import HTTPAccepted, HTTPBadRequest, HTTPCreated, \
     HTTPInternalServerError, HTTPNoContent, HTTPNotFound, HTTPNotModified, \
@@ -882,24 +882,101 @@ class ObjectController(object):
     def REPLICATE(self, request):
         """
         Handle REPLICATE requests for the Swift Object Server.  This is used
-        by the object replicator to get hashes for directories.
+        by the object replicator to get hashes for directories.  With an
+        X-Object-Replication header of "list", it lists the object files in
+        the directories instead, and with "put" it stores an object file
+        pushed by the replicator.
         """
+        replication = request.headers.get('x-object-replication')
         try:
-            device, partition, suffix = split_path(
-                unquote(request.path), 2, 3, True)
+            if replication == 'put':
+                device, partition, suffix, name_hash, filename = \
+                    split_path(unquote(request.path), 5, 5)
+            else:
+                device, partition, suffix = split_path(
+                    unquote(request.path), 2, 3, True)
             validate_device_partition(device, partition)
         except ValueError, e:
             return HTTPBadRequest(body=str(e), request=request,
                                   content_type='text/plain')
         if self.mount_check and not check_mount(self.devices, device):
             return HTTPInsufficientStorage(drive=device, request=request)
+        if replication == 'put':
+            return self._replicate_put(request, device, partition, suffix,
+                                       name_hash, filename)
         path = os.path.join(self.devices, device, DATADIR, partition)
         if not os.path.exists(path):
             mkdirs(path)
         suffixes = suffix.split('-') if suffix else []
+        if replication == 'list':
+            listing = tpool_reraise(get_suffix_listing, path, suffixes)
+            return Response(body=pickle.dumps(listing, PICKLE_PROTOCOL))
         _junk, hashes = tpool_reraise(get_hashes, path, recalculate=suffixes)
         return Response(body=pickle.dumps(hashes))
 
+    def _replicate_put(self, request, device, partition, suffix, name_hash,
+                       filename):
+        """
+        Store an object file pushed by the object replicator.  The request
+        body is the metadata of the file as a JSON object of strings, of
+        X-Object-Metadata-Length bytes, followed by its contents.
+        """
+        try:
+            metadata_length = \
+                int(request.headers['x-object-metadata-length'])
+            content_length = int(request.headers['content-length'])
+        except (KeyError, ValueError):
+            return HTTPBadRequest(body='Missing metadata length',
+                                  request=request, content_type='text/plain')
+        reader = request.environ['wsgi.input'].read
+        metadata = reader(metadata_length)
+        if len(metadata) != metadata_length:
+            return HTTPClientDisconnect(request=request)
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            metadata = None
+        if not isinstance(metadata, dict) or \
+                not all(isinstance(key, basestring) and
+                        isinstance(value, basestring)
+                        for key, value in metadata.iteritems()):
+            return HTTPBadRequest(body='Invalid metadata', request=request,
+                                  content_type='text/plain')
+        metadata = dict((key.encode('utf-8'), value.encode('utf-8'))
+                        for key, value in metadata.iteritems())
+        timestamp, extension = os.path.splitext(filename)
+        try:
+            valid = normalize_timestamp(metadata['X-Timestamp']) == timestamp
+        except (KeyError, ValueError):
+            valid = False
+        if extension not in ('.data', '.meta', '.ts') or not valid:
+            return HTTPBadRequest(body='Invalid file name', request=request,
+                                  content_type='text/plain')
+        try:
+            account, container, obj = split_path(metadata.get('name', ''),
+                                                 3, 3, True)
+        except ValueError:
+            return HTTPBadRequest(body='Invalid object name',
+                                  request=request, content_type='text/plain')
+        file = DiskFile(self.devices, device, partition, account, container,
+                        obj, self.logger, disk_chunk_size=self.disk_chunk_size)
+        if os.path.basename(file.datadir) != name_hash or \
+                name_hash[-3:] != suffix:
+            return HTTPBadRequest(body='Invalid object hash', request=request,
+                                  content_type='text/plain')
+        upload_size = 0
+        with file.mkstemp() as fd:
+            for chunk in iter(lambda: reader(self.network_chunk_size), ''):
+                upload_size += len(chunk)
+                while chunk:
+                    written = os.write(fd, chunk)
+                    chunk = chunk[written:]
+                sleep()
+            if metadata_length + upload_size != content_length:
+                return HTTPClientDisconnect(request=request)
+            file.put(fd, metadata, extension=extension)
+        return HTTPCreated(request=request)
+
     def __call__(self, env, start_response):
         """WSGI Application entry point for the Swift Object Server."""
         start_time = time.time()
@@ -25,14 +25,16 @@ import fcntl
 import time
 import tempfile
 from contextlib import contextmanager
+from hashlib import md5
 from eventlet.green import subprocess
 from eventlet import Timeout, tpool
 from test.unit import FakeLogger, mock
 from swift.common import utils
 from swift.common.utils import hash_path, mkdirs, normalize_timestamp
 from swift.common import ring
+from swift.common.swob import Request
 from swift.obj import replicator as object_replicator
-from swift.obj.server import DiskFile
+from swift.obj.server import DiskFile, ObjectController
 
 
 def _ips():
@@ -611,6 +613,156 @@ class TestObjectReplicator(unittest.TestCase):
             object_replicator.get_hashes = was_get_hashes
             tpool.execute = was_execute
 
+    def test_get_suffix_listing(self):
+        df = DiskFile(self.devices, 'sda', '0', 'a', 'c', 'o', FakeLogger())
+        mkdirs(df.datadir)
+        for filename in ('1.00000.data', '2.00000.meta'):
+            with open(os.path.join(df.datadir, filename), 'wb') as f:
+                f.write('1234567890')
+        ohash = hash_path('a', 'c', 'o')
+        listing = object_replicator.get_suffix_listing(
+            self.parts['0'], [ohash[-3:], 'abc'])
+        self.assertEquals(listing,
+                          {ohash[-3:]: {ohash: ['1.00000.data',
+                                                '2.00000.meta']}})
+
+    def test_files_to_push(self):
+        files_to_push = object_replicator.files_to_push
+        local_files = ['1.00000.data', '3.00000.meta']
+        self.assertEquals(files_to_push(local_files, []), local_files)
+        self.assertEquals(files_to_push(local_files, local_files), [])
+        self.assertEquals(files_to_push(local_files, ['1.00000.data']),
+                          ['3.00000.meta'])
+        self.assertEquals(files_to_push(local_files, ['0.00000.data',
+                                                      '2.00000.meta']),
+                          local_files)
+        self.assertEquals(files_to_push(local_files, ['1.00000.data',
+                                                      '4.00000.meta']), [])
+        self.assertEquals(files_to_push(local_files, ['2.00000.ts']),
+                          ['3.00000.meta'])
+        self.assertEquals(files_to_push(['4.00000.ts'], ['2.00000.data']),
+                          ['4.00000.ts'])
+
+    def _create_object(self, timestamp, body='1234567890', tombstone=False):
+        df = DiskFile(self.devices, 'sda', '0', 'a', 'c', 'o', FakeLogger())
+        if tombstone:
+            df.put_metadata({'X-Timestamp': timestamp}, tombstone=True)
+            return df
+        with df.mkstemp() as fd:
+            os.write(fd, body)
+            df.put(fd, {'X-Timestamp': timestamp,
+                        'Content-Type': 'text/plain',
+                        'Content-Length': str(len(body)),
+                        'ETag': md5(body).hexdigest()})
+        return df
+
+    def test_http_sync(self):
+        remote_devices = os.path.join(self.testdir, 'remote')
+        mkdirs(os.path.join(remote_devices, 'sda'))
+        controller = ObjectController({'devices': remote_devices,
+                                       'mount_check': 'false'})
+        requests = []
+
+        def fake_replicate_request(conn, path, headers, body=()):
+            requests.append((path, headers['X-Object-Replication']))
+            req = Request.blank(
+                path, environ={'REQUEST_METHOD': 'REPLICATE'},
+                headers=dict((k, str(v)) for k, v in headers.iteritems()),
+                body=''.join(body))
+            resp = controller.REPLICATE(req)
+            return resp.status_int, resp.body
+
+        self.replicator._replicate_request = fake_replicate_request
+
+        def my_tpool_execute(func, *args, **kwargs):
+            return func(*args, **kwargs)
+
+        was_tpool_exe = tpool.execute
+        tpool.execute = my_tpool_execute
+        try:
+            node = {'ip': '127.0.0.1', 'port': 6000, 'device': 'sda'}
+            job = {'path': self.parts['0'], 'partition': '0'}
+            timestamp = normalize_timestamp(time.time())
+            df = self._create_object(timestamp)
+            ohash = hash_path('a', 'c', 'o')
+            suffix = ohash[-3:]
+
+            self.assertTrue(self.replicator.http_sync(node, job, [suffix]))
+            self.assertEquals(requests, [
+                ('/sda/0/' + suffix, 'list'),
+                ('/sda/0/%s/%s/%s.data' % (suffix, ohash, timestamp), 'put')])
+            remote_df = DiskFile(remote_devices, 'sda', '0', 'a', 'c', 'o',
+                                 FakeLogger())
+            self.assertEquals(remote_df.metadata, df.metadata)
+            with open(remote_df.data_file, 'rb') as f:
+                self.assertEquals(f.read(), '1234567890')
+            self.assertEquals(
+                self.replicator.logger.log_dict['update_stats'],
+                [(('http_sync.files', 1), {}), (('http_sync.bytes', 10), {})])
+
+            # Nothing is missing anymore
+            del requests[:]
+            self.assertTrue(self.replicator.http_sync(node, job, [suffix]))
+            self.assertEquals(requests, [('/sda/0/' + suffix, 'list')])
+
+            # Only the newer tombstone is pushed
+            del requests[:]
+            timestamp = normalize_timestamp(float(timestamp) + 1)
+            self._create_object(timestamp, tombstone=True)
+            self.assertTrue(self.replicator.http_sync(node, job, [suffix]))
+            self.assertEquals(requests, [
+                ('/sda/0/' + suffix, 'list'),
+                ('/sda/0/%s/%s/%s.ts' % (suffix, ohash, timestamp), 'put')])
+            remote_df = DiskFile(remote_devices, 'sda', '0', 'a', 'c', 'o',
+                                 FakeLogger())
+            self.assertTrue(remote_df.is_deleted())
+        finally:
+            tpool.execute = was_tpool_exe
+
+    def test_http_sync_file_gone(self):
+        requests = []
+        timestamp = normalize_timestamp(time.time())
+        df = self._create_object(timestamp)
+
+        def fake_replicate_request(conn, path, headers, body=()):
+            requests.append((path, headers['X-Object-Replication']))
+            # Reclaimed locally after it was listed
+            os.unlink(os.path.join(df.datadir, timestamp + '.data'))
+            return 200, pickle.dumps({})
+
+        self.replicator._replicate_request = fake_replicate_request
+
+        def my_tpool_execute(func, *args, **kwargs):
+            return func(*args, **kwargs)
+
+        was_tpool_exe = tpool.execute
+        tpool.execute = my_tpool_execute
+        try:
+            node = {'ip': '127.0.0.1', 'port': 6000, 'device': 'sda'}
+            job = {'path': self.parts['0'], 'partition': '0'}
+            suffix = hash_path('a', 'c', 'o')[-3:]
+            self.assertTrue(self.replicator.http_sync(node, job, [suffix]))
+            self.assertEquals(requests, [('/sda/0/' + suffix, 'list')])
+            self.assertEquals(
+                self.replicator.logger.log_dict['update_stats'],
+                [(('http_sync.files', 0), {}), (('http_sync.bytes', 0), {})])
+        finally:
+            tpool.execute = was_tpool_exe
+
+    def test_http_sync_nothing_to_sync(self):
+        node = {'ip': '127.0.0.1', 'port': 6000, 'device': 'sda'}
+        job = {'path': self.parts['0'], 'partition': '0'}
+        self.assertFalse(self.replicator.http_sync(node, job, ['abc']))
+
+    def test_sync_method(self):
+        calls = []
+        self.replicator.rsync = lambda *args: calls.append('rsync')
+        self.replicator.http_sync = lambda *args: calls.append('http_sync')
+        self.replicator.sync(None, None, [])
+        self.replicator.sync_method = 'http'
+        self.replicator.sync(None, None, [])
+        self.assertEquals(calls, ['rsync', 'http_sync'])
+
     def test_run(self):
         with _mock_process([(0, '')] * 100):
             self.replicator.replicate()
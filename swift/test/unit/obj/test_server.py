@@ -34,7 +34,7 @@ from test.unit import connect_tcp, readuntil2crlfs
 from swift.obj import server as object_server, replicator
 from swift.common import utils
 from swift.common.utils import hash_path, mkdirs, normalize_timestamp, \
-                               NullLogger, storage_directory
+                               NullLogger, storage_directory, json
 from swift.common.exceptions import DiskFileNotExist
 from swift.common import constraints
 from eventlet import tpool
@@ -2454,6 +2454,99 @@ class TestObjectController(unittest.TestCase):
             tpool.execute = was_tpool_exe
             object_server.get_hashes = was_get_hashes
 
+    def test_REPLICATE_list(self):
+        timestamp = normalize_timestamp(time())
+        req = Request.blank('/sda1/p/a/c/o', environ={'REQUEST_METHOD': 'PUT'},
+                            headers={'X-Timestamp': timestamp,
+                                     'Content-Type': 'text/plain'},
+                            body='VERIFY')
+        resp = self.object_controller.PUT(req)
+        self.assertEquals(resp.status_int, 201)
+        ohash = hash_path('a', 'c', 'o')
+
+        def my_tpool_execute(func, *args, **kwargs):
+            return func(*args, **kwargs)
+
+        was_tpool_exe = tpool.execute
+        tpool.execute = my_tpool_execute
+        try:
+            req = Request.blank('/sda1/p/%s-abc' % ohash[-3:],
+                                environ={'REQUEST_METHOD': 'REPLICATE'},
+                                headers={'X-Object-Replication': 'list'})
+            resp = self.object_controller.REPLICATE(req)
+            self.assertEquals(resp.status_int, 200)
+            self.assertEquals(pickle.loads(resp.body),
+                              {ohash[-3:]: {ohash: [timestamp + '.data']}})
+        finally:
+            tpool.execute = was_tpool_exe
+
+    def _replicate_put_request(self, path, metadata, body):
+        if not isinstance(metadata, str):
+            metadata = json.dumps(metadata)
+        return Request.blank(path, environ={'REQUEST_METHOD': 'REPLICATE'},
+                             headers={'X-Object-Replication': 'put',
+                                      'X-Object-Metadata-Length':
+                                          str(len(metadata))},
+                             body=metadata + body)
+
+    def test_REPLICATE_put(self):
+        timestamp = normalize_timestamp(time())
+        ohash = hash_path('a', 'c', 'o')
+        metadata = {'name': '/a/c/o', 'X-Timestamp': timestamp,
+                    'Content-Type': 'text/plain', 'Content-Length': '6',
+                    'ETag': md5('VERIFY').hexdigest(),
+                    'X-Object-Meta-Snowman': '\xe2\x98\x83'}
+        req = self._replicate_put_request(
+            '/sda1/p/%s/%s/%s.data' % (ohash[-3:], ohash, timestamp),
+            metadata, 'VERIFY')
+        resp = self.object_controller.REPLICATE(req)
+        self.assertEquals(resp.status_int, 201)
+        req = Request.blank('/sda1/p/a/c/o')
+        resp = self.object_controller.GET(req)
+        self.assertEquals(resp.status_int, 200)
+        self.assertEquals(resp.body, 'VERIFY')
+        self.assertEquals(resp.headers['X-Timestamp'], timestamp)
+        self.assertEquals(resp.headers['X-Object-Meta-Snowman'],
+                          '\xe2\x98\x83')
+
+    def test_REPLICATE_put_invalid(self):
+        timestamp = normalize_timestamp(time())
+        ohash = hash_path('a', 'c', 'o')
+        metadata = {'name': '/a/c/o', 'X-Timestamp': timestamp}
+        for path in ('/sda1/p/%s/%s/%s.data' % (ohash[-3:], ohash,
+                                                normalize_timestamp(1)),
+                     '/sda1/p/%s/%s/%s.foo' % (ohash[-3:], ohash, timestamp),
+                     '/sda1/p/abc/%sabc/%s.ts' % (ohash[:-3], timestamp),
+                     '/sda1/p/%s/%s' % (ohash[-3:], ohash)):
+            req = self._replicate_put_request(path, metadata, '')
+            resp = self.object_controller.REPLICATE(req)
+            self.assertEquals(resp.status_int, 400)
+        self.assertFalse(os.path.exists(os.path.join(self.testdir, 'sda1',
+                                                     'objects', 'p')))
+
+    def test_REPLICATE_put_invalid_metadata(self):
+        timestamp = normalize_timestamp(time())
+        ohash = hash_path('a', 'c', 'o')
+        path = '/sda1/p/%s/%s/%s.ts' % (ohash[-3:], ohash, timestamp)
+        metadata = {'name': '/a/c/o', 'X-Timestamp': timestamp}
+        for metadata in (pickle.dumps(metadata), '{"name": ',
+                         json.dumps([metadata]),
+                         json.dumps(dict(metadata, Size=1)),
+                         json.dumps(dict(metadata, Meta={'a': 'b'}))):
+            req = self._replicate_put_request(path, metadata, '')
+            resp = self.object_controller.REPLICATE(req)
+            self.assertEquals(resp.status_int, 400)
+            self.assertEquals(resp.body, 'Invalid metadata')
+        for metadata in ({'name': '/a/c/o'},
+                         {'name': '/a/c/o', 'X-Timestamp': 'garbage'},
+                         {'name': '/a/c/o', 'X-Timestamp': '1.0'}):
+            req = self._replicate_put_request(path, metadata, '')
+            resp = self.object_controller.REPLICATE(req)
+            self.assertEquals(resp.status_int, 400)
+            self.assertEquals(resp.body, 'Invalid file name')
+        self.assertFalse(os.path.exists(os.path.join(self.testdir, 'sda1',
+                                                     'objects', 'p')))
+
     def test_PUT_with_full_drive(self):
 
         class IgnoredBody():